@@ -31,6 +31,12 @@ def main():
     parser.add_argument("start", help="Data timestamp YYYYmmddHHMM")
     parser.add_argument("stop", help="Data timestamp YYYYmmddHHMM")
     parser.add_argument("station", help="Station code")
+    parser.add_argument("-s", "--source", choices=['plots', 'netcdf'],
+                        help="Frames from the PNG plots, or rendered from the netCDF outputs")
+    parser.add_argument("-c", "--codec", choices=['mp4v', 'MJPG'], help="Video codec")
+    parser.add_argument("--fps", type=float, help="Frames per second")
+    parser.add_argument("--scale", type=float, help="Frame size, relative to the plots (0 to 1)")
+    parser.add_argument("-w", "--workers", type=int, help="Videos encoded in parallel, 0 for one per CPU")
 
     args = parser.parse_args()
 
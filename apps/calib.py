@@ -29,27 +29,16 @@ On this grid, we need to have:
 """
 
 import os
-import sys
 import math
 import datetime
 import argparse
-from contextlib import contextmanager
 
 import numpy as np
 import netCDF4 as nc
 
-@contextmanager
-def suppress_stdout():
-    with open(os.devnull, 'w') as devnull:
-        valid_stdout = sys.stdout
-        sys.stdout = devnull
-        try:
-            yield
-        finally:
-            sys.stdout = valid_stdout
-
-with suppress_stdout():
-    import pyart
+# pyart is only imported when the first radar file is read, this
+# keeps it from printing its banner at that point.
+os.environ.setdefault("PYART_QUIET", "1")
 
 import bugtracker
 
@@ -72,7 +61,7 @@ def plot_calib_iris(args, config):
     if len(iris_collection.sets) == 0:
         raise ValueError("Invalid length")
 
-    metadata = bugtracker.core.metadata.from_iris_set(iris_collection.sets[0])
+    metadata = bugtracker.io.iris.read_metadata(iris_collection.sets[0])
     grid_info = bugtracker.io.iris.iris_grid()
 
     nc_file = bugtracker.core.cache.calib_filepath(metadata, grid_info)
@@ -226,13 +215,16 @@ def run_iris_calib(args, config):
     iris_collection = bugtracker.io.iris.IrisCollection(args.station)
     first_set = iris_collection.closest_set(time_start)
 
-    metadata = bugtracker.core.metadata.from_iris_set(first_set)
+    metadata = bugtracker.io.iris.read_metadata(first_set)
     grid_info = bugtracker.io.iris.iris_grid()
 
-    calib_grid = bugtracker.calib.calib.get_srtm(metadata, grid_info)
+    with bugtracker.core.profiling.stage('srtm'):
+        calib_grid = bugtracker.calib.calib.get_srtm(metadata, grid_info)
 
     calib_controller = bugtracker.calib.calib.IrisController(args, metadata, grid_info)
-    calib_controller.set_grids(calib_grid)
+
+    with bugtracker.core.profiling.stage('set_grids'):
+        calib_controller.set_grids(calib_grid)
 
 
     print("Time start:", time_start.strftime("%Y%m%d%H%M"))
@@ -249,11 +241,17 @@ def run_iris_calib(args, config):
 
     threshold = config['clutter']['coverage_threshold']
 
-    calib_controller.set_calib_data(calib_sets)
-    calib_controller.create_masks(threshold)
+    with bugtracker.core.profiling.stage('calib_data'):
+        calib_controller.set_calib_data(calib_sets)
+
+    with bugtracker.core.profiling.stage('create_masks'):
+        calib_controller.create_masks(threshold)
+
     calib_controller.print_masks()
-    calib_controller.save()
-    calib_controller.save_masks()
+
+    with bugtracker.core.profiling.stage('save'):
+        calib_controller.save()
+        calib_controller.save_masks()
 
 
 def run_nexrad_calib(args, config):
@@ -273,7 +271,8 @@ def run_nexrad_calib(args, config):
     manager = bugtracker.io.nexrad.NexradManager(config, station_id)
     manager.populate(start_time)
 
-    calib_grid = bugtracker.calib.calib.get_srtm(manager.metadata, manager.grid_info)
+    with bugtracker.core.profiling.stage('srtm'):
+        calib_grid = bugtracker.calib.calib.get_srtm(manager.metadata, manager.grid_info)
 
     calib_files = manager.get_range(start_time, end_time)
 
@@ -284,11 +283,19 @@ def run_nexrad_calib(args, config):
     threshold = config['clutter']['coverage_threshold']
 
     calib_controller = bugtracker.calib.calib.NexradController(args, manager)
-    calib_controller.set_grids(calib_grid)
-    calib_controller.set_calib_data(calib_files)
-    calib_controller.create_masks(threshold)
-    calib_controller.save()
-    calib_controller.save_masks()
+
+    with bugtracker.core.profiling.stage('set_grids'):
+        calib_controller.set_grids(calib_grid)
+
+    with bugtracker.core.profiling.stage('calib_data'):
+        calib_controller.set_calib_data(calib_files)
+
+    with bugtracker.core.profiling.stage('create_masks'):
+        calib_controller.create_masks(threshold)
+
+    with bugtracker.core.profiling.stage('save'):
+        calib_controller.save()
+        calib_controller.save_masks()
 
 
 def run_odim_calib(args, config):
@@ -308,7 +315,8 @@ def run_odim_calib(args, config):
     manager = bugtracker.io.odim.OdimManager(config, station_id)
     manager.populate(start_time)
 
-    calib_grid = bugtracker.calib.calib.get_srtm(manager.metadata, manager.grid_info)
+    with bugtracker.core.profiling.stage('srtm'):
+        calib_grid = bugtracker.calib.calib.get_srtm(manager.metadata, manager.grid_info)
 
     calib_files = manager.get_range(start_time, end_time)
 
@@ -319,11 +327,19 @@ def run_odim_calib(args, config):
     threshold = config['clutter']['coverage_threshold']
 
     calib_controller = bugtracker.calib.calib.OdimController(args, manager)
-    calib_controller.set_grids(calib_grid)
-    calib_controller.set_calib_data(calib_files)
-    calib_controller.create_masks(threshold)
-    calib_controller.save()
-    calib_controller.save_masks()
+
+    with bugtracker.core.profiling.stage('set_grids'):
+        calib_controller.set_grids(calib_grid)
+
+    with bugtracker.core.profiling.stage('calib_data'):
+        calib_controller.set_calib_data(calib_files)
+
+    with bugtracker.core.profiling.stage('create_masks'):
+        calib_controller.create_masks(threshold)
+
+    with bugtracker.core.profiling.stage('save'):
+        calib_controller.save()
+        calib_controller.save_masks()
 
 
 def main():
@@ -336,6 +352,11 @@ def main():
     parser.add_argument('-d', '--debug', action='store_true', help="Debug plotting")
     parser.add_argument('-c', '--clear', action='store_true', help="Clear cache")
     parser.add_argument('-p', '--plot', action='store_true', help="Plot diagnostic graphs")
+    parser.add_argument('--profile', action='store_true', help="cProfile each calibration stage")
+    parser.add_argument('--profile-memory', action='store_true', help="Top allocations of each stage (tracemalloc)")
+    parser.add_argument('--profile-dir', default=None, help="Profile output folder (default: cache_dir/profiles)")
+    parser.add_argument('--trace', action='store_true', help="Timeline of the stages and plot workers (Perfetto)")
+    parser.add_argument('--trace-dir', default=None, help="Trace output folder (default: cache_dir/traces)")
     # Reset
 
     args = parser.parse_args()
@@ -350,6 +371,17 @@ def main():
     cache_manager.make_folders()
     config = bugtracker.config.load("./bugtracker.json")
 
+    profile_dir = None
+
+    if args.profile or args.profile_memory:
+        profile_dir = args.profile_dir or bugtracker.core.profiling.default_dir(config, "calib")
+        bugtracker.core.profiling.enable(profile_dir, cpu=args.profile, memory=args.profile_memory)
+
+    trace_dir = None
+
+    if args.trace:
+        trace_dir = args.trace_dir or bugtracker.core.tracing.default_dir(config, "calib")
+        bugtracker.core.tracing.enable(trace_dir)
 
     if args.plot:
         plot_calib_graphs(args, config)
@@ -363,6 +395,12 @@ def main():
         else:
             raise ValueError(f"Invalid dtype {dtype}")
 
+    if profile_dir is not None:
+        bugtracker.core.profiling.report(profile_dir)
+
+    if trace_dir is not None:
+        bugtracker.core.tracing.merge(trace_dir)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,83 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Query the catalog of processed scans, for example:
+
+python catalog.py 201907010000 201907080000 kcbw --min_bugs 0.05
+python catalog.py 201907010000 201907080000 kcbw --profiles
+"""
+
+import os
+import datetime
+import argparse
+
+import bugtracker
+import bugtracker.config
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("stop", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("station", help="Station code")
+    parser.add_argument("-b", "--min_bugs", type=float, default=None, help="Minimum fraction of bug gates")
+    parser.add_argument("-p", "--max_precip", type=float, default=None, help="Maximum precip coverage")
+    parser.add_argument("-f", "--files", action='store_true', help="Only print output file paths")
+    parser.add_argument("-z", "--profiles", action='store_true', help="Print the bug reflectivity profiles")
+
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d%H%M"
+    start = datetime.datetime.strptime(args.start, date_format)
+    stop = datetime.datetime.strptime(args.stop, date_format)
+
+    config = bugtracker.config.load("./bugtracker.json")
+
+    catalog_file = bugtracker.io.catalog.catalog_filepath(config)
+
+    if not os.path.isfile(catalog_file):
+        raise FileNotFoundError(catalog_file)
+
+    catalog = bugtracker.io.catalog.ScanCatalog(catalog_file)
+    scans = catalog.query(args.station, start, stop, min_bug_fraction=args.min_bugs,
+                          max_precip_coverage=args.max_precip)
+
+    if args.profiles:
+        for row in catalog.profiles(args.station, start, stop):
+            timestamp = row['scan_dt'].strftime(date_format)
+            values = " ".join(f"p{percentile:g}: {dbz:.1f}" for percentile, dbz in sorted(row['percentiles'].items()))
+            print(f"{timestamp} {row['height']:6.0f} m gates: {row['count']} mean: {row['mean_dbz']:.1f} dBZ {values}")
+
+        catalog.close()
+        return
+
+    for scan in scans:
+        if args.files:
+            print(scan['output_path'])
+        else:
+            timestamp = scan['scan_dt'].strftime(date_format)
+            print(f"{timestamp} bugs: {scan['bug_fraction']:.4f} precip: {scan['precip_coverage']:.4f} "
+                  f"clutter: {scan['clutter_coverage']:.4f} {scan['output_path']}")
+
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
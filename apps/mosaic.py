@@ -0,0 +1,66 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Builds the multi-radar mosaic of the tracker.py outputs nearest one
+or more target times, on the grid of the mosaic section of
+bugtracker.json. For example:
+
+python mosaic.py 201907300300
+python mosaic.py 201907300300 -e 201907300600 -i 30 -s kcbw kdox kakq -r distance
+"""
+
+import datetime
+import argparse
+
+import bugtracker
+import bugtracker.config
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", help="Target timestamp YYYYmmddHHMM")
+    parser.add_argument("-e", "--end", default=None, help="Last target timestamp YYYYmmddHHMM")
+    parser.add_argument("-i", "--interval", type=int, default=10, help="Minutes between mosaics (with --end)")
+    parser.add_argument("-s", "--stations", nargs='+', default=None, help="Station codes (default: from config)")
+    parser.add_argument("-r", "--rule", default=None, choices=['max', 'nearest', 'distance'], help="Merge rule")
+
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d%H%M"
+    start = datetime.datetime.strptime(args.start, date_format)
+    end = start if args.end is None else datetime.datetime.strptime(args.end, date_format)
+
+    if args.interval <= 0 or end < start:
+        raise ValueError(f"Invalid mosaic times: {args.start} to {args.end} every {args.interval} min")
+
+    config = bugtracker.config.load("./bugtracker.json")
+
+    settings = bugtracker.io.mosaic.from_config(config, stations=args.stations, rule=args.rule)
+    builder = bugtracker.io.mosaic.MosaicBuilder(config, settings)
+
+    # The station operators are built on the first mosaic only
+    target_dt = start
+    while target_dt <= end:
+        builder.build_and_write(target_dt)
+        target_dt += datetime.timedelta(minutes=args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Computes the echo motion between consecutive tracker.py output files
+of a station, and appends the u/v fields and quality to each output
+(after the first one). Uses the motion section of bugtracker.json,
+the tracked field can be overridden. For example:
+
+python motion.py 201907300000 201907310000 kcbw
+python motion.py 201907300000 201907310000 kcbw -f bugs
+"""
+
+import datetime
+import argparse
+
+import bugtracker
+import bugtracker.config
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("stop", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("station", help="Station code")
+    parser.add_argument("-f", "--field", default=None, choices=['joint', 'bugs'], help="Tracked field")
+    parser.add_argument("-c", "--calib", default=None, help="Calib file (if the station has several)")
+
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d%H%M"
+    start = datetime.datetime.strptime(args.start, date_format)
+    stop = datetime.datetime.strptime(args.stop, date_format)
+    station = args.station.lower().strip()
+
+    config = bugtracker.config.load("./bugtracker.json")
+
+    # The batch mode runs even if tracking is disabled in tracker.py
+    motion_config = dict(config['motion'])
+    motion_config['enabled'] = True
+    if args.field is not None:
+        motion_config['field'] = args.field
+
+    settings = bugtracker.io.motion.from_config({'motion': motion_config})
+
+    output_files = bugtracker.io.lookup.find_output_files(config, station, start, stop)
+    print(f"Tracking motion over {len(output_files)} output files")
+
+    if len(output_files) < 2:
+        raise FileNotFoundError(f"Need at least 2 output files for {station} between {args.start} and {args.stop}")
+
+    calib_file = args.calib
+    if calib_file is None:
+        calib_file = bugtracker.io.lookup.find_calib_file(config, station)
+
+    radar_id, grid_info = bugtracker.core.cache.calib_grid(calib_file)
+
+    metadata = bugtracker.io.motion.output_metadata(output_files[0], radar_id)
+
+    tracker = bugtracker.io.motion.MotionTracker(config, metadata, grid_info, settings)
+    count = bugtracker.io.motion.track_outputs(tracker, output_files)
+
+    print(f"Wrote {count} motion fields")
+
+
+if __name__ == "__main__":
+    main()
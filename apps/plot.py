@@ -0,0 +1,66 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+"""
+Makes the plots queued by tracker.py when plot_settings.mode is
+"deferred" in the config. For example:
+
+python plot.py
+python plot.py -s kcbw -n 500
+python plot.py --retry
+"""
+
+import os
+import argparse
+
+import bugtracker
+import bugtracker.config
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--station", default=None, help="Only plot this station")
+    parser.add_argument("-n", "--max_jobs", type=int, default=None, help="Maximum number of plots")
+    parser.add_argument("-r", "--retry", action='store_true', help="Queue the failed plots again")
+
+    args = parser.parse_args()
+
+    config = bugtracker.config.load("./bugtracker.json")
+
+    queue_file = bugtracker.plots.plot_queue.queue_filepath(config)
+
+    if not os.path.isfile(queue_file):
+        raise FileNotFoundError(queue_file)
+
+    queue = bugtracker.plots.plot_queue.PlotQueue(queue_file)
+
+    if args.retry:
+        queue.retry_failed(radar_id=args.station)
+
+    done, failed = bugtracker.plots.plot_queue.drain(queue, radar_id=args.station, limit=args.max_jobs)
+
+    print(f"Plots done: {done}, failed: {failed}")
+    print("Queue:", queue.counts())
+
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -37,9 +37,8 @@ def plot_sample(radar_id, scan_dt):
     metadata = odim_manager.metadata
     grid_info = odim_manager.grid_info
 
-    grid_coords = bugtracker.core.utils.latlon(grid_info, metadata)
-    lats = grid_coords['lats']
-    lons = grid_coords['lons']
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    lats, lons = geometry.latlon()
 
     plotter = bugtracker.plots.radial.RadialPlotter(lats, lons, output_folder, grid_info)
 
@@ -0,0 +1,109 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Extract time series at one or more sites from the tracker.py output
+files, and save them as CSV. For example:
+
+python timeseries.py 201907010000 201907080000 kcbw -p trap1 38.1 -76.2 -p trap2 38.3 -75.9
+"""
+
+import csv
+import datetime
+import argparse
+
+import bugtracker
+import bugtracker.config
+
+
+def write_csv(output_file, series, fields):
+
+    header = ["site", "scan_dt"]
+    names = [name for name in series if name != 'scan_dt']
+
+    # One column per output level
+    columns = []
+    for field in fields:
+        num_levels = series[names[0]][field].shape[1]
+        for level in range(0, num_levels):
+            columns.append((field, level))
+            header.append(f"{field}_{level}" if num_levels > 1 else field)
+
+    with open(output_file, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(header)
+
+        for name in names:
+            for x in range(0, len(series['scan_dt'])):
+                row = [name, series['scan_dt'][x].strftime("%Y%m%d%H%M")]
+                for field, level in columns:
+                    row.append(f"{series[name][field][x,level]:.4f}")
+                writer.writerow(row)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("start", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("stop", help="Data timestamp YYYYmmddHHMM")
+    parser.add_argument("station", help="Station code")
+    parser.add_argument("-p", "--point", nargs=3, action='append', metavar=("NAME", "LAT", "LON"),
+                        required=True, help="Site name and lat/lon (can be repeated)")
+    parser.add_argument("-n", "--neighbours", type=int, default=1, help="Number of gates averaged per site")
+    parser.add_argument("-d", "--max-distance", type=float, default=2000.0,
+                        help="Max distance (m) from a site to its nearest gate, sites further away are an error")
+    parser.add_argument("-c", "--calib", default=None, help="Calib file (if the station has several)")
+    parser.add_argument("-o", "--output", default="timeseries.csv", help="Output CSV file")
+
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d%H%M"
+    start = datetime.datetime.strptime(args.start, date_format)
+    stop = datetime.datetime.strptime(args.stop, date_format)
+
+    config = bugtracker.config.load("./bugtracker.json")
+
+    calib_file = args.calib
+    if calib_file is None:
+        calib_file = bugtracker.io.lookup.find_calib_file(config, args.station)
+
+    lookup = bugtracker.io.lookup.get_lookup(config, calib_file)
+
+    selections = dict()
+    for name, lat, lon in args.point:
+        selections[name] = lookup.query_point(float(lat), float(lon), neighbours=args.neighbours,
+                                              max_distance=args.max_distance)
+        print(f"Site {name}:")
+        print(selections[name])
+
+    output_files = bugtracker.io.lookup.find_output_files(config, args.station, start, stop)
+    print(f"Extracting from {len(output_files)} output files")
+
+    if len(output_files) == 0:
+        raise FileNotFoundError(f"No output files for {args.station} between {args.start} and {args.stop}")
+
+    fields = ['dbz_joint', 'dbz_filtered', 'target_id']
+    extractor = bugtracker.io.lookup.TimeSeriesExtractor(selections)
+    series = extractor.extract(output_files, fields=fields)
+
+    write_csv(args.output, series, fields)
+    print("Saved:", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,29 +17,16 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
-import sys
 import glob
 import argparse
 import datetime
 import time
 
-# To avoid spamming console every time the utility is run.
-from contextlib import contextmanager
-
 import numpy as np
 
-@contextmanager
-def suppress_stdout():
-    with open(os.devnull, 'w') as devnull:
-        valid_stdout = sys.stdout
-        sys.stdout = devnull
-        try:
-            yield
-        finally:
-            sys.stdout = valid_stdout
-
-with suppress_stdout():
-    import pyart
+# pyart is only imported when the first radar file is read, this
+# keeps it from printing its banner at that point.
+os.environ.setdefault("PYART_QUIET", "1")
 
 import bugtracker
 
@@ -101,7 +88,7 @@ def iris_tracker(args, config):
         iris_set_list = iris_collection.time_range(time_start, data_mins)
 
     first_set = iris_set_list[0]
-    metadata = bugtracker.core.metadata.from_iris_set(first_set)
+    metadata = bugtracker.io.iris.read_metadata(first_set)
     grid_info = bugtracker.io.iris.iris_grid()
     print("metadata:", metadata)
     print("grid_info:", grid_info)
@@ -184,10 +171,27 @@ def main():
     parser.add_argument("-dt", "--data_hours", type=int, default=0)
     parser.add_argument("-r", "--range", default=100, type=int, help="Maximum range (km)")
     parser.add_argument('-d', '--debug', action='store_true', help="Debug plotting")
+    parser.add_argument('--profile', action='store_true', help="cProfile each processing stage")
+    parser.add_argument('--profile-memory', action='store_true', help="Top allocations of each stage (tracemalloc)")
+    parser.add_argument('--profile-dir', default=None, help="Profile output folder (default: cache_dir/profiles)")
+    parser.add_argument('--trace', action='store_true', help="Timeline of the stages and plot workers (Perfetto)")
+    parser.add_argument('--trace-dir', default=None, help="Trace output folder (default: cache_dir/traces)")
 
     args = parser.parse_args()
     check_args(args)
 
+    profile_dir = None
+
+    if args.profile or args.profile_memory:
+        profile_dir = args.profile_dir or bugtracker.core.profiling.default_dir(config, "tracker")
+        bugtracker.core.profiling.enable(profile_dir, cpu=args.profile, memory=args.profile_memory)
+
+    trace_dir = None
+
+    if args.trace:
+        trace_dir = args.trace_dir or bugtracker.core.tracing.default_dir(config, "tracker")
+        bugtracker.core.tracing.enable(trace_dir)
+
     dtype = args.dtype.lower()
 
     if dtype == 'iris':
@@ -200,6 +204,12 @@ def main():
         # Unreachable code, given the previous check_args()
         raise ValueError(f"Invalid dtype {dtype}")
 
+    if profile_dir is not None:
+        bugtracker.core.profiling.report(profile_dir)
+
+    if trace_dir is not None:
+        bugtracker.core.tracing.merge(trace_dir)
+
 
 if __name__ == "__main__":
     main()
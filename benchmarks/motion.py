@@ -0,0 +1,122 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Time of the echo motion tracking for one scan: Cartesian resampling
+of the polar field and FFT phase correlation of all the tiles, on a
+synthetic volume with a known displacement. The default is a 300 km
+domain at 1 km (301 x 301 pixels). For example:
+
+python motion.py
+python motion.py -x 2000 -t 16 -r 20
+
+Exits with status 1 if the tracking is over budget, or if the
+displacement is not recovered.
+"""
+
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+
+import numpy as np
+from scipy import ndimage
+
+import bugtracker
+
+
+# Milliseconds per scan (resampling and correlation)
+BUDGET = 100.0
+
+
+def synthetic_field(grid_info, shift_x, shift_y):
+    """
+    Smoothed noise (dBZ, NaN without echo) at the polar gates, moved
+    by shift_x/shift_y meters
+    """
+
+    rng = np.random.default_rng(0)
+    pattern = ndimage.gaussian_filter(rng.normal(size=(601, 601)), 3.0) * 150.0
+
+    azims = np.radians(np.arange(grid_info.azims) * grid_info.azim_step)
+    ranges = np.arange(grid_info.gates) * grid_info.gate_step
+    x_arr = np.outer(np.sin(azims), ranges) - shift_x
+    y_arr = np.outer(np.cos(azims), ranges) - shift_y
+
+    field = ndimage.map_coordinates(pattern, [y_arr / 1000.0 + 300.0, x_arr / 1000.0 + 300.0], order=1)
+    return np.where(field > 0.0, field, np.nan).astype(np.float32)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-x", "--resolution", type=float, default=1000.0, help="Raster resolution (m)")
+    parser.add_argument("-m", "--max-range", type=float, default=150.0, help="Raster max range (km)")
+    parser.add_argument("-t", "--tile-size", type=int, default=32, help="Tile size (pixels)")
+    parser.add_argument("-r", "--repeats", type=int, default=10, help="Runs (best is kept)")
+    args = parser.parse_args()
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.io.motion.MotionSettings(resolution=args.resolution, max_range=args.max_range,
+                                                   tile_size=args.tile_size)
+
+    # 6 km east, 4 km north in 10 minutes
+    interval = 600.0
+    previous = synthetic_field(grid_info, 0.0, 0.0)
+    current = synthetic_field(grid_info, 6000.0, 4000.0)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tracker = bugtracker.io.motion.MotionTracker({'cache_dir': cache_dir}, metadata, grid_info, settings)
+
+        scan_dt = datetime.datetime(2019, 7, 30, 3, 0)
+        next_dt = scan_dt + datetime.timedelta(seconds=interval)
+        best = None
+
+        for x in range(0, args.repeats):
+            tracker.reset()
+            tracker.update(scan_dt, previous)
+
+            start = time.perf_counter()
+            motion = tracker.update(next_dt, current)
+            elapsed = (time.perf_counter() - start) * 1000.0
+
+            if best is None or elapsed < best:
+                best = elapsed
+
+    size = settings.spec.size
+    valid = np.isfinite(motion.u)
+    u = np.median(motion.u[valid])
+    v = np.median(motion.v[valid])
+
+    print(f"Domain: {size} x {size} pixels at {settings.spec.resolution:.0f} m, tiles: {motion.u.shape}")
+    print(f"Valid tiles: {np.count_nonzero(valid)}, median u/v: {u:.2f} / {v:.2f} m/s (expected 10.00 / 6.67)")
+    print(f"Time per scan: {best:.1f} ms (budget {BUDGET:.0f} ms)")
+
+    if not (abs(u - 10.0) < 0.5 and abs(v - 4000.0 / interval) < 0.5):
+        print("Displacement not recovered")
+        sys.exit(1)
+
+    if best > BUDGET:
+        print("Over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
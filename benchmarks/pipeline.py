@@ -0,0 +1,620 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Time of each processing stage, on synthetic IRIS-, NEXRAD- and
+ODIM-shaped volumes (no archived data needed):
+
+regrid   - IRIS: CONVOL upsampling, DOPVOL fill and merge_dbz
+           NEXRAD: fill_lower/fill_upper, ODIM: fill_lower
+precip   - IRIS: PrecipFilter.apply, NEXRAD/ODIM: NexradPrecipFilter.apply
+joint    - clutter and precip filters imposed, joint product
+target_id - TargetId classification
+write    - netCDF output, with the target_id
+plot     - one dBZ level and one target_id level
+
+The volumes have bug echo decreasing with range, precipitation cells
+(high correlation, low differential reflectivity), missing rays, NaN
+gates without echo and clutter near the radar. The stages run in
+order, 'repeats' times, and the best time of each stage is kept. For
+example (from this folder, the config is found in ../apps):
+
+python pipeline.py
+python pipeline.py -f nexrad odim -g 500 -r 5 -o results.json
+python pipeline.py -o new.json -b results.json
+
+The results are written as JSON with -o. With -b, every stage is
+compared with the same stage of an earlier result file, and the exit
+status is 1 if one is slower by more than the tolerance.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import contextlib
+import subprocess
+import importlib.metadata
+
+import numpy as np
+from scipy import ndimage
+
+import bugtracker
+from bugtracker.io.scan import ScanData
+
+
+FORMATS = ['iris', 'nexrad', 'odim']
+STAGES = ['regrid', 'precip', 'joint', 'target_id', 'write', 'plot']
+
+# Native gates of each format (IRIS: after upsampling)
+NATIVE_GATES = {'iris': 512, 'nexrad': 1832, 'odim': 1000}
+GATE_STEPS = {'iris': 500.0, 'nexrad': 250.0, 'odim': 250.0}
+
+# The lower NEXRAD sweeps are scanned twice, one of each pair is decoded
+NEXRAD_LOWER_ELEVS = [0.5, 1.5, 2.4]
+NEXRAD_UPPER_ELEVS = [3.4, 4.3, 6.0, 9.9, 14.6, 19.5]
+ODIM_ELEVS = [0.4, 0.8, 1.5, 2.4, 3.5, 5.0, 7.0, 10.0, 15.0, 25.0]
+IRIS_CONVOL_ELEVS = [0.3, 0.5, 0.8, 1.1, 1.5]
+IRIS_DOPVOL_ELEVS = [0.5, 0.5, 1.5]
+
+# Missing rays and precipitation cells per level
+MISSING_RAYS = 8
+PRECIP_CELLS = 6
+
+
+class SyntheticHandle:
+    """
+    The parts of a pyart Radar read by the NexradData/OdimData
+    regridding, and by the IrisData DOPVOL fill. Field data are
+    (rays, gates) masked arrays.
+    """
+
+    def __init__(self, fields, azimuth, sweep_start_ray_index, fixed_angle):
+
+        self.fields = {key: {'data': data} for key, data in fields.items()}
+        self.azimuth = {'data': azimuth}
+        self.sweep_start_ray_index = {'data': sweep_start_ray_index}
+        self.fixed_angle = {'data': np.array(fixed_angle, dtype=np.float32)}
+
+
+class SyntheticVolume:
+    """
+    Polar moments on the regular (levels, azims, gates) grid, NaN
+    without echo, with the clutter and precipitation masks.
+    """
+
+    def __init__(self, grid_info, elevs, seed=0):
+
+        rng = np.random.default_rng(seed)
+        dims = (len(elevs), grid_info.azims, grid_info.gates)
+
+        ranges = (np.arange(grid_info.gates) + 0.5) * grid_info.gate_step / 1000.0
+        azims = np.radians(np.arange(grid_info.azims) * grid_info.azim_step)
+
+        texture = ndimage.gaussian_filter(rng.normal(size=(grid_info.azims, grid_info.gates)), 3.0, mode='wrap')
+        texture *= 8.0 / texture.std()
+
+        self.precip = np.zeros(dims, dtype=bool)
+        cells = np.zeros((grid_info.azims, grid_info.gates))
+        azim_idx = np.arange(grid_info.azims)[:,np.newaxis]
+        gate_idx = np.arange(grid_info.gates)[np.newaxis,:]
+
+        for x in range(0, PRECIP_CELLS):
+            center_azim = rng.integers(0, grid_info.azims)
+            center_gate = rng.integers(grid_info.gates // 10, grid_info.gates)
+            azim_dist = (azim_idx - center_azim + grid_info.azims // 2) % grid_info.azims - grid_info.azims // 2
+            cells = np.maximum(cells, np.exp(-(azim_dist / 15.0) ** 2 - ((gate_idx - center_gate) / (grid_info.gates / 25.0)) ** 2))
+
+        self.dbz = np.empty(dims, dtype=np.float32)
+
+        for z, elev in enumerate(elevs):
+            bugs = 15.0 - 0.15 * ranges[np.newaxis,:] - 1.5 * elev + texture
+            level = np.where(cells > 0.3, 30.0 + 20.0 * cells, bugs)
+            level[level < -15.0] = np.nan
+            level[:, ranges > 250.0] = np.nan
+            level[rng.integers(0, grid_info.azims, size=MISSING_RAYS),:] = np.nan
+
+            self.dbz[z] = level
+            self.precip[z] = cells > 0.3
+
+        echo = np.isfinite(self.dbz)
+        noise = rng.normal(size=dims).astype(np.float32)
+
+        self.diff_reflectivity = np.where(self.precip, 0.5, 4.0) + noise
+        self.cross_correlation_ratio = np.clip(np.where(self.precip, 0.98, 0.6) + 0.05 * noise, 0.0, 1.0)
+        self.velocity = (8.0 * np.sin(azims)[np.newaxis,:,np.newaxis] + 2.0 * noise)
+        self.spectrum_width = np.abs(2.0 + noise)
+
+        for field in [self.diff_reflectivity, self.cross_correlation_ratio, self.velocity, self.spectrum_width]:
+            field[~echo] = np.nan
+
+        # Ground clutter within 20 km, mostly on the lowest levels
+        near = ranges[np.newaxis,np.newaxis,:] < 20.0
+        fraction = 0.4 / (1.0 + np.arange(len(elevs)))[:,np.newaxis,np.newaxis]
+        self.clutter = near & (rng.random(dims) < fraction)
+
+
+def masked(field):
+    return np.ma.masked_invalid(field.astype(np.float32))
+
+
+def rotated_rays(level, theta):
+    """
+    Rays of one sweep as recorded, starting at azimuth index theta
+    (undone by fill_lower_field/fill_upper_field)
+    """
+
+    return np.roll(level, -theta, axis=0)
+
+
+def nexrad_handle(volume, grid_info, rng):
+
+    keys = ['reflectivity', 'spectrum_width', 'velocity', 'cross_correlation_ratio', 'differential_reflectivity']
+    sources = [volume.dbz, volume.spectrum_width, volume.velocity, volume.cross_correlation_ratio,
+               volume.diff_reflectivity]
+
+    num_lower = len(NEXRAD_LOWER_ELEVS)
+    rays = {key: [] for key in keys}
+    azimuth = []
+    starts = []
+    ray_count = 0
+
+    for z in range(0, volume.dbz.shape[0]):
+        lower = z < num_lower
+        step = 1 if lower else 2
+        num_rays = grid_info.azims // step
+        theta = int(rng.integers(0, num_rays))
+
+        for key, source in zip(keys, sources):
+            rays[key].append(rotated_rays(source[z, ::step], theta))
+
+        if lower:
+            azimuth.append(grid_info.azim_offset + grid_info.azim_step * ((theta + np.arange(num_rays)) % num_rays))
+        else:
+            azimuth.append(0.5 + 1.0 * ((theta + np.arange(num_rays)) % num_rays))
+
+        starts.append(ray_count)
+        ray_count += num_rays
+
+    fields = {key: masked(np.concatenate(rays[key])) for key in keys}
+    return SyntheticHandle(fields, np.concatenate(azimuth), np.array(starts), NEXRAD_LOWER_ELEVS + NEXRAD_UPPER_ELEVS)
+
+
+def odim_handle(volume, grid_info, num_upper, rng):
+    """
+    The upper sweeps (360 rays) come first, then the lower sweeps
+    (720 rays) from the highest to the lowest, as read by OdimData
+    """
+
+    keys = ['reflectivity', 'velocity', 'cross_correlation_ratio', 'differential_reflectivity']
+    sources = [volume.dbz, volume.velocity, volume.cross_correlation_ratio, volume.diff_reflectivity]
+
+    fields = dict()
+
+    for key, source in zip(keys, sources):
+        upper = [source[-1, ::2]] * num_upper
+        lower = [source[z] for z in reversed(range(0, source.shape[0]))]
+        fields[key] = masked(np.concatenate(upper + lower))
+
+    num_rays = fields['reflectivity'].shape[0]
+    fixed_angle = list(reversed(ODIM_ELEVS))
+
+    return SyntheticHandle(fields, np.zeros(num_rays), np.zeros(len(fixed_angle), dtype=int), fixed_angle)
+
+
+def scan_shell(cls, metadata, grid_info, scan_dt):
+    """
+    ScanData subclass instance set up without reading a file
+    """
+
+    scan_data = cls.__new__(cls)
+    ScanData.__init__(scan_data, metadata, grid_info, scan_dt)
+    return scan_data
+
+
+class Pipeline:
+    """
+    One format: the stages share their inputs and outputs through
+    the instance, and must run in the STAGES order.
+    """
+
+    def __init__(self, radar_format, gates, workdir, renderer, features, seed=0):
+
+        self.radar_format = radar_format
+        self.workdir = workdir
+        self.renderer = renderer
+        self.features = features
+        self.config = bugtracker.config.get()
+        self.rng = np.random.default_rng(seed)
+
+        azim_offset = 0.0 if radar_format == 'iris' else 0.25
+        self.grid_info = bugtracker.core.grid.GridInfo(gates, 720, GATE_STEPS[radar_format], 0.5,
+                                                       azim_offset=azim_offset)
+        self.metadata = bugtracker.core.samples.metadata()
+        self.scan_dt = self.metadata.scan_dt
+
+        if radar_format == 'iris':
+            self.elevs = sorted(set(IRIS_CONVOL_ELEVS + IRIS_DOPVOL_ELEVS))
+        elif radar_format == 'nexrad':
+            self.elevs = NEXRAD_LOWER_ELEVS + NEXRAD_UPPER_ELEVS
+        else:
+            self.elevs = ODIM_ELEVS[0:6]
+
+        self.volume = SyntheticVolume(self.grid_info, self.elevs, seed)
+        self.clutter_mask = bugtracker.core.filter.PackedMask(self.volume.clutter)
+
+        if radar_format == 'nexrad':
+            self.handle = nexrad_handle(self.volume, self.grid_info, self.rng)
+        elif radar_format == 'odim':
+            self.handle = odim_handle(self.volume, self.grid_info, len(ODIM_ELEVS) - 6, self.rng)
+        else:
+            self.iris_inputs()
+
+
+    def __str__(self):
+        dims = (len(self.elevs), self.grid_info.azims, self.grid_info.gates)
+        return f"{self.radar_format}: {dims}, {np.prod(dims) / 1e6:.1f} M gates"
+
+
+    def dims(self):
+        return [len(self.elevs), self.grid_info.azims, self.grid_info.gates]
+
+
+    def iris_inputs(self):
+        """
+        Raw CONVOL levels (360 x gates/2), DOPVOL short (720 x 225)
+        and long (360 x gates/4) scans.
+        """
+
+        if self.grid_info.gates < 225 or self.grid_info.gates % 4 != 0:
+            raise ValueError(f"IRIS gates must be a multiple of 4, at least 225: {self.grid_info.gates}")
+
+        volume = self.volume
+        levels = [self.elevs.index(elev) for elev in IRIS_CONVOL_ELEVS]
+        self.convol_raw = [masked(volume.dbz[z, ::2, ::2]) for z in levels]
+
+        keys = ['reflectivity', 'total_power', 'velocity', 'spectrum_width']
+        sources = [volume.dbz, volume.dbz, volume.velocity, volume.spectrum_width]
+
+        self.dopvol_scans = []
+
+        for idx, elev in enumerate(IRIS_DOPVOL_ELEVS):
+            z = self.elevs.index(elev)
+            if idx < 2:
+                fields = {key: masked(source[z, :, 0:225]) for key, source in zip(keys, sources)}
+            else:
+                fields = {key: masked(source[z, ::2, ::4]) for key, source in zip(keys, sources)}
+            self.dopvol_scans.append(SyntheticHandle(fields, None, None, [elev]))
+
+        self.convol_clutter = self.volume.clutter[levels]
+        dopvol_levels = [self.elevs.index(elev) for elev in IRIS_DOPVOL_ELEVS]
+        self.dopvol_clutter = self.volume.clutter[dopvol_levels]
+
+
+    def regrid(self):
+
+        if self.radar_format == 'iris':
+            self.regrid_iris()
+        elif self.radar_format == 'nexrad':
+            self.regrid_nexrad()
+        else:
+            self.regrid_odim()
+
+
+    def regrid_iris(self):
+
+        iris = bugtracker.io.iris
+        data = scan_shell(iris.IrisData, self.metadata, self.grid_info, self.scan_dt)
+        dims = (self.grid_info.azims, self.grid_info.gates)
+
+        data.convol_elevs = list(IRIS_CONVOL_ELEVS)
+        data.dopvol_elevs = list(IRIS_DOPVOL_ELEVS)
+        data.convol = bugtracker.io.scan.nan_field((len(IRIS_CONVOL_ELEVS),) + dims, data.dtype)
+        data.dopvol = bugtracker.io.scan.nan_field((len(IRIS_DOPVOL_ELEVS),) + dims, data.dtype)
+        data.total_power = bugtracker.io.scan.nan_field(data.dopvol.shape, data.dtype)
+        data.velocity = bugtracker.io.scan.nan_field(data.dopvol.shape, data.dtype)
+        data.spectrum_width = bugtracker.io.scan.nan_field(data.dopvol.shape, data.dtype)
+        data.dopvol_fields = ['reflectivity', 'total_power', 'velocity', 'spectrum_width']
+
+        # As fill_convol, once the CONVOL file is read
+        for z, level in enumerate(self.convol_raw):
+            data.convol[z,:,:] = iris.upsample(level, self.grid_info.azims, self.grid_info.gates, data.dtype)
+
+        for idx, scan in enumerate(self.dopvol_scans):
+            scan_type = "short" if idx < 2 else "long"
+            for field_key in data.dopvol_fields:
+                data.fill_dopvol_field(scan, data.get_dopvol_array(field_key), field_key, idx, scan_type)
+
+        data.dbz_unfiltered = data.merge_dbz()
+        self.data = data
+
+
+    def regrid_nexrad(self):
+
+        nexrad = bugtracker.io.nexrad
+        data = scan_shell(nexrad.NexradData, self.metadata, self.grid_info, self.scan_dt)
+
+        data.azims_per_lower = 720
+        data.azims_per_upper = 360
+        data.get_odd_scans = False
+        data.scans = data.get_scan_indices()
+        data.handle = self.handle
+
+        data.dbz_unfiltered = data.init_field()
+        data.spectrum_width = data.init_field()
+        data.velocity = data.init_field()
+        data.cross_correlation_ratio = data.init_field()
+        data.diff_reflectivity = data.init_field()
+
+        num_lower = data.get_num_lower()
+        num_upper = data.get_num_upper()
+        data.dbz_elevs = data.get_scan_angles(num_lower, num_upper)
+
+        data.fill_lower(num_lower)
+        data.fill_upper(num_lower, num_upper)
+        bugtracker.io.scan.apply_cutoff(data.dbz_unfiltered, self.config['nexrad_settings']['dbz_cutoff'])
+
+        self.data = data
+
+
+    def regrid_odim(self):
+
+        odim = bugtracker.io.odim
+        data = scan_shell(odim.OdimData, self.metadata, self.grid_info, self.scan_dt)
+
+        data.handle = self.handle
+        data.azims_per_lower = 720
+        data.azims_per_upper = 360
+
+        data.dbz_unfiltered = data.init_field()
+        data.velocity = data.init_field()
+        data.cross_correlation_ratio = data.init_field()
+        data.diff_reflectivity = data.init_field()
+
+        num_lower = data.get_num_lower()
+        num_upper = data.get_num_upper()
+        data.dbz_elevs = data.get_scan_angles(num_lower, num_upper)
+
+        data.fill_lower(num_lower, num_upper)
+        bugtracker.io.scan.apply_cutoff(data.dbz_unfiltered, self.config['odim_settings']['dbz_cutoff'])
+
+        self.data = data
+
+
+    def precip(self):
+
+        precip = bugtracker.core.precip
+
+        if self.radar_format == 'iris':
+            self.precip_filter = precip.PrecipFilter(self.metadata, self.grid_info, IRIS_CONVOL_ELEVS)
+            self.precip_filter.apply(self.data.convol, self.convol_clutter, IRIS_CONVOL_ELEVS)
+        else:
+            self.precip_filter = precip.NexradPrecipFilter(self.metadata, self.grid_info, self.data.dbz_elevs)
+            self.precip_filter.apply(self.data)
+
+
+    def joint(self):
+
+        data = self.data
+        scan = bugtracker.io.scan
+
+        if self.radar_format == 'iris':
+            # The CONVOL precip filter is uniform over elevation
+            precip = self.precip_filter.filter_3d[0]
+            data.convol = scan.apply_filter(data.convol, self.convol_clutter | precip)
+            data.dopvol = scan.apply_filter(data.dopvol, self.dopvol_clutter | precip)
+            data.dbz_filtered = data.merge_dbz()
+            self.precip_3d = np.broadcast_to(precip, data.dbz_filtered.shape)
+            self.clutter_3d = self.volume.clutter
+        else:
+            filter_joint = self.clutter_mask.union(self.precip_filter.filter_3d)
+            data.dbz_filtered = scan.apply_filter(data.dbz_unfiltered, filter_joint)
+            self.precip_3d = self.precip_filter.filter_3d
+            self.clutter_3d = self.clutter_mask
+
+        data.joint_product = scan.joint_max(data.dbz_filtered, self.config['processing']['joint_cutoff'])
+
+
+    def target_id(self):
+
+        dbz = self.data.dbz_filtered if self.radar_format == 'iris' else self.data.dbz_unfiltered
+        target_id = bugtracker.core.target_id.TargetId(dbz, self.clutter_3d, self.precip_3d)
+        self.id_matrix = target_id.export_matrix()
+
+
+    def write(self):
+
+        models = bugtracker.io.models
+
+        if self.radar_format == 'iris':
+            output = models.IrisOutput(self.metadata, self.grid_info)
+            id_matrix = self.id_matrix
+        else:
+            max_scans = self.config[f"{self.radar_format}_settings"].get('vertical_scans', len(self.elevs))
+            id_matrix = self.id_matrix[0:max_scans]
+            if self.radar_format == 'nexrad':
+                output = models.NexradOutput(self.metadata, self.grid_info)
+            else:
+                output = models.OdimOutput(self.metadata, self.grid_info)
+
+        nc_filename = os.path.join(self.workdir, f"{self.radar_format}.nc")
+
+        output.populate(self.data)
+        output.validate()
+        output.write(nc_filename, self.scan_dt)
+        output.append_target_id(nc_filename, id_matrix)
+
+
+    def plot(self):
+
+        max_range = self.config['plot_settings']['max_range']
+        data = bugtracker.io.scan.to_masked(self.data.dbz_filtered[0])
+        output_folder = os.path.join(self.workdir, "plots")
+        os.makedirs(output_folder, exist_ok=True)
+
+        if self.renderer == 'fast':
+            raster = bugtracker.plots.raster
+            cache = {'cache_dir': self.workdir}
+            layout = raster.get_layout(cache, self.metadata, self.grid_info, max_range)
+            renderer = raster.QuicklookRenderer(layout, raster.get_background(cache, layout, features=self.features))
+
+            renderer.render_dbz(data, os.path.join(output_folder, "dbz.png"), "dbz")
+            renderer.render_target_id(self.id_matrix[0], os.path.join(output_folder, "target_id.png"), "target_id")
+        else:
+            lats, lons = bugtracker.core.geometry.get_geometry(self.grid_info, self.metadata).latlon()
+
+            plotter = bugtracker.plots.radial.RadialPlotter(lats, lons, output_folder, self.grid_info)
+            plotter.set_data(data, "dbz", self.scan_dt, self.metadata, max_range)
+            plotter.save_plot(min_value=-15.0, max_value=40.0)
+
+            id_plotter = bugtracker.plots.identify.TargetIdPlotter(lats, lons, output_folder, self.grid_info)
+            id_plotter.set_data(self.id_matrix[0], "target_id", self.scan_dt, self.metadata, max_range)
+            id_plotter.save_plot()
+
+
+def run_stages(pipeline, stages, repeats, verbose):
+    """
+    Best and mean time (ms) of each stage. All the stages run, the
+    unselected ones are not reported.
+    """
+
+    times = {stage: [] for stage in STAGES}
+
+    for x in range(0, repeats):
+        for stage in STAGES:
+            output = sys.stdout if verbose else io.StringIO()
+            with contextlib.redirect_stdout(output):
+                start = time.perf_counter()
+                getattr(pipeline, stage)()
+                times[stage].append((time.perf_counter() - start) * 1000.0)
+
+    return {stage: {'best_ms': min(times[stage]), 'mean_ms': float(np.mean(times[stage]))} for stage in stages}
+
+
+def environment():
+
+    package_dir = os.path.dirname(os.path.abspath(bugtracker.__file__))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=package_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    try:
+        version = importlib.metadata.version("bugtracker")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+
+    return {
+        'datetime': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+        'version': version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the ratio to the baseline of every stage found in both,
+    returns the list of (format, stage) slower than tolerance.
+    """
+
+    regressions = []
+
+    for radar_format, result in results['formats'].items():
+        previous = baseline['formats'].get(radar_format)
+
+        if previous is None:
+            continue
+
+        if previous['dims'] != result['dims']:
+            print(f"{radar_format}: different dims in the baseline, {previous['dims']}, not compared")
+            continue
+
+        for stage, timing in result['stages'].items():
+            if stage not in previous['stages']:
+                continue
+
+            ratio = timing['best_ms'] / previous['stages'][stage]['best_ms']
+            flag = ""
+
+            if ratio > tolerance:
+                regressions.append((radar_format, stage))
+                flag = " REGRESSION"
+
+            print(f"{radar_format:<8} {stage:<10} {ratio:>6.2f}x{flag}")
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--formats", nargs="+", choices=FORMATS, default=FORMATS, help="Volume formats")
+    parser.add_argument("-s", "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages reported")
+    parser.add_argument("-g", "--gates", type=int, default=None, help="Gates of every volume (default: native)")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Runs of the pipeline (best is kept)")
+    parser.add_argument("-p", "--renderer", choices=['fast', 'cartopy'], default='fast', help="Plot renderer")
+    parser.add_argument("-m", "--map-features", action="store_true", help="Draw map features on the quicklooks")
+    parser.add_argument("-o", "--output", default=None, help="JSON results file")
+    parser.add_argument("-b", "--baseline", default=None, help="JSON results file to compare with")
+    parser.add_argument("-t", "--tolerance", type=float, default=1.25, help="Slowdown ratio flagged as a regression")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the processing output")
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'repeats': args.repeats, 'formats': dict()}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for radar_format in args.formats:
+            gates = NATIVE_GATES[radar_format] if args.gates is None else args.gates
+            pipeline = Pipeline(radar_format, gates, workdir, args.renderer, args.map_features)
+            print(pipeline)
+
+            stages = run_stages(pipeline, args.stages, args.repeats, args.verbose)
+            results['formats'][radar_format] = {'dims': pipeline.dims(), 'stages': stages}
+
+            for stage, timing in stages.items():
+                print(f"  {stage:<10} {timing['best_ms']:>10.1f} ms (mean {timing['mean_ms']:.1f})")
+
+    if args.output is not None:
+        with open(args.output, mode='w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written: {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, mode='r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        if len(regressions) > 0:
+            print(f"{len(regressions)} stage(s) slower than {args.tolerance:.2f}x the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
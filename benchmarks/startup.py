@@ -0,0 +1,141 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Startup time of the command-line apps. Each app is run with '-h'
+under 'python -X importtime', and the import time (sum of the
+top-level imports) is compared with a budget. For example:
+
+python startup.py
+python startup.py -r 5 -a calib nexrad_aws
+
+Exits with status 1 if an app is over budget. The heavy packages
+(pyart, matplotlib, cartopy, cv2) should only be imported once a
+radar file is read or a plot is made, not at startup.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+# Import time budgets in milliseconds, by app. Before the lazy
+# imports, every app was at about 3500 ms (mostly pyart).
+BUDGETS = {
+    'nexrad_aws': 800.0,
+    'calib': 500.0,
+    'tracker': 500.0,
+    'animate': 500.0,
+    'catalog': 500.0,
+    'timeseries': 500.0,
+    'plot': 500.0,
+    'motion': 500.0,
+    'mosaic': 500.0
+}
+
+HEAVY_MODULES = ['pyart', 'matplotlib', 'cartopy', 'cv2']
+
+
+def apps_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'apps')
+
+
+def parse_importtime(stderr):
+    """
+    Returns the total import time (ms), and the set of top-level
+    packages imported, from the -X importtime output.
+    """
+
+    total_us = 0
+    packages = set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+
+        name = fields[2].rstrip()
+        packages.add(name.strip().split(".")[0])
+
+        # Nested imports are indented, and already in their parent's
+        # cumulative time
+        if not name.startswith("  "):
+            total_us += int(fields[1])
+
+    return total_us / 1000.0, packages
+
+
+def measure(app, repeats):
+    """
+    Best of 'repeats' runs. Returns (import ms, wall clock ms, packages)
+    """
+
+    best = None
+
+    for x in range(0, repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", f"{app}.py", "-h"],
+                                cwd=apps_dir(), capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - start) * 1000.0
+
+        if result.returncode != 0:
+            raise ValueError(f"{app}.py -h failed:\n{result.stderr}")
+
+        import_ms, packages = parse_importtime(result.stderr)
+
+        if best is None or import_ms < best[0]:
+            best = (import_ms, wall_ms, packages)
+
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--apps", nargs='+', default=list(BUDGETS.keys()), help="Apps to measure")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Runs per app (best is kept)")
+    args = parser.parse_args()
+
+    over_budget = []
+
+    print(f"{'app':<12} {'imports ms':>10} {'wall ms':>8} {'budget ms':>9}  heavy modules")
+
+    for app in args.apps:
+        if app not in BUDGETS:
+            raise ValueError(f"Unknown app: {app}, choose from {list(BUDGETS.keys())}")
+
+        import_ms, wall_ms, packages = measure(app, args.repeats)
+        heavy = [module for module in HEAVY_MODULES if module in packages]
+
+        print(f"{app:<12} {import_ms:>10.1f} {wall_ms:>8.1f} {BUDGETS[app]:>9.1f}  {', '.join(heavy)}")
+
+        if import_ms > BUDGETS[app]:
+            over_budget.append(app)
+
+    if len(over_budget) > 0:
+        print("Over budget:", over_budget)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
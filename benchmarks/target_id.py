@@ -0,0 +1,126 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Time and peak memory of the target_id classification for one
+synthetic volume, comparing the former np.where implementation (int64
+cubes) with bugtracker.core.target_id.classify (uint8, per level).
+The default size is a NEXRAD volume. For example:
+
+python target_id.py
+python target_id.py -l 5 -a 720 -g 512 -r 10
+
+The peak memory is measured with tracemalloc (numpy reports its
+allocations to it), excluding the input arrays.
+"""
+
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+import bugtracker
+
+
+def legacy_matrix(dbz, clutter, precip, min_dbz_bugs, max_dbz_bugs):
+
+    dims = dbz.shape
+    code_dict = bugtracker.core.target_id.get_code_dict()
+    all_clutter = np.full(dims, code_dict['clutter'], dtype=int)
+    all_rain = np.full(dims, code_dict['rain'], dtype=int)
+    all_bugs = np.full(dims, code_dict['bugs'], dtype=int)
+
+    id_matrix = np.zeros(dims, dtype=int)
+
+    bug_condition = np.logical_and(dbz < max_dbz_bugs, dbz > min_dbz_bugs)
+    bug_condition = np.logical_and(bug_condition, np.logical_not(np.ma.getmask(dbz)))
+
+    id_matrix = np.where(bug_condition, all_bugs, id_matrix)
+    id_matrix = np.where(precip, all_rain, id_matrix)
+    id_matrix = np.where(clutter, all_clutter, id_matrix)
+
+    return id_matrix
+
+
+def fused_matrix(dbz, clutter, precip, min_dbz_bugs, max_dbz_bugs):
+
+    return bugtracker.core.target_id.classify(dbz, clutter, precip, min_dbz_bugs, max_dbz_bugs)
+
+
+def synthetic_volume(dims):
+
+    rng = np.random.default_rng(0)
+
+    data = rng.uniform(-30.0, 50.0, size=dims).astype(np.float32)
+    dbz = np.ma.masked_array(data, mask=rng.random(dims) < 0.3)
+    clutter = rng.random(dims) < 0.05
+    precip = rng.random(dims) < 0.2
+
+    return dbz, clutter, precip
+
+
+def measure(function, inputs, repeats):
+    """
+    Returns (best time in s, peak memory in MB, result)
+    """
+
+    best = None
+
+    for x in range(0, repeats):
+        start = time.perf_counter()
+        result = function(*inputs, -10.0, 30.0)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    result = function(*inputs, -10.0, 30.0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak / 1e6, result
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--levels", type=int, default=9, help="Elevation levels")
+    parser.add_argument("-a", "--azims", type=int, default=720, help="Azimuths")
+    parser.add_argument("-g", "--gates", type=int, default=1832, help="Gates")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Runs per implementation (best is kept)")
+    args = parser.parse_args()
+
+    dims = (args.levels, args.azims, args.gates)
+    inputs = synthetic_volume(dims)
+    print(f"Volume: {dims}, {np.prod(dims) / 1e6:.1f} M gates")
+
+    legacy_time, legacy_peak, legacy = measure(legacy_matrix, inputs, args.repeats)
+    fused_time, fused_peak, fused = measure(fused_matrix, inputs, args.repeats)
+
+    if not np.array_equal(legacy, fused):
+        raise ValueError("The classifications differ")
+
+    print(f"{'':<8} {'time ms':>9} {'peak MB':>9} {'output MB':>10}")
+    print(f"{'legacy':<8} {legacy_time * 1000:>9.1f} {legacy_peak:>9.1f} {legacy.nbytes / 1e6:>10.1f}")
+    print(f"{'fused':<8} {fused_time * 1000:>9.1f} {fused_peak:>9.1f} {fused.nbytes / 1e6:>10.1f}")
+    print(f"Speedup: {legacy_time / fused_time:.1f}x, memory: {legacy_peak / fused_peak:.1f}x less")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,22 @@
-import bugtracker.core
-import bugtracker.config
-import bugtracker.calib
-import bugtracker.io
-import bugtracker.plots
+"""
+Subpackages are imported on first attribute access (PEP 562), so that
+'import bugtracker' does not pull in pyart, cartopy, matplotlib or cv2
+for tools that never read radar files or plot. bugtracker.x.y attribute
+chains keep working as with the former eager imports.
+"""
 
+import importlib
+
+_submodules = ['core', 'config', 'calib', 'io', 'plots']
+
+
+def __getattr__(name):
+
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -1,5 +1,16 @@
-import bugtracker.calib.geometry
-import bugtracker.calib.clutter
-import bugtracker.calib.calib
-import bugtracker.calib.elevation
-import bugtracker.calib.srtm3_download
+import importlib
+
+# Submodules are imported on first attribute access, see bugtracker/__init__.py
+_submodules = ['geometry', 'clutter', 'calib', 'elevation', 'srtm3_download']
+
+
+def __getattr__(name):
+
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
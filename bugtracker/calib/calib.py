@@ -29,6 +29,8 @@ import netCDF4 as nc
 
 import bugtracker.config
 import bugtracker.core.utils
+import bugtracker.core.geometry
+import bugtracker.core.tracing
 from bugtracker.calib.clutter import ClutterFilter
 
 
@@ -70,10 +72,9 @@ def get_srtm(metadata, grid_info):
     """
 
     final_grid = bugtracker.calib.calib.Grid()
-    coords = bugtracker.core.utils.latlon(grid_info, metadata)
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
 
-    final_grid.lats = coords['lats']
-    final_grid.lons = coords['lons']
+    final_grid.lats, final_grid.lons = geometry.latlon()
 
     grid_dims = final_grid.lons.shape
     final_grid.altitude = np.zeros(grid_dims, dtype=float)
@@ -167,7 +168,7 @@ class Controller(abc.ABC):
     def __init__(self, args, metadata, grid_info):
 
         self.args = args
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.metadata = metadata
         self.grid_info = grid_info
         self.data = Data(metadata, grid_info)
@@ -214,7 +215,7 @@ class IrisController(Controller):
     def __init__(self, args, metadata, grid_info):
 
         super().__init__(args, metadata, grid_info)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.convol_clutter = ClutterFilter(metadata, grid_info)
         self.dopvol_clutter = ClutterFilter(metadata, grid_info)
 
@@ -247,7 +248,8 @@ class IrisController(Controller):
         iris_data = None
 
         try:
-            iris_data = bugtracker.io.iris.IrisData(iris_set)
+            # The clutter count only needs dBZ from the DOPVOL files
+            iris_data = bugtracker.io.iris.IrisData(iris_set, dopvol_fields=bugtracker.io.iris.DOPVOL_CALIB_FIELDS)
             iris_data.fill_grids()
         except (OSError, IndexError, FileNotFoundError):
             print("Could not read file, skipping.")
@@ -297,7 +299,8 @@ class IrisController(Controller):
         self.num_excluded = 0
 
         for iris_set in self.calib_sets:
-            self.count_instances(iris_set)
+            with bugtracker.core.tracing.span("count_instances", "calib", file=iris_set.convol):
+                self.count_instances(iris_set)
 
         print("Total number of excluded files:", self.num_excluded)
         adjusted_total = num_timeseries - self.num_excluded
@@ -404,7 +407,7 @@ class NexradController(Controller):
     def __init__(self, args, manager):
 
         super().__init__(args, manager.metadata, manager.grid_info)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         # Using NexradManager for I/O processing
         self.manager = manager
 
@@ -449,7 +452,7 @@ class NexradController(Controller):
                 raise ValueError(f"Incompatible shape: {clutter_dims}")
 
             clutter_above = nex_data.dbz_unfiltered > dbz_threshold
-            clutter_above = clutter_above.filled(fill_value=False)
+            clutter_above = np.ma.filled(clutter_above, False)
             self.clutter_instances = self.clutter_instances + clutter_above.astype(int)
 
 
@@ -479,7 +482,8 @@ class NexradController(Controller):
 
         for calib_file in self.calib_files:
             print("Calib file processing:", calib_file)
-            self.count_instances(calib_file)
+            with bugtracker.core.tracing.span("count_instances", "calib", file=calib_file):
+                self.count_instances(calib_file)
 
         adjusted_num_timeseries = num_timeseries - self.num_excluded
         print("Num excluded:", self.num_excluded)
@@ -543,7 +547,7 @@ class OdimController(Controller):
     def __init__(self, args, manager):
 
         super().__init__(args, manager.metadata, manager.grid_info)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         # Using OdimManager for I/O processing
         self.manager = manager
 
@@ -587,7 +591,7 @@ class OdimController(Controller):
 
         clutter_above = odim_data.dbz_unfiltered > dbz_threshold
 
-        clutter_above = clutter_above.filled(fill_value=False)
+        clutter_above = np.ma.filled(clutter_above, False)
 
         self.clutter_instances = self.clutter_instances + clutter_above.astype(int)
 
@@ -617,7 +621,8 @@ class OdimController(Controller):
 
         for calib_file in self.calib_files:
             print("Calib file processing:", calib_file)
-            self.count_instances(calib_file)
+            with bugtracker.core.tracing.span("count_instances", "calib", file=calib_file):
+                self.count_instances(calib_file)
 
         # Normalization
         self.norm_clutter = self.clutter_instances / float(num_timeseries)
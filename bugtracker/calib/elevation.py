@@ -74,12 +74,11 @@ class SRTM3Reader:
         of the upscaled polar radar.
         """
 
-        self.config = bugtracker.config.load('./bugtracker.json')
+        self.config = bugtracker.config.get()
         self.metadata = metadata
         self.grid_info = grid_info
-        coords = bugtracker.core.utils.latlon(grid_info, metadata)
-        self.radar_lats = coords['lats']
-        self.radar_lons = coords['lons']
+        geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+        self.radar_lats, self.radar_lons = geometry.latlon()
         self.polar_points = dict()
 
         bugtracker.core.utils.arr_info(self.radar_lats, "radar_lats")
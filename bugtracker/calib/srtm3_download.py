@@ -63,7 +63,7 @@ class Downloader():
         """
         self.src_url = "https://dds.cr.usgs.gov/srtm/version2_1/SRTM3/North_America/"
         self.keys = active_keys
-        self.config = bugtracker.config.load('./bugtracker.json')
+        self.config = bugtracker.config.get()
         self.missing = None
         root_cache = self.config['cache_dir']
         self.srtm3_dir = os.path.join(root_cache, 'elevation', 'srtm3')
@@ -16,12 +16,42 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+"""
+The config is read once per process and shared, bugtracker.config.get()
+returns the same dict on every call. The BUGTRACKER_CONFIG environment
+variable overrides the path of the config file, which also makes
+worker processes independent of the current directory.
+
+Sections missing from an older config file are filled in with the
+defaults of the ConfigTemplate, and values of the wrong type raise a
+ValueError.
+"""
+
 import os
+import copy
 import json
 
 
+ENV_VARIABLE = "BUGTRACKER_CONFIG"
+DEFAULT_PATH = "./bugtracker.json"
+
+# These have no default value, they depend on the installation
+REQUIRED_DIRS = ["plot_dir", "netcdf_dir", "cache_dir", "animation_dir"]
+REQUIRED_INPUT_DIRS = ["iris", "nexrad", "odim"]
+
+# Loaded configs, by requested path
+_configs = dict()
+
+
 def locate_path(base_path):
 
+    env_path = os.environ.get(ENV_VARIABLE)
+
+    if env_path is not None:
+        if not os.path.isfile(env_path):
+            raise FileNotFoundError(f"{ENV_VARIABLE} file not found: {env_path}")
+        return env_path
+
     backup_path = "../apps/bugtracker.json"
 
     if os.path.isfile(base_path):
@@ -32,22 +62,111 @@ def locate_path(base_path):
         raise FileNotFoundError(base_path)
 
 
-def load(base_path):
+def defaults():
+    """
+    Default processing settings (everything except the directories)
     """
-    This function provides a simple way to call load a .json
-    config file.
 
-    One weakness of this approach is that the top-level scripts
-    must be run from within the /apps folder.
+    template = ConfigTemplate()
+    template.populate_settings()
+    return template.data
+
+
+def check_type(value, default, label):
+
+    # Integers are valid floats, but booleans are not numbers here
+    if isinstance(default, bool) or isinstance(value, bool):
+        valid = isinstance(value, bool) and isinstance(default, bool)
+    elif isinstance(default, float):
+        valid = isinstance(value, (int, float))
+    else:
+        valid = isinstance(value, type(default))
+
+    if not valid:
+        raise ValueError(f"Invalid config value {label}: {value} (expected {type(default).__name__})")
+
+
+def validate(config_json):
+    """
+    Checks the required directories, and fills in the missing
+    settings with their default values (typed as in ConfigTemplate).
+    Returns the completed config.
     """
 
-    config_path = locate_path(base_path)
+    for key in REQUIRED_DIRS:
+        if key not in config_json:
+            raise ValueError(f"Missing config entry: {key}")
+
+    if "input_dirs" not in config_json:
+        raise ValueError("Missing config entry: input_dirs")
+
+    for key in REQUIRED_INPUT_DIRS:
+        if key not in config_json["input_dirs"]:
+            raise ValueError(f"Missing config entry: input_dirs.{key}")
+
+    for section, settings in defaults().items():
+        if section not in config_json:
+            config_json[section] = copy.deepcopy(settings)
+            continue
+
+        if not isinstance(config_json[section], dict):
+            raise ValueError(f"Config section {section} must be a dict")
+
+        for key, default in settings.items():
+            if key not in config_json[section]:
+                config_json[section][key] = default
+            else:
+                check_type(config_json[section][key], default, f"{section}.{key}")
+
+    return config_json
+
+
+def read(config_path):
+    """
+    Reads and validates a config file, without any caching.
+    """
 
     config_file = open(config_path, mode='r')
     config_json = json.load(config_file)
     config_file.close()
 
-    return config_json
+    return validate(config_json)
+
+
+def load(base_path):
+    """
+    This function provides a simple way to call load a .json
+    config file. The file is only read on the first call, later calls
+    return the same (shared) dict, so it must not be modified.
+
+    One weakness of this approach is that the top-level scripts
+    must be run from within the /apps folder (or set BUGTRACKER_CONFIG).
+    """
+
+    key = os.environ.get(ENV_VARIABLE, base_path)
+
+    if key not in _configs:
+        _configs[key] = read(locate_path(base_path))
+
+    return _configs[key]
+
+
+def get():
+    """
+    Accessor for the process-wide config.
+    """
+
+    return load(DEFAULT_PATH)
+
+
+def reload():
+    """
+    Forget the loaded configs, so that the next call reads the file
+    again (e.g. when watching for new data over a long period).
+    """
+
+    _configs.clear()
+    return get()
 
 
 class ConfigTemplate:
@@ -71,7 +190,18 @@ class ConfigTemplate:
         self.data["cache_dir"] = os.path.join(root_directory, "cache")
         self.data["animation_dir"] = os.path.join(root_directory, "animation")
 
-        # Default processing settings
+        self.populate_settings()
+
+
+    def populate_settings(self):
+        """
+        Default processing settings, these also serve as the schema
+        used by validate().
+        """
+
+        if self.data is None:
+            self.data = dict()
+
         self.data["iris_settings"] = dict()
         self.data["iris_settings"]["convol_scans"] = 5
         self.data["iris_settings"]["azim_precip_region"] = 4
@@ -96,9 +226,74 @@ class ConfigTemplate:
 
         self.data["processing"] = dict()
         self.data["processing"]["joint_cutoff"] = 30.0
+        self.data["processing"]["dtype"] = "float32"
+        # 0 is unbounded, see core/memory.py
+        self.data["processing"]["max_memory_mb"] = 0
+        self.data["processing"]["worker_memory_mb"] = 250
 
         self.data["plot_settings"] = dict()
         self.data["plot_settings"]["max_range"] = 150.0
+        self.data["plot_settings"]["renderer"] = "cartopy"
+        self.data["plot_settings"]["mode"] = "inline"
+        self.data["plot_settings"]["products"] = dict()
+
+        for product in ["joint", "filtered", "unfiltered", "target_id"]:
+            self.data["plot_settings"]["products"][product] = {"cadence": 0, "elevations": []}
+
+        self.data["animation"] = dict()
+        self.data["animation"]["source"] = "plots"
+        self.data["animation"]["codec"] = "mp4v"
+        self.data["animation"]["fps"] = 1.0
+        self.data["animation"]["scale"] = 0.5
+        self.data["animation"]["workers"] = 0
+
+        self.data["cartesian"] = dict()
+        self.data["cartesian"]["enabled"] = False
+        self.data["cartesian"]["resolution"] = 1000.0
+        self.data["cartesian"]["max_range"] = 150.0
+        self.data["cartesian"]["method"] = "nearest"
+
+        self.data["motion"] = dict()
+        self.data["motion"]["enabled"] = False
+        self.data["motion"]["field"] = "joint"
+        self.data["motion"]["resolution"] = 1000.0
+        self.data["motion"]["max_range"] = 150.0
+        self.data["motion"]["tile_size"] = 32
+        self.data["motion"]["min_coverage"] = 0.1
+        self.data["motion"]["min_quality"] = 0.1
+        self.data["motion"]["max_gap"] = 20.0
+
+        self.data["vad"] = dict()
+        self.data["vad"]["enabled"] = True
+        self.data["vad"]["min_range"] = 5.0
+        self.data["vad"]["max_range"] = 50.0
+        self.data["vad"]["ring_width"] = 2000.0
+        self.data["vad"]["height_step"] = 100.0
+        self.data["vad"]["max_height"] = 3000.0
+        self.data["vad"]["min_gates"] = 50
+        self.data["vad"]["min_sectors"] = 6
+
+        self.data["vertical_profile"] = dict()
+        self.data["vertical_profile"]["enabled"] = True
+        self.data["vertical_profile"]["height_step"] = 100.0
+        self.data["vertical_profile"]["max_height"] = 3000.0
+        self.data["vertical_profile"]["percentiles"] = [10.0, 50.0, 90.0]
+
+        self.data["mosaic"] = dict()
+        self.data["mosaic"]["stations"] = []
+        self.data["mosaic"]["rule"] = "max"
+        self.data["mosaic"]["lat_min"] = 40.0
+        self.data["mosaic"]["lat_max"] = 50.0
+        self.data["mosaic"]["lon_min"] = -80.0
+        self.data["mosaic"]["lon_max"] = -65.0
+        self.data["mosaic"]["resolution"] = 0.01
+        self.data["mosaic"]["max_range"] = 150.0
+        self.data["mosaic"]["max_offset"] = 10.0
+
+        self.data["metrics"] = dict()
+        self.data["metrics"]["enabled"] = True
+        self.data["metrics"]["prometheus_dir"] = ""
+        self.data["metrics"]["buckets"] = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
 
 
     def write(self, output_file):
@@ -129,9 +324,15 @@ class ConfigTemplate:
         cache_dir = self.data["cache_dir"]
         cache_calib_dir = os.path.join(cache_dir, "calib")
         cache_elevation_dir = os.path.join(cache_dir, "elevation")
+        cache_cartesian_dir = os.path.join(cache_dir, "cartesian")
+        cache_mosaic_dir = os.path.join(cache_dir, "mosaic")
+        cache_metrics_dir = os.path.join(cache_dir, "metrics")
 
         self.safe_mkdir(cache_dir)
         self.safe_mkdir(cache_calib_dir)
         self.safe_mkdir(cache_elevation_dir)
+        self.safe_mkdir(cache_cartesian_dir)
+        self.safe_mkdir(cache_mosaic_dir)
+        self.safe_mkdir(cache_metrics_dir)
 
         self.safe_mkdir(self.data["animation_dir"])
@@ -1,10 +1,16 @@
-import bugtracker.core.exceptions
-import bugtracker.core.grid
-import bugtracker.core.metadata
-import bugtracker.core.cache
-import bugtracker.core.utils
-import bugtracker.core.filter
-import bugtracker.core.precip
-import bugtracker.core.waves
-import bugtracker.core.samples
-import bugtracker.core.target_id
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first attribute access, see bugtracker/__init__.py
+_submodules = ['exceptions', 'grid', 'metadata', 'geometry', 'cache', 'utils', 'filter', 'precip', 'waves', 'samples', 'target_id', 'vad', 'vertical_profile', 'metrics', 'profiling', 'memory', 'tracing', 'sigmet']
+
+
+def __getattr__(name):
+
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -31,9 +31,9 @@ import shutil
 
 import numpy as np
 import netCDF4 as nc
-import pyart
 
 import bugtracker.config
+import bugtracker.core.grid
 
 
 
@@ -54,12 +54,54 @@ def get_calib_key(metadata, grid_info):
     return cache_basename
 
 
+def parse_calib_key(calib_file):
+    """
+    Inverse of get_calib_key, returns (radar_id, GridInfo). The
+    offsets are not part of the key, and are taken as zero: use
+    calib_grid to geolocate the gates.
+    """
+
+    basename = os.path.splitext(os.path.basename(calib_file))[0]
+    elements = basename.rsplit('_', 4)
+
+    if len(elements) != 5:
+        raise ValueError(f"Invalid calib filename: {calib_file}")
+
+    radar_id, azims, gates, azim_step, gate_step = elements
+    grid_info = bugtracker.core.grid.GridInfo(int(gates), int(azims), float(gate_step), float(azim_step))
+
+    return radar_id, grid_info
+
+
+def calib_grid(calib_file):
+    """
+    (radar_id, GridInfo) of a calib file, with the offsets saved in
+    the file (e.g. NEXRAD and ODIM gates start at the centre of the
+    first gate). Older calib files without them get zero offsets.
+    """
+
+    radar_id, grid_info = parse_calib_key(calib_file)
+
+    dset = nc.Dataset(calib_file, mode='r')
+    attributes = dset.ncattrs()
+
+    if 'azim_offset' in attributes and 'gate_offset' in attributes:
+        grid_info.azim_offset = float(dset.getncattr('azim_offset'))
+        grid_info.gate_offset = float(dset.getncattr('gate_offset'))
+    else:
+        print(f"Warning: no grid offsets in {calib_file}, using zero")
+
+    dset.close()
+
+    return radar_id, grid_info
+
+
 def calib_filepath(metadata, grid_info):
     """
     Sort out folder structure.
     """
 
-    config = bugtracker.config.load("./bugtracker.json")
+    config = bugtracker.config.get()
     cache_base = config['cache_dir']
     cache_folder = os.path.join(cache_base, 'calib')
     calib_filename = get_calib_key(metadata, grid_info)
@@ -72,7 +114,7 @@ class CacheManager:
 
     def __init__(self):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
 
     def __safe_mkdir(self, folder):
@@ -118,8 +160,10 @@ class CacheManager:
         zipped_folder = os.path.join(elev_folder, "zipped")
         srtm3_folder = os.path.join(elev_folder, "srtm3")
         calib_folder = os.path.join(cache_root, "calib")
+        cartesian_folder = os.path.join(cache_root, "cartesian")
 
         self.__safe_mkdir(elev_folder)
         self.__safe_mkdir(zipped_folder)
         self.__safe_mkdir(srtm3_folder)
         self.__safe_mkdir(calib_folder)
+        self.__safe_mkdir(cartesian_folder)
@@ -39,8 +39,16 @@ Keep in mind that the filtering occors on dbz data.
 """
 
 import abc
+import copy
+
 import numpy as np
 
+import bugtracker.core.geometry
+
+
+# Number of bits set in each byte value
+BIT_COUNTS = np.array([bin(x).count("1") for x in range(0, 256)], dtype=np.uint8)
+
 
 class Filter(abc.ABC):
 
@@ -48,6 +56,7 @@ class Filter(abc.ABC):
         
         self.metadata = metadata
         self.grid_info = grid_info
+        self.geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
 
         self.filter_3d = None
         self.vertical_angles = None
@@ -131,3 +140,74 @@ class Filter(abc.ABC):
         self.set_filter(fill_entry=False)
 
 
+
+
+class PackedMask:
+    """
+    Boolean (levels, azims, gates) filter mask stored with 8 gates per
+    byte (np.packbits along the gates), 1/8 of the size of a bool
+    array. Indexing a level returns it unpacked, as a bool array.
+    """
+
+    def __init__(self, mask):
+
+        mask = np.asarray(mask, dtype=bool)
+
+        if mask.ndim != 3:
+            raise ValueError(f"PackedMask must be 3D: {mask.shape}")
+
+        self.shape = mask.shape
+        self.bits = np.packbits(mask, axis=-1)
+
+
+    def __str__(self):
+        return f"PackedMask: {self.shape}, {self.nbytes} bytes"
+
+
+    def __getitem__(self, level):
+
+        if not isinstance(level, (int, np.integer)):
+            raise ValueError(f"PackedMask can only be indexed by level: {level}")
+
+        return np.unpackbits(self.bits[level], axis=-1, count=self.shape[-1]).view(bool)
+
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+
+    def unpack(self):
+
+        return np.unpackbits(self.bits, axis=-1, count=self.shape[-1]).view(bool)
+
+
+    def union(self, other):
+        """
+        Gates set in either mask. other is a PackedMask or a boolean
+        array of the same shape.
+        """
+
+        if not isinstance(other, PackedMask):
+            other = PackedMask(other)
+
+        if other.shape != self.shape:
+            raise ValueError(f"Incompatible mask dimensions: {other.shape} != {self.shape}")
+
+        combined = copy.copy(self)
+        combined.bits = self.bits | other.bits
+
+        return combined
+
+
+    def coverage(self, num_levels=None):
+        """
+        Fraction of the gates set, over the first num_levels levels
+        (all levels by default). The padding bits are always zero.
+        """
+
+        bits = self.bits[0:num_levels]
+        num_levels = bits.shape[0]
+
+        hits = BIT_COUNTS[bits].sum(dtype=np.int64)
+        return hits / float(num_levels * self.shape[1] * self.shape[2])
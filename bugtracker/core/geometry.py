@@ -0,0 +1,222 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Geometry of the (azims, gates) polar grid of one radar site.
+
+Lat/lon, ground range and beam height only depend on the GridInfo,
+the site and the elevation angle, so they are computed once (on first
+use) and shared by the filters, calibration and plots. All arrays are
+float32.
+
+As in GridInfo.get_range(), gate y is at range
+gate_offset + y * gate_step (gate_offset is the range to the center of
+the first gate, 0 for IRIS).
+"""
+
+import numpy as np
+import pyart
+
+
+# Effective earth radius (4/3 model) in meters, as used by
+# pyart.core.antenna_to_cartesian
+EFFECTIVE_RADIUS = 6371.0 * 1000.0 * 4.0 / 3.0
+
+# GridGeometry objects already built in this process
+_geometries = dict()
+
+
+def get_geometry_key(grid_info, metadata):
+
+    site = f"{metadata.radar_id.lower()}_{metadata.lat:.5f}_{metadata.lon:.5f}"
+    polar = f"{grid_info.azims}_{grid_info.gates}_{grid_info.azim_step}_{grid_info.gate_step}"
+    return f"{site}_{polar}_{grid_info.azim_offset}_{grid_info.gate_offset}"
+
+
+def get_geometry(grid_info, metadata):
+    """
+    Returns the shared GridGeometry for this site and grid.
+    """
+
+    key = get_geometry_key(grid_info, metadata)
+
+    if key not in _geometries:
+        _geometries[key] = GridGeometry(grid_info, metadata)
+
+    return _geometries[key]
+
+
+class GridGeometry:
+
+    def __init__(self, grid_info, metadata, elevs=None):
+        """
+        elevs is an optional list of elevation angles (degrees),
+        used by heights() when no angles are given.
+        """
+
+        self.grid_info = grid_info
+        self.metadata = metadata
+        self.elevs = elevs
+
+        # 1D coordinates, azimuths in degrees, ranges in meters
+        azim_idx = np.arange(grid_info.azims, dtype=np.float64)
+        gate_idx = np.arange(grid_info.gates, dtype=np.float64)
+        self.azimuths = azim_idx * grid_info.azim_step + grid_info.azim_offset
+        self.ranges = gate_idx * grid_info.gate_step + grid_info.gate_offset
+
+        self._lats = None
+        self._lons = None
+        self._ground_range = dict()
+        self._beam_height = dict()
+        self._flat_height = dict()
+
+
+    def __str__(self):
+        rep = "GridGeometry:\n"
+
+        rep += f"radar_id: {self.metadata.radar_id}\n"
+        rep += f"azims: {self.grid_info.azims}\n"
+        rep += f"gates: {self.grid_info.gates}\n"
+        rep += f"cached elevations: {sorted(self._beam_height.keys())}\n"
+
+        return rep
+
+
+    def _elev_key(self, elev):
+        return round(float(elev), 4)
+
+
+    def _beam(self, elev):
+        """
+        Beam height and ground range (meters, float64) of each gate,
+        using the 4/3 effective earth radius model.
+        """
+
+        elev_rad = np.radians(elev)
+        ranges = self.ranges
+        radius = EFFECTIVE_RADIUS
+
+        height = np.sqrt(ranges ** 2 + radius ** 2 + 2.0 * ranges * radius * np.sin(elev_rad)) - radius
+        ground = radius * np.arcsin(ranges * np.cos(elev_rad) / (radius + height))
+
+        return height, ground
+
+
+    def beam_height(self, elev):
+        """
+        Height of the beam center above the radar (meters) at each
+        gate. Shape: (gates,)
+        """
+
+        key = self._elev_key(elev)
+
+        if key not in self._beam_height:
+            height, ground = self._beam(key)
+            self._beam_height[key] = height.astype(np.float32)
+            self._ground_range[key] = ground.astype(np.float32)
+
+        return self._beam_height[key]
+
+
+    def ground_range(self, elev=0.0):
+        """
+        Distance along the ground (meters) at each gate. Shape: (gates,)
+        """
+
+        key = self._elev_key(elev)
+
+        if key not in self._ground_range:
+            self.beam_height(key)
+
+        return self._ground_range[key]
+
+
+    def flat_height(self, elev):
+        """
+        Flat earth approximation h = r * tan(elev), in km. This is the
+        height used by the PrecipFilter slopes. Shape: (gates,)
+        """
+
+        key = self._elev_key(elev)
+
+        if key not in self._flat_height:
+            range_km = self.ranges * 0.001
+            self._flat_height[key] = (range_km * np.tan(np.radians(key))).astype(np.float32)
+
+        return self._flat_height[key]
+
+
+    def heights(self, elevs=None):
+        """
+        Beam heights (meters) for a list of elevations.
+        Shape: (elevs, gates)
+        """
+
+        if elevs is None:
+            elevs = self.elevs
+
+        if elevs is None:
+            raise ValueError("No elevation angles")
+
+        return np.stack([self.beam_height(elev) for elev in elevs])
+
+
+    def latlon(self):
+        """
+        Lat/lon of the gates at 0 degrees elevation.
+        Shape: (azims, gates)
+        """
+
+        if self._lats is None:
+            azim_rad = np.radians(self.azimuths)[:,np.newaxis]
+            ground = self._beam(0.0)[1][np.newaxis,:]
+
+            x_arr = ground * np.sin(azim_rad)
+            y_arr = ground * np.cos(azim_rad)
+
+            lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, self.metadata.lon, self.metadata.lat)
+
+            self._lats = lats.astype(np.float32)
+            self._lons = lons.astype(np.float32)
+
+        return self._lats, self._lons
+
+
+    def polar_position(self, x_arr, y_arr):
+        """
+        Fractional (azim, gate) indices of Cartesian points (meters,
+        east/north of the radar), the inverse of azimuths and ranges.
+        Azimuths are clockwise from north, and the gate range is taken
+        as the ground range (flat earth, low elevation angles).
+        """
+
+        ranges = np.hypot(x_arr, y_arr)
+        azimuths = np.degrees(np.arctan2(x_arr, y_arr)) % 360.0
+
+        azim_pos = (azimuths - self.azimuths[0]) / self.grid_info.azim_step
+        gate_pos = (ranges - self.ranges[0]) / self.grid_info.gate_step
+
+        return azim_pos, gate_pos, ranges
+
+
+    def lats(self):
+        return self.latlon()[0]
+
+
+    def lons(self):
+        return self.latlon()[1]
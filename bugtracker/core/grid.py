@@ -54,8 +54,8 @@ class GridInfo():
 
         # Missing some fields with info
         _range = dict()
-        begin = 0
-        end = (self.gates - 1) * self.gate_step
+        begin = self.gate_offset
+        end = self.gate_offset + (self.gates - 1) * self.gate_step
         _range['data'] = np.linspace(begin, end, self.gates)
         return _range
 
@@ -0,0 +1,196 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Memory accounting, and the memory-bounded processing mode.
+
+array_bytes() adds up the numpy arrays held by the scan objects
+(ScanData, filters, PackedMask), the RSS functions read the process
+resident set size. On Linux the high-water mark (VmHWM) can be reset
+through /proc/self/clear_refs, so that peak_rss_mb() is the peak of
+one scan. Elsewhere it falls back to getrusage(), the peak of the
+whole process.
+
+With processing.max_memory_mb set (0 means unbounded), MemoryBudget
+decides how many elevations are processed at a time and how many plot
+workers are started, from the headroom left under the limit.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+MB = 1024 * 1024
+
+
+def array_bytes(*objects):
+    """
+    Bytes of the numpy arrays (with masks) among the objects, and
+    among their attributes, lists and dicts (one level deep).
+    """
+
+    total = 0
+
+    for obj in objects:
+        if isinstance(obj, np.ndarray):
+            total += obj.nbytes
+            mask = np.ma.getmask(obj)
+            if mask is not np.ma.nomask:
+                total += mask.nbytes
+        elif isinstance(obj, (list, tuple)):
+            total += sum(array_bytes(value) for value in obj if isinstance(value, np.ndarray))
+        elif isinstance(obj, dict):
+            total += sum(array_bytes(value) for value in obj.values() if isinstance(value, np.ndarray))
+        elif hasattr(obj, '__dict__'):
+            total += sum(array_bytes(value) for value in vars(obj).values()
+                         if isinstance(value, (np.ndarray, list, tuple, dict)))
+
+    return total
+
+
+def proc_status(key):
+    """
+    Value of a /proc/self/status entry in MB, None if unavailable
+    """
+
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith(f"{key}:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    return None
+
+
+def current_rss_mb():
+    return proc_status("VmRSS")
+
+
+def reset_peak_rss():
+    """
+    Resets the RSS high-water mark (Linux only). Returns False if the
+    peak cannot be reset, peak_rss_mb() is then the process peak.
+    """
+
+    try:
+        with open("/proc/self/clear_refs", mode='w') as handle:
+            handle.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    RSS high-water mark in MB, None if unavailable
+    """
+
+    peak = proc_status("VmHWM")
+
+    if peak is not None or resource is None:
+        return peak
+
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / MB if sys.platform == 'darwin' else maxrss / 1024.0
+
+
+class MemoryBudget:
+    """
+    max_memory_mb is the limit for the processing (parent) process and
+    its plot workers. worker_memory_mb is the estimated footprint of a
+    plot worker before it receives its scan.
+    """
+
+    def __init__(self, max_memory_mb, worker_memory_mb=250):
+
+        if max_memory_mb <= 0 or worker_memory_mb <= 0:
+            raise ValueError(f"Invalid memory budget: {max_memory_mb} MB, {worker_memory_mb} MB per worker")
+
+        self.max_memory_mb = max_memory_mb
+        self.worker_memory_mb = worker_memory_mb
+
+
+    def __str__(self):
+        return f"MemoryBudget: {self.max_memory_mb} MB, {self.worker_memory_mb} MB per worker"
+
+
+    def headroom_mb(self):
+        """
+        Memory left under the limit, the whole limit if the RSS is
+        unknown.
+        """
+
+        rss = current_rss_mb()
+
+        if rss is None:
+            return float(self.max_memory_mb)
+
+        return max(self.max_memory_mb - rss, 0.0)
+
+
+    def chunk_levels(self, level_bytes, copies, levels):
+        """
+        Number of elevations processed at a time, when a stage keeps
+        'copies' temporaries of level_bytes per elevation. At least one.
+        """
+
+        needed = copies * level_bytes / MB
+
+        if needed <= 0.0:
+            return levels
+
+        return int(min(max(self.headroom_mb() // needed, 1), levels))
+
+
+    def workers(self, payload_bytes, jobs):
+        """
+        Size of the plot pool: each worker holds its baseline and a
+        copy of the scan (payload_bytes). At least one, at most one
+        per job and per cpu.
+        """
+
+        per_worker = self.worker_memory_mb + payload_bytes / MB
+        fit = int(self.headroom_mb() // per_worker)
+
+        return max(min(fit, jobs, os.cpu_count() or 1), 1)
+
+
+def from_config(config):
+    """
+    MemoryBudget of the 'processing' config section, None if the
+    processing is unbounded (max_memory_mb is 0).
+    """
+
+    settings = config.get('processing', dict())
+    max_memory_mb = settings.get('max_memory_mb', 0)
+
+    if max_memory_mb <= 0:
+        return None
+
+    return MemoryBudget(max_memory_mb, settings.get('worker_memory_mb', 250))
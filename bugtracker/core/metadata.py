@@ -21,9 +21,6 @@ The metadata extracts a standardized list of metatdata outputs
 from a variety of input formats.
 """
 
-import os
-
-import pyart
 
 
 class Metadata:
@@ -52,21 +49,16 @@ class Metadata:
         return f"radar_id: {self.radar_id}\nscan_dt: {self.scan_dt}\nlatitude: {self.lat}\nlongitude: {self.lon}\n"
 
 
-def from_iris_set(iris_set):
+def from_iris_set(iris_set, iris_convol):
     """
-    Takes an IrisSet object as an input, creates corresponding
+    Takes an IrisSet object and the pyart handle of its CONVOL file
+    (see bugtracker.io.iris.read_metadata), creates corresponding
     metadata.
     """
 
     scan_dt = iris_set.datetime
     radar_id = iris_set.radar_id
 
-    convol_file = iris_set.convol
-    if not os.path.isfile(convol_file):
-        raise FileNotFoundError(convol_file)
-
-    iris_convol = pyart.io.read_sigmet(convol_file)
-
     latitude = iris_convol.latitude['data'][0]
     longitude = iris_convol.longitude['data'][0]
 
@@ -0,0 +1,449 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Per-scan processing metrics.
+
+A ScanMetrics times the stages of one scan (time.perf_counter), and
+collects the process-wide counters incremented with count() while the
+scan was processed:
+
+bytes_read      - size of the radar files read
+bytes_written   - size of the output files written
+gates_processed - gates of the regular (levels, azims, gates) grid
+cache_hits      - operators/layouts found in memory or in the disk cache
+cache_misses    - operators/layouts that had to be built
+
+The memory of a scan is the size of the arrays held (see hold()) at
+the end of each stage, and the peak RSS of the process during the scan
+(see memory.py).
+
+The MetricsWriter appends one JSON line per scan to
+<cache_dir>/metrics/<radar_id>.jsonl and, if 'prometheus_dir' is set,
+rewrites a Prometheus textfile (node_exporter textfile collector)
+with per-stage histograms. tracker.py is usually run once per scan, so
+the histograms and counters are kept in
+<cache_dir>/metrics/<radar_id>.state.json and carried over from one
+process to the next. Changing the buckets starts them over, which
+rate()/increase() handle as a counter reset.
+"""
+
+import os
+import json
+import time
+import datetime
+import contextlib
+import collections
+
+import bugtracker.core.memory
+import bugtracker.core.profiling
+
+
+COUNTERS = ['bytes_read', 'bytes_written', 'gates_processed', 'cache_hits', 'cache_misses']
+
+# Process-wide counters, see count()
+_counters = collections.Counter()
+
+
+def count(name, value=1):
+    """
+    Increments a process-wide counter (one of COUNTERS)
+    """
+
+    if name not in COUNTERS:
+        raise ValueError(f"Invalid counter: {name}, must be one of {COUNTERS}")
+
+    _counters[name] += int(value)
+
+
+def count_cache(hit):
+    count('cache_hits' if hit else 'cache_misses')
+
+
+def file_size(filepath):
+    """
+    Size in bytes of a file, 0 if it does not exist
+    """
+
+    if filepath is None or not os.path.isfile(filepath):
+        return 0
+
+    return os.path.getsize(filepath)
+
+
+class ScanMetrics:
+    """
+    Stage times (seconds, in the order the stages ran) and counters
+    of one scan. A stage that runs more than once is accumulated.
+    array_mb is the memory held by the scan arrays after each stage.
+    """
+
+    def __init__(self, radar_id, radar_filetype, input_file=None):
+
+        self.radar_id = radar_id
+        self.radar_filetype = radar_filetype
+        self.input_file = input_file
+        self.scan_dt = None
+        self.output_file = None
+
+        self.timings = dict()
+        self.counters = None
+        self.total = None
+
+        self.held = dict()
+        self.array_mb = dict()
+        self.peak_rss_mb = None
+        bugtracker.core.memory.reset_peak_rss()
+
+        self._start_counters = dict(_counters)
+        self._start = time.perf_counter()
+
+
+    def __str__(self):
+        rep = "ScanMetrics:\n"
+
+        for stage, elapsed in self.timings.items():
+            rep += f"{stage:<16} {elapsed:8.3f} s\n"
+
+        if self.total is not None:
+            rep += f"{'total':<16} {self.total:8.3f} s\n"
+
+        if len(self.array_mb) > 0:
+            held = ", ".join(f"{stage}: {size:.1f}" for stage, size in self.array_mb.items())
+            rep += f"arrays (MB): {held}\n"
+
+        if self.peak_rss_mb is not None:
+            rep += f"peak_rss: {self.peak_rss_mb:.1f} MB\n"
+
+        counters = self.counters if self.counters is not None else self.current_counters()
+
+        for name in COUNTERS:
+            rep += f"{name}: {counters[name]}\n"
+
+        return rep
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager timing one stage (also profiled with
+        tracker.py --profile, see profiling.py)
+        """
+
+        start = time.perf_counter()
+
+        try:
+            with bugtracker.core.profiling.stage(name, self.input_file):
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+            self.array_mb[name] = self.held_bytes() / bugtracker.core.memory.MB
+
+
+    def hold(self, key, obj):
+        """
+        Counts the arrays of obj (a ScanData, Filter, array...) in the
+        memory of the scan, from now on. Replaces any previous obj
+        held under the same key, None stops counting it.
+        """
+
+        if obj is None:
+            self.held.pop(key, None)
+        else:
+            self.held[key] = obj
+
+
+    def held_bytes(self):
+        return bugtracker.core.memory.array_bytes(*self.held.values())
+
+
+    def current_counters(self):
+        return {name: _counters[name] - self._start_counters.get(name, 0) for name in COUNTERS}
+
+
+    def finish(self, scan_dt, output_file):
+        """
+        Ends the scan: the total time and the counters are frozen.
+        """
+
+        self.scan_dt = scan_dt
+        self.output_file = output_file
+        self.total = time.perf_counter() - self._start
+        self.counters = self.current_counters()
+        self.peak_rss_mb = bugtracker.core.memory.peak_rss_mb()
+
+        # The scan arrays are not kept alive by the metrics
+        self.held = dict()
+
+
+    def to_dict(self):
+
+        scan_dt = None if self.scan_dt is None else self.scan_dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+        return {
+            'radar_id': self.radar_id,
+            'filetype': self.radar_filetype,
+            'scan_datetime': scan_dt,
+            'processed': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+            'input_file': self.input_file,
+            'output_file': self.output_file,
+            'total': self.total,
+            'stages': dict(self.timings),
+            'counters': dict(self.counters if self.counters is not None else self.current_counters()),
+            'array_mb': dict(self.array_mb),
+            'peak_rss_mb': self.peak_rss_mb
+        }
+
+
+class Histogram:
+    """
+    Cumulative histogram, as exported to Prometheus. buckets are the
+    upper bounds (seconds), +Inf is implicit.
+    """
+
+    def __init__(self, buckets):
+
+        self.buckets = sorted(float(bound) for bound in buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+
+        for x in range(0, len(self.buckets)):
+            if value <= self.buckets[x]:
+                self.counts[x] += 1
+
+        self.sum += value
+        self.count += 1
+
+
+    def to_dict(self):
+
+        return {'buckets': self.buckets, 'counts': self.counts, 'sum': self.sum, 'count': self.count}
+
+
+    def load(self, state):
+        """
+        Restores the counts of to_dict(), the buckets must match
+        """
+
+        if [float(bound) for bound in state['buckets']] != self.buckets:
+            raise ValueError(f"Histogram buckets changed: {state['buckets']} != {self.buckets}")
+
+        self.counts = [int(value) for value in state['counts']]
+        self.sum = float(state['sum'])
+        self.count = int(state['count'])
+
+
+    def lines(self, name, labels):
+
+        lines = []
+
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+
+        return lines
+
+
+def jsonl_filepath(config, radar_id):
+    return os.path.join(config['cache_dir'], 'metrics', f"{radar_id.lower()}.jsonl")
+
+
+def state_filepath(config, radar_id):
+    return os.path.join(config['cache_dir'], 'metrics', f"{radar_id.lower()}.state.json")
+
+
+def prometheus_filepath(prometheus_dir, radar_id):
+    return os.path.join(prometheus_dir, f"bugtracker_{radar_id.lower()}.prom")
+
+
+class MetricsWriter:
+    """
+    Writes the ScanMetrics of one station. prometheus_file is None if
+    the textfile export is disabled. The Prometheus aggregates are
+    loaded from state_file, and saved there after each scan.
+    """
+
+    def __init__(self, radar_id, jsonl_file, prometheus_file=None, buckets=None, state_file=None):
+
+        self.radar_id = radar_id.lower()
+        self.jsonl_file = jsonl_file
+        self.prometheus_file = prometheus_file
+        self.buckets = buckets
+        self.state_file = state_file
+
+        self.stage_histograms = dict()
+        self.scan_histogram = Histogram(buckets)
+        self.totals = collections.Counter()
+        self.scans = 0
+        self.last_scan = None
+        self.peak_rss_mb = None
+
+        if self.prometheus_file is not None and self.state_file is not None:
+            self.load_state()
+
+
+    def load_state(self):
+        """
+        Aggregates of the previous processes, if the state file exists
+        and has the same buckets.
+        """
+
+        if not os.path.isfile(self.state_file):
+            return
+
+        with open(self.state_file) as handle:
+            state = json.load(handle)
+
+        try:
+            for stage, stage_state in state['stages'].items():
+                histogram = Histogram(self.buckets)
+                histogram.load(stage_state)
+                self.stage_histograms[stage] = histogram
+
+            self.scan_histogram.load(state['scan'])
+        except (KeyError, ValueError) as error:
+            print(f"Metrics state not loaded, starting over: {error}")
+            self.stage_histograms = dict()
+            self.scan_histogram = Histogram(self.buckets)
+            return
+
+        self.totals.update(state['totals'])
+        self.scans = state['scans']
+        self.last_scan = state['last_scan']
+
+
+    def save_state(self):
+
+        state = {
+            'stages': {stage: histogram.to_dict() for stage, histogram in self.stage_histograms.items()},
+            'scan': self.scan_histogram.to_dict(),
+            'totals': dict(self.totals),
+            'scans': self.scans,
+            'last_scan': self.last_scan
+        }
+
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        temp_file = f"{self.state_file}.{os.getpid()}.tmp"
+
+        with open(temp_file, mode='w') as handle:
+            json.dump(state, handle)
+
+        os.replace(temp_file, self.state_file)
+
+
+    def write(self, metrics):
+
+        os.makedirs(os.path.dirname(self.jsonl_file), exist_ok=True)
+
+        # One write per line, appends from several processes do not mix
+        with open(self.jsonl_file, mode='a') as handle:
+            handle.write(json.dumps(metrics.to_dict()) + "\n")
+
+        if self.prometheus_file is None:
+            return
+
+        for stage, elapsed in metrics.timings.items():
+            if stage not in self.stage_histograms:
+                self.stage_histograms[stage] = Histogram(self.buckets)
+            self.stage_histograms[stage].observe(elapsed)
+
+        self.scan_histogram.observe(metrics.total)
+        self.totals.update(metrics.counters)
+        self.scans += 1
+        self.last_scan = time.time()
+        self.peak_rss_mb = metrics.peak_rss_mb
+
+        if self.state_file is not None:
+            self.save_state()
+
+        self.write_prometheus()
+
+
+    def prometheus_lines(self):
+
+        radar = f'radar="{self.radar_id}"'
+        lines = []
+
+        lines.append("# HELP bugtracker_stage_seconds Processing time of each stage of a scan.")
+        lines.append("# TYPE bugtracker_stage_seconds histogram")
+
+        for stage, histogram in self.stage_histograms.items():
+            lines += histogram.lines("bugtracker_stage_seconds", f'{radar},stage="{stage}"')
+
+        lines.append("# HELP bugtracker_scan_seconds Processing time of a scan.")
+        lines.append("# TYPE bugtracker_scan_seconds histogram")
+        lines += self.scan_histogram.lines("bugtracker_scan_seconds", radar)
+
+        lines.append("# HELP bugtracker_scans_total Scans processed.")
+        lines.append("# TYPE bugtracker_scans_total counter")
+        lines.append(f"bugtracker_scans_total{{{radar}}} {self.scans}")
+
+        for name in COUNTERS:
+            lines.append(f"# TYPE bugtracker_{name}_total counter")
+            lines.append(f"bugtracker_{name}_total{{{radar}}} {self.totals[name]}")
+
+        lines.append("# HELP bugtracker_last_scan_timestamp_seconds End of the last processed scan.")
+        lines.append("# TYPE bugtracker_last_scan_timestamp_seconds gauge")
+        lines.append(f"bugtracker_last_scan_timestamp_seconds{{{radar}}} {self.last_scan:.3f}")
+
+        if self.peak_rss_mb is not None:
+            lines.append("# HELP bugtracker_scan_peak_rss_bytes Peak resident memory during the last scan.")
+            lines.append("# TYPE bugtracker_scan_peak_rss_bytes gauge")
+            lines.append(f"bugtracker_scan_peak_rss_bytes{{{radar}}} {int(self.peak_rss_mb * bugtracker.core.memory.MB)}")
+
+        return lines
+
+
+    def write_prometheus(self):
+        """
+        The textfile collector may read at any time, so the file is
+        replaced rather than rewritten in place.
+        """
+
+        os.makedirs(os.path.dirname(self.prometheus_file), exist_ok=True)
+        temp_file = f"{self.prometheus_file}.{os.getpid()}.tmp"
+
+        with open(temp_file, mode='w') as handle:
+            handle.write("\n".join(self.prometheus_lines()) + "\n")
+
+        os.replace(temp_file, self.prometheus_file)
+
+
+def from_config(config, radar_id):
+    """
+    Returns the MetricsWriter of the 'metrics' config section, or None
+    if the metrics are disabled.
+    """
+
+    settings = config.get('metrics', dict())
+
+    if not settings.get('enabled', False):
+        return None
+
+    prometheus_dir = settings.get('prometheus_dir', "")
+    prometheus_file = prometheus_filepath(prometheus_dir, radar_id) if prometheus_dir != "" else None
+
+    return MetricsWriter(radar_id, jsonl_filepath(config, radar_id), prometheus_file, settings['buckets'],
+                         state_filepath(config, radar_id))
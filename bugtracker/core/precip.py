@@ -18,7 +18,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import time
-import math
 
 import numpy as np
 from scipy import stats
@@ -26,6 +25,7 @@ import pyart
 import geopy.distance
 
 import bugtracker.core.utils
+import bugtracker.core.sigmet
 from bugtracker.core.filter import Filter
 import bugtracker.plots.radial
 
@@ -46,13 +46,13 @@ class IrisPrecipFilter(Filter):
 
         # Using one output elevation angle
 
-        self.convol = pyart.io.read(iris_set.convol)
+        self.convol = bugtracker.core.sigmet.read_sigmet(iris_set.convol, fields=bugtracker.core.sigmet.CONVOL_FIELDS)
         self.bins = None
         # Using one horizontal angle (for now)
         angles = [0.0]
 
         self.setup(angles)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
 
     def get_convol_coords(self):
@@ -62,36 +62,19 @@ class IrisPrecipFilter(Filter):
         ranges = self.convol.range['data']
         elevations = self.convol.elevation['data']
 
-        num_azims = len(azimuths)
-        num_ranges = len(ranges)
-        shape = (num_azims, num_ranges)
-        augmented_azims = np.zeros(shape, dtype=float)
-        augmented_ranges = np.zeros(shape, dtype=float)
-        augmented_elevs = np.zeros(shape, dtype=float)
-
-        for x in range(0, num_ranges):
-            augmented_azims[:,x] = azimuths[:]
-            augmented_elevs[:,x] = elevations[:]
-
-        for y in range(0, num_azims):
-            augmented_ranges[y,:] = ranges[:]
+        shape = (len(azimuths), len(ranges))
 
+        # The CONVOL rays are not on the GridInfo grid, so the
+        # GridGeometry cannot be used here.
+        augmented_azims = np.broadcast_to(azimuths[:,np.newaxis], shape)
+        augmented_elevs = np.broadcast_to(elevations[:,np.newaxis], shape)
         # Normalizing to kilometers
-        augmented_ranges = augmented_ranges / 1000.0
+        augmented_ranges = np.broadcast_to(ranges[np.newaxis,:] / 1000.0, shape)
 
         x_arr, y_arr, z_arr = pyart.core.antenna_to_cartesian(augmented_ranges, augmented_azims, augmented_elevs)
 
         distance_arr = np.sqrt(np.square(x_arr) + np.square(y_arr))
 
-        lon_0 = self.metadata.lon
-        lat_0 = self.metadata.lat
-
-        print("lon_0:", lon_0)
-        print("lat_0:", lat_0)
-
-        lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, lon_0, lat_0)
-
-
         # Convert to polar
 
         convol_coords = dict()
@@ -257,9 +240,7 @@ class IrisPrecipFilter(Filter):
         if self.slopes is None:
             raise ValueError("Slopes cannot be None")
 
-        grid_coords = bugtracker.core.utils.latlon(self.grid_info, self.metadata)
-        lats = grid_coords['lats']
-        lons = grid_coords['lons']
+        lats, lons = self.geometry.latlon()
         output_folder = os.path.join(self.config['plot_dir'], self.metadata.radar_id)
         plotter = bugtracker.plots.radial.RadialPlotter(lats, lons, output_folder, self.grid_info)
 
@@ -312,6 +293,9 @@ class IrisPrecipFilter(Filter):
 
 class NexradPrecipFilter(Filter):
 
+    # Float volumes alive at the same time in precip_mask()
+    TEMPORARIES = 8
+
     def __init__(self, metadata, grid_info, angles):
         """
         The NEXRAD precipitation filter is based on a differential
@@ -320,7 +304,7 @@ class NexradPrecipFilter(Filter):
 
         super().__init__(metadata, grid_info)
         self.setup(angles)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
 
     def verify_dims(self):
@@ -337,9 +321,7 @@ class NexradPrecipFilter(Filter):
 
         max_range = self.config['plot_settings']['max_range']
 
-        grid_coords = bugtracker.core.utils.latlon(self.grid_info, self.metadata)
-        lats = grid_coords['lats']
-        lons = grid_coords['lons']
+        lats, lons = self.geometry.latlon()
 
         base_folder = self.config['plot_dir']
         output_folder = os.path.join(base_folder, self.metadata.radar_id)
@@ -372,7 +354,7 @@ class NexradPrecipFilter(Filter):
         azim_subgrids = azims // 3
         gate_subgrids = gates // 3
 
-        new_grid = np.zeros(source.shape, dtype=float)
+        new_grid = np.zeros(source.shape, dtype=source.dtype)
 
         for z in range(0, elevs):
             for x in range(0, azim_subgrids):
@@ -390,10 +372,13 @@ class NexradPrecipFilter(Filter):
         return new_grid
 
 
-    def apply(self, nexrad_data):
+    def precip_mask(self, diff_reflectivity, cross_correlation_ratio):
+        """
+        Precip mask of a set of levels (levels, azims, gates)
+        """
 
-        z_dr_log = self.subgrid_smoothing(nexrad_data.diff_reflectivity)
-        rho_hv = self.subgrid_smoothing(nexrad_data.cross_correlation_ratio)
+        z_dr_log = self.subgrid_smoothing(diff_reflectivity)
+        rho_hv = self.subgrid_smoothing(cross_correlation_ratio)
 
         """
         This cutoff comes from the equation DR(db) = 10*log10(DR_lin)
@@ -414,11 +399,28 @@ class NexradPrecipFilter(Filter):
 
         dr_linear = np.divide(numerator, denominator)
 
-        if dr_linear.shape != self.filter_3d.shape:
+        #self.plot_filter(nexrad_data, dr_linear)
+        return dr_linear < precip_cutoff
+
+
+    def apply(self, nexrad_data, chunk_levels=None):
+        """
+        The levels are independent: with chunk_levels, they are
+        filtered chunk_levels at a time, which bounds the memory of
+        the float temporaries (TEMPORARIES per level) of precip_mask().
+        """
+
+        levels = nexrad_data.diff_reflectivity.shape[0]
+
+        if nexrad_data.diff_reflectivity.shape != self.filter_3d.shape:
             raise ValueError("Incompatible filter dimensions")
 
-        #self.plot_filter(nexrad_data, dr_linear)
-        self.filter_3d = dr_linear < precip_cutoff
+        step = levels if chunk_levels is None else max(int(chunk_levels), 1)
+
+        for start in range(0, levels, step):
+            end = min(start + step, levels)
+            self.filter_3d[start:end] = self.precip_mask(nexrad_data.diff_reflectivity[start:end],
+                                                         nexrad_data.cross_correlation_ratio[start:end])
 
 
 class PrecipFilter(Filter):
@@ -427,7 +429,7 @@ class PrecipFilter(Filter):
         super().__init__(metadata, grid_info)
 
         self.setup(angles)
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
 
     def verify_dims(self):
@@ -475,62 +477,42 @@ class PrecipFilter(Filter):
         min_gate = gate_zone * gate_region
         max_gate = (gate_zone + 1) * gate_region
 
-        angle_list = []
+        # Using midpoint approximation for the zone height
+        midpoint = int((min_gate + max_gate) / 2.0)
+
+        angle_set = set()
         dbz_list = []
         height_list = []
 
-        # Above this threshold, we consider it rain.
-        max_dbz_per_km = -5.0
-
         for x in range(0, len(angles)):
             angle = angles[x]
             zone_data = dbz_3d[x,min_azim:max_azim,min_gate:max_gate]
             # Should be more OOP
             zone_clutter = clutter[x,min_azim:max_azim,min_gate:max_gate]
-            zone_clutter_bool = zone_clutter.astype(bool)
 
             if zone_data.shape != zone_clutter.shape:
                 raise ValueError("Incompatible zone shapes.")
 
-            zone_flat = list(zone_data.flatten())
-
-            zone_clutter_flat = list(zone_clutter_bool.flatten())
-
-            num_cells = len(zone_flat)
-            num_clutter = len(zone_clutter_flat)
-
-            if num_cells != num_clutter:
-                raise ValueError("Incompatible list lengths.")
-
-            for y in range(0, num_cells):
-                if not zone_clutter_flat[y]:
-                    dbz = zone_flat[y]
-                    if not isinstance(dbz, np.ma.core.MaskedConstant):
-                        angle_list.append(angle)
-                        dbz_list.append(dbz)
-                        # Making trig approximation h = x*tan(theta)
-                        # Note, distance must be in km, and theta must
-                        # be converted to radians.
-                        # TODO: Use builtin pyart methods.
-                        rad_angle = math.radians(angle)
-                        # Using midpoint approximation
-                        midpoint = int((min_gate + max_gate) / 2.0)
-                        # Convert to kilometers
-                        distance = midpoint * self.grid_info.gate_step * 0.001
-                        height = distance * math.tan(rad_angle)
-                        height_list.append(height)
-
-        if len(angle_list) != len(dbz_list):
-            raise ValueError("Zone slope error")
+            # Keep the cells that are neither clutter nor missing
+            # (masked, or NaN in unmasked arrays)
+            missing = np.logical_or(np.ma.getmaskarray(zone_data), np.isnan(np.ma.getdata(zone_data)))
+            valid = np.logical_not(np.logical_or(zone_clutter.astype(bool), missing))
+            zone_dbz = np.ma.getdata(zone_data)[valid]
+
+            if len(zone_dbz) > 0:
+                # Flat earth approximation h = x*tan(theta), in km
+                height = self.geometry.flat_height(angle)[midpoint]
+                angle_set.add(angle)
+                dbz_list.append(zone_dbz)
+                height_list.append(np.full(len(zone_dbz), height))
 
         # If there is only data from one elevation angle, we cannot
         # compute the slope.
 
-        angle_set = set(angle_list)
         if len(angle_set) < 2:
             return np.nan
         else:
-            slope, intercept, r_value, p_value, std_err = stats.linregress(height_list, dbz_list)
+            slope, intercept, r_value, p_value, std_err = stats.linregress(np.concatenate(height_list), np.concatenate(dbz_list))
             return slope
 
 
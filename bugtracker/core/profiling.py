@@ -0,0 +1,241 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+On-demand profiling of the processing stages (tracker.py/calib.py
+--profile and --profile-memory).
+
+Once enable() is called, every stage(name) block is profiled:
+
+cpu    - one cProfile per stage and process, dumped after every run of
+         the stage to <profile_dir>/<stage>.<pid>.pstats
+memory - tracemalloc snapshots at the start and end of the stage, the
+         peak and the top allocations (by line) are appended to
+         <profile_dir>/<stage>.<pid>.memory.txt
+
+The settings are also passed in environment variables, so that the
+worker processes (plot pool) profile their own stages. report()
+merges the files of all the processes into <stage>.pstats and
+<stage>.txt. Nested stages are part of the enclosing stage's profile
+and memory report (one cProfile can be active at a time).
+
+The same stage() blocks are the spans of the --trace timeline.
+"""
+
+import os
+import io
+import glob
+import pstats
+import cProfile
+import datetime
+import tracemalloc
+import contextlib
+
+import bugtracker.core.tracing
+
+
+ENV_DIR = "BUGTRACKER_PROFILE_DIR"
+ENV_CPU = "BUGTRACKER_PROFILE_CPU"
+ENV_MEMORY = "BUGTRACKER_PROFILE_MEMORY"
+
+# Frames kept per allocation, and allocations/functions in the reports
+TRACE_FRAMES = 10
+TOP_ENTRIES = 25
+
+# Profiler of this process (None if profiling is disabled)
+_profiler = None
+
+
+class StageProfiler:
+
+    def __init__(self, profile_dir, cpu=True, memory=False):
+
+        self.profile_dir = profile_dir
+        self.cpu = cpu
+        self.memory = memory
+        self.pid = os.getpid()
+
+        self.profiles = dict()
+        self.active = None
+
+        os.makedirs(profile_dir, exist_ok=True)
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+
+
+    def stage_file(self, name, extension):
+        return os.path.join(self.profile_dir, f"{name}.{self.pid}.{extension}")
+
+
+    def snapshot(self):
+
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+    @contextlib.contextmanager
+    def stage(self, name, label=None):
+
+        outermost = self.active is None
+        memory = self.memory and outermost
+        profile = None
+
+        if self.cpu and outermost:
+            if name not in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+            profile = self.profiles[name]
+
+        if outermost:
+            self.active = name
+
+        if memory:
+            before = self.snapshot()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        if profile is not None:
+            profile.enable()
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.stage_file(name, "pstats"))
+
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                after = self.snapshot()
+                self.write_memory(name, label, after.compare_to(before, 'lineno'), peak - start_memory, current - start_memory)
+
+            if outermost:
+                self.active = None
+
+
+    def write_memory(self, name, label, differences, peak, net):
+
+        with open(self.stage_file(name, "memory.txt"), mode='a') as handle:
+            handle.write(f"{datetime.datetime.utcnow():%Y-%m-%dT%H:%M:%S} {name} {label or ''}\n")
+            handle.write(f"peak: {peak / 1e6:.1f} MB above the start, net: {net / 1e6:+.1f} MB\n")
+
+            for difference in differences[0:TOP_ENTRIES]:
+                handle.write(f"    {difference}\n")
+
+            handle.write("\n")
+
+
+def default_dir(config, app):
+    """
+    <cache_dir>/profiles/<app>_<utc time>
+    """
+
+    label = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(config['cache_dir'], 'profiles', f"{app}_{label}")
+
+
+def enable(profile_dir, cpu=True, memory=False):
+    """
+    Starts profiling the stages of this process, and of the worker
+    processes started afterwards.
+    """
+
+    global _profiler
+
+    os.environ[ENV_DIR] = os.path.abspath(profile_dir)
+    os.environ[ENV_CPU] = "1" if cpu else "0"
+    os.environ[ENV_MEMORY] = "1" if memory else "0"
+
+    _profiler = StageProfiler(os.environ[ENV_DIR], cpu=cpu, memory=memory)
+    print(f"Profiling stages into: {_profiler.profile_dir} (cpu: {cpu}, memory: {memory})")
+
+    return _profiler
+
+
+def get():
+    """
+    Profiler of this process, None if profiling is disabled. Worker
+    processes (forked or spawned) create their own from the
+    environment.
+    """
+
+    global _profiler
+
+    if _profiler is not None and _profiler.pid == os.getpid():
+        return _profiler
+
+    profile_dir = os.environ.get(ENV_DIR)
+
+    if profile_dir is None:
+        _profiler = None
+    else:
+        cpu = os.environ.get(ENV_CPU, "1") == "1"
+        memory = os.environ.get(ENV_MEMORY, "0") == "1"
+        _profiler = StageProfiler(profile_dir, cpu=cpu, memory=memory)
+
+    return _profiler
+
+
+@contextlib.contextmanager
+def stage(name, label=None):
+    """
+    Profiles a block if profiling is enabled. The stage is also a span
+    of the trace, if tracing is enabled (see tracing.py).
+    """
+
+    profiler = get()
+    args = dict() if label is None else {'label': label}
+
+    with bugtracker.core.tracing.span(name, "stage", **args):
+        if profiler is None:
+            yield
+        else:
+            with profiler.stage(name, label):
+                yield
+
+
+def report(profile_dir):
+    """
+    Merges the per-process cProfile dumps of every stage into
+    <stage>.pstats, with the top functions (cumulative time) in
+    <stage>.txt. Returns {stage: total time (s)}.
+    """
+
+    stage_files = dict()
+
+    for filepath in sorted(glob.glob(os.path.join(profile_dir, "*.*.pstats"))):
+        name = os.path.basename(filepath).rsplit(".", 2)[0]
+        stage_files.setdefault(name, []).append(filepath)
+
+    totals = dict()
+
+    for name, files in stage_files.items():
+        stream = io.StringIO()
+        stats = pstats.Stats(*files, stream=stream)
+        stats.dump_stats(os.path.join(profile_dir, f"{name}.pstats"))
+
+        stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+
+        with open(os.path.join(profile_dir, f"{name}.txt"), mode='w') as handle:
+            handle.write(f"{name}: {len(files)} process(es)\n")
+            handle.write(stream.getvalue())
+
+        totals[name] = stats.total_tt
+        print(f"Profile {name:<20} {stats.total_tt:8.3f} s in {len(files)} process(es)")
+
+    return totals
@@ -0,0 +1,50 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+IRIS (sigmet) reads. Every IRIS file is read through read_sigmet(),
+with the field list of its consumer, so that pyart only decodes the
+fields that are used.
+"""
+
+import os
+
+
+# Fields that each consumer needs from the DOPVOL files. Processing
+# writes all four moments to the output, calibration only counts dBZ.
+DOPVOL_PROCESSING_FIELDS = ['reflectivity', 'total_power', 'velocity', 'spectrum_width']
+DOPVOL_CALIB_FIELDS = ['reflectivity']
+
+# The CONVOL scans (for some reason) use the 'total_power' field
+# to store reflectivity.
+CONVOL_FIELDS = ['total_power']
+
+
+def read_sigmet(filename, fields=None):
+    """
+    All IRIS reads go through here, so that only the requested fields
+    are decoded. Passing fields=None reads every field in the file.
+    """
+
+    # Imported here, pyart is slow to load
+    import pyart
+
+    if not os.path.isfile(filename):
+        raise FileNotFoundError(filename)
+
+    return pyart.io.read_sigmet(filename, include_fields=fields)
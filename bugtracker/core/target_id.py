@@ -45,6 +45,64 @@ def get_code(target_code):
         return code_dict[target_code]
 
 
+def classify(dbz, clutter, precip, min_dbz_bugs, max_dbz_bugs, out=None):
+    """
+    uint8 target_id codes of a (levels, azims, gates) volume.
+
+    Each level is classified in one pass, with the bug threshold test,
+    clutter and precip masks fused into a few in-place operations on
+    (azims, gates) buffers. The codes are written in increasing order
+    of priority (bugs, then rain, then clutter), so that higher
+    priority classes overwrite the others. Masked or NaN dBZ values
+    are never bugs.
+    """
+
+    if dbz.ndim == 2:
+        return classify(dbz[np.newaxis], clutter[np.newaxis], precip[np.newaxis],
+                        min_dbz_bugs, max_dbz_bugs)[0]
+
+    code_dict = get_code_dict()
+    bugs = np.uint8(code_dict['bugs'])
+    rain = np.uint8(code_dict['rain'])
+    clutter_code = np.uint8(code_dict['clutter'])
+
+    data = np.ma.getdata(dbz)
+    mask = np.ma.getmask(dbz)
+
+    # clutter and precip may also be PackedMask objects, unpacked
+    # one level at a time
+    if isinstance(clutter, np.ndarray):
+        clutter = np.ma.getdata(clutter)
+    if isinstance(precip, np.ndarray):
+        precip = np.ma.getdata(precip)
+
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+    elif out.shape != data.shape or out.dtype != np.uint8:
+        raise ValueError(f"Invalid output array: {out.shape}, {out.dtype}")
+
+    # Reused for every level
+    is_bug = np.empty(data.shape[1:], dtype=bool)
+    buffer = np.empty(data.shape[1:], dtype=bool)
+
+    for x in range(0, data.shape[0]):
+        np.greater(data[x], min_dbz_bugs, out=is_bug)
+        np.less(data[x], max_dbz_bugs, out=buffer)
+        is_bug &= buffer
+
+        if mask is not np.ma.nomask:
+            np.logical_not(mask[x], out=buffer)
+            is_bug &= buffer
+
+        level = out[x]
+        level.fill(code_dict['none'])
+        np.copyto(level, bugs, where=is_bug)
+        np.copyto(level, rain, where=np.asarray(precip[x], dtype=bool))
+        np.copyto(level, clutter_code, where=np.asarray(clutter[x], dtype=bool))
+
+    return out
+
+
 class TargetId():
 
     def __init__(self, filtered_dbz, clutter_3d, precip_3d):
@@ -88,23 +146,8 @@ class TargetId():
         Priority list for classification:
         clutter > rain > bugs
         """
-        
-        code_dict = get_code_dict()
-        all_clutter = np.full(self.dims, code_dict['clutter'], dtype=int)
-        all_rain = np.full(self.dims, code_dict['rain'], dtype=int)
-        all_bugs = np.full(self.dims, code_dict['bugs'], dtype=int)
-
-        self.id_matrix = np.zeros(self.dims, dtype=int)
-
-        bug_condition = np.logical_and(self.dbz < self.max_dbz_bugs, self.dbz > self.min_dbz_bugs)
-        bug_condition = np.logical_and(bug_condition, np.logical_not(np.ma.getmask(self.dbz)))
-
-        # Successively writing target classifications, with higher
-        # priority classes overwriting previous.
 
-        self.id_matrix = np.where(bug_condition, all_bugs, self.id_matrix)
-        self.id_matrix = np.where(self.precip, all_rain, self.id_matrix)
-        self.id_matrix = np.where(self.clutter, all_clutter, self.id_matrix)
+        self.id_matrix = classify(self.dbz, self.clutter, self.precip, self.min_dbz_bugs, self.max_dbz_bugs)
 
 
     def export_matrix(self):
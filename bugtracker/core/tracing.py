@@ -0,0 +1,195 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Timeline of a run across processes (tracker.py/calib.py --trace), in
+the Chrome trace-event format read by Perfetto (ui.perfetto.dev) and
+chrome://tracing.
+
+Once enable() is called, every span(name) block records a begin ("B")
+and an end ("E") event with its pid and tid. The events are buffered
+per process, and appended to <trace_dir>/events.<pid>.jsonl whenever
+the outermost span of the process ends. That way the plot workers,
+which are not shut down cleanly, lose nothing. merge() combines the
+files of all the processes into <trace_dir>/trace.json.
+
+The timestamps are wall-clock microseconds, shared by all the
+processes of the node.
+"""
+
+import os
+import json
+import glob
+import time
+import datetime
+import threading
+import contextlib
+
+
+ENV_DIR = "BUGTRACKER_TRACE_DIR"
+
+# Tracer of this process (None if tracing is disabled)
+_tracer = None
+
+
+class Tracer:
+
+    def __init__(self, trace_dir, process_name):
+
+        self.trace_dir = trace_dir
+        self.pid = os.getpid()
+        self.events = []
+        self.depth = 0
+
+        os.makedirs(trace_dir, exist_ok=True)
+
+        self.events.append({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                            'args': {'name': f"{process_name} {self.pid}"}})
+
+
+    def event(self, name, category, phase, args=None):
+
+        event = {'name': name, 'cat': category, 'ph': phase, 'ts': time.time_ns() // 1000,
+                 'pid': self.pid, 'tid': threading.get_native_id()}
+
+        if args:
+            event['args'] = args
+
+        self.events.append(event)
+
+
+    @contextlib.contextmanager
+    def span(self, name, category, args=None):
+
+        self.event(name, category, 'B', args)
+        self.depth += 1
+
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.event(name, category, 'E')
+
+            if self.depth == 0:
+                self.flush()
+
+
+    def flush(self):
+
+        if len(self.events) == 0:
+            return
+
+        filename = os.path.join(self.trace_dir, f"events.{self.pid}.jsonl")
+
+        with open(filename, mode='a') as handle:
+            handle.write("".join(json.dumps(event) + "\n" for event in self.events))
+
+        self.events = []
+
+
+def default_dir(config, app):
+    """
+    <cache_dir>/traces/<app>_<utc time>
+    """
+
+    label = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(config['cache_dir'], 'traces', f"{app}_{label}")
+
+
+def enable(trace_dir, process_name="main"):
+    """
+    Starts tracing this process, and the worker processes started
+    afterwards.
+    """
+
+    global _tracer
+
+    os.environ[ENV_DIR] = os.path.abspath(trace_dir)
+    _tracer = Tracer(os.environ[ENV_DIR], process_name)
+    print(f"Tracing into: {_tracer.trace_dir}")
+
+    return _tracer
+
+
+def get():
+    """
+    Tracer of this process, None if tracing is disabled. Worker
+    processes (forked or spawned) create their own from the
+    environment, and drop the buffer copied from the parent.
+    """
+
+    global _tracer
+
+    if _tracer is not None and _tracer.pid == os.getpid():
+        return _tracer
+
+    trace_dir = os.environ.get(ENV_DIR)
+
+    if trace_dir is None:
+        _tracer = None
+    else:
+        _tracer = Tracer(trace_dir, "worker")
+
+    return _tracer
+
+
+@contextlib.contextmanager
+def span(name, category="stage", **args):
+    """
+    Records a block if tracing is enabled, does nothing otherwise.
+    The keyword arguments are shown with the event.
+    """
+
+    tracer = get()
+
+    if tracer is None:
+        yield
+    else:
+        with tracer.span(name, category, {key: str(value) for key, value in args.items()}):
+            yield
+
+
+def merge(trace_dir):
+    """
+    Merges the events of all the processes into <trace_dir>/trace.json,
+    returns its path.
+    """
+
+    tracer = get()
+
+    if tracer is not None:
+        tracer.flush()
+
+    events = []
+
+    for filepath in sorted(glob.glob(os.path.join(trace_dir, "events.*.jsonl"))):
+        with open(filepath) as handle:
+            events += [json.loads(line) for line in handle if line.strip() != ""]
+
+    # Metadata events first, then by time. The sort is stable, so the
+    # events of a process with equal times stay in their order.
+    events.sort(key=lambda event: (event['ph'] != 'M', event.get('ts', 0)))
+
+    output_file = os.path.join(trace_dir, "trace.json")
+
+    with open(output_file, mode='w') as handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+
+    print(f"Trace of {len(events)} events: {output_file} (open in ui.perfetto.dev)")
+
+    return output_file
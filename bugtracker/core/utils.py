@@ -28,10 +28,9 @@ import sys
 import datetime
 
 import numpy as np
-import geopy
-import pyart
 
 import bugtracker.config
+import bugtracker.core.sigmet
 
 def date_range(datetime_1, datetime_2):
 
@@ -129,6 +128,8 @@ class BoundingBox:
 
     def __init__(self, lat_0, lon_0, km_distance):
 
+        import geopy.distance
+
         origin = geopy.Point(lat_0, lon_0)
         dist = geopy.distance.distance(kilometers=km_distance)
  
@@ -149,31 +150,13 @@ class BoundingBox:
 
 def latlon(grid_info, metadata):
     """
-    This code should not be duplicated in multiple places
+    Kept for the scripts using the dict interface, the lat/lon are
+    taken from the shared GridGeometry.
     """
 
-    azims = grid_info.azims
-    gates = grid_info.gates
-    dims = (azims, gates)
-
-    ranges = np.zeros(dims, dtype=float)
-    azimuths = np.zeros(dims, dtype=float)
-    elevations = np.zeros(1, dtype=float)
-
-    for x in range(0,azims):
-        azimuths[x,:] = (grid_info.azim_step) * x + grid_info.azim_offset
-
-    for y in range(0, gates):
-        # rescaling to meters from kilometers
-        ranges[:,y] = (grid_info.gate_step / 1000.0) * y
-
-    x_arr, y_arr, z_arr = pyart.core.antenna_to_cartesian(ranges, azimuths, elevations)
-
-    lon_0 = metadata.lon
-    lat_0 = metadata.lat
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    lats, lons = geometry.latlon()
 
-    lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, lon_0, lat_0)
-    
     grid_coords = dict()
     grid_coords['lats'] = lats
     grid_coords['lons'] = lons
@@ -189,7 +172,8 @@ def iris_scan_stats(radar_file, label):
         raise FileNotFoundError(radar_file)
 
     print("Iris statistics for scan type:", label)
-    radar = pyart.io.read_sigmet(radar_file)
+    # Statistics are shown for every field
+    radar = bugtracker.core.sigmet.read_sigmet(radar_file)
 
     ngates = radar.ngates
     nrays = radar.nrays
@@ -0,0 +1,321 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Velocity-Azimuth Display (VAD) retrieval of the insect flow.
+
+On each range ring of each elevation, the radial velocity of the
+gates classified as bugs is fitted with the harmonic model
+
+    vr = c0 + c1 * sin(azim) + c2 * cos(azim)
+
+so that u = c1 / cos(elev) and v = c2 / cos(elev). All the rings of
+all the elevations are fitted at once: the normal equations of every
+(level, ring) are accumulated with np.bincount, and the stacked 3x3
+systems are solved with one np.linalg.solve call.
+
+Rings with too few gates, or gates in too few azimuth sectors, are
+left out. The fits are then merged (weighted by gate count) into a
+height profile, using the beam height of the ring center (GridGeometry,
+4/3 earth model). The direction is where the insects are heading to,
+in degrees clockwise from north. Velocities are used as stored, they
+are not dealiased.
+"""
+
+import numpy as np
+import netCDF4 as nc
+
+import bugtracker.core.geometry
+import bugtracker.core.target_id
+
+
+# Azimuth sectors used to check the coverage of a ring
+SECTORS = 8
+
+
+class VadSettings:
+    """
+    min_range and max_range are in km, ring_width, height_step and
+    max_height in meters.
+    """
+
+    def __init__(self, min_range=5.0, max_range=50.0, ring_width=2000.0, height_step=100.0,
+                 max_height=3000.0, min_gates=50, min_sectors=6):
+
+        if min_range < 0.0 or max_range <= min_range:
+            raise ValueError(f"Invalid VAD ranges: {min_range}, {max_range}")
+
+        if ring_width <= 0.0 or height_step <= 0.0 or max_height <= 0.0:
+            raise ValueError(f"Invalid VAD ring_width/height_step/max_height: {ring_width}, {height_step}, {max_height}")
+
+        if min_gates < 3 or not 3 <= min_sectors <= SECTORS:
+            raise ValueError(f"Invalid VAD min_gates/min_sectors: {min_gates}, {min_sectors}")
+
+        self.min_range = float(min_range)
+        self.max_range = float(max_range)
+        self.ring_width = float(ring_width)
+        self.height_step = float(height_step)
+        self.max_height = float(max_height)
+        self.min_gates = int(min_gates)
+        self.min_sectors = int(min_sectors)
+
+
+def from_config(config):
+    """
+    Returns the VadSettings of the 'vad' config section, or None if
+    the retrieval is disabled.
+    """
+
+    settings = config.get('vad', dict())
+
+    if not settings.get('enabled', False):
+        return None
+
+    keys = ['min_range', 'max_range', 'ring_width', 'height_step', 'max_height', 'min_gates', 'min_sectors']
+    return VadSettings(**{key: settings[key] for key in keys if key in settings})
+
+
+def match_levels(vel_elevs, dbz_elevs):
+    """
+    (velocity level, target_id level) pairs with the same elevation,
+    to 0.1 degree.
+    """
+
+    labels = [f"{float(elev):.1f}" for elev in dbz_elevs]
+    pairs = []
+
+    for vel_level, elev in enumerate(vel_elevs):
+        label = f"{float(elev):.1f}"
+        if label in labels:
+            pairs.append((vel_level, labels.index(label)))
+
+    return pairs
+
+
+def solve_normal(sums, counts, min_gates):
+    """
+    Solves the stacked normal equations. sums has the per-bin sums of
+    [1, s, c, ss, sc, cc, v, vs, vc, vv] (s, c: sin/cos of azimuth).
+    Returns the (bins, 3) coefficients and the rms residual, NaN for
+    the bins with less than min_gates gates or a singular system.
+    """
+
+    one, s, c, ss, sc, cc, v, vs, vc, vv = sums
+
+    matrix = np.stack([np.stack([one, s, c], axis=-1),
+                       np.stack([s, ss, sc], axis=-1),
+                       np.stack([c, sc, cc], axis=-1)], axis=-2)
+    rhs = np.stack([v, vs, vc], axis=-1)
+
+    coeffs = np.full(rhs.shape, np.nan)
+    rms = np.full(len(counts), np.nan)
+
+    enough = counts >= min_gates
+    # Near-singular systems (gates all along one direction) are skipped
+    enough[enough] = np.abs(np.linalg.det(matrix[enough])) > 1e-6 * counts[enough] ** 3
+
+    if np.any(enough):
+        solved = np.linalg.solve(matrix[enough], rhs[enough][..., np.newaxis])[..., 0]
+        coeffs[enough] = solved
+
+        # Residual sum of squares from the same sums, no second pass
+        fitted = np.einsum('ni,nij,nj->n', solved, matrix[enough], solved)
+        residual = vv[enough] - 2.0 * np.einsum('ni,ni->n', solved, rhs[enough]) + fitted
+        rms[enough] = np.sqrt(np.maximum(residual, 0.0) / counts[enough])
+
+    return coeffs, rms
+
+
+class VadProfile:
+    """
+    Height profile of the insect flow. heights are the bin centers
+    (meters above the radar), u/v and speed in m/s, direction in
+    degrees (heading, clockwise from north), gates is the number of
+    bug gates used per bin.
+    """
+
+    def __init__(self, heights, u, v, gates, rms):
+
+        self.heights = heights
+        self.u = u
+        self.v = v
+        self.gates = gates
+        self.rms = rms
+
+        self.speed = np.hypot(u, v)
+        self.direction = np.degrees(np.arctan2(u, v)) % 360.0
+
+
+    def __str__(self):
+        rep = "VadProfile:\n"
+
+        for x in np.nonzero(self.gates > 0)[0]:
+            rep += f"{self.heights[x]:6.0f} m: {self.speed[x]:5.1f} m/s to {self.direction[x]:5.1f} deg"
+            rep += f" ({self.gates[x]} gates, rms {self.rms[x]:.1f} m/s)\n"
+
+        return rep
+
+
+    def write(self, filename):
+        """
+        Appends the profile to an output file.
+        """
+
+        dset = nc.Dataset(filename, mode="a")
+
+        dset.createDimension("vad_heights", len(self.heights))
+
+        nc_heights = dset.createVariable("vad_heights", np.float32, ('vad_heights',))
+        nc_heights.units = "m"
+        nc_heights[:] = self.heights
+
+        variables = [("vad_u", self.u, "m s-1"), ("vad_v", self.v, "m s-1"), ("vad_speed", self.speed, "m s-1"),
+                     ("vad_direction", self.direction, "degree"), ("vad_rms", self.rms, "m s-1")]
+
+        for name, values, units in variables:
+            variable = dset.createVariable(name, np.float32, ('vad_heights',), fill_value=np.nan)
+            variable.units = units
+            variable[:] = values
+
+        nc_gates = dset.createVariable("vad_gates", np.int32, ('vad_heights',))
+        nc_gates[:] = self.gates
+
+        dset.close()
+
+
+class VadRetrieval:
+    """
+    The ring of each gate and the ring heights only depend on the grid
+    and the elevation, so they are computed once per processor.
+    """
+
+    def __init__(self, metadata, grid_info, settings):
+
+        self.grid_info = grid_info
+        self.settings = settings
+        self.geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+
+        ranges = self.geometry.ranges
+        in_range = (ranges >= settings.min_range * 1000.0) & (ranges < settings.max_range * 1000.0)
+
+        self.rings = np.where(in_range, ((ranges - settings.min_range * 1000.0) // settings.ring_width), -1).astype(np.int64)
+        self.num_rings = int(self.rings.max()) + 1
+
+        azim_rad = np.radians(self.geometry.azimuths)
+        self.sin_azim = np.sin(azim_rad)
+        self.cos_azim = np.cos(azim_rad)
+        self.sectors = (np.floor((self.geometry.azimuths % 360.0) / (360.0 / SECTORS))).astype(np.int64) % SECTORS
+
+        self.edges = np.arange(0.0, settings.max_height + settings.height_step, settings.height_step)
+        self.edges = self.edges[self.edges <= settings.max_height + 1e-6]
+
+
+    def ring_heights(self, elev):
+        """
+        Mean beam height (meters) of each ring at one elevation
+        """
+
+        ring_gates = self.rings >= 0
+        heights = self.geometry.beam_height(elev)[ring_gates]
+
+        sums = np.bincount(self.rings[ring_gates], weights=heights, minlength=self.num_rings)
+        counts = np.bincount(self.rings[ring_gates], minlength=self.num_rings)
+
+        return sums / np.maximum(counts, 1)
+
+
+    def fit_rings(self, velocity, bugs, elevs):
+        """
+        Fits all the (level, ring) bins of a (levels, azims, gates)
+        velocity field, on the bug gates. Returns u, v, rms and gate
+        counts, each of shape (levels, rings).
+        """
+
+        num_levels = velocity.shape[0]
+        num_bins = num_levels * self.num_rings
+
+        rings = self.rings[np.newaxis, np.newaxis, :]
+        valid = bugs & np.isfinite(velocity) & (rings >= 0)
+        level_idx, azim_idx, gate_idx = np.nonzero(valid)
+
+        values = velocity[level_idx, azim_idx, gate_idx].astype(np.float64)
+        bins = level_idx * self.num_rings + self.rings[gate_idx]
+        s = self.sin_azim[azim_idx]
+        c = self.cos_azim[azim_idx]
+
+        counts = np.bincount(bins, minlength=num_bins)
+        products = [s, c, s * s, s * c, c * c, values, values * s, values * c, values * values]
+        sums = [counts.astype(np.float64)]
+        sums += [np.bincount(bins, weights=product, minlength=num_bins) for product in products]
+
+        sector_counts = np.bincount(bins * SECTORS + self.sectors[azim_idx], minlength=num_bins * SECTORS)
+        covered = np.count_nonzero(sector_counts.reshape(num_bins, SECTORS), axis=1)
+
+        coeffs, rms = solve_normal(sums, counts, self.settings.min_gates)
+
+        rejected = covered < self.settings.min_sectors
+        coeffs[rejected] = np.nan
+        rms[rejected] = np.nan
+
+        cos_elev = np.repeat(np.cos(np.radians(np.asarray(elevs, dtype=np.float64))), self.num_rings)
+        u = coeffs[:, 1] / cos_elev
+        v = coeffs[:, 2] / cos_elev
+
+        shape = (num_levels, self.num_rings)
+        return u.reshape(shape), v.reshape(shape), rms.reshape(shape), counts.reshape(shape)
+
+
+    def retrieve(self, velocity, vel_elevs, id_matrix, dbz_elevs):
+        """
+        VadProfile of one scan. The velocity levels are matched with
+        the target_id levels by elevation, levels without target_id
+        are not used.
+        """
+
+        pairs = match_levels(vel_elevs, dbz_elevs)
+        heights = self.edges[:-1] + 0.5 * np.diff(self.edges)
+        num_heights = len(heights)
+
+        if len(pairs) == 0:
+            print("VAD: no velocity level with a target_id")
+            empty = np.full(num_heights, np.nan)
+            return VadProfile(heights, empty, empty.copy(), np.zeros(num_heights, dtype=np.int64), empty.copy())
+
+        vel_levels = [pair[0] for pair in pairs]
+        id_levels = [pair[1] for pair in pairs]
+        elevs = [float(vel_elevs[level]) for level in vel_levels]
+
+        field = np.ma.filled(np.ma.asarray(velocity)[vel_levels], np.nan)
+        bugs = np.asarray(id_matrix)[id_levels] == bugtracker.core.target_id.get_code('bugs')
+
+        u, v, rms, counts = self.fit_rings(field, bugs, elevs)
+
+        # Merging the ring fits into height bins, weighted by gate count
+        ring_heights = np.stack([self.ring_heights(elev) for elev in elevs])
+        fitted = np.isfinite(u) & (ring_heights < self.edges[-1])
+        height_idx = np.digitize(ring_heights[fitted], self.edges) - 1
+        weights = counts[fitted].astype(np.float64)
+
+        gates = np.bincount(height_idx, weights=weights, minlength=num_heights)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profile_u = np.bincount(height_idx, weights=weights * u[fitted], minlength=num_heights) / gates
+            profile_v = np.bincount(height_idx, weights=weights * v[fitted], minlength=num_heights) / gates
+            profile_rms = np.bincount(height_idx, weights=weights * rms[fitted], minlength=num_heights) / gates
+
+        return VadProfile(heights, profile_u, profile_v, gates.astype(np.int64), profile_rms)
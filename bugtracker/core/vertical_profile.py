@@ -0,0 +1,222 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Vertical profile of the bug reflectivity of one scan.
+
+The gates classified as bugs are binned by beam height (GridGeometry,
+4/3 effective earth model), in bins of height_step meters up to
+max_height. Per bin:
+
+count      - number of bug gates
+mean_dbz   - mean of the linear reflectivity Z, in dBZ
+percentiles - dBZ percentiles (linear interpolation, as np.percentile)
+
+The gate counts and linear Z sums are np.bincount's of the bin index.
+The percentiles come from a single sort of the gates by (bin, dBZ):
+the bins are then contiguous, and their start is the cumulative count.
+"""
+
+import numpy as np
+import netCDF4 as nc
+
+import bugtracker.core.geometry
+import bugtracker.core.target_id
+
+
+class ProfileSettings:
+
+    def __init__(self, height_step=100.0, max_height=3000.0, percentiles=(10.0, 50.0, 90.0)):
+
+        if height_step <= 0.0 or max_height < height_step:
+            raise ValueError(f"Invalid profile height_step/max_height: {height_step}, {max_height}")
+
+        for percentile in percentiles:
+            if not 0.0 <= percentile <= 100.0:
+                raise ValueError(f"Invalid profile percentile: {percentile}")
+
+        self.height_step = float(height_step)
+        self.max_height = float(max_height)
+        self.percentiles = np.array(percentiles, dtype=np.float64)
+
+        num_bins = int(round(self.max_height / self.height_step))
+        self.edges = np.arange(0, num_bins + 1) * self.height_step
+
+
+def from_config(config):
+    """
+    Returns the ProfileSettings of the 'vertical_profile' config
+    section, or None if the profile is disabled.
+    """
+
+    settings = config.get('vertical_profile', dict())
+
+    if not settings.get('enabled', False):
+        return None
+
+    keys = ['height_step', 'max_height', 'percentiles']
+    return ProfileSettings(**{key: settings[key] for key in keys if key in settings})
+
+
+def binned_percentiles(values, bins, counts, percentiles):
+    """
+    Percentiles of 'values' within each bin, (bins, percentiles),
+    NaN for empty bins.
+    """
+
+    result = np.full((len(counts), len(percentiles)), np.nan)
+
+    if len(values) == 0:
+        return result
+
+    # One float key sorts by bin, then by value (faster than lexsort)
+    lowest = values.min()
+    span = values.max() - lowest + 1.0
+    ordered = values[np.argsort(bins * span + (values - lowest))]
+
+    starts = np.cumsum(counts) - counts
+    filled = counts > 0
+
+    position = starts[filled, np.newaxis] + (percentiles / 100.0) * (counts[filled, np.newaxis] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, (starts + counts - 1)[filled, np.newaxis])
+    fraction = position - lower
+
+    result[filled] = ordered[lower] + fraction * (ordered[upper] - ordered[lower])
+
+    return result
+
+
+class ReflectivityProfile:
+    """
+    heights are the bin centers, in meters above the radar.
+    """
+
+    def __init__(self, heights, counts, mean_dbz, percentiles, percentile_values):
+
+        self.heights = heights
+        self.counts = counts
+        self.mean_dbz = mean_dbz
+        self.percentiles = percentiles
+        self.percentile_values = percentile_values
+
+
+    def __str__(self):
+        rep = "ReflectivityProfile:\n"
+
+        for x in np.nonzero(self.counts > 0)[0]:
+            values = " ".join(f"p{percentile:g}: {value:.1f}"
+                              for percentile, value in zip(self.percentiles, self.percentile_values[x]))
+            rep += f"{self.heights[x]:6.0f} m: {self.counts[x]} gates, mean {self.mean_dbz[x]:.1f} dBZ, {values}\n"
+
+        return rep
+
+
+    def write(self, filename):
+        """
+        Appends the profile to an output file.
+        """
+
+        dset = nc.Dataset(filename, mode="a")
+
+        dset.createDimension("profile_heights", len(self.heights))
+        dset.createDimension("profile_percentiles", len(self.percentiles))
+
+        nc_heights = dset.createVariable("profile_heights", np.float32, ('profile_heights',))
+        nc_heights.units = "m"
+        nc_heights[:] = self.heights
+
+        nc_percentiles = dset.createVariable("profile_percentiles", np.float32, ('profile_percentiles',))
+        nc_percentiles[:] = self.percentiles
+
+        nc_count = dset.createVariable("profile_count", np.int32, ('profile_heights',))
+        nc_count[:] = self.counts
+
+        nc_mean = dset.createVariable("profile_mean_dbz", np.float32, ('profile_heights',), fill_value=np.nan)
+        nc_mean.units = "dBZ"
+        nc_mean[:] = self.mean_dbz
+
+        nc_values = dset.createVariable("profile_dbz", np.float32, ('profile_heights','profile_percentiles'),
+                                        fill_value=np.nan)
+        nc_values.units = "dBZ"
+        nc_values[:,:] = self.percentile_values
+
+        dset.close()
+
+
+class VerticalProfiler:
+    """
+    The height bin of every gate only depends on the grid and the
+    elevation, so it is computed once per elevation.
+    """
+
+    def __init__(self, metadata, grid_info, settings):
+
+        self.settings = settings
+        self.geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+        self.heights = settings.edges[:-1] + 0.5 * settings.height_step
+        self._gate_bins = dict()
+
+
+    def gate_bins(self, elev):
+        """
+        Height bin of each gate at one elevation, -1 above max_height.
+        Shape: (gates,)
+        """
+
+        key = round(float(elev), 4)
+
+        if key not in self._gate_bins:
+            heights = self.geometry.beam_height(key)
+            bins = np.floor(heights / self.settings.height_step).astype(np.int64)
+            bins[(bins >= len(self.heights)) | (heights < 0.0)] = -1
+            self._gate_bins[key] = bins
+
+        return self._gate_bins[key]
+
+
+    def compute(self, dbz, id_matrix, dbz_elevs):
+        """
+        ReflectivityProfile of the bug gates of a (levels, azims, gates)
+        reflectivity field, with the target_id of the same levels.
+        """
+
+        if dbz.shape != id_matrix.shape or len(dbz_elevs) != dbz.shape[0]:
+            raise ValueError(f"Incompatible profile inputs: {dbz.shape}, {id_matrix.shape}, {len(dbz_elevs)} elevs")
+
+        num_bins = len(self.heights)
+
+        gate_bins = np.stack([self.gate_bins(elev) for elev in dbz_elevs])
+        values = np.ma.filled(np.ma.asarray(dbz, dtype=np.float32), np.nan)
+
+        bugs = np.asarray(id_matrix) == bugtracker.core.target_id.get_code('bugs')
+        valid = bugs & np.isfinite(values) & (gate_bins[:, np.newaxis, :] >= 0)
+        level_idx, azim_idx, gate_idx = np.nonzero(valid)
+
+        bins = gate_bins[level_idx, gate_idx]
+        bug_dbz = values[level_idx, azim_idx, gate_idx].astype(np.float64)
+
+        counts = np.bincount(bins, minlength=num_bins)
+        linear_sum = np.bincount(bins, weights=10.0 ** (bug_dbz / 10.0), minlength=num_bins)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_dbz = 10.0 * np.log10(linear_sum / counts)
+
+        percentile_values = binned_percentiles(bug_dbz, bins, counts, self.settings.percentiles)
+
+        return ReflectivityProfile(self.heights, counts, mean_dbz, self.settings.percentiles, percentile_values)
@@ -1,7 +1,16 @@
-import bugtracker.io.models
-import bugtracker.io.scan
-import bugtracker.io.iris
-import bugtracker.io.output
-import bugtracker.io.processor
-import bugtracker.io.nexrad
-import bugtracker.io.odim
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first attribute access, see bugtracker/__init__.py
+_submodules = ['models', 'scan', 'iris', 'output', 'processor', 'nexrad', 'odim', 'catalog', 'input_index', 'cartesian', 'lookup', 'motion', 'mosaic']
+
+
+def __getattr__(name):
+
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
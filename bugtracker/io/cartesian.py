@@ -0,0 +1,442 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Resampling of the native (azims, gates) polar products onto a
+Cartesian raster centered on the radar, in an azimuthal equidistant
+projection.
+
+The polar -> Cartesian mapping only depends on the GridInfo, the
+radar site and the raster spec, so it is computed once as a sparse
+matrix of shape (pixels, azims * gates). The matrix is cached on
+disk (cache_dir/cartesian), and regridding a scan is then a single
+sparse matrix product per field.
+
+Methods:
+nearest - each pixel takes the value of the closest polar gate
+idw     - inverse-distance weights of the 4 surrounding polar gates
+
+The target_id field is categorical, so it is always resampled with
+the nearest operator.
+"""
+
+import os
+import math
+
+import numpy as np
+import netCDF4 as nc
+import pyart
+from scipy import sparse
+
+import bugtracker.core.target_id
+import bugtracker.core.geometry
+import bugtracker.core.metrics
+
+
+METHODS = ['nearest', 'idw']
+
+# Fill value for target_id pixels outside of the radar coverage
+TARGET_FILL = -1
+
+# Resamplers already built in this process, by cache key
+_resamplers = dict()
+
+
+class CartesianSpec:
+    """
+    Square raster centered on the radar. Resolution is in meters,
+    max_range is in km (same units as plot_settings.max_range).
+    """
+
+    def __init__(self, resolution, max_range, method='nearest'):
+
+        if method not in METHODS:
+            raise ValueError(f"Invalid resampling method: {method}, must be one of {METHODS}")
+
+        if resolution <= 0.0:
+            raise ValueError(f"Invalid resolution: {resolution}")
+
+        if max_range <= 0.0:
+            raise ValueError(f"Invalid max_range: {max_range}")
+
+        self.resolution = float(resolution)
+        self.max_range = float(max_range)
+        self.method = method
+
+        half_pixels = int(math.ceil(self.max_range * 1000.0 / self.resolution))
+        self.size = 2 * half_pixels + 1
+
+
+    def __str__(self):
+        rep = "CartesianSpec:\n"
+
+        rep += f"resolution: {self.resolution} m\n"
+        rep += f"max_range: {self.max_range} km\n"
+        rep += f"size: {self.size} x {self.size}\n"
+        rep += f"method: {self.method}\n"
+
+        return rep
+
+
+    def coords(self):
+        """
+        1D x (easting) and y (northing) pixel centers, in meters.
+        """
+
+        half = (self.size - 1) // 2
+        axis = (np.arange(self.size, dtype=np.float64) - half) * self.resolution
+        return axis, axis.copy()
+
+
+def from_config(config):
+    """
+    Returns the CartesianSpec of the 'cartesian' config section,
+    or None if the Cartesian export is disabled.
+    """
+
+    settings = config.get('cartesian', dict())
+
+    if not settings.get('enabled', False):
+        return None
+
+    resolution = settings.get('resolution', 1000.0)
+    max_range = settings.get('max_range', config['plot_settings']['max_range'])
+    method = settings.get('method', 'nearest')
+
+    return CartesianSpec(resolution, max_range, method)
+
+
+def get_cartesian_key(metadata, grid_info, spec, method):
+
+    radar_id = metadata.radar_id.lower()
+    site = f"{metadata.lat:.5f}_{metadata.lon:.5f}"
+    polar = f"{grid_info.azims}_{grid_info.gates}_{grid_info.azim_step}_{grid_info.gate_step}"
+    polar += f"_{grid_info.azim_offset}_{grid_info.gate_offset}"
+    raster = f"{spec.size}_{spec.resolution}_{spec.max_range}"
+
+    return f"{radar_id}_{site}_{polar}_{raster}_{method}.npz"
+
+
+def cartesian_filepath(config, metadata, grid_info, spec, method):
+
+    cache_folder = os.path.join(config['cache_dir'], 'cartesian')
+    return os.path.join(cache_folder, get_cartesian_key(metadata, grid_info, spec, method))
+
+
+def build_nearest(geometry, spec):
+
+    grid_info = geometry.grid_info
+    x_axis, y_axis = spec.coords()
+    x_arr, y_arr = np.meshgrid(x_axis, y_axis)
+
+    azim_pos, gate_pos, ranges = geometry.polar_position(x_arr.ravel(), y_arr.ravel())
+
+    azim_idx = np.rint(azim_pos).astype(np.int64) % grid_info.azims
+    gate_idx = np.rint(gate_pos).astype(np.int64)
+
+    valid = (gate_idx >= 0) & (gate_idx < grid_info.gates) & (ranges <= spec.max_range * 1000.0)
+
+    rows = np.nonzero(valid)[0]
+    cols = azim_idx[valid] * grid_info.gates + gate_idx[valid]
+    data = np.ones(len(rows), dtype=np.float32)
+
+    shape = (spec.size * spec.size, grid_info.azims * grid_info.gates)
+    return sparse.csr_matrix((data, (rows, cols)), shape=shape)
+
+
+def build_idw(geometry, spec, power=2.0):
+
+    grid_info = geometry.grid_info
+    x_axis, y_axis = spec.coords()
+    x_arr, y_arr = np.meshgrid(x_axis, y_axis)
+    x_flat = x_arr.ravel()
+    y_flat = y_arr.ravel()
+
+    azim_pos, gate_pos, ranges = geometry.polar_position(x_flat, y_flat)
+
+    azim_0 = np.floor(azim_pos).astype(np.int64)
+    gate_0 = np.floor(gate_pos).astype(np.int64)
+
+    in_range = (gate_pos >= 0.0) & (gate_pos <= grid_info.gates - 1) & (ranges <= spec.max_range * 1000.0)
+    pixels = np.nonzero(in_range)[0]
+
+    all_rows = []
+    all_cols = []
+    all_weights = []
+
+    # The 4 polar gates surrounding each pixel
+    for azim_shift, gate_shift in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+
+        azim_idx = azim_0[pixels] + azim_shift
+        gate_idx = gate_0[pixels] + gate_shift
+
+        ok = gate_idx < grid_info.gates
+        corner_pixels = pixels[ok]
+        azim_idx = azim_idx[ok]
+        gate_idx = gate_idx[ok]
+
+        azim_rad = np.radians(geometry.azimuths[azim_idx % grid_info.azims])
+        corner_range = geometry.ranges[gate_idx]
+
+        dist = np.hypot(x_flat[corner_pixels] - corner_range * np.sin(azim_rad),
+                        y_flat[corner_pixels] - corner_range * np.cos(azim_rad))
+
+        # Pixels sitting on a gate center get (almost) all the weight
+        weights = 1.0 / np.maximum(dist, 1e-3) ** power
+
+        all_rows.append(corner_pixels)
+        all_cols.append((azim_idx % grid_info.azims) * grid_info.gates + gate_idx)
+        all_weights.append(weights)
+
+    rows = np.concatenate(all_rows)
+    cols = np.concatenate(all_cols)
+    weights = np.concatenate(all_weights)
+
+    row_sums = np.bincount(rows, weights=weights, minlength=spec.size * spec.size)
+    weights = (weights / row_sums[rows]).astype(np.float32)
+
+    shape = (spec.size * spec.size, grid_info.azims * grid_info.gates)
+    return sparse.csr_matrix((weights, (rows, cols)), shape=shape)
+
+
+def load_operator(config, metadata, grid_info, spec, method):
+    """
+    Loads the resampling matrix from the disk cache, building it
+    (and saving it) on the first call.
+    """
+
+    filepath = cartesian_filepath(config, metadata, grid_info, spec, method)
+
+    cached = os.path.isfile(filepath)
+    bugtracker.core.metrics.count_cache(cached)
+
+    if cached:
+        return sparse.load_npz(filepath).tocsr()
+
+    print(f"Building {method} Cartesian operator: {filepath}")
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+
+    if method == 'nearest':
+        operator = build_nearest(geometry, spec)
+    elif method == 'idw':
+        operator = build_idw(geometry, spec)
+    else:
+        raise ValueError(f"Invalid resampling method: {method}")
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    sparse.save_npz(filepath, operator)
+
+    return operator
+
+
+def get_resampler(config, metadata, grid_info, spec):
+    """
+    Returns the CartesianResampler for this radar and raster, reusing
+    the one already built in this process if possible.
+    """
+
+    key = get_cartesian_key(metadata, grid_info, spec, spec.method)
+
+    if key in _resamplers:
+        bugtracker.core.metrics.count_cache(True)
+    else:
+        _resamplers[key] = CartesianResampler(config, metadata, grid_info, spec)
+
+    return _resamplers[key]
+
+
+class CartesianResampler:
+
+    def __init__(self, config, metadata, grid_info, spec):
+
+        self.metadata = metadata
+        self.grid_info = grid_info
+        self.spec = spec
+
+        self.nearest = load_operator(config, metadata, grid_info, spec, 'nearest')
+
+        if spec.method == 'nearest':
+            self.operator = self.nearest
+        else:
+            self.operator = load_operator(config, metadata, grid_info, spec, spec.method)
+
+        self.shape = (spec.size, spec.size)
+        self.covered = (np.diff(self.nearest.indptr) > 0).reshape(self.shape)
+
+        self._lats = None
+        self._lons = None
+
+
+    def check_dims(self, polar_shape):
+
+        polar_dims = (self.grid_info.azims, self.grid_info.gates)
+
+        if tuple(polar_shape[-2:]) != polar_dims:
+            raise ValueError(f"Incompatible polar dims: {polar_shape} (expected {polar_dims})")
+
+
+    def resample(self, field):
+        """
+        Resamples a (azims, gates) or (levels, azims, gates) field.
+        Masked and NaN gates are left out of the weights, pixels
+        without any valid gate are NaN.
+        """
+
+        self.check_dims(field.shape)
+
+        values = np.ma.filled(np.ma.asarray(field, dtype=np.float32), np.nan)
+        levels = values.reshape(-1, self.grid_info.azims * self.grid_info.gates)
+        finite = np.isfinite(levels)
+
+        # Values and weight of the valid gates, in one product
+        stacked = np.concatenate([np.where(finite, levels, 0.0), finite], axis=0).T
+        product = self.operator @ stacked
+
+        num_levels = levels.shape[0]
+        weighted = product[:, 0:num_levels]
+        weight_sum = product[:, num_levels:]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = np.where(weight_sum > 0.0, weighted / weight_sum, np.nan)
+
+        result = result.T.astype(np.float32).reshape((num_levels,) + self.shape)
+
+        if field.ndim == 2:
+            return result[0]
+        else:
+            return result
+
+
+    def resample_target_id(self, id_matrix):
+        """
+        Nearest gate resampling for the categorical target_id codes.
+        """
+
+        self.check_dims(id_matrix.shape)
+
+        levels = np.asarray(id_matrix).reshape(-1, self.grid_info.azims * self.grid_info.gates)
+        product = self.nearest @ levels.T.astype(np.float32)
+
+        result = np.rint(product.T).astype(np.int8).reshape((levels.shape[0],) + self.shape)
+        result[:, ~self.covered] = TARGET_FILL
+
+        return result
+
+
+    def latlon(self):
+        """
+        Lat/lon of the pixel centers (computed once)
+        """
+
+        if self._lats is None:
+            x_axis, y_axis = self.spec.coords()
+            x_arr, y_arr = np.meshgrid(x_axis, y_axis)
+            lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, self.metadata.lon, self.metadata.lat)
+            self._lats = lats.astype(np.float32)
+            self._lons = lons.astype(np.float32)
+
+        return self._lats, self._lons
+
+
+    def write(self, filename, radar_filetype, scan_dt, dbz_elevs, joint_product, id_matrix):
+        """
+        Writes the Cartesian rasters of the joint product and target_id
+        as a CF netCDF4 file, georeferenced through the 'crs' grid
+        mapping and the 2D lat/lon. The resampler is shared by the scans
+        of a station, so the scan time is passed in.
+        """
+
+        joint = self.resample(joint_product)
+        target = self.resample_target_id(id_matrix)
+
+        if len(dbz_elevs) != target.shape[0]:
+            raise ValueError(f"Incompatible levels: {len(dbz_elevs)} != {target.shape[0]}")
+
+        lats, lons = self.latlon()
+        x_axis, y_axis = self.spec.coords()
+
+        dset = nc.Dataset(filename, mode="w")
+
+        dset.Conventions = "CF-1.7"
+        dset.latitude = self.metadata.lat
+        dset.longitude = self.metadata.lon
+        dset.radar_id = self.metadata.radar_id
+        dset.datetime = scan_dt.strftime("%Y%m%d%H%M")
+        # netCDF4.Dataset.name is a read-only property (the group name)
+        dset.setncattr("name", self.metadata.name)
+        dset.filetype = radar_filetype
+        dset.resampling = self.spec.method
+
+        dset.createDimension("dbz_elevs", len(dbz_elevs))
+        dset.createDimension("y", self.spec.size)
+        dset.createDimension("x", self.spec.size)
+
+        crs = dset.createVariable("crs", np.int32)
+        crs.grid_mapping_name = "azimuthal_equidistant"
+        crs.longitude_of_projection_origin = self.metadata.lon
+        crs.latitude_of_projection_origin = self.metadata.lat
+        crs.false_easting = 0.0
+        crs.false_northing = 0.0
+
+        nc_x = dset.createVariable("x", np.float32, ('x',))
+        nc_x.standard_name = "projection_x_coordinate"
+        nc_x.units = "m"
+        nc_x[:] = x_axis
+
+        nc_y = dset.createVariable("y", np.float32, ('y',))
+        nc_y.standard_name = "projection_y_coordinate"
+        nc_y.units = "m"
+        nc_y[:] = y_axis
+
+        nc_lats = dset.createVariable("lats", np.float32, ('y','x'))
+        nc_lats.standard_name = "latitude"
+        nc_lats.units = "degrees_north"
+        nc_lats[:,:] = lats
+
+        nc_lons = dset.createVariable("lons", np.float32, ('y','x'))
+        nc_lons.standard_name = "longitude"
+        nc_lons.units = "degrees_east"
+        nc_lons[:,:] = lons
+
+        nc_dbz_elevs = dset.createVariable("dbz_elevs", np.float32, ('dbz_elevs',))
+        nc_dbz_elevs[:] = dbz_elevs[:]
+
+        nc_joint = dset.createVariable("dbz_joint", np.float32, ('y','x'), fill_value=np.nan)
+        nc_joint.units = "dBZ"
+        nc_joint.grid_mapping = "crs"
+        nc_joint.coordinates = "lats lons"
+        nc_joint[:,:] = joint
+
+        nc_target = dset.createVariable("target_id", np.int8, ('dbz_elevs','y','x'), fill_value=TARGET_FILL)
+        nc_target.grid_mapping = "crs"
+        nc_target.coordinates = "lats lons"
+        nc_target.flag_values = np.array([bugtracker.core.target_id.get_code(target)
+                                          for target in ['none', 'clutter', 'rain', 'bugs']], dtype=np.int8)
+        nc_target.flag_meanings = "none clutter rain bugs"
+        nc_target[:,:,:] = target
+
+        dset.close()
+
+
+def cartesian_filename(nc_filename):
+    """
+    The Cartesian raster is saved next to the polar output file.
+    """
+
+    base, ext = os.path.splitext(nc_filename)
+    return base + "_cartesian" + ext
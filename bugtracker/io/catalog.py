@@ -0,0 +1,325 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+The scan catalog is a small SQLite database, kept in the cache
+folder, with one row per processed scan. It stores the output
+netCDF4 path along with summary statistics (target_id gate counts,
+filter coverage, stage timings), so that selecting scans does not
+require opening every output file.
+
+Tables:
+scans   - one row per output file
+levels  - per-elevation clutter/rain/bugs gate counts
+timings - per-stage processing time in seconds
+profiles - per-height-bin bug gate count and mean dBZ
+profile_percentiles - per-height-bin bug dBZ percentiles
+"""
+
+import os
+import sqlite3
+import datetime
+
+import bugtracker.core.target_id
+
+
+DT_FMT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    radar_id TEXT NOT NULL,
+    scan_dt TEXT NOT NULL,
+    filetype TEXT NOT NULL,
+    output_path TEXT NOT NULL UNIQUE,
+    precip_coverage REAL,
+    clutter_coverage REAL,
+    bug_fraction REAL,
+    processing_time REAL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_radar_dt ON scans (radar_id, scan_dt);
+CREATE INDEX IF NOT EXISTS idx_scans_bugs ON scans (radar_id, bug_fraction);
+
+CREATE TABLE IF NOT EXISTS levels (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    level INTEGER NOT NULL,
+    elev REAL NOT NULL,
+    clutter INTEGER NOT NULL,
+    rain INTEGER NOT NULL,
+    bugs INTEGER NOT NULL,
+    PRIMARY KEY (scan_id, level)
+);
+
+CREATE TABLE IF NOT EXISTS timings (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (scan_id, stage)
+);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    height REAL NOT NULL,
+    count INTEGER NOT NULL,
+    mean_dbz REAL NOT NULL,
+    PRIMARY KEY (scan_id, height)
+);
+
+CREATE TABLE IF NOT EXISTS profile_percentiles (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    height REAL NOT NULL,
+    percentile REAL NOT NULL,
+    dbz REAL NOT NULL,
+    PRIMARY KEY (scan_id, height, percentile)
+);
+"""
+
+
+def catalog_filepath(config):
+
+    cache_dir = config['cache_dir']
+    return os.path.join(cache_dir, "catalog.sqlite")
+
+
+class ScanRecord:
+    """
+    Summary of one processed scan, as it will be stored in the
+    catalog.
+    """
+
+    def __init__(self, metadata, scan_dt, filetype, output_path, dbz_elevs, id_matrix):
+
+        if len(dbz_elevs) != id_matrix.shape[0]:
+            raise ValueError(f"Incompatible levels: {len(dbz_elevs)} != {id_matrix.shape[0]}")
+
+        self.radar_id = metadata.radar_id.lower()
+        self.scan_dt = scan_dt
+        self.filetype = filetype
+        self.output_path = os.path.abspath(output_path)
+        self.dbz_elevs = [float(elev) for elev in dbz_elevs]
+
+        self.precip_coverage = None
+        self.clutter_coverage = None
+        self.timings = dict()
+        self.profile = None
+
+        self.level_counts = dict()
+
+        for target in ['clutter', 'rain', 'bugs']:
+            code = bugtracker.core.target_id.get_code(target)
+            counts = (id_matrix == code).sum(axis=(1,2))
+            self.level_counts[target] = [int(count) for count in counts]
+
+        total_bugs = sum(self.level_counts['bugs'])
+        self.bug_fraction = total_bugs / float(id_matrix.size)
+
+
+    def set_coverage(self, precip_coverage, clutter_coverage):
+
+        self.precip_coverage = float(precip_coverage)
+        self.clutter_coverage = float(clutter_coverage)
+
+
+    def set_timings(self, timings):
+
+        self.timings = dict(timings)
+
+
+    def set_profile(self, profile):
+        """
+        ReflectivityProfile of the bug gates (or None), only the height
+        bins with bugs are stored.
+        """
+
+        self.profile = profile
+
+
+    def processing_time(self):
+
+        return sum(self.timings.values())
+
+
+class ScanCatalog:
+    """
+    Records are buffered in memory and written in batches, each batch
+    in one transaction. Call flush() once processing is done, so that
+    the last partial batch is written.
+    """
+
+    def __init__(self, db_path, batch_size=20):
+
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = []
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+
+    def add(self, record):
+
+        self.pending.append(record)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+
+    def _insert(self, record):
+
+        # Reprocessing a scan replaces its previous entry
+        self.conn.execute("DELETE FROM scans WHERE output_path = ?", (record.output_path,))
+
+        cursor = self.conn.execute(
+            "INSERT INTO scans (radar_id, scan_dt, filetype, output_path, precip_coverage, "
+            "clutter_coverage, bug_fraction, processing_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record.radar_id, record.scan_dt.strftime(DT_FMT), record.filetype, record.output_path,
+             record.precip_coverage, record.clutter_coverage, record.bug_fraction,
+             record.processing_time()))
+
+        scan_id = cursor.lastrowid
+
+        level_rows = []
+        for x in range(0, len(record.dbz_elevs)):
+            level_rows.append((scan_id, x, record.dbz_elevs[x], record.level_counts['clutter'][x],
+                               record.level_counts['rain'][x], record.level_counts['bugs'][x]))
+
+        self.conn.executemany("INSERT INTO levels VALUES (?, ?, ?, ?, ?, ?)", level_rows)
+
+        timing_rows = [(scan_id, stage, seconds) for stage, seconds in record.timings.items()]
+        self.conn.executemany("INSERT INTO timings VALUES (?, ?, ?)", timing_rows)
+
+        if record.profile is not None:
+            profile = record.profile
+            filled = [x for x in range(0, len(profile.heights)) if profile.counts[x] > 0]
+
+            profile_rows = [(scan_id, float(profile.heights[x]), int(profile.counts[x]), float(profile.mean_dbz[x]))
+                            for x in filled]
+            self.conn.executemany("INSERT INTO profiles VALUES (?, ?, ?, ?)", profile_rows)
+
+            percentile_rows = []
+            for x in filled:
+                for percentile, dbz in zip(profile.percentiles, profile.percentile_values[x]):
+                    percentile_rows.append((scan_id, float(profile.heights[x]), float(percentile), float(dbz)))
+            self.conn.executemany("INSERT INTO profile_percentiles VALUES (?, ?, ?, ?)", percentile_rows)
+
+
+    def flush(self):
+        """
+        Write all pending records in one transaction.
+        """
+
+        if len(self.pending) == 0:
+            return
+
+        with self.conn:
+            for record in self.pending:
+                self._insert(record)
+
+        self.pending = []
+
+
+    def close(self):
+
+        self.flush()
+        self.conn.close()
+
+
+    def query(self, radar_id, start, end, min_bug_fraction=None, max_precip_coverage=None):
+        """
+        Returns a list of scan rows (as dicts) in [start, end], sorted
+        by scan time.
+        """
+
+        sql = "SELECT * FROM scans WHERE radar_id = ? AND scan_dt >= ? AND scan_dt <= ?"
+        params = [radar_id.lower(), start.strftime(DT_FMT), end.strftime(DT_FMT)]
+
+        if min_bug_fraction is not None:
+            sql += " AND bug_fraction >= ?"
+            params.append(min_bug_fraction)
+
+        if max_precip_coverage is not None:
+            sql += " AND precip_coverage <= ?"
+            params.append(max_precip_coverage)
+
+        sql += " ORDER BY scan_dt"
+
+        rows = []
+
+        for row in self.conn.execute(sql, params):
+            scan = dict(row)
+            scan['scan_dt'] = datetime.datetime.strptime(scan['scan_dt'], DT_FMT)
+            rows.append(scan)
+
+        return rows
+
+
+    def output_files(self, radar_id, start, end, **kwargs):
+        """
+        Output netCDF4 paths of the scans matching query()
+        """
+
+        return [scan['output_path'] for scan in self.query(radar_id, start, end, **kwargs)]
+
+
+    def levels(self, scan_id):
+
+        sql = "SELECT * FROM levels WHERE scan_id = ? ORDER BY level"
+        return [dict(row) for row in self.conn.execute(sql, (scan_id,))]
+
+
+    def timings(self, scan_id):
+
+        sql = "SELECT stage, seconds FROM timings WHERE scan_id = ?"
+        return {row['stage']: row['seconds'] for row in self.conn.execute(sql, (scan_id,))}
+
+
+    def profiles(self, radar_id, start, end):
+        """
+        Bug reflectivity profiles of the scans in [start, end], for
+        height-time plots without reading the output files. Returns
+        one dict per (scan, height bin with bugs), sorted by scan time
+        and height. The percentiles are a {percentile: dBZ} dict.
+        """
+
+        sql = ("SELECT scans.scan_dt, profiles.scan_id, profiles.height, profiles.count, profiles.mean_dbz "
+               "FROM profiles JOIN scans ON scans.id = profiles.scan_id "
+               "WHERE scans.radar_id = ? AND scans.scan_dt >= ? AND scans.scan_dt <= ? "
+               "ORDER BY scans.scan_dt, profiles.height")
+        params = [radar_id.lower(), start.strftime(DT_FMT), end.strftime(DT_FMT)]
+
+        rows = []
+        index = dict()
+
+        for row in self.conn.execute(sql, params):
+            profile = dict(row)
+            profile['scan_dt'] = datetime.datetime.strptime(profile['scan_dt'], DT_FMT)
+            profile['percentiles'] = dict()
+            index[(profile['scan_id'], profile['height'])] = profile
+            rows.append(profile)
+
+        sql = ("SELECT profile_percentiles.* FROM profile_percentiles "
+               "JOIN scans ON scans.id = profile_percentiles.scan_id "
+               "WHERE scans.radar_id = ? AND scans.scan_dt >= ? AND scans.scan_dt <= ?")
+
+        for row in self.conn.execute(sql, params):
+            index[(row['scan_id'], row['height'])]['percentiles'][row['percentile']] = row['dbz']
+
+        return rows
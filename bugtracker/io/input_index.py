@@ -0,0 +1,247 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+On-disk index of the raw input files of each station.
+
+The input folders follow the /yyyy/mm/dd structure. For every day
+folder, the index keeps the parsed timestamp, scan type and size of
+each input file, along with the folder mtime. A folder is only listed
+again when its mtime changes (i.e. a file was added, removed or
+renamed), so repeated range queries do not touch the filesystem
+beyond one stat() per day folder.
+
+The entries are stored in SQLite, ordered by an index on
+(radar_type, radar_id, scan_dt), so range and closest-scan queries
+are binary searches on that index.
+"""
+
+import os
+import sqlite3
+import datetime
+
+import bugtracker.core.utils
+
+
+DT_FMT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    radar_type TEXT NOT NULL,
+    radar_id TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (radar_type, radar_id, folder)
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    radar_type TEXT NOT NULL,
+    radar_id TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    path TEXT NOT NULL,
+    scan_dt TEXT NOT NULL,
+    scan_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (radar_type, radar_id, path)
+);
+CREATE INDEX IF NOT EXISTS idx_files_dt ON files (radar_type, radar_id, scan_dt, scan_type);
+CREATE INDEX IF NOT EXISTS idx_files_folder ON files (radar_type, radar_id, folder);
+"""
+
+
+def index_filepath(config):
+
+    cache_dir = config['cache_dir']
+    return os.path.join(cache_dir, "input_index.sqlite")
+
+
+class InputIndex:
+    """
+    The parser is a function that takes a file path, and returns a
+    (datetime, scan_type) tuple. It must raise ValueError for files
+    that are not valid input files, these are left out of the index.
+    """
+
+    def __init__(self, config, radar_type, radar_id, parser):
+
+        self.config = config
+        self.radar_type = radar_type.strip().lower()
+        self.radar_id = radar_id.strip().lower()
+        self.parser = parser
+
+        self.conn = sqlite3.connect(index_filepath(config))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+
+    def _key(self):
+        return (self.radar_type, self.radar_id)
+
+
+    def _stored_mtime(self, folder):
+
+        sql = "SELECT mtime FROM folders WHERE radar_type = ? AND radar_id = ? AND folder = ?"
+        row = self.conn.execute(sql, self._key() + (folder,)).fetchone()
+
+        if row is None:
+            return None
+        else:
+            return row['mtime']
+
+
+    def _drop_folder(self, folder):
+
+        params = self._key() + (folder,)
+        self.conn.execute("DELETE FROM files WHERE radar_type = ? AND radar_id = ? AND folder = ?", params)
+        self.conn.execute("DELETE FROM folders WHERE radar_type = ? AND radar_id = ? AND folder = ?", params)
+
+
+    def _scan_folder(self, folder, mtime):
+
+        rows = []
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    scan_dt, scan_type = self.parser(entry.path)
+                except (ValueError, SyntaxError):
+                    continue
+                size = entry.stat().st_size
+                rows.append(self._key() + (folder, entry.path, scan_dt.strftime(DT_FMT), scan_type, size))
+
+        with self.conn:
+            self._drop_folder(folder)
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT INTO folders VALUES (?, ?, ?, ?)", self._key() + (folder, mtime))
+
+        print(f"Indexed {len(rows)} files in {folder}")
+
+
+    def refresh(self, start, stop):
+        """
+        Bring the day folders between start and stop up to date.
+        Returns the number of day folders that exist.
+        """
+
+        folders = bugtracker.core.utils.get_input_folders(self.config, self.radar_type, self.radar_id, start, stop)
+        existing = 0
+
+        for folder in folders:
+            try:
+                mtime = os.stat(folder).st_mtime
+            except FileNotFoundError:
+                if self._stored_mtime(folder) is not None:
+                    with self.conn:
+                        self._drop_folder(folder)
+                continue
+
+            existing += 1
+
+            if self._stored_mtime(folder) != mtime:
+                self._scan_folder(folder, mtime)
+
+        if existing == 0:
+            msg = f"No files found! List of input folders checked: {folders}"
+            raise FileNotFoundError(msg)
+
+        return existing
+
+
+    def _rows(self, sql, params):
+
+        entries = []
+
+        for row in self.conn.execute(sql, params):
+            entry = dict(row)
+            entry['scan_dt'] = datetime.datetime.strptime(entry['scan_dt'], DT_FMT)
+            entries.append(entry)
+
+        return entries
+
+
+    def entries(self, start, stop, scan_type=None):
+        """
+        Index entries (dicts with path, scan_dt, scan_type, size) with
+        start <= scan_dt <= stop, sorted by (scan_dt, scan_type).
+        """
+
+        self.refresh(start, stop)
+
+        sql = "SELECT path, scan_dt, scan_type, size FROM files WHERE radar_type = ? AND radar_id = ? "
+        sql += "AND scan_dt >= ? AND scan_dt <= ?"
+        params = self._key() + (start.strftime(DT_FMT), stop.strftime(DT_FMT))
+
+        if scan_type is not None:
+            sql += " AND scan_type = ?"
+            params = params + (scan_type,)
+
+        sql += " ORDER BY scan_dt, scan_type"
+
+        return self._rows(sql, params)
+
+
+    def get_range(self, start, stop, scan_type=None):
+        """
+        File paths with start <= scan_dt <= stop, sorted by time.
+        """
+
+        return [entry['path'] for entry in self.entries(start, stop, scan_type=scan_type)]
+
+
+    def get_closest(self, target_dt, max_diff, scan_type=None):
+        """
+        Path of the file closest in time to target_dt, or None if
+        there is no file within max_diff (a timedelta).
+        """
+
+        self.refresh(target_dt - max_diff, target_dt + max_diff)
+
+        target = target_dt.strftime(DT_FMT)
+        params = self._key() + (target,)
+        type_clause = ""
+
+        if scan_type is not None:
+            type_clause = " AND scan_type = ?"
+            params = params + (scan_type,)
+
+        base = "SELECT path, scan_dt, scan_type, size FROM files WHERE radar_type = ? AND radar_id = ? "
+        before_sql = base + "AND scan_dt <= ?" + type_clause + " ORDER BY scan_dt DESC LIMIT 1"
+        after_sql = base + "AND scan_dt >= ?" + type_clause + " ORDER BY scan_dt ASC LIMIT 1"
+
+        candidates = self._rows(before_sql, params) + self._rows(after_sql, params)
+
+        closest = None
+        min_diff = None
+
+        for entry in candidates:
+            diff = abs(entry['scan_dt'] - target_dt)
+            if diff > max_diff:
+                continue
+            if min_diff is None or diff < min_diff:
+                min_diff = diff
+                closest = entry['path']
+
+        return closest
+
+
+    def close(self):
+
+        self.conn.close()
@@ -23,6 +23,7 @@ spread out over multiple DOPVOL and CONVOL files.
 
 import os
 import glob
+import bisect
 import datetime
 
 import numpy as np
@@ -35,7 +36,23 @@ import bugtracker.core.grid
 import bugtracker.plots.dbz
 import bugtracker.core.metadata
 import bugtracker.core.exceptions
-from bugtracker.io.scan import ScanData
+import bugtracker.core.metrics
+import bugtracker.io.input_index
+from bugtracker.io.scan import ScanData, nan_field, to_nan
+# The field lists of each consumer, and the reader, are shared with
+# bugtracker.core (see core/sigmet.py)
+from bugtracker.core.sigmet import read_sigmet, CONVOL_FIELDS, DOPVOL_PROCESSING_FIELDS, DOPVOL_CALIB_FIELDS
+
+
+def read_metadata(iris_set):
+    """
+    Metadata of an IrisSet, from the headers of its CONVOL file
+    """
+
+    # Only the headers are needed here
+    iris_convol = read_sigmet(iris_set.convol, fields=CONVOL_FIELDS)
+
+    return bugtracker.core.metadata.from_iris_set(iris_set, iris_convol)
 
 
 def get_scan_type(radar):
@@ -62,10 +79,7 @@ def get_dbz_key(radar):
 
 def extract_dbz(filename):
 
-    if not os.path.isfile(filename):
-        raise FileNotFoundError(filename)
-
-    radar = pyart.io.read_sigmet(filename)
+    radar = read_sigmet(filename, fields=CONVOL_FIELDS + ['reflectivity'])
     scan_type = get_scan_type(radar)
     print("Extracting array from scan:", scan_type)
     dbz_key = get_dbz_key(radar)
@@ -78,10 +92,8 @@ def extract_dbz(filename):
 
 def extract_fixed_angle(filename, single=False):
 
-    if not os.path.isfile(filename):
-        raise FileNotFoundError(filename)
-
-    radar = pyart.io.read_sigmet(filename)
+    # Angles are in the scan headers, the smallest field is enough
+    radar = read_sigmet(filename, fields=CONVOL_FIELDS + ['reflectivity'])
     angles = radar.fixed_angle['data']
 
     if single:
@@ -102,6 +114,45 @@ def round_angle(angle):
     return round(angle,1)
 
 
+def upsample(field, azims, gates, dtype):
+    """
+    Nearest neighbour regridding of a (raw azims, raw gates) field
+    onto (azims, gates), each raw cell covering 2 x 2 cells. Masked
+    values are NaN.
+    """
+
+    azim_idx = np.arange(azims) // 2
+    gate_idx = np.arange(gates) // 2
+
+    return to_nan(field, dtype)[azim_idx[:,np.newaxis], gate_idx[np.newaxis,:]]
+
+
+def merge_levels(all_dbz, all_elevs):
+    """
+    Mean of the levels (axis 0) scanned at the same elevation, over
+    the valid (not NaN) values. Returns the merged levels, by
+    increasing elevation, and the unique elevations.
+    """
+
+    unique_levels = sorted(set(all_elevs))
+    merged_dims = (len(unique_levels),) + all_dbz.shape[1:]
+    dbz_merged = nan_field(merged_dims, all_dbz.dtype)
+
+    for x in range(0, len(unique_levels)):
+        idx_list = [y for y in range(0, len(all_elevs)) if all_elevs[y] == unique_levels[x]]
+
+        if len(idx_list) == 1:
+            dbz_merged[x,:,:] = all_dbz[idx_list[0],:,:]
+            continue
+
+        sub_array = all_dbz[idx_list,:,:]
+        counts = np.count_nonzero(~np.isnan(sub_array), axis=0)
+        totals = np.nansum(sub_array, axis=0)
+        np.divide(totals, counts, out=dbz_merged[x,:,:], where=counts > 0)
+
+    return dbz_merged, unique_levels
+
+
 def iris_grid():
 
     gates = 256 * 2
@@ -115,10 +166,16 @@ def iris_grid():
 
 class IrisFile:
 
-    def __init__(self, path):
+    def __init__(self, path, scan_dt=None, scan_type=None):
 
         self.path = path
 
+        # Already parsed (e.g. entries from the InputIndex)
+        if scan_dt is not None and scan_type is not None:
+            self.datetime = scan_dt
+            self.type = scan_type
+            return
+
         # This section may need to be adapted, if more patterns emerge.
         # Currently, there are two recognized filename formats for IRIS
 
@@ -171,7 +228,7 @@ class IrisSet:
 
     def __init__(self, convol, radar_id):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
         if convol.datetime is None:
             raise ValueError("IrisSet datetime cannot be null.")
@@ -280,14 +337,25 @@ class IrisSet:
 
 
 
+def parse_iris_file(path):
+    """
+    Parser for the InputIndex, returns the (datetime, type) of an
+    IRIS file.
+    """
+
+    iris_file = IrisFile(path)
+    return iris_file.datetime, iris_file.type
+
+
 class IrisCollection:
 
     def __init__(self, radar_id):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.radar_id = radar_id
         self.files = []
         self.sets = []
+        self.index = bugtracker.io.input_index.InputIndex(self.config, "iris", radar_id, parse_iris_file)
 
 
     def _sort(self):
@@ -302,16 +370,13 @@ class IrisCollection:
         The 'reset' function is called due to the YYYY/mm/dd folder structure.
         """
 
-        # including all files
-        file_list = bugtracker.core.utils.get_input_files(self.config, "iris", self.radar_id, start, stop)
+        # Invalid filenames are already left out of the index
+        entries = self.index.entries(start, stop)
 
         self.files = []
 
-        for file in file_list:
-            try:
-                self.files.append(IrisFile(file))
-            except (ValueError, SyntaxError):
-                print(f"Invalid file, skipping: {file}")
+        for entry in entries:
+            self.files.append(IrisFile(entry['path'], entry['scan_dt'], entry['scan_type']))
 
         self._sort()
 
@@ -348,9 +413,9 @@ class IrisCollection:
 
 
     def closest_set(self, target_dt):
-
         """
-        This can be rewritten as a log(N) algorithm.
+        The sets are sorted by datetime, so only the two sets on
+        either side of the bisection point are candidates.
         """
 
         start = target_dt + datetime.timedelta(hours=-1)
@@ -358,12 +423,15 @@ class IrisCollection:
 
         self._reset(start, end)
 
-        num_sets = len(self.sets)
+        set_times = [iris_set.datetime for iris_set in self.sets]
+        pos = bisect.bisect_left(set_times, target_dt)
 
         min_idx = -1
         min_diff = 999999999
 
-        for x in range(0, num_sets):
+        for x in [pos - 1, pos]:
+            if x < 0 or x >= len(self.sets):
+                continue
             diff = target_dt - self.sets[x].datetime
             total_seconds = abs(diff.total_seconds())
             if total_seconds < min_diff:
@@ -417,22 +485,26 @@ class IrisCollection:
 
 class IrisData(ScanData):
 
-    def __init__(self, iris_set):
+    def __init__(self, iris_set, dopvol_fields=DOPVOL_PROCESSING_FIELDS):
         """
         Extract numpy arrays for easy file manipulation
+
+        Only the DOPVOL moments in dopvol_fields are read, the other
+        moment arrays are left empty.
         """
 
         if not iris_set.is_valid():
             str_rep = str(iris_set)
             raise FileNotFoundError(str_rep)
 
-        metadata = bugtracker.core.metadata.from_iris_set(iris_set)
+        metadata = read_metadata(iris_set)
         grid_info = iris_grid()
         datetime = iris_set.datetime
 
         super().__init__(metadata, grid_info, datetime)
 
         self._iris_set = iris_set
+        self.dopvol_fields = dopvol_fields
         self.convol_scans = self.config["iris_settings"]["convol_scans"]
         self.dopvol_scans = 3 
 
@@ -450,12 +522,13 @@ class IrisData(ScanData):
         print("CONVOL_dims", convol_dims)
         print("DOPVOL_dims", dopvol_dims)
 
-        self.convol = np.ma.zeros(convol_dims, dtype=float)
-        self.dopvol = np.ma.zeros(dopvol_dims, dtype=float)
+        # NaN where there is no data, see scan.py
+        self.convol = nan_field(convol_dims, self.dtype)
+        self.dopvol = nan_field(dopvol_dims, self.dtype)
 
-        self.total_power = np.ma.zeros(dopvol_dims, dtype=float)
-        self.velocity = np.ma.zeros(dopvol_dims, dtype=float)
-        self.spectrum_width = np.ma.zeros(dopvol_dims, dtype=float)
+        self.total_power = nan_field(dopvol_dims, self.dtype)
+        self.velocity = nan_field(dopvol_dims, self.dtype)
+        self.spectrum_width = nan_field(dopvol_dims, self.dtype)
 
 
     def fill_convol(self):
@@ -479,11 +552,7 @@ class IrisData(ScanData):
             raise ValueError("Convol scans:", len(convol_scans))
 
         for z in range(0, self.convol_scans):
-            for x in range(0, self.grid_info.azims):
-                azim_idx = int(x) // 2
-                for y in range(0, self.grid_info.gates):
-                    gate_idx = int(y) // 2
-                    self.convol[z, x, y] = convol_levels[z][azim_idx, gate_idx]
+            self.convol[z,:,:] = upsample(convol_levels[z], self.grid_info.azims, self.grid_info.gates, self.dtype)
 
 
     def fill_dopvol_short(self, scan, np_array, field_key, idx):
@@ -498,8 +567,8 @@ class IrisData(ScanData):
             or short_field_shape[1] != dopvol_short_range):
             raise ValueError("Shape error", short_field_shape)
 
-        np_array[idx,0:dopvol_short_azims,0:dopvol_short_range] = short_field[:,:]
-        np_array.mask[idx,:,dopvol_short_range:] = True
+        np_array[idx,0:dopvol_short_azims,0:dopvol_short_range] = to_nan(short_field, self.dtype)
+        np_array[idx,:,dopvol_short_range:] = np.nan
 
 
     def fill_dopvol_long(self, scan, np_array, field_key, idx):
@@ -510,13 +579,8 @@ class IrisData(ScanData):
         dopvol_2_gates = long_field_shape[1]
         dopvol_long_range = dopvol_2_gates * 2
 
-        for x in range(0, self.grid_info.azims):
-            azim_idx = int(x) // 2
-            for y in range(0, dopvol_long_range):
-                gate_idx = int(y) // 2
-                np_array[idx, x, y] = long_field[azim_idx, gate_idx]
-
-        np_array.mask[idx,:,dopvol_long_range:] = True
+        np_array[idx,:,0:dopvol_long_range] = upsample(long_field, self.grid_info.azims, dopvol_long_range, self.dtype)
+        np_array[idx,:,dopvol_long_range:] = np.nan
 
 
     def fill_dopvol_field(self, scan, np_array, field_key, idx, scan_type):
@@ -531,14 +595,27 @@ class IrisData(ScanData):
             raise ValueError(f"Invalid scan_type: {scan_type}")
 
 
+    def get_dopvol_array(self, field_key):
+
+        if field_key == "reflectivity":
+            return self.dopvol
+        elif field_key == "total_power":
+            return self.total_power
+        elif field_key == "velocity":
+            return self.velocity
+        elif field_key == "spectrum_width":
+            return self.spectrum_width
+        else:
+            raise ValueError(f"Unsupported DOPVOL field: {field_key}")
+
+
     def fill_dopvol_file(self, iris_file, idx, scan_type):
         
-        scan = pyart.io.read_sigmet(iris_file)
+        scan = read_sigmet(iris_file, fields=self.dopvol_fields)
 
-        self.fill_dopvol_field(scan, self.dopvol, "reflectivity", idx, scan_type)
-        self.fill_dopvol_field(scan, self.total_power, "total_power", idx, scan_type)
-        self.fill_dopvol_field(scan, self.velocity, "velocity", idx, scan_type)
-        self.fill_dopvol_field(scan, self.spectrum_width, "spectrum_width", idx, scan_type)
+        for field_key in self.dopvol_fields:
+            np_array = self.get_dopvol_array(field_key)
+            self.fill_dopvol_field(scan, np_array, field_key, idx, scan_type)
 
 
     def fill_grids(self):
@@ -552,6 +629,10 @@ class IrisData(ScanData):
         self.fill_dopvol_file(self._iris_set.dopvol_1B, 1, "short")
         self.fill_dopvol_file(self._iris_set.dopvol_2, 2, "long")
 
+        iris_set = self._iris_set
+        for iris_file in [iris_set.convol, iris_set.dopvol_1A, iris_set.dopvol_1B, iris_set.dopvol_2]:
+            bugtracker.core.metrics.count('bytes_read', bugtracker.core.metrics.file_size(iris_file))
+
 
     def plot_level(self, dbz_array, output_folder, label, max_range):
         # This should be decoupled and in the 'plots' module
@@ -626,55 +707,6 @@ class IrisData(ScanData):
             raise ValueError("Incompatible convol/dopvol dims.")
 
 
-    def level_indices(self, unique_levels, all_elevs):
-
-        idx_dict = dict()
-
-        num_total_levels = len(all_elevs)
-
-        for x in range(0, num_total_levels):
-            elev = all_elevs[x]
-            if elev not in idx_dict:
-                idx_dict[elev] = [x]
-            else:
-                idx_dict[elev].append(x)
-
-        return idx_dict
-
-
-    def merge_subarray(self, all_dbz, idx_list):
-
-        sub_array_dims = (len(idx_list), self.grid_info.azims, self.grid_info.gates)
-        sub_array = np.ma.zeros(sub_array_dims, dtype=float)
-
-        for x in range(0, len(idx_list)):
-            idx = idx_list[x]
-            sub_array[x,:,:] = all_dbz[idx,:,:]
-
-        return np.average(sub_array, axis=0)
-
-
-    def combine_all(self, all_dbz, level_indices, unique_levels):
-
-        num_unique = len(unique_levels)
-        dbz_dims = (num_unique, self.grid_info.azims, self.grid_info.gates)
-        dbz_merged = np.ma.zeros(dbz_dims, dtype=float)
-
-        for x in range(0, num_unique):
-            unique_level = unique_levels[x]
-            level_idx_list = level_indices[unique_level]
-            if len(level_idx_list) == 0:
-                raise ValueError("Empty index")
-            elif len(level_idx_list) == 1:
-                current_idx = level_idx_list[0]
-                dbz_merged[x,:,:] = all_dbz[current_idx,:,:]
-            else:
-                merged_level = self.merge_subarray(all_dbz, level_idx_list)
-                dbz_merged[x,:,:] = merged_level[:,:]
-
-        return dbz_merged
-
-
     def merge_dbz(self):
         """
         Merge dopvol and convol together
@@ -685,23 +717,12 @@ class IrisData(ScanData):
 
         self.check_grids(c_shape, d_shape)
 
-        convol_levels = c_shape[0]
-        dopvol_levels = d_shape[0]
-        all_levels = convol_levels + dopvol_levels
         all_elevs = self.convol_elevs + self.dopvol_elevs
-        all_dims = (all_levels, self.grid_info.azims, self.grid_info.gates)
 
         # Combining DOPVOL and CONVOL into one big array
-        all_dbz = np.ma.zeros(all_dims, dtype=float)
-        all_dbz[0:convol_levels,:,:] = self.convol[:,:,:]
-        all_dbz[convol_levels:,:,:] = self.dopvol[:,:,:]
-
-        unique_levels = list(set(all_elevs))
-        unique_levels.sort()
+        all_dbz = np.concatenate([self.convol, self.dopvol], axis=0)
 
-        level_indices = self.level_indices(unique_levels, all_elevs)
-        
-        dbz_merged = self.combine_all(all_dbz, level_indices, unique_levels)
+        dbz_merged, unique_levels = merge_levels(all_dbz, all_elevs)
         self.dbz_elevs = unique_levels
 
         return dbz_merged
@@ -758,7 +779,7 @@ class IrisData(ScanData):
         gates = self.grid_info.gates
         dims = (num_angles, azims, gates)
 
-        dopvol_field = np.ma.zeros(dims, dtype=float)
+        dopvol_field = np.ma.zeros(dims, dtype=self.dtype)
 
         field_1A = self.pyart_dopvol_1A.fields[field_type]['data']
         field_1B = self.pyart_dopvol_1B.fields[field_type]['data']
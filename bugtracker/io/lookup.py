@@ -0,0 +1,402 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Reverse lookup from lat/lon to the (azim, gate) cells of the polar
+grid, for extracting time series at a site (trap, weather station).
+
+The gate lat/lon of the calib file are projected on an azimuthal
+equidistant plane centered on the radar, and stored in a KD-tree.
+The tree is pickled in cache_dir/lookup, and rebuilt only when the
+calib file changes.
+"""
+
+import os
+import glob
+import pickle
+
+import numpy as np
+import netCDF4 as nc
+import pyart
+from scipy import spatial
+from matplotlib import path as mpl_path
+
+import bugtracker.core.utils
+import bugtracker.core.metrics
+import bugtracker.core.target_id
+import bugtracker.io.models
+
+
+# GateLookup objects already loaded in this process, by calib file
+_lookups = dict()
+
+
+class GateSelection:
+    """
+    A set of (azim, gate) cells with weights summing to 1.
+    """
+
+    def __init__(self, azims, gates, weights):
+
+        self.azims = np.asarray(azims, dtype=np.int64)
+        self.gates = np.asarray(gates, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        if len(self.azims) == 0:
+            raise ValueError("Empty gate selection")
+
+        if len(self.azims) != len(self.gates) or len(self.azims) != len(self.weights):
+            raise ValueError("Incompatible gate selection arrays")
+
+
+    def __len__(self):
+        return len(self.azims)
+
+
+    def __str__(self):
+        rep = "GateSelection:\n"
+
+        for x in range(0, len(self)):
+            rep += f"azim: {self.azims[x]}, gate: {self.gates[x]}, weight: {self.weights[x]:.4f}\n"
+
+        return rep
+
+
+class GateLookup:
+
+    def __init__(self, lats, lons, lat_0, lon_0):
+        """
+        lats/lons are the (azims, gates) grids, and lat_0/lon_0 is
+        the center of the projection (the radar site).
+        """
+
+        if lats.shape != lons.shape or len(lats.shape) != 2:
+            raise ValueError(f"Invalid lat/lon grids: {lats.shape}, {lons.shape}")
+
+        self.shape = lats.shape
+        self.lat_0 = float(lat_0)
+        self.lon_0 = float(lon_0)
+
+        x_arr, y_arr = self.project(np.ravel(lats), np.ravel(lons))
+        self.points = np.column_stack([x_arr, y_arr])
+        self.tree = spatial.cKDTree(self.points)
+
+
+    def project(self, lats, lons):
+
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+
+        return pyart.core.geographic_to_cartesian_aeqd(lons, lats, self.lon_0, self.lat_0)
+
+
+    def _cells(self, flat_idx):
+
+        return np.unravel_index(flat_idx, self.shape)
+
+
+    def query_point(self, lat, lon, neighbours=1, max_distance=None):
+        """
+        Gates closest to (lat, lon). With neighbours > 1, the gates
+        are weighted by inverse distance. Raises ValueError if the
+        nearest gate is further than max_distance (meters).
+        """
+
+        x_arr, y_arr = self.project(lat, lon)
+        distances, flat_idx = self.tree.query([x_arr[0], y_arr[0]], k=neighbours)
+
+        distances = np.atleast_1d(distances)
+        flat_idx = np.atleast_1d(flat_idx)
+
+        if max_distance is not None and distances[0] > max_distance:
+            raise ValueError(f"No gate within {max_distance} m of ({lat}, {lon})")
+
+        weights = 1.0 / np.maximum(distances, 1e-3) ** 2
+        weights = weights / weights.sum()
+
+        azims, gates = self._cells(flat_idx)
+        return GateSelection(azims, gates, weights)
+
+
+    def query_polygon(self, vertices):
+        """
+        All gates inside the polygon, with equal weights. Vertices
+        are a list of (lat, lon) pairs.
+        """
+
+        if len(vertices) < 3:
+            raise ValueError("A polygon needs at least 3 vertices")
+
+        vertex_lats = [vertex[0] for vertex in vertices]
+        vertex_lons = [vertex[1] for vertex in vertices]
+        x_arr, y_arr = self.project(vertex_lats, vertex_lons)
+        polygon_xy = np.column_stack([x_arr, y_arr])
+
+        # Candidates are the gates within the circle enclosing the polygon
+        center = polygon_xy.mean(axis=0)
+        radius = np.hypot(polygon_xy[:,0] - center[0], polygon_xy[:,1] - center[1]).max()
+        candidates = np.array(self.tree.query_ball_point(center, radius), dtype=np.int64)
+
+        if len(candidates) == 0:
+            raise ValueError(f"No gates inside polygon {vertices}")
+
+        inside = mpl_path.Path(polygon_xy).contains_points(self.points[candidates])
+        flat_idx = candidates[inside]
+
+        if len(flat_idx) == 0:
+            raise ValueError(f"No gates inside polygon {vertices}")
+
+        azims, gates = self._cells(flat_idx)
+        weights = np.full(len(flat_idx), 1.0 / len(flat_idx))
+
+        return GateSelection(azims, gates, weights)
+
+
+def lookup_filepath(config, calib_file):
+
+    cache_folder = os.path.join(config['cache_dir'], 'lookup')
+    basename = os.path.splitext(os.path.basename(calib_file))[0]
+    return os.path.join(cache_folder, f"{basename}.pickle")
+
+
+def find_calib_file(config, radar_id):
+    """
+    Calib file of a station, when only the station code is known.
+    """
+
+    pattern = os.path.join(config['cache_dir'], 'calib', f"{radar_id.lower()}_*.nc")
+    calib_files = sorted(glob.glob(pattern))
+
+    if len(calib_files) == 0:
+        raise FileNotFoundError(f"No calib file matching {pattern}")
+
+    if len(calib_files) > 1:
+        raise ValueError(f"Several calib files for {radar_id}, choose one of: {calib_files}")
+
+    return calib_files[0]
+
+
+def from_calib(calib_file):
+    """
+    Builds the GateLookup from the lats/lons of a calib file. The
+    first gate of each ray is the radar site.
+    """
+
+    dset = nc.Dataset(calib_file, mode='r')
+    lats = np.array(dset.variables['lats'][:,:])
+    lons = np.array(dset.variables['lons'][:,:])
+    dset.close()
+
+    return GateLookup(lats, lons, lats[0,0], lons[0,0])
+
+
+def get_lookup(config, calib_file):
+    """
+    Returns the GateLookup of a calib file, from memory, from the disk
+    cache or built from scratch (in that order).
+    """
+
+    if not os.path.isfile(calib_file):
+        raise FileNotFoundError(f"Missing calib file {calib_file}")
+
+    calib_mtime = os.stat(calib_file).st_mtime
+
+    if calib_file in _lookups and _lookups[calib_file][0] == calib_mtime:
+        bugtracker.core.metrics.count_cache(True)
+        return _lookups[calib_file][1]
+
+    cache_file = lookup_filepath(config, calib_file)
+    lookup = None
+
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as handle:
+            cached_mtime, cached_lookup = pickle.load(handle)
+        if cached_mtime == calib_mtime:
+            lookup = cached_lookup
+
+    bugtracker.core.metrics.count_cache(lookup is not None)
+
+    if lookup is None:
+        print(f"Building gate lookup: {cache_file}")
+        lookup = from_calib(calib_file)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'wb') as handle:
+            pickle.dump((calib_mtime, lookup), handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    _lookups[calib_file] = (calib_mtime, lookup)
+    return lookup
+
+
+def find_output_files(config, radar_id, start, end):
+    """
+    Output netCDF4 files of a station between start and end, sorted
+    by time. This follows the layout of Processor.output_filename.
+    """
+
+    radar_id = radar_id.lower()
+    output_files = []
+
+    for scan_date in bugtracker.core.utils.date_range(start, end):
+        day_folder = os.path.join(config['netcdf_dir'], radar_id, scan_date.strftime(os.path.join("%Y", "%m", "%d")))
+
+        for filename in glob.glob(os.path.join(day_folder, "dbz_*.nc")):
+            try:
+                scan_dt = bugtracker.io.models.output_datetime(filename)
+            except ValueError:
+                # e.g. the *_cartesian.nc rasters
+                continue
+            if start <= scan_dt and scan_dt <= end:
+                output_files.append((scan_dt, filename))
+
+    output_files.sort()
+    return [filename for scan_dt, filename in output_files]
+
+
+class TimeSeriesExtractor:
+    """
+    Extracts the values at many sites from a series of output files,
+    reading each file and each field once.
+
+    For dBZ fields, the value is the weighted mean of the valid gates
+    of each selection. For target_id, it is the weighted fraction of
+    gates identified as bugs.
+    """
+
+    def __init__(self, selections):
+        """
+        selections is a dict of GateSelection objects, by site name
+        """
+
+        if len(selections) == 0:
+            raise ValueError("No sites to extract")
+
+        self.names = list(selections.keys())
+
+        all_azims = []
+        all_gates = []
+        all_weights = []
+        self.offsets = []
+
+        offset = 0
+        for name in self.names:
+            selection = selections[name]
+            self.offsets.append(offset)
+            all_azims.append(selection.azims)
+            all_gates.append(selection.gates)
+            all_weights.append(selection.weights)
+            offset += len(selection)
+
+        self.azims = np.concatenate(all_azims)
+        self.gates = np.concatenate(all_gates)
+        self.weights = np.concatenate(all_weights)
+        self.offsets = np.array(self.offsets, dtype=np.int64)
+
+
+    def reduce(self, values, valid):
+        """
+        Weighted mean per site. values/valid have shape (levels, gates)
+        where gates are the concatenated selections.
+        """
+
+        weights = self.weights * valid
+        weighted = np.add.reduceat(np.where(valid, values, 0.0) * weights, self.offsets, axis=-1)
+        weight_sum = np.add.reduceat(weights, self.offsets, axis=-1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(weight_sum > 0.0, weighted / weight_sum, np.nan)
+
+
+    def extract_field(self, variable, field):
+
+        data = variable[:]
+        values = np.ma.getdata(data)[..., self.azims, self.gates].astype(np.float64)
+        mask = np.ma.getmaskarray(data)[..., self.azims, self.gates]
+
+        values = np.atleast_2d(values)
+        valid = np.logical_and(np.logical_not(np.atleast_2d(mask)), np.isfinite(values))
+
+        if field == 'target_id':
+            values = (values == bugtracker.core.target_id.get_code('bugs')).astype(np.float64)
+
+        # Result has shape (levels, sites)
+        return self.reduce(values, valid)
+
+
+    def extract(self, output_files, fields=None):
+        """
+        Returns a dict with the list of scan datetimes ('scan_dt') and
+        for each site name, a dict of field -> array (scans, levels).
+        Fields missing from a file are NaN.
+        """
+
+        if fields is None:
+            fields = ['dbz_joint', 'dbz_filtered', 'target_id']
+
+        scan_times = []
+        rows = {name: {field: [] for field in fields} for name in self.names}
+
+        for output_file in output_files:
+            try:
+                dset = nc.Dataset(output_file, mode='r')
+            except OSError:
+                print(f"Could not read file, skipping: {output_file}")
+                continue
+
+            scan_times.append(bugtracker.io.models.output_datetime(output_file, dset))
+
+            for field in fields:
+                if field in dset.variables:
+                    result = self.extract_field(dset.variables[field], field)
+                else:
+                    result = None
+
+                for x in range(0, len(self.names)):
+                    if result is None:
+                        rows[self.names[x]][field].append(np.full(1, np.nan))
+                    else:
+                        rows[self.names[x]][field].append(result[:,x])
+
+            dset.close()
+
+        series = dict()
+        series['scan_dt'] = scan_times
+
+        for name in self.names:
+            series[name] = dict()
+            for field in fields:
+                series[name][field] = stack_rows(rows[name][field])
+
+        return series
+
+
+def stack_rows(rows):
+    """
+    Stacks per-scan level arrays into (scans, levels), padding with
+    NaN when the number of levels changes between files.
+    """
+
+    if len(rows) == 0:
+        return np.zeros((0, 0), dtype=np.float64)
+
+    max_levels = max(len(row) for row in rows)
+    stacked = np.full((len(rows), max_levels), np.nan)
+
+    for x in range(0, len(rows)):
+        stacked[x,0:len(rows[x])] = rows[x]
+
+    return stacked
@@ -16,41 +16,67 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import abc
+import datetime
 import numpy as np
 import netCDF4 as nc
 
 import bugtracker.config
+from bugtracker.io.scan import to_masked
+
+
+# Output files are named after their scan (see Processor.output_filename)
+OUTPUT_PATTERN = "dbz_%Y%m%d%H%M.nc"
+
+
+def output_datetime(output_file, dset=None):
+    """
+    Scan datetime of an output file, taken from its name. The
+    'datetime' attribute is only a fallback for renamed files (with
+    dset, the open file): outputs written before it was stamped per
+    scan all carry the start time of their run.
+    """
+
+    try:
+        return datetime.datetime.strptime(os.path.basename(output_file), OUTPUT_PATTERN)
+    except ValueError:
+        if dset is None:
+            raise
+        return datetime.datetime.strptime(dset.getncattr('datetime'), "%Y%m%d%H%M")
+
 
 class BaseOutput(abc.ABC):
 
     def __init__(self, metadata, grid_info, radar_filetype):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.metadata = metadata
         self.grid_info = grid_info
         self.radar_filetype = radar_filetype
 
 
-    def write_metadata(self, dset):
+    def write_metadata(self, dset, scan_dt):
         """
         Put in all of the important attributes and metadata
-        using the dset file handle.
+        using the dset file handle. scan_dt is the time of this scan,
+        self.metadata is shared by all the scans of a run.
         """
 
         dset.latitude = self.metadata.lat
         dset.longitude = self.metadata.lon
         dset.radar_id = self.metadata.radar_id
-        dset.datetime = self.metadata.scan_dt.strftime("%Y%m%d%H%M")
-        dset.name = self.metadata.name
+        dset.datetime = scan_dt.strftime("%Y%m%d%H%M")
+        # "name" is reserved by netCDF4 for attribute assignment
+        dset.setncattr("name", self.metadata.name)
         dset.filetype = self.radar_filetype
 
 
-    def write(self, filename):
+    def write(self, filename, scan_dt):
 
         dset = nc.Dataset(filename, mode="w")
 
-        self.write_metadata(dset)
+        self.write_metadata(dset, scan_dt)
         # Create dbz_elevs, azims, gates as dimensions
 
         azims = self.grid_info.azims
@@ -67,10 +93,11 @@ class BaseOutput(abc.ABC):
         nc_dbz_unfiltered = dset.createVariable("dbz_unfiltered", np.float32, ('dbz_elevs','azims','gates'))
         nc_dbz_joint = dset.createVariable("dbz_joint", np.float32, ('azims','gates'))
 
+        # NaN gates are written as missing values
         nc_dbz_elevs[:] = dbz_elevs[:]
-        nc_dbz_filtered[:,:,:] = self.dbz_filtered[:,:,:]
-        nc_dbz_unfiltered[:,:,:] = self.dbz_unfiltered[:,:,:]
-        nc_dbz_joint = self.joint_product[:,:]
+        nc_dbz_filtered[:,:,:] = to_masked(self.dbz_filtered[:,:,:])
+        nc_dbz_unfiltered[:,:,:] = to_masked(self.dbz_unfiltered[:,:,:])
+        nc_dbz_joint[:,:] = to_masked(self.joint_product[:,:])
 
         dset.close()
 
@@ -178,7 +205,7 @@ class IrisOutput(BaseOutput):
             raise ValueError(f"Incompatible shapes {velocity_shape} != {spectrum_shape}")
 
 
-    def write(self, filename):
+    def write(self, filename, scan_dt):
         """
         Appends. File is created in super class.
 
@@ -190,7 +217,7 @@ class IrisOutput(BaseOutput):
 
         self.validate()
 
-        super().write(filename)
+        super().write(filename, scan_dt)
 
         dset = nc.Dataset(filename, mode="a")
 
@@ -206,9 +233,9 @@ class IrisOutput(BaseOutput):
         nc_spectrum = dset.createVariable("spectrum_width", np.float32, dop_dims)
 
         nc_dop_elevs[:] = dop_elevs[:]
-        nc_power[:,:,:] = self.total_power[:,:,:]
-        nc_velocity[:,:,:] = self.velocity[:,:,:]
-        nc_spectrum[:,:,:] = self.spectrum_width[:,:,:]
+        nc_power[:,:,:] = to_masked(self.total_power[:,:,:])
+        nc_velocity[:,:,:] = to_masked(self.velocity[:,:,:])
+        nc_spectrum[:,:,:] = to_masked(self.spectrum_width[:,:,:])
 
         dset.close()
 
@@ -251,7 +278,7 @@ class NexradOutput(BaseOutput):
         pass
 
 
-    def write(self, filename):
+    def write(self, filename, scan_dt):
         """
         Appends. File is created in super class.
 
@@ -263,7 +290,7 @@ class NexradOutput(BaseOutput):
 
         self.validate()
 
-        super().write(filename)
+        super().write(filename, scan_dt)
 
         dset = nc.Dataset(filename, mode="a")
 
@@ -311,7 +338,7 @@ class OdimOutput(BaseOutput):
         super().validate()
 
 
-    def write(self, filename):
+    def write(self, filename, scan_dt):
         """
         Appends. File is created in super class.
 
@@ -323,7 +350,7 @@ class OdimOutput(BaseOutput):
 
         self.validate()
 
-        super().write(filename)
+        super().write(filename, scan_dt)
 
         dset = nc.Dataset(filename, mode="a")
 
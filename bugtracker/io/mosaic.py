@@ -0,0 +1,480 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Multi-radar mosaic of the joint product and target_id, on a shared
+regular lat/lon grid (mosaic section of the config).
+
+For each station, the pixels of the grid within max_range of the
+radar are mapped to their nearest polar gate. This sparse operator
+(pixel index, gate index, distance to the radar) only depends on the
+site, the polar grid and the mosaic grid, so it is saved in
+cache_dir/mosaic and only built once. A mosaic is then one gather per
+station, and a merge:
+
+max      - highest dBZ of the radars covering the pixel
+nearest  - dBZ of the nearest radar with a valid gate
+distance - mean of the linear Z of the radars, weighted by
+           1 / distance^2
+
+target_id is categorical, it always comes from the nearest radar
+covering the pixel, as does the radar_index field.
+"""
+
+import os
+import math
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+import pyart
+
+import bugtracker.core.cache
+import bugtracker.core.geometry
+import bugtracker.core.metadata
+import bugtracker.core.metrics
+import bugtracker.io.lookup
+import bugtracker.io.models
+
+
+RULES = ['max', 'nearest', 'distance']
+
+# Fill value for target_id and radar_index pixels outside of coverage
+MOSAIC_FILL = -1
+
+# Station operators already loaded in this process, by cache key
+_operators = dict()
+
+
+class MosaicGrid:
+    """
+    Regular lat/lon grid, resolution in degrees. Rows go from south to
+    north, columns from west to east.
+    """
+
+    def __init__(self, lat_min, lat_max, lon_min, lon_max, resolution):
+
+        if lat_max <= lat_min or lon_max <= lon_min:
+            raise ValueError(f"Invalid mosaic bounds: {lat_min}, {lat_max}, {lon_min}, {lon_max}")
+
+        if resolution <= 0.0:
+            raise ValueError(f"Invalid mosaic resolution: {resolution}")
+
+        self.lat_min = float(lat_min)
+        self.lat_max = float(lat_max)
+        self.lon_min = float(lon_min)
+        self.lon_max = float(lon_max)
+        self.resolution = float(resolution)
+
+        self.num_lats = int(math.floor((self.lat_max - self.lat_min) / self.resolution + 1e-9)) + 1
+        self.num_lons = int(math.floor((self.lon_max - self.lon_min) / self.resolution + 1e-9)) + 1
+        self.shape = (self.num_lats, self.num_lons)
+
+
+    def __str__(self):
+        rep = "MosaicGrid:\n"
+
+        rep += f"lats: {self.lat_min} to {self.lat_max}\n"
+        rep += f"lons: {self.lon_min} to {self.lon_max}\n"
+        rep += f"resolution: {self.resolution} deg\n"
+        rep += f"size: {self.num_lats} x {self.num_lons}\n"
+
+        return rep
+
+
+    def key(self):
+        return f"{self.lat_min:.4f}_{self.lat_max:.4f}_{self.lon_min:.4f}_{self.lon_max:.4f}_{self.resolution:.5f}"
+
+
+    def coords(self):
+        """
+        1D latitudes and longitudes of the pixel centers
+        """
+
+        lats = self.lat_min + np.arange(self.num_lats, dtype=np.float64) * self.resolution
+        lons = self.lon_min + np.arange(self.num_lons, dtype=np.float64) * self.resolution
+
+        return lats, lons
+
+
+class MosaicSettings:
+
+    def __init__(self, grid, stations, rule='max', max_range=150.0, max_offset=10.0):
+
+        if rule not in RULES:
+            raise ValueError(f"Invalid mosaic rule: {rule}, must be one of {RULES}")
+
+        if max_range <= 0.0 or max_offset < 0.0:
+            raise ValueError(f"Invalid mosaic max_range/max_offset: {max_range}, {max_offset}")
+
+        self.grid = grid
+        self.stations = [station.lower().strip() for station in stations]
+        self.rule = rule
+        # km from the radar, and minutes from the target time
+        self.max_range = float(max_range)
+        self.max_offset = float(max_offset)
+
+
+def from_config(config, stations=None, rule=None):
+    """
+    MosaicSettings of the 'mosaic' config section, the stations and
+    rule can be overridden (e.g. from the command line).
+    """
+
+    settings = config['mosaic']
+
+    grid = MosaicGrid(settings['lat_min'], settings['lat_max'], settings['lon_min'],
+                      settings['lon_max'], settings['resolution'])
+
+    if stations is None:
+        stations = settings['stations']
+
+    if rule is None:
+        rule = settings['rule']
+
+    if len(stations) == 0:
+        raise ValueError("No mosaic stations")
+
+    return MosaicSettings(grid, stations, rule, settings['max_range'], settings['max_offset'])
+
+
+def get_operator_key(metadata, grid_info, grid, max_range):
+
+    radar_id = metadata.radar_id.lower()
+    site = f"{metadata.lat:.5f}_{metadata.lon:.5f}"
+    polar = f"{grid_info.azims}_{grid_info.gates}_{grid_info.azim_step}_{grid_info.gate_step}"
+    polar += f"_{grid_info.azim_offset}_{grid_info.gate_offset}"
+
+    return f"{radar_id}_{site}_{polar}_{grid.key()}_{max_range}.npz"
+
+
+def operator_filepath(config, metadata, grid_info, grid, max_range):
+
+    cache_folder = os.path.join(config['cache_dir'], 'mosaic')
+    return os.path.join(cache_folder, get_operator_key(metadata, grid_info, grid, max_range))
+
+
+class StationOperator:
+    """
+    Nearest gate operator of one station, in sparse (COO) form: the
+    covered grid pixels (flat indices), their polar gate (flat index
+    into (azims, gates)) and their distance to the radar (km).
+    """
+
+    def __init__(self, pixels, gates, distance):
+
+        self.pixels = pixels
+        self.gates = gates
+        self.distance = distance
+        self.weights = 1.0 / np.maximum(distance, 0.1) ** 2
+
+
+    def __len__(self):
+        return len(self.pixels)
+
+
+    def save(self, filepath):
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        np.savez(filepath, pixels=self.pixels, gates=self.gates, distance=self.distance)
+
+
+def build_operator(metadata, grid_info, grid, max_range):
+
+    lats, lons = grid.coords()
+
+    # Only the grid rows/columns that can be within max_range
+    lat_margin = max_range / 111.0
+    lon_margin = max_range / (111.0 * max(math.cos(math.radians(metadata.lat)), 0.1))
+
+    rows = np.nonzero(np.abs(lats - metadata.lat) <= lat_margin)[0]
+    cols = np.nonzero(np.abs(lons - metadata.lon) <= lon_margin)[0]
+
+    if len(rows) == 0 or len(cols) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return StationOperator(empty, empty.copy(), np.zeros(0, dtype=np.float32))
+
+    lon_arr, lat_arr = np.meshgrid(lons[cols], lats[rows])
+    x_arr, y_arr = pyart.core.geographic_to_cartesian_aeqd(lon_arr.ravel(), lat_arr.ravel(), metadata.lon, metadata.lat)
+
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    azim_pos, gate_pos, ranges = geometry.polar_position(x_arr, y_arr)
+
+    azim_idx = np.rint(azim_pos).astype(np.int64) % grid_info.azims
+    gate_idx = np.rint(gate_pos).astype(np.int64)
+
+    valid = (gate_idx >= 0) & (gate_idx < grid_info.gates) & (ranges <= max_range * 1000.0)
+
+    row_idx, col_idx = np.meshgrid(rows, cols, indexing='ij')
+    pixels = (row_idx.ravel() * grid.num_lons + col_idx.ravel())[valid]
+    gates = azim_idx[valid] * grid_info.gates + gate_idx[valid]
+    distance = (ranges[valid] / 1000.0).astype(np.float32)
+
+    return StationOperator(pixels.astype(np.int64), gates.astype(np.int64), distance)
+
+
+def get_operator(config, metadata, grid_info, grid, max_range):
+    """
+    StationOperator from this process, or from the disk cache, built
+    (and saved) on the first call.
+    """
+
+    key = get_operator_key(metadata, grid_info, grid, max_range)
+
+    if key in _operators:
+        bugtracker.core.metrics.count_cache(True)
+        return _operators[key]
+
+    filepath = operator_filepath(config, metadata, grid_info, grid, max_range)
+    bugtracker.core.metrics.count_cache(os.path.isfile(filepath))
+
+    if os.path.isfile(filepath):
+        cached = np.load(filepath)
+        operator = StationOperator(cached['pixels'], cached['gates'], cached['distance'])
+    else:
+        print(f"Building mosaic operator: {filepath}")
+        operator = build_operator(metadata, grid_info, grid, max_range)
+        operator.save(filepath)
+
+    _operators[key] = operator
+
+    return operator
+
+
+class StationScan:
+    """
+    The fields of one station output file that go in the mosaic
+    """
+
+    def __init__(self, radar_id, scan_dt, metadata, grid_info, joint, target_id, output_file):
+
+        self.radar_id = radar_id
+        self.scan_dt = scan_dt
+        self.metadata = metadata
+        self.grid_info = grid_info
+        self.joint = joint
+        self.target_id = target_id
+        self.output_file = output_file
+
+
+def read_station(config, station, target_dt, max_offset):
+    """
+    StationScan of the output file nearest target_dt (within max_offset
+    minutes), None if there is none.
+    """
+
+    offset = datetime.timedelta(minutes=max_offset)
+    output_files = bugtracker.io.lookup.find_output_files(config, station, target_dt - offset, target_dt + offset)
+
+    if len(output_files) == 0:
+        return None
+
+    def time_offset(output_file):
+        scan_dt = bugtracker.io.models.output_datetime(output_file)
+        return abs((scan_dt - target_dt).total_seconds())
+
+    output_file = min(output_files, key=time_offset)
+    scan_dt = bugtracker.io.models.output_datetime(output_file)
+
+    # The gate offsets are part of the operator key
+    calib_file = bugtracker.io.lookup.find_calib_file(config, station)
+    radar_id, grid_info = bugtracker.core.cache.calib_grid(calib_file)
+
+    dset = nc.Dataset(output_file, mode='r')
+    metadata = bugtracker.core.metadata.Metadata(radar_id, scan_dt, float(dset.getncattr('latitude')),
+                                                 float(dset.getncattr('longitude')), radar_id)
+
+    joint = np.ma.filled(dset.variables['dbz_joint'][:,:].astype(np.float32), np.nan)
+
+    # The lowest level is the most representative of the surface layer
+    if 'target_id' in dset.variables:
+        target_id = np.asarray(dset.variables['target_id'][0,:,:]).astype(np.int8)
+    else:
+        target_id = None
+
+    dset.close()
+
+    return StationScan(radar_id, scan_dt, metadata, grid_info, joint, target_id, output_file)
+
+
+class Mosaic:
+    """
+    The merged fields, on the MosaicGrid
+    """
+
+    def __init__(self, settings, target_dt, scans):
+
+        self.settings = settings
+        self.grid = settings.grid
+        self.target_dt = target_dt
+        self.scans = scans
+
+        self.joint = np.full(self.grid.shape, np.nan, dtype=np.float32)
+        self.target_id = np.full(self.grid.shape, MOSAIC_FILL, dtype=np.int8)
+        self.radar_index = np.full(self.grid.shape, MOSAIC_FILL, dtype=np.int8)
+
+
+    def write(self, filename):
+
+        lats, lons = self.grid.coords()
+
+        dset = nc.Dataset(filename, mode="w")
+
+        dset.datetime = self.target_dt.strftime("%Y%m%d%H%M")
+        dset.rule = self.settings.rule
+        dset.stations = " ".join(scan.radar_id for scan in self.scans)
+        dset.scan_datetimes = " ".join(scan.scan_dt.strftime("%Y%m%d%H%M") for scan in self.scans)
+
+        dset.createDimension("lat", self.grid.num_lats)
+        dset.createDimension("lon", self.grid.num_lons)
+
+        nc_lat = dset.createVariable("lat", np.float32, ('lat',))
+        nc_lat.standard_name = "latitude"
+        nc_lat.units = "degrees_north"
+        nc_lat[:] = lats
+
+        nc_lon = dset.createVariable("lon", np.float32, ('lon',))
+        nc_lon.standard_name = "longitude"
+        nc_lon.units = "degrees_east"
+        nc_lon[:] = lons
+
+        nc_joint = dset.createVariable("dbz_joint", np.float32, ('lat','lon'), fill_value=np.nan)
+        nc_joint.units = "dBZ"
+        nc_joint[:,:] = self.joint
+
+        nc_target = dset.createVariable("target_id", np.int8, ('lat','lon'), fill_value=MOSAIC_FILL)
+        nc_target.flag_meanings = "none clutter rain bugs"
+        nc_target[:,:] = self.target_id
+
+        nc_radar = dset.createVariable("radar_index", np.int8, ('lat','lon'), fill_value=MOSAIC_FILL)
+        nc_radar.comment = "Index of the nearest radar, in the stations attribute"
+        nc_radar[:,:] = self.radar_index
+
+        dset.close()
+
+
+def merge(settings, target_dt, scans, operators):
+    """
+    Mosaic of the StationScans, with their StationOperators
+    """
+
+    mosaic = Mosaic(settings, target_dt, scans)
+    num_pixels = mosaic.grid.num_lats * mosaic.grid.num_lons
+
+    joint = mosaic.joint.reshape(-1)
+    target_id = mosaic.target_id.reshape(-1)
+    radar_index = mosaic.radar_index.reshape(-1)
+
+    nearest = np.full(num_pixels, np.inf, dtype=np.float32)
+    nearest_valid = np.full(num_pixels, np.inf, dtype=np.float32)
+
+    if settings.rule == 'distance':
+        weighted = np.zeros(num_pixels, dtype=np.float64)
+        weight_sum = np.zeros(num_pixels, dtype=np.float64)
+
+    for index, (scan, operator) in enumerate(zip(scans, operators)):
+        pixels = operator.pixels
+        values = scan.joint.reshape(-1)[operator.gates]
+        valid = np.isfinite(values)
+
+        # Nearest covering radar, for target_id and radar_index
+        closer = operator.distance < nearest[pixels]
+        closer_pixels = pixels[closer]
+        nearest[closer_pixels] = operator.distance[closer]
+        radar_index[closer_pixels] = index
+
+        if scan.target_id is not None:
+            target_id[closer_pixels] = scan.target_id.reshape(-1)[operator.gates[closer]]
+        else:
+            target_id[closer_pixels] = MOSAIC_FILL
+
+        if settings.rule == 'max':
+            joint[pixels] = np.fmax(joint[pixels], values)
+
+        elif settings.rule == 'nearest':
+            closer = valid & (operator.distance < nearest_valid[pixels])
+            nearest_valid[pixels[closer]] = operator.distance[closer]
+            joint[pixels[closer]] = values[closer]
+
+        else:
+            weights = operator.weights[valid]
+            weighted[pixels[valid]] += weights * 10.0 ** (values[valid] / 10.0)
+            weight_sum[pixels[valid]] += weights
+
+    if settings.rule == 'distance':
+        covered = weight_sum > 0.0
+        joint[covered] = (10.0 * np.log10(weighted[covered] / weight_sum[covered])).astype(np.float32)
+
+    return mosaic
+
+
+def mosaic_filename(config, target_dt):
+    """
+    netcdf_dir/mosaic/YYYY/mm/dd/mosaic_YYYYmmddHHMM.nc
+    """
+
+    folder = os.path.join(config['netcdf_dir'], 'mosaic', target_dt.strftime(os.path.join("%Y", "%m", "%d")))
+    return os.path.join(folder, target_dt.strftime("mosaic_%Y%m%d%H%M.nc"))
+
+
+class MosaicBuilder:
+
+    def __init__(self, config, settings):
+
+        self.config = config
+        self.settings = settings
+
+
+    def build(self, target_dt):
+        """
+        Mosaic of the station outputs nearest target_dt. Stations
+        without an output within max_offset are left out.
+        """
+
+        scans = []
+        operators = []
+
+        for station in self.settings.stations:
+            scan = read_station(self.config, station, target_dt, self.settings.max_offset)
+
+            if scan is None:
+                print(f"No output for {station} within {self.settings.max_offset} min of {target_dt}")
+                continue
+
+            operator = get_operator(self.config, scan.metadata, scan.grid_info, self.settings.grid,
+                                    self.settings.max_range)
+            scans.append(scan)
+            operators.append(operator)
+
+        if len(scans) == 0:
+            raise FileNotFoundError(f"No station output within {self.settings.max_offset} min of {target_dt}")
+
+        return merge(self.settings, target_dt, scans, operators)
+
+
+    def build_and_write(self, target_dt):
+
+        mosaic = self.build(target_dt)
+
+        filename = mosaic_filename(self.config, target_dt)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        mosaic.write(filename)
+
+        print(f"Mosaic of {len(mosaic.scans)} radars: {filename}")
+
+        return filename
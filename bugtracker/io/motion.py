@@ -0,0 +1,450 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Echo motion between consecutive scans, by FFT phase correlation.
+
+Both scans are resampled on the same Cartesian raster (cartesian.py,
+with the resolution and max_range of the motion config section), and
+cut into square tiles of tile_size pixels. The displacement of each
+tile is the peak of the inverse FFT of the normalized cross-power
+spectrum, refined to a fraction of a pixel with a parabolic fit.
+All the tiles are transformed at once as a (tiles, size, size) stack.
+
+field: "joint" tracks the joint product, "bugs" the lowest level of
+       dbz_unfiltered, where target_id is bugs
+quality: height of the correlation peak, from 0 (no match) to 1
+         (pure translation). Tiles with less than min_coverage of
+         echo get a quality of 0, and u/v are NaN below min_quality.
+
+The motion fields (u eastward, v northward, in m/s) are appended to
+the output file of the later scan. tracker.py is usually run once per
+scan, so its MotionTracker starts from the latest earlier output of the
+station (within max_gap).
+"""
+
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+
+import bugtracker.core.metadata
+import bugtracker.core.target_id
+import bugtracker.io.cartesian
+import bugtracker.io.lookup
+import bugtracker.io.models
+
+
+FIELDS = ['joint', 'bugs']
+
+# Echo below this reflectivity is treated as no echo
+MIN_DBZ = -15.0
+
+
+class MotionSettings:
+
+    def __init__(self, field='joint', resolution=1000.0, max_range=150.0, tile_size=32,
+                 min_coverage=0.1, min_quality=0.1, max_gap=20.0):
+
+        if field not in FIELDS:
+            raise ValueError(f"Invalid motion field: {field}, must be one of {FIELDS}")
+
+        if tile_size < 8 or tile_size % 2 != 0:
+            raise ValueError(f"Invalid tile_size: {tile_size}, must be even and at least 8")
+
+        if max_gap <= 0.0:
+            raise ValueError(f"Invalid max_gap: {max_gap}")
+
+        self.field = field
+        self.tile_size = int(tile_size)
+        self.min_coverage = float(min_coverage)
+        self.min_quality = float(min_quality)
+        # Minutes between scans, beyond which no motion is computed
+        self.max_gap = float(max_gap)
+
+        self.spec = bugtracker.io.cartesian.CartesianSpec(resolution, max_range, 'nearest')
+
+
+def from_config(config):
+    """
+    Returns the MotionSettings of the 'motion' config section, or
+    None if motion tracking is disabled.
+    """
+
+    settings = config.get('motion', dict())
+
+    if not settings.get('enabled', False):
+        return None
+
+    keys = ['field', 'resolution', 'max_range', 'tile_size', 'min_coverage', 'min_quality', 'max_gap']
+    return MotionSettings(**{key: settings[key] for key in keys if key in settings})
+
+
+def polar_field(field, joint_product, dbz_unfiltered, id_matrix):
+    """
+    The 2D polar field that is tracked
+    """
+
+    if field == 'joint':
+        return joint_product
+
+    bugs = np.asarray(id_matrix[0]) == bugtracker.core.target_id.get_code('bugs')
+    lowest = np.ma.filled(np.ma.asarray(dbz_unfiltered[0], dtype=np.float32), np.nan)
+
+    return np.where(bugs, lowest, np.nan)
+
+
+def split_tiles(raster, tile_size):
+    """
+    (tiles_y, tiles_x, tile_size, tile_size) view of a 2D raster,
+    zero-padded up to a whole number of tiles.
+    """
+
+    tiles_y = -(-raster.shape[0] // tile_size)
+    tiles_x = -(-raster.shape[1] // tile_size)
+
+    padded = np.zeros((tiles_y * tile_size, tiles_x * tile_size), dtype=np.float32)
+    padded[0:raster.shape[0], 0:raster.shape[1]] = raster
+
+    tiles = padded.reshape(tiles_y, tile_size, tiles_x, tile_size).swapaxes(1, 2)
+    return tiles
+
+
+def echo_tiles(raster, tile_size):
+    """
+    Tiles of echo intensity (dBZ above MIN_DBZ, 0 without echo), and
+    the fraction of each tile covered by echo.
+    """
+
+    intensity = np.nan_to_num(raster - MIN_DBZ, nan=0.0)
+    np.maximum(intensity, 0.0, out=intensity)
+
+    tiles = split_tiles(intensity, tile_size)
+    coverage = np.count_nonzero(tiles, axis=(2, 3)) / float(tile_size * tile_size)
+
+    return tiles, coverage
+
+
+def peak_offset(corr, index, axis):
+    """
+    Sub-pixel offset of the correlation peak along one axis, from a
+    parabola through the peak and its two (circular) neighbours.
+    """
+
+    size = corr.shape[axis]
+    rows = np.arange(corr.shape[0])
+
+    if axis == 1:
+        before = corr[rows, (index[0] - 1) % size, index[1]]
+        after = corr[rows, (index[0] + 1) % size, index[1]]
+    else:
+        before = corr[rows, index[0], (index[1] - 1) % size]
+        after = corr[rows, index[0], (index[1] + 1) % size]
+
+    peak = corr[rows, index[0], index[1]]
+    denom = before - 2.0 * peak + after
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(denom < 0.0, 0.5 * (before - after) / denom, 0.0)
+
+    return np.clip(offset, -0.5, 0.5)
+
+
+def phase_correlation(previous, current):
+    """
+    Displacement of each current tile relative to the previous one.
+    Inputs are (tiles, size, size) stacks, returns (dy, dx) in pixels
+    and the peak height.
+    """
+
+    size = previous.shape[-1]
+    window = np.outer(np.hanning(size), np.hanning(size)).astype(np.float32)
+
+    # Removing the tile mean keeps the DC term out of the peak
+    previous = (previous - previous.mean(axis=(1, 2), keepdims=True)) * window
+    current = (current - current.mean(axis=(1, 2), keepdims=True)) * window
+
+    cross = np.fft.rfft2(current) * np.conj(np.fft.rfft2(previous))
+    magnitude = np.abs(cross)
+    np.divide(cross, magnitude, out=cross, where=magnitude > 1e-12)
+    cross[magnitude <= 1e-12] = 0.0
+
+    corr = np.fft.irfft2(cross, s=(size, size))
+
+    flat_index = np.argmax(corr.reshape(len(corr), -1), axis=1)
+    index = np.unravel_index(flat_index, (size, size))
+    peak = corr.reshape(len(corr), -1)[np.arange(len(corr)), flat_index]
+
+    # Circular shifts past half the tile are negative
+    dy = np.where(index[0] > size // 2, index[0] - size, index[0]) + peak_offset(corr, index, 1)
+    dx = np.where(index[1] > size // 2, index[1] - size, index[1]) + peak_offset(corr, index, 2)
+
+    return dy, dx, np.clip(peak, 0.0, 1.0)
+
+
+class MotionField:
+    """
+    u/v (m/s) and quality on the tile grid. x/y are the tile centers
+    in meters from the radar.
+    """
+
+    def __init__(self, u, v, quality, x, y, interval, previous_dt):
+
+        self.u = u
+        self.v = v
+        self.quality = quality
+        self.x = x
+        self.y = y
+        self.interval = interval
+        self.previous_dt = previous_dt
+
+
+    def __str__(self):
+        valid = np.isfinite(self.u)
+
+        rep = "MotionField:\n"
+        rep += f"tiles: {self.u.shape[0]} x {self.u.shape[1]} ({np.count_nonzero(valid)} valid)\n"
+        rep += f"interval: {self.interval:.0f} s\n"
+
+        if np.any(valid):
+            speed = np.hypot(self.u[valid], self.v[valid])
+            rep += f"median speed: {np.median(speed):.2f} m/s\n"
+
+        return rep
+
+
+    def write(self, filename):
+        """
+        Appends the motion fields to an output file, replacing them if
+        the file already has some (e.g. batch reprocessing).
+        """
+
+        dset = nc.Dataset(filename, mode="a")
+
+        if "motion_y" not in dset.dimensions:
+            dset.createDimension("motion_y", len(self.y))
+            dset.createDimension("motion_x", len(self.x))
+
+            nc_y = dset.createVariable("motion_y", np.float32, ('motion_y',))
+            nc_y.units = "m"
+            nc_x = dset.createVariable("motion_x", np.float32, ('motion_x',))
+            nc_x.units = "m"
+
+            for name, units in [("motion_u", "m s-1"), ("motion_v", "m s-1"), ("motion_quality", "1")]:
+                variable = dset.createVariable(name, np.float32, ('motion_y','motion_x'), fill_value=np.nan)
+                variable.units = units
+
+        elif (len(dset.dimensions["motion_y"]), len(dset.dimensions["motion_x"])) != self.u.shape:
+            dset.close()
+            raise ValueError(f"Motion tiles {self.u.shape} differ from the ones in {filename}")
+
+        dset.variables["motion_y"][:] = self.y
+        dset.variables["motion_x"][:] = self.x
+        dset.variables["motion_u"][:,:] = self.u
+        dset.variables["motion_v"][:,:] = self.v
+        dset.variables["motion_quality"][:,:] = self.quality
+
+        dset.motion_previous = self.previous_dt.strftime("%Y%m%d%H%M")
+        dset.motion_interval = float(self.interval)
+
+        dset.close()
+
+
+def estimate_motion(previous, current, settings, interval, previous_dt=None, covered=None):
+    """
+    MotionField between two Cartesian rasters (dBZ, NaN without echo)
+    taken 'interval' seconds apart. Tiles that are not entirely within
+    'covered' (the pixels in radar range) are rejected, as the edge of
+    the coverage does not move and would pull the shift to zero.
+    """
+
+    if previous.shape != current.shape:
+        raise ValueError(f"Incompatible rasters: {previous.shape} != {current.shape}")
+
+    if interval <= 0.0:
+        raise ValueError(f"Invalid motion interval: {interval}")
+
+    tile_size = settings.tile_size
+
+    previous_tiles, previous_coverage = echo_tiles(previous, tile_size)
+    current_tiles, current_coverage = echo_tiles(current, tile_size)
+    tiles_shape = previous_coverage.shape
+
+    stack_shape = (-1, tile_size, tile_size)
+    dy, dx, quality = phase_correlation(previous_tiles.reshape(stack_shape), current_tiles.reshape(stack_shape))
+
+    quality = quality.reshape(tiles_shape).astype(np.float32)
+    quality[np.minimum(previous_coverage, current_coverage) < settings.min_coverage] = 0.0
+
+    if covered is not None:
+        in_range = split_tiles(covered.astype(np.float32), tile_size).min(axis=(2, 3))
+        quality[in_range < 1.0] = 0.0
+
+    resolution = settings.spec.resolution
+    u = (dx.reshape(tiles_shape) * resolution / interval).astype(np.float32)
+    v = (dy.reshape(tiles_shape) * resolution / interval).astype(np.float32)
+
+    rejected = quality < settings.min_quality
+    u[rejected] = np.nan
+    v[rejected] = np.nan
+
+    # Tile centers, in the raster coordinates (rows are northward)
+    axis, _ = settings.spec.coords()
+    centers = axis[0] + (np.arange(max(tiles_shape)) * tile_size + (tile_size - 1) / 2.0) * resolution
+    y = centers[0:tiles_shape[0]].astype(np.float32)
+    x = centers[0:tiles_shape[1]].astype(np.float32)
+
+    return MotionField(u, v, quality, x, y, interval, previous_dt)
+
+
+class MotionTracker:
+    """
+    Keeps the raster of the last scan, and computes the motion of each
+    new scan relative to it. With seed_outputs, the first scan is
+    tracked relative to the latest earlier output file of the station.
+    """
+
+    def __init__(self, config, metadata, grid_info, settings, seed_outputs=False):
+
+        self.config = config
+        self.radar_id = metadata.radar_id
+        self.settings = settings
+        self.seed_outputs = seed_outputs
+        self.resampler = bugtracker.io.cartesian.get_resampler(config, metadata, grid_info, settings.spec)
+
+        self.previous = None
+        self.previous_dt = None
+
+
+    def reset(self):
+
+        self.previous = None
+        self.previous_dt = None
+
+
+    def update(self, scan_dt, field, nc_filename=None):
+        """
+        Tracks the 2D polar field of a scan. Returns the MotionField
+        (also appended to nc_filename if given), or None for the first
+        scan and after a gap longer than max_gap.
+        """
+
+        raster = self.resampler.resample(field)
+        motion = None
+
+        if self.previous is None and self.seed_outputs:
+            self.seed(scan_dt)
+
+        if self.previous is not None:
+            interval = (scan_dt - self.previous_dt).total_seconds()
+
+            if 0.0 < interval <= self.settings.max_gap * 60.0:
+                motion = estimate_motion(self.previous, raster, self.settings, interval, self.previous_dt,
+                                         self.resampler.covered)
+            else:
+                print(f"No motion for {scan_dt}: {interval:.0f} s since the previous scan")
+
+        self.previous = raster
+        self.previous_dt = scan_dt
+
+        if motion is not None and nc_filename is not None:
+            motion.write(nc_filename)
+
+        return motion
+
+
+    def seed(self, scan_dt):
+        """
+        Previous raster from the latest output file of the station
+        before scan_dt, within max_gap. Returns False if there is none.
+        """
+
+        start = scan_dt - datetime.timedelta(minutes=self.settings.max_gap)
+        output_files = bugtracker.io.lookup.find_output_files(self.config, self.radar_id, start, scan_dt)
+
+        # The output of this scan may already be written
+        scan_minute = scan_dt.replace(second=0, microsecond=0)
+        output_files = [output_file for output_file in output_files
+                        if bugtracker.io.models.output_datetime(output_file) < scan_minute]
+
+        if len(output_files) == 0:
+            return False
+
+        try:
+            previous_dt, data = read_output_field(output_files[-1], self.settings.field)
+        except (OSError, KeyError) as error:
+            print(f"Could not read the previous output {output_files[-1]}: {error}")
+            return False
+
+        self.previous = self.resampler.resample(data)
+        self.previous_dt = previous_dt
+
+        return True
+
+
+def read_output_field(output_file, field):
+    """
+    Scan datetime and tracked polar field of an output file
+    """
+
+    dset = nc.Dataset(output_file, mode='r')
+    scan_dt = bugtracker.io.models.output_datetime(output_file, dset)
+
+    if field == 'joint':
+        data = polar_field(field, dset.variables['dbz_joint'][:,:], None, None)
+    else:
+        data = polar_field(field, None, dset.variables['dbz_unfiltered'][0:1,:,:],
+                           dset.variables['target_id'][0:1,:,:])
+
+    dset.close()
+
+    return scan_dt, data
+
+
+def output_metadata(output_file, radar_id):
+    """
+    Metadata of the radar site of an output file, which has the same
+    lat/lon (and so the same Cartesian raster) as in tracker.py
+    """
+
+    dset = nc.Dataset(output_file, mode='r')
+    scan_dt = bugtracker.io.models.output_datetime(output_file, dset)
+    metadata = bugtracker.core.metadata.Metadata(radar_id, scan_dt, float(dset.getncattr('latitude')),
+                                                 float(dset.getncattr('longitude')), radar_id)
+    dset.close()
+
+    return metadata
+
+
+def track_outputs(tracker, output_files):
+    """
+    Batch mode: computes the motion between consecutive output files
+    (sorted by time), and appends it to the later ones. Returns the
+    number of motion fields written.
+    """
+
+    count = 0
+    tracker.reset()
+
+    for output_file in output_files:
+        scan_dt, data = read_output_field(output_file, tracker.settings.field)
+
+        if tracker.update(scan_dt, data, output_file) is not None:
+            count += 1
+
+    return count
@@ -20,14 +20,71 @@ import os
 import glob
 import datetime
 import math
-import time
 
 import numpy as np
-import pyart
-from scipy import interpolate
 
 import bugtracker.core.utils
-from bugtracker.io.scan import ScanData
+import bugtracker.core.metrics
+import bugtracker.io.input_index
+from bugtracker.io.scan import ScanData, apply_cutoff
+
+
+# Level II moments that are used by NexradData. Anything else in the
+# volume (differential_phase, clutter_filter_power_removed, ...) is
+# skipped by the reader, and is never converted to a float array.
+NEXRAD_FIELDS = ['reflectivity', 'velocity', 'spectrum_width',
+                 'cross_correlation_ratio', 'differential_reflectivity']
+
+# Sweeps of the volume that are used: the lower levels are scanned
+# twice (split cuts), and by convention the first 6 upper levels.
+NUM_LOWER = 6
+NUM_UPPER = 6
+
+
+def lower_scans(get_odd_scans=False):
+    """
+    Sweep indices of the lower levels, one of each pair
+    """
+
+    scans = []
+
+    for x in range(0, NUM_LOWER):
+        if get_odd_scans:
+            if x % 2 != 0:
+                scans.append(x)
+        else:
+            if x % 2 == 0:
+                scans.append(x)
+
+    return scans
+
+
+def scan_indices(get_odd_scans=False):
+    """
+    Sweep indices (in the full volume) of every level we keep. It only
+    depends on the sweep settings, not on the file.
+    """
+
+    upper_scans = [NUM_LOWER + y for y in range(0, NUM_UPPER)]
+
+    return lower_scans(get_odd_scans) + upper_scans
+
+
+def read_nexrad(nexrad_file, fields=None, scans=None):
+    """
+    Selective Level II read. Only the requested moments and sweeps
+    (indices into the full volume) are decoded by pyart.
+    Passing None reads everything, which is equivalent to pyart.io.read()
+    """
+
+    # Imported here, so that the downloader can use this module without
+    # loading pyart (and with it matplotlib and cartopy)
+    import pyart
+
+    if not os.path.isfile(nexrad_file):
+        raise FileNotFoundError(nexrad_file)
+
+    return pyart.io.read_nexrad_archive(nexrad_file, include_fields=fields, scans=scans)
 
 
 def datetime_from_file(filepath, radar_id):
@@ -56,6 +113,7 @@ class NexradManager:
         self.config = config
         self.radar_id = radar_id.lower()
         self.nexrad_dir = self.config['input_dirs']['nexrad']
+        self.index = bugtracker.io.input_index.InputIndex(config, "nexrad", self.radar_id, self.parse_file)
 
         # Initialize radar parameters to None
         self.metadata = None
@@ -85,34 +143,29 @@ class NexradManager:
         return file_dt
 
 
-    def get_closest(self, target_dt):
+    def parse_file(self, filepath):
         """
-        Get the closest radar scan to the specified date,
-        and return an error if the closest is more than 30mins away
-        or if no input files are found.
+        Parser for the InputIndex, only V06 volumes are valid.
         """
 
-        start = target_dt + datetime.timedelta(hours=-1)
-        end = target_dt + datetime.timedelta(hours=1)
+        if "V06" not in os.path.basename(filepath):
+            raise ValueError(f"Not a NEXRAD volume: {filepath}")
 
-        files_in_range = self.get_range(start, end)
+        return self.datetime_from_file(filepath), "V06"
 
-        if len(files_in_range) == 0:
-            raise FileNotFoundError("No files found within +/- 1 hour range of target datetime")
 
-        min_diff = 999999999
-        min_idx = -1
+    def get_closest(self, target_dt):
+        """
+        Get the closest radar scan to the specified date,
+        and return an error if the closest is more than 1 hour away
+        or if no input files are found.
+        """
 
-        for x in range(0, len(files_in_range)):
-            current_file = files_in_range[x]
-            file_dt = self.datetime_from_file(current_file)
-            diff = file_dt - target_dt
-            total_seconds = abs(diff.total_seconds())
-            if total_seconds < min_diff:
-                min_diff = total_seconds
-                min_idx = x
+        max_diff = datetime.timedelta(hours=1)
+        closest = self.index.get_closest(target_dt, max_diff)
 
-        closest = files_in_range[min_idx]
+        if closest is None:
+            raise FileNotFoundError("No files found within +/- 1 hour range of target datetime")
 
         if not os.path.isfile(closest):
             raise FileNotFoundError(closest)
@@ -126,30 +179,7 @@ class NexradManager:
         date range.
         """
 
-        # First, get all files
-        all_files = bugtracker.core.utils.get_input_files(self.config, "nexrad", self.radar_id, start, end)
-        all_files.sort()
-
-        # Next, filter the files according to NEXRAD specs
-
-        filtered_files = []
-
-        for filename in all_files:
-            if "V06" in filename:
-                filtered_files.append(filename)
-
-        range_list = []
-
-        for input_file in filtered_files:
-            current_dt = self.datetime_from_file(input_file)
-            if start <= current_dt and current_dt <= end:
-                range_list.append(input_file)
-
-        for file in range_list:
-            if not os.path.isfile(file):
-                raise FileNotFoundError(f"File does not exist: {file}")
-
-        return range_list
+        return self.index.get_range(start, end)
 
 
     def extract_metadata(self, nexrad_file):
@@ -157,7 +187,9 @@ class NexradManager:
         This method extracts metadata from any nexrad_file
         """
 
-        nexrad_handle = pyart.io.read(nexrad_file)
+        # Only the station header is needed, so decoding one sweep of
+        # one moment is enough.
+        nexrad_handle = read_nexrad(nexrad_file, fields=['reflectivity'], scans=[0])
 
         radar_name = nexrad_handle.metadata['instrument_name']
 
@@ -188,7 +220,7 @@ class NexradManager:
 
     def extract_grid(self, nexrad_file):
 
-        nexrad_handle = pyart.io.read(nexrad_file)
+        nexrad_handle = read_nexrad(nexrad_file, fields=['reflectivity'], scans=[0])
 
         gates = 1832
         azims = 720
@@ -230,8 +262,6 @@ class NexradManager:
         if self.grid_info is None:
             raise ValueError("grid_info cannot be None")
 
-        t0 = time.time()
-
         try:
             nexrad_data = NexradData(nexrad_file, self.metadata, self.grid_info)
         except (IndexError, KeyError) as e:
@@ -239,9 +269,7 @@ class NexradManager:
             print(e)
             return None
 
-        t1 = time.time()
-        elapsed = t1 - t0
-        print(f"Time for data extraction: {elapsed:.3f} s")
+        bugtracker.core.metrics.count('bytes_read', bugtracker.core.metrics.file_size(nexrad_file))
         return nexrad_data
 
 
@@ -261,11 +289,17 @@ class NexradData(ScanData):
 
         super().__init__(metadata, grid_info, datetime)
 
-        self.handle = pyart.io.read(nexrad_file)
-
         self.azims_per_lower = 720
         self.azims_per_upper = 360
 
+        # Option to get odd or even scans of the doubled lower sweeps
+        self.get_odd_scans = False
+
+        # Only the sweeps that end up in the 3D fields are decoded. Sweep
+        # indices of the handle refer to positions in self.scans.
+        self.scans = self.get_scan_indices()
+        self.handle = read_nexrad(nexrad_file, fields=NEXRAD_FIELDS, scans=self.scans)
+
         # Initializing normalized 3D fields
         self.dbz_unfiltered = self.init_field()
         self.spectrum_width = self.init_field()
@@ -290,9 +324,10 @@ class NexradData(ScanData):
         self.fill_lower(num_lower_levels)
         self.fill_upper(num_lower_levels, num_upper_levels)
 
-        # This is not a "classification filter", but a preprocessing step
+        # This is not a "classification filter", but a preprocessing step.
+        # Gates below the cutoff are NaN (see scan.py)
         min_dbz_cutoff = self.config['nexrad_settings']['dbz_cutoff']
-        self.dbz_unfiltered = np.ma.masked_where(self.dbz_unfiltered < min_dbz_cutoff, self.dbz_unfiltered)
+        apply_cutoff(self.dbz_unfiltered, min_dbz_cutoff)
 
 
     def __str__(self):
@@ -331,27 +366,37 @@ class NexradData(ScanData):
         num_vertical = num_lower_levels // 2 + num_upper_levels
 
         field_shape = (num_vertical,self.grid_info.azims, self.grid_info.gates)
-        field = np.zeros(field_shape, dtype=np.float32)
+        field = np.zeros(field_shape, dtype=self.dtype)
 
         return field
 
 
-    def get_scan_angles(self, num_lower_levels, num_upper_levels):
+    def get_lower_scans(self):
+        """
+        The lower levels are scanned twice, we only take one of
+        each pair.
+        """
 
-        fixed_angle = self.handle.fixed_angle['data']
+        return lower_scans(self.get_odd_scans)
 
-        scan_angles = []
 
-        for x in range(num_lower_levels):
-            # Getting even scans
-            if x % 2 == 0:
-                scan_angles.append(fixed_angle[x])
+    def get_scan_indices(self):
+        """
+        Sweep indices (in the full volume) of every level we keep.
+        """
+
+        return scan_indices(self.get_odd_scans)
 
-        for y in range(num_upper_levels):
-            idx = num_lower_levels + y
-            scan_angles.append(fixed_angle[idx])
 
-        return scan_angles
+    def get_scan_angles(self, num_lower_levels, num_upper_levels):
+
+        # The handle only contains the selected sweeps, in order.
+        fixed_angle = self.handle.fixed_angle['data']
+
+        if len(fixed_angle) != len(self.scans):
+            raise ValueError(f"Expected {len(self.scans)} sweeps, found {len(fixed_angle)}")
+
+        return list(fixed_angle)
 
 
     def check_field_dims(self, field_name):
@@ -404,7 +449,7 @@ class NexradData(ScanData):
 
     def get_num_lower(self):
 
-        return 6
+        return NUM_LOWER
 
 
     def get_num_upper(self):
@@ -414,7 +459,7 @@ class NexradData(ScanData):
         upper scans.
         """
 
-        return 6
+        return NUM_UPPER
 
 
     def fill_lower_field(self, field, field_key, theta, start_idx, vertical_level):
@@ -437,11 +482,10 @@ class NexradData(ScanData):
             dst_idx += 1
 
 
-    def fill_lower_scan(self, scan_idx, level):
-
+    def fill_lower_scan(self, sweep_idx, level):
 
-        start_idx = self.azims_per_lower * scan_idx
-        end_idx = self.azims_per_lower * (scan_idx + 1)
+        start_idx = self.handle.sweep_start_ray_index['data'][sweep_idx]
+        end_idx = start_idx + self.azims_per_lower
 
         azim_start = self.handle.azimuth['data'][start_idx]
         azim_end = self.handle.azimuth['data'][end_idx-1]
@@ -465,23 +509,12 @@ class NexradData(ScanData):
         This can be efficiently solved by using numpy array slicing
         """
 
-        # Option to get odd or even scans
-        get_odd_scans = False
-
-        scans = []
-
-        for x in range(0, num_lower):
-            if get_odd_scans:
-                if x % 2 != 0:
-                    scans.append(x)
-            else:
-                if x % 2 == 0:
-                    scans.append(x)
-
+        # The skipped half of the lower sweeps was never decoded, so
+        # the selected lower sweeps are the first ones in the handle.
+        num_selected = len(self.get_lower_scans())
 
-        for new_idx in range(0, len(scans)):
-            scan_idx = scans[new_idx]
-            self.fill_lower_scan(scan_idx, new_idx)
+        for new_idx in range(0, num_selected):
+            self.fill_lower_scan(new_idx, new_idx)
 
 
     def fill_upper_field(self, field, field_key, theta, start_idx, vertical_level):
@@ -521,8 +554,9 @@ class NexradData(ScanData):
 
     def fill_upper_scan(self, upper_idx, new_idx, num_lower, num_upper):
 
-        start_idx = self.azims_per_lower * num_lower + self.azims_per_upper * upper_idx
-        end_idx = self.azims_per_lower * num_lower + self.azims_per_upper * (upper_idx+1)
+        sweep_idx = len(self.get_lower_scans()) + upper_idx
+        start_idx = self.handle.sweep_start_ray_index['data'][sweep_idx]
+        end_idx = start_idx + self.azims_per_upper
 
         azim_start = self.handle.azimuth['data'][start_idx]
         azim_end = self.handle.azimuth['data'][end_idx-1]
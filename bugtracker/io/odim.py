@@ -20,14 +20,14 @@ import os
 import glob
 import datetime
 import math
-import time
 
 import numpy as np
 import pyart
-from scipy import interpolate
 
 import bugtracker.core.utils
-from bugtracker.io.scan import ScanData
+import bugtracker.core.metrics
+import bugtracker.io.input_index
+from bugtracker.io.scan import ScanData, apply_cutoff
 
 
 def datetime_from_file(filepath):
@@ -60,6 +60,7 @@ class OdimManager:
         self.config = config
         self.radar_id = radar_id.lower()
         self.odim_dir = self.config['input_dirs']['odim']
+        self.index = bugtracker.io.input_index.InputIndex(config, "odim", self.radar_id, self.parse_file)
 
         self.metadata = None
         self.grid_info = None
@@ -84,39 +85,34 @@ class OdimManager:
         return file_dt
 
 
+    def parse_file(self, filepath):
+        """
+        Parser for the InputIndex, only volumes of this radar are valid.
+        """
+
+        radar_lower = self.radar_id.lower()
+
+        if f"{radar_lower}.h5" not in os.path.basename(filepath):
+            raise ValueError(f"Not an ODIM_H5 volume: {filepath}")
+
+        return self.datetime_from_file(filepath), "h5"
+
+
     def get_closest(self, target_dt):
         """
         Get the closest radar scan to the specified date,
-        and return an error if the closest is more than 30mins away
+        and return an error if the closest is more than 1 hour away
         or if no input files are found.
-
-        Check +/- 1 hour range
         """
 
-        start = target_dt + datetime.timedelta(hours=-1)
-        end = target_dt + datetime.timedelta(hours=1)
+        max_diff = datetime.timedelta(hours=1)
+        closest = self.index.get_closest(target_dt, max_diff)
 
-        files_in_range = self.get_range(start, end)
-
-        if len(files_in_range) == 0:
+        if closest is None:
             timestamp = target_dt.strftime("%Y-%m-%d %H:%M:%S")
             msg = f"No files found in 1 hour window around time: {timestamp}"
             raise FileNotFoundError(msg)
 
-        min_diff = 999999999
-        min_idx = -1
-
-        for x in range(0, len(files_in_range)):
-            current_file = files_in_range[x]
-            file_dt = self.datetime_from_file(current_file)
-            diff = file_dt - target_dt
-            total_seconds = abs(diff.total_seconds())
-            if total_seconds < min_diff:
-                min_diff = total_seconds
-                min_idx = x
-
-        closest = files_in_range[min_idx]
-
         if not os.path.isfile(closest):
             raise FileNotFoundError(closest)
 
@@ -129,31 +125,7 @@ class OdimManager:
         date range.
         """
 
-        radar_lower = self.radar_id.lower()
-
-        # First, grabbing all files
-        all_files = bugtracker.core.utils.get_input_files(self.config, "odim", self.radar_id, start, end)
-
-        # Next, filtering files
-        filtered_files = []
-
-        for filename in all_files:
-            if f"{radar_lower}.h5" in filename:
-                filtered_files.append(filename)
-
-        range_list = []
-
-        for input_file in filtered_files:
-            current_dt = self.datetime_from_file(input_file)
-            if start <= current_dt and current_dt <= end:
-                range_list.append(input_file)
-
-        for file in range_list:
-            if not os.path.isfile(file):
-                raise FileNotFoundError(f"File does not exist: {file}")
-
-        return range_list
-
+        return self.index.get_range(start, end)
 
 
     def extract_metadata(self, odim_file):
@@ -228,13 +200,9 @@ class OdimManager:
         if self.grid_info is None:
             raise ValueError("grid_info cannot be None")
 
-        t0 = time.time()
-
         odim_data = OdimData(odim_file, self.metadata, self.grid_info)
         
-        t1 = time.time()
-        elapsed = t1 - t0
-        print(f"Time for data extraction: {elapsed:.3f} s")
+        bugtracker.core.metrics.count('bytes_read', bugtracker.core.metrics.file_size(odim_file))
         return odim_data
 
 
@@ -280,10 +248,11 @@ class OdimData(ScanData):
 
         self.fill_lower(num_lower_levels, num_upper_levels)
 
-        # This is not a "classification filter", but a preprocessing step
+        # This is not a "classification filter", but a preprocessing step.
+        # Gates below the cutoff are NaN (see scan.py)
         min_dbz_cutoff = self.config['odim_settings']['dbz_cutoff']
 
-        self.dbz_unfiltered = np.ma.masked_where(self.dbz_unfiltered < min_dbz_cutoff, self.dbz_unfiltered)
+        apply_cutoff(self.dbz_unfiltered, min_dbz_cutoff)
 
 
 
@@ -329,7 +298,7 @@ class OdimData(ScanData):
         num_vertical = num_lower_levels
 
         field_shape = (num_vertical,self.grid_info.azims, self.grid_info.gates)
-        field = np.zeros(field_shape, dtype=np.float32)
+        field = np.zeros(field_shape, dtype=self.dtype)
 
         print("field shape:", field_shape)
 
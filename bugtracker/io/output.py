@@ -83,6 +83,6 @@ def save_netcdf(grid, metadata, dbz_array, output_folder):
     dset.longitude = metadata.lon
     dset.radar_id = metadata.radar_id
     dset.datetime = metadata.scan_dt.strftime("%Y%m%d%H%M")
-    dset.name = metadata.name
+    dset.setncattr("name", metadata.name)
 
     dset.close()
\ No newline at end of file
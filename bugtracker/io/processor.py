@@ -21,8 +21,6 @@ Currently unused processor class
 """
 import os
 import abc
-import datetime
-import time
 import math
 
 import numpy as np
@@ -31,15 +29,21 @@ from scipy import stats
 
 import bugtracker
 import bugtracker.core.precip
+import bugtracker.core.filter
+import bugtracker.core.metrics
+import bugtracker.core.memory
+import bugtracker.core.tracing
+import bugtracker.io.scan
 
 class Processor(abc.ABC):
 
     def __init__(self, metadata, grid_info):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
 
         self.metadata = metadata
         self.grid_info = grid_info
+        self.dtype = bugtracker.io.scan.get_dtype(self.config)
         self.calib_file = bugtracker.core.cache.calib_filepath(metadata, grid_info)
         self.plotter = None
 
@@ -49,6 +53,59 @@ class Processor(abc.ABC):
         self.load_universal_calib()
         self.verify_universal_calib()
 
+        catalog_file = bugtracker.io.catalog.catalog_filepath(self.config)
+        self.catalog = bugtracker.io.catalog.ScanCatalog(catalog_file)
+
+        # Which plots are made, and whether they are queued for plot.py
+        self.plot_policy = bugtracker.plots.policy.from_config(self.config)
+        self.plot_queue = None
+
+        if self.plot_policy.mode == 'deferred':
+            queue_file = bugtracker.plots.plot_queue.queue_filepath(self.config)
+            self.plot_queue = bugtracker.plots.plot_queue.PlotQueue(queue_file)
+
+        # Optional Cartesian raster export (None if disabled)
+        cartesian_spec = bugtracker.io.cartesian.from_config(self.config)
+
+        if cartesian_spec is None:
+            self.cartesian = None
+        else:
+            self.cartesian = bugtracker.io.cartesian.get_resampler(self.config, metadata, grid_info, cartesian_spec)
+
+        # Optional echo motion between consecutive scans (None if disabled)
+        motion_settings = bugtracker.io.motion.from_config(self.config)
+
+        if motion_settings is None:
+            self.motion = None
+        else:
+            self.motion = bugtracker.io.motion.MotionTracker(self.config, metadata, grid_info, motion_settings,
+                                                             seed_outputs=True)
+
+        # VAD profile of the insect flow (None if disabled)
+        vad_settings = bugtracker.core.vad.from_config(self.config)
+
+        if vad_settings is None:
+            self.vad = None
+        else:
+            self.vad = bugtracker.core.vad.VadRetrieval(metadata, grid_info, vad_settings)
+
+        # Vertical profile of the bug reflectivity (None if disabled)
+        profile_settings = bugtracker.core.vertical_profile.from_config(self.config)
+
+        if profile_settings is None:
+            self.profiler = None
+        else:
+            self.profiler = bugtracker.core.vertical_profile.VerticalProfiler(metadata, grid_info, profile_settings)
+
+        # Per-scan stage times and counters (None if disabled)
+        self.metrics_writer = bugtracker.core.metrics.from_config(self.config, metadata.radar_id)
+
+        # Memory-bounded processing (None if unbounded)
+        self.memory_budget = bugtracker.core.memory.from_config(self.config)
+
+        if self.memory_budget is not None:
+            print(self.memory_budget)
+
 
     def load_universal_calib(self):
         """
@@ -112,6 +169,144 @@ class Processor(abc.ABC):
         return os.path.join(subfolder, output_filename)
 
 
+    def check_dtypes(self, scan_data, stage):
+        """
+        The dBZ fields present at the end of a stage must all be of
+        the dtype of the processing policy (see scan.py).
+        """
+
+        for name in ['convol', 'dopvol', 'dbz_unfiltered', 'dbz_filtered', 'joint_product']:
+            field = getattr(scan_data, name, None)
+            if field is not None:
+                bugtracker.io.scan.check_dtype(field, self.dtype, f"{stage} ({name})")
+
+
+    def release_handle(self, scan_data):
+        """
+        In memory-bounded mode, drops the pyart handle once the 3D
+        fields are filled, rather than at the end of the scan (it would
+        also be pickled for every plot worker).
+        """
+
+        if self.memory_budget is not None and getattr(scan_data, 'handle', None) is not None:
+            scan_data.handle = None
+
+
+    def precip_chunk(self, scan_data):
+        """
+        Elevations filtered at a time by the NexradPrecipFilter, None
+        (all of them) unless the processing is memory-bounded.
+        """
+
+        if self.memory_budget is None:
+            return None
+
+        field = scan_data.diff_reflectivity
+        copies = bugtracker.core.precip.NexradPrecipFilter.TEMPORARIES
+        chunk = self.memory_budget.chunk_levels(field[0].nbytes, copies, field.shape[0])
+        print(f"Precip filter: {chunk} of {field.shape[0]} elevations at a time")
+
+        return chunk
+
+
+    def plot(self, nc_filename, scan_data, id_matrix, output_elevs):
+        """
+        Makes the plots due for this scan, or queues them in deferred
+        mode (the output file must be written first). output_elevs are
+        the elevations written to the output, the deferred plots are
+        made from that file.
+        """
+
+        dbz_elevs = scan_data.dbz_elevs if self.plot_queue is None else output_elevs
+        jobs = self.plot_policy.jobs(self.metadata.radar_id, scan_data.datetime, dbz_elevs)
+
+        if len(jobs) == 0:
+            return
+
+        if self.plot_queue is not None:
+            self.plot_queue.enqueue(self.metadata, scan_data.datetime, nc_filename, self.calib_file,
+                                    self.grid_info, jobs)
+        else:
+            bugtracker.plots.parallel.ParallelPlotter(self.lats, self.lons, self.metadata, self.grid_info,
+                                                      scan_data, id_matrix, jobs=jobs)
+
+
+    def write_cartesian(self, nc_filename, radar_filetype, scan_dt, dbz_elevs, joint_product, id_matrix):
+        """
+        Writes the Cartesian rasters next to the polar output, if the
+        export is enabled in the config.
+        """
+
+        if self.cartesian is None:
+            return
+
+        cartesian_file = bugtracker.io.cartesian.cartesian_filename(nc_filename)
+        self.cartesian.write(cartesian_file, radar_filetype, scan_dt, dbz_elevs, joint_product, id_matrix)
+        bugtracker.core.metrics.count('bytes_written', bugtracker.core.metrics.file_size(cartesian_file))
+
+
+    def track_motion(self, nc_filename, scan_data, id_matrix):
+        """
+        Appends the echo motion since the previous scan to the output,
+        if motion tracking is enabled in the config.
+        """
+
+        if self.motion is None:
+            return
+
+        field = bugtracker.io.motion.polar_field(self.motion.settings.field, scan_data.joint_product,
+                                                 scan_data.dbz_unfiltered, id_matrix)
+        motion = self.motion.update(scan_data.datetime, field, nc_filename)
+
+        if motion is not None:
+            print(motion)
+
+
+    def retrieve_vad(self, nc_filename, velocity, vel_elevs, id_matrix, dbz_elevs):
+        """
+        Appends the VAD profile of the bug gates to the output, if the
+        retrieval is enabled in the config.
+        """
+
+        if self.vad is None:
+            return
+
+        profile = self.vad.retrieve(velocity, vel_elevs, id_matrix, dbz_elevs)
+        profile.write(nc_filename)
+        print(profile)
+
+
+    def bug_profile(self, nc_filename, dbz, id_matrix, dbz_elevs):
+        """
+        Appends the vertical profile of the bug reflectivity to the
+        output, and returns it for the catalog (None if disabled).
+        """
+
+        if self.profiler is None:
+            return None
+
+        profile = self.profiler.compute(dbz, id_matrix, dbz_elevs)
+        profile.write(nc_filename)
+        print(profile)
+
+        return profile
+
+
+    def finish_metrics(self, metrics, scan_dt, nc_filename):
+        """
+        Prints the stage times and counters of the scan, and writes
+        them if the metrics are enabled. The output file is complete
+        at this point, its size is counted here.
+        """
+
+        bugtracker.core.metrics.count('bytes_written', bugtracker.core.metrics.file_size(nc_filename))
+        metrics.finish(scan_dt, nc_filename)
+        print(metrics)
+
+        if self.metrics_writer is not None:
+            self.metrics_writer.write(metrics)
+
+
     @abc.abstractmethod
     def load_specific_calib(self):
         """
@@ -192,14 +387,8 @@ class IrisProcessor(Processor):
         raw_dopvol_shape = iris_data.dopvol.shape
         raw_convol_shape = iris_data.convol.shape
 
-        raw_dopvol_mask = np.ma.getmask(iris_data.dopvol)
-        raw_convol_mask = np.ma.getmask(iris_data.convol)
-
-        dopvol_mask = np.ma.mask_or(np_dopvol, raw_dopvol_mask)
-        convol_mask = np.ma.mask_or(np_convol, raw_convol_mask)
-
-        iris_data.dopvol = np.ma.array(iris_data.dopvol, mask=dopvol_mask)
-        iris_data.convol = np.ma.array(iris_data.convol, mask=convol_mask)
+        iris_data.dopvol = bugtracker.io.scan.apply_filter(iris_data.dopvol, np_dopvol)
+        iris_data.convol = bugtracker.io.scan.apply_filter(iris_data.convol, np_convol)
 
         filtered_dopvol_shape = iris_data.dopvol.shape
         filtered_convol_shape = iris_data.convol.shape
@@ -218,10 +407,7 @@ class IrisProcessor(Processor):
 
         # Let's mask out anything over 30, first
         bug_threshold = self.config['processing']['joint_cutoff']
-        final_dbz = np.ma.masked_where(iris_data.dbz_filtered >= bug_threshold, iris_data.dbz_filtered)
-
-        iris_data.joint_product = np.amax(final_dbz, axis=0)
-        print(type(iris_data.joint_product))
+        iris_data.joint_product = bugtracker.io.scan.joint_max(iris_data.dbz_filtered, bug_threshold)
         print("joint shape:", iris_data.joint_product.shape)
 
 
@@ -277,74 +463,88 @@ class IrisProcessor(Processor):
         be handling the internal data of the Filter objects.
         """
 
-        t0 = time.time()
+        metrics = bugtracker.core.metrics.ScanMetrics(self.metadata.radar_id, "iris", iris_set.convol)
+
+        with metrics.stage('extract'):
+            iris_data = bugtracker.io.iris.IrisData(iris_set)
+            iris_data.fill_grids()
+            self.check_dtypes(iris_data, "extract")
+            metrics.hold('scan', iris_data)
 
-        iris_data = bugtracker.io.iris.IrisData(iris_set)
-        iris_data.fill_grids()
-        
         print("iris date:", iris_data.datetime)
         print("metadata date:", self.metadata.scan_dt)
 
-        t1 = time.time()
-
-        # construct the PrecipFilter from iris_set
-        convol_precip = bugtracker.core.precip.PrecipFilter(self.metadata, self.grid_info, self.convol_angles)
-        dopvol_precip = bugtracker.core.precip.PrecipFilter(self.metadata, self.grid_info, self.dopvol_angles)
+        with metrics.stage('precip'):
+            # construct the PrecipFilter from iris_set
+            convol_precip = bugtracker.core.precip.PrecipFilter(self.metadata, self.grid_info, self.convol_angles)
+            dopvol_precip = bugtracker.core.precip.PrecipFilter(self.metadata, self.grid_info, self.dopvol_angles)
 
-        convol_precip.apply(iris_data.convol, self.convol_clutter, self.convol_angles)
-        convol_precip.copy(dopvol_precip)
-        t2 = time.time()
+            convol_precip.apply(iris_data.convol, self.convol_clutter, self.convol_angles)
+            convol_precip.copy(dopvol_precip)
+            metrics.hold('precip', [convol_precip.filter_3d, dopvol_precip.filter_3d])
 
-        # Combining ClutterFilter with PrecipFilter
+        with metrics.stage('combine_filters'):
+            # Combining ClutterFilter with PrecipFilter
+            convol_clutter_bool = self.convol_clutter.astype(bool)
+            dopvol_clutter_bool = self.dopvol_clutter.astype(bool)
 
-        convol_clutter_bool = self.convol_clutter.astype(bool)
-        dopvol_clutter_bool = self.dopvol_clutter.astype(bool)
+            convol_joint = np.logical_or(convol_clutter_bool, convol_precip.filter_3d)
+            dopvol_joint = np.logical_or(dopvol_clutter_bool, dopvol_precip.filter_3d)
+            metrics.hold('filter_joint', [convol_joint, dopvol_joint])
 
-        convol_joint = np.logical_or(convol_clutter_bool, convol_precip.filter_3d)
-        dopvol_joint = np.logical_or(dopvol_clutter_bool, dopvol_precip.filter_3d)
+        with metrics.stage('vertical_merge'):
+            iris_data.dbz_unfiltered = iris_data.merge_dbz()
 
-        t3 = time.time()
+        with metrics.stage('output'):
+            # modify the files based on filters
+            self.impose_filter(iris_data, convol_joint, dopvol_joint)
 
-        iris_data.dbz_unfiltered = iris_data.merge_dbz()
+            nc_filename = self.output_filename(iris_data.datetime)
 
-        t4 = time.time()
+            iris_data.dbz_filtered = iris_data.merge_dbz()
+            self.set_joint_product(iris_data)
+            self.check_dtypes(iris_data, "filter")
 
-        # modify the files based on filters
-        self.impose_filter(iris_data, convol_joint, dopvol_joint)
+            iris_output = bugtracker.io.models.IrisOutput(self.metadata, self.grid_info)
+            iris_output.populate(iris_data)
+            iris_output.validate()
+            iris_output.write(nc_filename, iris_data.datetime)
 
-        nc_filename = self.output_filename(iris_data.datetime)
+        with metrics.stage('target_id'):
+            joint_precip_bool = self.combine_precip(convol_precip.filter_3d, dopvol_precip.filter_3d, iris_data)
+            joint_clutter_bool = self.combine_clutter(convol_clutter_bool, dopvol_clutter_bool, iris_data)
 
-        iris_data.dbz_filtered = iris_data.merge_dbz()
-        self.set_joint_product(iris_data)
+            target_id = bugtracker.core.target_id.TargetId(iris_data.dbz_filtered, joint_clutter_bool, joint_precip_bool)
+            id_matrix = target_id.export_matrix()
+            metrics.hold('id_matrix', id_matrix)
 
-        iris_output = bugtracker.io.models.IrisOutput(self.metadata, self.grid_info)
-        iris_output.populate(iris_data)
-        iris_output.validate()
-        iris_output.write(nc_filename)
+            iris_output.append_target_id(nc_filename, id_matrix)
 
-        t5 = time.time()
+        with metrics.stage('plot'):
+            self.plot(nc_filename, iris_data, id_matrix, iris_output.dbz_elevs)
 
-        joint_precip_bool = self.combine_precip(convol_precip.filter_3d, dopvol_precip.filter_3d, iris_data)
-        joint_clutter_bool = self.combine_clutter(convol_clutter_bool, dopvol_clutter_bool, iris_data)
+        with metrics.stage('cartesian'):
+            self.write_cartesian(nc_filename, "iris", iris_data.datetime, iris_data.dbz_elevs, iris_data.joint_product, id_matrix)
 
-        target_id = bugtracker.core.target_id.TargetId(iris_data.dbz_filtered, joint_clutter_bool, joint_precip_bool)
-        id_matrix = target_id.export_matrix()
+        with metrics.stage('motion'):
+            self.track_motion(nc_filename, iris_data, id_matrix)
 
-        iris_output.append_target_id(nc_filename, id_matrix)
+        with metrics.stage('vad'):
+            self.retrieve_vad(nc_filename, iris_data.velocity, iris_data.dopvol_elevs, id_matrix, iris_data.dbz_elevs)
 
-        t6 = time.time()
+        with metrics.stage('profile'):
+            profile = self.bug_profile(nc_filename, iris_data.dbz_filtered, id_matrix, iris_data.dbz_elevs)
 
-        plot_queue = bugtracker.plots.parallel.ParallelPlotter(self.lats, self.lons, self.metadata, self.grid_info, iris_data, id_matrix)
+        bugtracker.core.metrics.count('gates_processed', iris_data.dbz_unfiltered.size)
+        self.finish_metrics(metrics, iris_data.datetime, nc_filename)
 
-        t7 = time.time()
-
-        print(f"Fill grids, construct data: {(t1-t0):.3f} s")
-        print(f"Precip filter: {(t2-t1):.3f} s")
-        print(f"Combining filters: {(t3-t2):.3f} s")
-        print(f"Vertical merge: {(t4-t3):.3f} s")
-        print(f"Output product NETCDF4 {(t5-t4):.3f} s")
-        print(f"Target ID setup and export {(t6-t5):.3f} s")
-        print(f"Plotting radial graphs {(t7-t6):.3f} s")
+        record = bugtracker.io.catalog.ScanRecord(self.metadata, iris_data.datetime, "iris", nc_filename,
+                                                  iris_data.dbz_elevs, id_matrix)
+        # The clutter mask is a calibration array rather than a Filter object.
+        record.set_coverage(convol_precip.coverage(), joint_clutter_bool.mean())
+        record.set_timings(metrics.timings)
+        record.set_profile(profile)
+        self.catalog.add(record)
 
 
     def process_sets(self, iris_sets):
@@ -352,11 +552,15 @@ class IrisProcessor(Processor):
         if len(iris_sets) == 0:
             raise ValueError("There are 0 IrisSet entries - cannot process.")
 
-        for iris_set in iris_sets:
-            try:
-                self.process_set(iris_set)
-            except (OSError, IndexError, FileNotFoundError):
-                print("Could not read file, skipping.")
+        try:
+            for iris_set in iris_sets:
+                try:
+                    with bugtracker.core.tracing.span("scan", "scan", file=iris_set.convol):
+                        self.process_set(iris_set)
+                except (OSError, IndexError, FileNotFoundError):
+                    print("Could not read file, skipping.")
+        finally:
+            self.catalog.flush()
 
 
 class NexradProcessor(Processor):
@@ -386,6 +590,8 @@ class NexradProcessor(Processor):
 
         dset.close()
 
+        self.clutter_mask = bugtracker.core.filter.PackedMask(self.clutter.astype(bool))
+
 
     def verify_specific_calib(self):
         
@@ -414,10 +620,7 @@ class NexradProcessor(Processor):
         """
 
         raw_dbz_shape = nexrad_data.dbz_unfiltered.shape
-        raw_dbz_mask = np.ma.getmask(nexrad_data.dbz_unfiltered)
-        filter_mask = np.ma.mask_or(filter_joint, raw_dbz_mask)
-
-        nexrad_data.dbz_filtered = np.ma.array(nexrad_data.dbz_unfiltered, mask=filter_mask)
+        nexrad_data.dbz_filtered = bugtracker.io.scan.apply_filter(nexrad_data.dbz_unfiltered, filter_joint)
 
         dbz_filtered_shape = nexrad_data.dbz_filtered.shape
 
@@ -432,10 +635,7 @@ class NexradProcessor(Processor):
 
         # Let's mask out anything over 30, first
         bug_threshold = self.config['processing']['joint_cutoff']
-        final_dbz = np.ma.masked_where(nexrad_data.dbz_filtered >= bug_threshold, nexrad_data.dbz_filtered)
-
-        nexrad_data.joint_product = np.amax(final_dbz, axis=0)
-        print(type(nexrad_data.joint_product))
+        nexrad_data.joint_product = bugtracker.io.scan.joint_max(nexrad_data.dbz_filtered, bug_threshold)
         print("joint shape:", nexrad_data.joint_product.shape)
 
 
@@ -443,72 +643,97 @@ class NexradProcessor(Processor):
 
         print("Processing file:", nexrad_file)
 
-        t0 = time.time()
+        metrics = bugtracker.core.metrics.ScanMetrics(self.metadata.radar_id, "nexrad", nexrad_file)
+
+        with metrics.stage('extract'):
+            nexrad_data = self.manager.extract_data(nexrad_file)
+
+            if nexrad_data is not None:
+                self.release_handle(nexrad_data)
+                metrics.hold('scan', nexrad_data)
 
-        nexrad_data = self.manager.extract_data(nexrad_file)
         # Checking to make sure data is valid
         if nexrad_data is None:
             return None
 
-        t1 = time.time()
+        self.check_dtypes(nexrad_data, "extract")
 
-        # construct the PrecipFilter from iris_set
-        precip = bugtracker.core.precip.NexradPrecipFilter(self.metadata, self.grid_info, nexrad_data.dbz_elevs)
-        precip.apply(nexrad_data)
+        with metrics.stage('precip'):
+            # construct the PrecipFilter from iris_set
+            precip = bugtracker.core.precip.NexradPrecipFilter(self.metadata, self.grid_info, nexrad_data.dbz_elevs)
+            precip.apply(nexrad_data, self.precip_chunk(nexrad_data))
+            metrics.hold('precip', precip)
 
-        t2 = time.time()
+        with metrics.stage('combine_filters'):
+            # Combining ClutterFilter with PrecipFilter
+            filter_joint = self.clutter_mask.union(precip.filter_3d)
+            metrics.hold('filter_joint', filter_joint)
 
-        # Combining ClutterFilter with PrecipFilter
+        with metrics.stage('output'):
+            # modify the files based on filters
+            self.impose_filter(nexrad_data, filter_joint)
 
-        clutter_bool = self.clutter.astype(bool)
-        filter_joint = np.logical_or(clutter_bool, precip.filter_3d)
+            nexrad_datetime = self.manager.datetime_from_file(nexrad_file)
+            nc_filename = self.output_filename(nexrad_datetime)
 
-        t3 = time.time()
+            self.set_joint_product(nexrad_data)
+            self.check_dtypes(nexrad_data, "filter")
 
-        # modify the files based on filters
-        self.impose_filter(nexrad_data, filter_joint)
+            nexrad_output = bugtracker.io.models.NexradOutput(self.metadata, self.grid_info)
+            nexrad_output.populate(nexrad_data)
+            nexrad_output.validate()
+            nexrad_output.write(nc_filename, nexrad_datetime)
 
-        nexrad_datetime = self.manager.datetime_from_file(nexrad_file)
-        nc_filename = self.output_filename(nexrad_datetime)
+        with metrics.stage('target_id'):
+            target_id = bugtracker.core.target_id.TargetId(nexrad_data.dbz_unfiltered, self.clutter_mask, precip.filter_3d)
+            id_matrix = target_id.export_matrix()
+            metrics.hold('id_matrix', id_matrix)
 
-        self.set_joint_product(nexrad_data)
+            # Taking only desired levels
+            max_scans = self.config['nexrad_settings']['vertical_scans']
+            reduced_id_matrix = id_matrix[0:max_scans,:,:]
 
-        nexrad_output = bugtracker.io.models.NexradOutput(self.metadata, self.grid_info)
-        nexrad_output.populate(nexrad_data)
-        nexrad_output.validate()
-        nexrad_output.write(nc_filename)
+            nexrad_output.append_target_id(nc_filename, reduced_id_matrix)
 
-        t4 = time.time()
+        with metrics.stage('plot'):
+            self.plot(nc_filename, nexrad_data, id_matrix, nexrad_output.dbz_elevs)
 
-        precip_bool = precip.filter_3d.astype(bool)
+        with metrics.stage('cartesian'):
+            self.write_cartesian(nc_filename, "nexrad", nexrad_datetime, nexrad_data.dbz_elevs[0:max_scans], nexrad_data.joint_product, reduced_id_matrix)
 
-        target_id = bugtracker.core.target_id.TargetId(nexrad_data.dbz_unfiltered, clutter_bool, precip_bool)
-        id_matrix = target_id.export_matrix()
+        with metrics.stage('motion'):
+            self.track_motion(nc_filename, nexrad_data, reduced_id_matrix)
 
-        # Taking only desired levels
-        max_scans = self.config['nexrad_settings']['vertical_scans']
-        reduced_id_matrix = id_matrix[0:max_scans,:,:]
+        with metrics.stage('vad'):
+            self.retrieve_vad(nc_filename, nexrad_data.velocity[0:max_scans], nexrad_data.dbz_elevs[0:max_scans],
+                              reduced_id_matrix, nexrad_data.dbz_elevs[0:max_scans])
 
-        nexrad_output.append_target_id(nc_filename, reduced_id_matrix)
+        with metrics.stage('profile'):
+            profile = self.bug_profile(nc_filename, nexrad_data.dbz_unfiltered[0:max_scans], reduced_id_matrix,
+                                       nexrad_data.dbz_elevs[0:max_scans])
 
-        t5 = time.time()
+        bugtracker.core.metrics.count('gates_processed', nexrad_data.dbz_unfiltered.size)
+        self.finish_metrics(metrics, nexrad_datetime, nc_filename)
 
-        plot_queue = bugtracker.plots.parallel.ParallelPlotter(self.lats, self.lons, self.metadata, self.grid_info, nexrad_data, id_matrix)
-
-        t6 = time.time()
-
-        print(f"Fill grids, construct data: {(t1-t0):.3f} s")
-        print(f"Precip filter: {(t2-t1):.3f} s")
-        print(f"Combining filters: {(t3-t2):.3f} s")
-        print(f"Output product NETCDF4 {(t4-t3):.3f} s")
-        print(f"Target ID setup and export {(t5-t4):.3f} s")
-        print(f"Plotting radial graphs {(t6-t5):.3f} s")
+        # Statistics are for the levels that were written to the output
+        output_levels = reduced_id_matrix.shape[0]
+        record = bugtracker.io.catalog.ScanRecord(self.metadata, nexrad_datetime, "nexrad", nc_filename,
+                                                  nexrad_data.dbz_elevs[0:output_levels], reduced_id_matrix)
+        # The clutter mask is a calibration array rather than a Filter object.
+        record.set_coverage(precip.coverage(), self.clutter_mask.coverage(output_levels))
+        record.set_timings(metrics.timings)
+        record.set_profile(profile)
+        self.catalog.add(record)
 
 
     def process_files(self, nexrad_files):
 
-        for nexrad_file in nexrad_files:
-            self.process_file(nexrad_file)
+        try:
+            for nexrad_file in nexrad_files:
+                with bugtracker.core.tracing.span("scan", "scan", file=nexrad_file):
+                    self.process_file(nexrad_file)
+        finally:
+            self.catalog.flush()
 
 
 class OdimProcessor(Processor):
@@ -538,6 +763,8 @@ class OdimProcessor(Processor):
 
         dset.close()
 
+        self.clutter_mask = bugtracker.core.filter.PackedMask(self.clutter.astype(bool))
+
 
     def verify_specific_calib(self):
         
@@ -566,10 +793,7 @@ class OdimProcessor(Processor):
         """
 
         raw_dbz_shape = odim_data.dbz_unfiltered.shape
-        raw_dbz_mask = np.ma.getmask(odim_data.dbz_unfiltered)
-        filter_mask = np.ma.mask_or(filter_joint, raw_dbz_mask)
-
-        odim_data.dbz_filtered = np.ma.array(odim_data.dbz_unfiltered, mask=filter_mask)
+        odim_data.dbz_filtered = bugtracker.io.scan.apply_filter(odim_data.dbz_unfiltered, filter_joint)
 
         dbz_filtered_shape = odim_data.dbz_filtered.shape
 
@@ -584,10 +808,7 @@ class OdimProcessor(Processor):
 
         # Let's mask out anything over 30, first
         bug_threshold = self.config['processing']['joint_cutoff']
-        final_dbz = np.ma.masked_where(odim_data.dbz_filtered >= bug_threshold, odim_data.dbz_filtered)
-
-        odim_data.joint_product = np.amax(final_dbz, axis=0)
-        print(type(odim_data.joint_product))
+        odim_data.joint_product = bugtracker.io.scan.joint_max(odim_data.dbz_filtered, bug_threshold)
         print("joint shape:", odim_data.joint_product.shape)
 
 
@@ -595,63 +816,82 @@ class OdimProcessor(Processor):
 
         print("Processing file:", odim_file)
 
-        t0 = time.time()
-
-        odim_data = self.manager.extract_data(odim_file)
-
-        t1 = time.time()
-
-        # We can reuse the NexradPrecipFilter code here, because for this
-        # specific processing step, the data structures are identical.
-        precip = bugtracker.core.precip.NexradPrecipFilter(self.metadata, self.grid_info, odim_data.dbz_elevs)
-        precip.apply(odim_data)
+        metrics = bugtracker.core.metrics.ScanMetrics(self.metadata.radar_id, "odim", odim_file)
 
-        t2 = time.time()
+        with metrics.stage('extract'):
+            odim_data = self.manager.extract_data(odim_file)
+            self.check_dtypes(odim_data, "extract")
+            self.release_handle(odim_data)
+            metrics.hold('scan', odim_data)
 
-        # Combining ClutterFilter with PrecipFilter
+        with metrics.stage('precip'):
+            # We can reuse the NexradPrecipFilter code here, because for this
+            # specific processing step, the data structures are identical.
+            precip = bugtracker.core.precip.NexradPrecipFilter(self.metadata, self.grid_info, odim_data.dbz_elevs)
+            precip.apply(odim_data, self.precip_chunk(odim_data))
+            metrics.hold('precip', precip)
 
-        clutter_bool = self.clutter.astype(bool)
-        filter_joint = np.logical_or(clutter_bool, precip.filter_3d)
+        with metrics.stage('combine_filters'):
+            # Combining ClutterFilter with PrecipFilter
+            filter_joint = self.clutter_mask.union(precip.filter_3d)
+            metrics.hold('filter_joint', filter_joint)
 
-        t3 = time.time()
+        with metrics.stage('output'):
+            # modify the files based on filters
+            self.impose_filter(odim_data, filter_joint)
 
-        # modify the files based on filters
-        self.impose_filter(odim_data, filter_joint)
+            odim_datetime = self.manager.datetime_from_file(odim_file)
+            nc_filename = self.output_filename(odim_datetime)
 
-        odim_datetime = self.manager.datetime_from_file(odim_file)
-        nc_filename = self.output_filename(odim_datetime)
+            self.set_joint_product(odim_data)
+            self.check_dtypes(odim_data, "filter")
 
-        self.set_joint_product(odim_data)
+            odim_output = bugtracker.io.models.OdimOutput(self.metadata, self.grid_info)
+            odim_output.populate(odim_data)
+            odim_output.validate()
+            odim_output.write(nc_filename, odim_datetime)
 
-        odim_output = bugtracker.io.models.OdimOutput(self.metadata, self.grid_info)
-        odim_output.populate(odim_data)
-        odim_output.validate()
-        odim_output.write(nc_filename)
+        with metrics.stage('target_id'):
+            target_id = bugtracker.core.target_id.TargetId(odim_data.dbz_unfiltered, self.clutter_mask, precip.filter_3d)
+            id_matrix = target_id.export_matrix()
+            metrics.hold('id_matrix', id_matrix)
 
-        t4 = time.time()
+            odim_output.append_target_id(nc_filename, id_matrix)
 
-        precip_bool = precip.filter_3d.astype(bool)
+        with metrics.stage('plot'):
+            self.plot(nc_filename, odim_data, id_matrix, odim_output.dbz_elevs)
 
-        target_id = bugtracker.core.target_id.TargetId(odim_data.dbz_unfiltered, clutter_bool, precip_bool)
-        id_matrix = target_id.export_matrix()
+        with metrics.stage('cartesian'):
+            self.write_cartesian(nc_filename, "odim", odim_datetime, odim_data.dbz_elevs, odim_data.joint_product, id_matrix)
 
-        odim_output.append_target_id(nc_filename, id_matrix)
+        with metrics.stage('motion'):
+            self.track_motion(nc_filename, odim_data, id_matrix)
 
-        t5 = time.time()
+        with metrics.stage('vad'):
+            self.retrieve_vad(nc_filename, odim_data.velocity, odim_data.dbz_elevs, id_matrix, odim_data.dbz_elevs)
 
-        plot_queue = bugtracker.plots.parallel.ParallelPlotter(self.lats, self.lons, self.metadata, self.grid_info, odim_data, id_matrix)
+        with metrics.stage('profile'):
+            profile = self.bug_profile(nc_filename, odim_data.dbz_unfiltered, id_matrix, odim_data.dbz_elevs)
 
-        t6 = time.time()
+        bugtracker.core.metrics.count('gates_processed', odim_data.dbz_unfiltered.size)
+        self.finish_metrics(metrics, odim_datetime, nc_filename)
 
-        print(f"Fill grids, construct data: {(t1-t0):.3f} s")
-        print(f"Precip filter: {(t2-t1):.3f} s")
-        print(f"Combining filters: {(t3-t2):.3f} s")
-        print(f"Output product NETCDF4 {(t4-t3):.3f} s")
-        print(f"Target ID setup and export {(t5-t4):.3f} s")
-        print(f"Plotting radial graphs {(t6-t5):.3f} s")
+        # Statistics are for the levels that were written to the output
+        output_levels = id_matrix.shape[0]
+        record = bugtracker.io.catalog.ScanRecord(self.metadata, odim_datetime, "odim", nc_filename,
+                                                  odim_data.dbz_elevs[0:output_levels], id_matrix)
+        # The clutter mask is a calibration array rather than a Filter object.
+        record.set_coverage(precip.coverage(), self.clutter_mask.coverage(output_levels))
+        record.set_timings(metrics.timings)
+        record.set_profile(profile)
+        self.catalog.add(record)
 
 
     def process_files(self, odim_files):
 
-        for odim_file in odim_files:
-            self.process_file(odim_file)
\ No newline at end of file
+        try:
+            for odim_file in odim_files:
+                with bugtracker.core.tracing.span("scan", "scan", file=odim_file):
+                    self.process_file(odim_file)
+        finally:
+            self.catalog.flush()
\ No newline at end of file
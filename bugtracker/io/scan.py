@@ -16,11 +16,122 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+"""
+Scan fields are float32 ndarrays with NaN at the gates without data
+(below the dBZ cutoff, or removed by a filter), rather than numpy
+masked arrays. The filters are kept as bit-packed masks (see
+bugtracker.core.filter.PackedMask).
+
+Masked arrays are only built at the boundaries: when writing the
+netCDF4 outputs, and when plotting (to_masked).
+
+The float dtype of the fields is set by processing.dtype in the
+config ("float32" by default, or "float64"), from the decoding of
+the radar files through the filters. The processors check it at the
+end of each stage (check_dtype), so that a stage upcasting the data
+fails rather than doubling the memory silently.
+"""
+
 import abc
 
+import numpy as np
+
 import bugtracker.config
 
 
+DTYPES = ['float32', 'float64']
+
+
+def get_dtype(config=None):
+    """
+    The numpy dtype of the scan fields, from processing.dtype
+    """
+
+    if config is None:
+        config = bugtracker.config.get()
+
+    name = config['processing'].get('dtype', 'float32')
+
+    if name not in DTYPES:
+        raise ValueError(f"Invalid processing dtype: {name}, must be one of {DTYPES}")
+
+    return np.dtype(name)
+
+
+def check_dtype(field, dtype, stage):
+    """
+    Raises a ValueError if field is not of the policy dtype
+    """
+
+    if field.dtype != dtype:
+        raise ValueError(f"{stage}: field is {field.dtype}, expected {dtype}")
+
+
+def nan_field(shape, dtype):
+
+    return np.full(shape, np.nan, dtype=dtype)
+
+
+def to_nan(field, dtype=np.float32):
+    """
+    ndarray of dtype with NaN at the masked gates. No copy is made
+    if field is already an ndarray of that dtype.
+    """
+
+    return np.ma.filled(np.ma.asarray(field, dtype=dtype), np.nan)
+
+
+def to_masked(field):
+    """
+    Masked array view of a NaN field, for the netCDF4 and plot code
+    """
+
+    return np.ma.masked_invalid(field, copy=False)
+
+
+def apply_cutoff(field, min_value):
+    """
+    Sets the values below min_value to NaN, in place
+    """
+
+    field[field < min_value] = np.nan
+    return field
+
+
+def apply_filter(field, mask):
+    """
+    Copy of field with NaN where mask (a PackedMask or a boolean
+    array of the same shape) is set.
+    """
+
+    if field.shape != mask.shape:
+        raise ValueError(f"Incompatible filter dimensions: {mask.shape} != {field.shape}")
+
+    filtered = field.copy()
+
+    for x in range(0, field.shape[0]):
+        filtered[x][mask[x]] = np.nan
+
+    return filtered
+
+
+def joint_max(field, max_value):
+    """
+    Maximum over the levels (axis 0) of the values below max_value,
+    NaN where there are none. Same as np.nanmax on the cut field,
+    but one level at a time and without all-NaN warnings.
+    """
+
+    joint = np.full(field.shape[1:], np.nan, dtype=field.dtype)
+    below = np.empty(field.shape[1:], dtype=bool)
+
+    for x in range(0, field.shape[0]):
+        np.less(field[x], max_value, out=below)
+        np.fmax(joint, field[x], out=joint, where=below)
+
+    return joint
+
+
 class ScanData(abc.ABC):
     """
     This is a base class which IrisData, NexradData all inherit
@@ -28,10 +139,11 @@ class ScanData(abc.ABC):
 
     def __init__(self, metadata, grid_info, scan_datetime):
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.metadata = metadata
         self.grid_info = grid_info
         self.datetime = scan_datetime
+        self.dtype = get_dtype(self.config)
         self.validate_scan()
 
 
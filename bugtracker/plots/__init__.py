@@ -1,7 +1,16 @@
-import bugtracker.plots.parallel
-import bugtracker.plots.radial
-import bugtracker.plots.simple
-import bugtracker.plots.dbz
-import bugtracker.plots.identify
-import bugtracker.plots.alignment
-import bugtracker.plots.animation
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first attribute access, see bugtracker/__init__.py
+_submodules = ['parallel', 'radial', 'simple', 'dbz', 'identify', 'alignment', 'animation', 'raster', 'template', 'policy', 'plot_queue']
+
+
+def __getattr__(name):
+
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -16,34 +16,269 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+"""
+One video per plot keyword (e.g. filtered_angle_0.5, joint_product),
+set in the animation section of the config:
+
+"source": "plots" reads the PNG plots of plot_dir, "netcdf" renders
+          the frames from the netCDF4 outputs with the quicklook
+          renderer (raster.py), straight into the encoder
+"codec": "mp4v" (.mp4) or "MJPG" (.avi)
+"fps": frames per second
+"scale": frame size relative to the plots (PNG source) or to the
+         default quicklook height (netcdf source)
+"workers": processes encoding videos in parallel, 0 for one per CPU
+
+Each keyword is encoded by its own worker process, and frames are
+never written to disk.
+"""
+
 import os
 import glob
 import datetime
+import multiprocessing as mp
 
+import numpy as np
+import netCDF4 as nc
 import cv2
 
 import bugtracker
+import bugtracker.core.cache
+import bugtracker.core.metadata
+import bugtracker.io.lookup
+import bugtracker.io.models
+import bugtracker.plots.raster
+
+
+SOURCES = ['plots', 'netcdf']
+
+# Codec -> video file extension
+CODECS = {'mp4v': '.mp4', 'MJPG': '.avi'}
+
+
+def get_settings(config, args=None):
+    """
+    Animation settings from the config, overridden by the command
+    line arguments that are set (not None).
+    """
+
+    settings = dict(config['animation'])
+
+    if args is not None:
+        for key in ['source', 'codec', 'fps', 'scale', 'workers']:
+            value = getattr(args, key, None)
+            if value is not None:
+                settings[key] = value
+
+    if settings['source'] not in SOURCES:
+        raise ValueError(f"Invalid animation source: {settings['source']}, must be one of {SOURCES}")
+
+    if settings['codec'] not in CODECS:
+        raise ValueError(f"Invalid animation codec: {settings['codec']}, must be one of {list(CODECS.keys())}")
+
+    if settings['fps'] <= 0 or settings['scale'] <= 0 or settings['scale'] > 1:
+        raise ValueError(f"Invalid animation fps/scale: {settings['fps']}, {settings['scale']}")
+
+    if settings['workers'] < 0:
+        raise ValueError(f"Invalid animation workers: {settings['workers']}")
+
+    return settings
+
+
+def even_size(width, height, scale=1.0):
+    """
+    Scaled (width, height), rounded down to even numbers as some
+    codecs require.
+    """
+
+    width = max(2, int(width * scale) // 2 * 2)
+    height = max(2, int(height * scale) // 2 * 2)
+
+    return width, height
+
+
+class VideoEncoder:
+    """
+    Writes RGB frames to a video, resizing them to the size of the
+    video if needed.
+    """
+
+    def __init__(self, video_name, codec, fps, size):
+
+        self.video_name = video_name
+        self.size = size
+        self.num_frames = 0
+
+        fourcc = cv2.VideoWriter_fourcc(*codec)
+        self.writer = cv2.VideoWriter(video_name, fourcc, float(fps), size)
+
+        if not self.writer.isOpened():
+            raise ValueError(f"Cannot open video writer ({codec}): {video_name}")
+
+
+    def write(self, rgb_frame):
+
+        height, width = rgb_frame.shape[0:2]
+
+        if (width, height) != self.size:
+            rgb_frame = cv2.resize(rgb_frame, self.size, interpolation=cv2.INTER_AREA)
+
+        self.writer.write(np.ascontiguousarray(rgb_frame[:,:,::-1]))
+        self.num_frames += 1
+
+
+    def release(self):
+
+        self.writer.release()
+
+
+def frame_label(product, elev=None):
+    """
+    Keyword of a product, same as in the plot filenames
+    """
+
+    if product == 'joint':
+        return "joint_product"
+
+    return f"{product}_angle_{elev:.1f}"
+
+
+def png_worker(video_name, image_list, codec, fps, scale):
+    """
+    Encodes a list of PNG plots, returns the number of frames.
+    """
+
+    first = cv2.imread(image_list[0])
+    height, width = first.shape[0:2]
+
+    encoder = VideoEncoder(video_name, codec, fps, even_size(width, height, scale))
+
+    for image in image_list:
+        frame = cv2.imread(image)
+        if frame is None:
+            print(f"Skipping unreadable plot: {image}")
+            continue
+        # imread is BGR, the encoder expects RGB
+        encoder.write(frame[:,:,::-1])
+
+    encoder.release()
+    print(f"Created video: {video_name} ({encoder.num_frames} frames)")
+
+    return encoder.num_frames
+
+
+def read_field(dset, product, elev):
+    """
+    The 2D field of a product in an open output file, None if the
+    file has no such elevation (or no target_id).
+    """
+
+    if product == 'joint':
+        return dset.variables['dbz_joint'][:,:]
+
+    variables = {'filtered': 'dbz_filtered', 'unfiltered': 'dbz_unfiltered', 'target_id': 'target_id'}
+    name = variables[product]
+
+    if name not in dset.variables:
+        return None
+
+    labels = [f"{value:.1f}" for value in dset.variables['dbz_elevs'][:]]
+    elev_label = f"{elev:.1f}"
+
+    if elev_label not in labels:
+        return None
+
+    return dset.variables[name][labels.index(elev_label),:,:]
+
+
+def netcdf_worker(video_name, output_files, product, elev, layout, background, codec, fps):
+    """
+    Renders the frames of one keyword from the output files, only
+    reading the field needed. Returns the number of frames.
+    """
+
+    renderer = bugtracker.plots.raster.QuicklookRenderer(layout, background)
+    label = frame_label(product, elev)
+    encoder = None
+
+    for output_file in output_files:
+        dset = nc.Dataset(output_file, mode='r')
+        scan_dt = bugtracker.io.models.output_datetime(output_file, dset)
+        data = read_field(dset, product, elev)
+        dset.close()
+
+        if data is None:
+            continue
+
+        title = label + scan_dt.strftime(" at %Y-%m-%d %H:%M UTC")
+
+        if product == 'target_id':
+            frame = np.asarray(renderer.target_id_image(data, title))
+        else:
+            frame = np.asarray(renderer.dbz_image(data, title, min_value=-15.0, max_value=40.0))
+
+        if encoder is None:
+            height, width = frame.shape[0:2]
+            encoder = VideoEncoder(video_name, codec, fps, even_size(width, height))
+
+        encoder.write(frame)
+
+    if encoder is None:
+        print(f"No frames for {label}")
+        return 0
+
+    encoder.release()
+    print(f"Created video: {video_name} ({encoder.num_frames} frames)")
+
+    return encoder.num_frames
+
+
+def netcdf_keywords(output_file):
+    """
+    (product, elev) of every animation in an output file
+    """
+
+    dset = nc.Dataset(output_file, mode='r')
+    dbz_elevs = [float(elev) for elev in dset.variables['dbz_elevs'][:]]
+    has_target_id = 'target_id' in dset.variables
+    dset.close()
+
+    keywords = []
+
+    for product in ['filtered', 'unfiltered', 'target_id']:
+        if product == 'target_id' and not has_target_id:
+            continue
+        for elev in dbz_elevs:
+            keywords.append((product, elev))
+
+    keywords.append(('joint', None))
+
+    return keywords
 
 
 class AnimationManager:
 
     def __init__(self, config, args):
-        
+
         self.config = config
+        self.settings = get_settings(config, args)
 
         self.date_fmt = "%Y%m%d%H%M"
         self.start = datetime.datetime.strptime(args.start, self.date_fmt)
         self.stop = datetime.datetime.strptime(args.stop, self.date_fmt)
         self.anim_dir = self.config['animation_dir']
+        self.station = args.station.lower().strip()
 
         if not os.path.isdir(self.anim_dir):
             raise FileNotFoundError(self.anim_dir)
 
-        self.plot_dir = self.get_plot_dir(args)
-
-        all_plots = self.get_all_plots()
-
-        self.filtered_plots = self.filter_dates(all_plots)
+        if self.settings['source'] == 'plots':
+            self.plot_dir = self.get_plot_dir(args)
+            all_plots = self.get_all_plots()
+            self.filtered_plots = self.filter_dates(all_plots)
+        else:
+            self.output_files = bugtracker.io.lookup.find_output_files(config, self.station, self.start, self.stop)
+            print("Num output files:", len(self.output_files))
 
 
     def get_folder(self, dt):
@@ -84,8 +319,7 @@ class AnimationManager:
 
         base_plot_dir = self.config['plot_dir']
 
-        station = args.station.lower().strip()
-        plot_dir = os.path.join(base_plot_dir, station)
+        plot_dir = os.path.join(base_plot_dir, self.station)
 
         if not os.path.isdir(plot_dir):
             raise FileNotFoundError(plot_dir)
@@ -116,37 +350,94 @@ class AnimationManager:
         return filtered_dates
 
 
-    def create_animation(self, image_list, label):
-
-        frame = cv2.imread(image_list[0])
+    def video_name(self, label):
 
-        video_name = os.path.join(self.anim_dir, label + ".avi")
-        print("Creating video:", video_name)
-        height, width, layers = frame.shape
+        return os.path.join(self.anim_dir, label + CODECS[self.settings['codec']])
 
-        video = cv2.VideoWriter(video_name, 0, 1, (width, height))
 
-        for image in image_list:
-            video.write(cv2.imread(image))
-
-        cv2.destroyAllWindows()
-        video.release()
-
-
-    def animate_all(self):
+    def plot_buckets(self):
 
         self.filtered_plots.sort()
-        self.plot_bucket = dict()
+        plot_bucket = dict()
 
         for plot in self.filtered_plots:
             basename = os.path.basename(plot)
             element_list = basename.split('_')
             keyword = "_".join(element_list[1:])
             keyword = keyword[0:-4]
-            if keyword in self.plot_bucket:
-                self.plot_bucket[keyword].append(plot)
+            if keyword in plot_bucket:
+                plot_bucket[keyword].append(plot)
             else:
-                self.plot_bucket[keyword] = [plot]
+                plot_bucket[keyword] = [plot]
+
+        return plot_bucket
+
+
+    def plot_args(self):
+
+        codec = self.settings['codec']
+        fps = self.settings['fps']
+        scale = self.settings['scale']
+
+        args = []
+
+        for key, image_list in self.plot_buckets().items():
+            args.append((self.video_name(key), image_list, codec, fps, scale))
+
+        return args
+
+
+    def netcdf_args(self):
+
+        if len(self.output_files) == 0:
+            return []
+
+        calib_file = bugtracker.io.lookup.find_calib_file(self.config, self.station)
+        radar_id, grid_info = bugtracker.core.cache.calib_grid(calib_file)
+
+        dset = nc.Dataset(self.output_files[0], mode='r')
+        metadata = bugtracker.core.metadata.Metadata(radar_id, self.start, float(dset.getncattr('latitude')),
+                                                     float(dset.getncattr('longitude')), radar_id)
+        dset.close()
+
+        # Frames are rendered at the scaled size, no resizing needed
+        max_range = self.config["plot_settings"]["max_range"]
+        height = int(bugtracker.plots.raster.DEFAULT_HEIGHT * self.settings['scale'])
+        layout = bugtracker.plots.raster.get_layout(self.config, metadata, grid_info, max_range, height=height)
+        background = bugtracker.plots.raster.get_background(self.config, layout)
+
+        codec = self.settings['codec']
+        fps = self.settings['fps']
+
+        args = []
+
+        for product, elev in netcdf_keywords(self.output_files[-1]):
+            label = frame_label(product, elev)
+            args.append((self.video_name(label), self.output_files, product, elev, layout, background, codec, fps))
+
+        return args
+
+
+    def animate_all(self):
+
+        if self.settings['source'] == 'plots':
+            worker = png_worker
+            args = self.plot_args()
+        else:
+            worker = netcdf_worker
+            args = self.netcdf_args()
+
+        if len(args) == 0:
+            print("Nothing to animate")
+            return
+
+        processes = self.settings['workers']
+        if processes == 0:
+            processes = None
+
+        pool = mp.Pool(processes)
+        frames = pool.starmap(worker, args)
+        pool.close()
+        pool.join()
 
-        for key in self.plot_bucket:
-            self.create_animation(self.plot_bucket[key], key)
+        print(f"Created {len(args)} videos, {sum(frames)} frames")
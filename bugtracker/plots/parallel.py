@@ -25,8 +25,14 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 import bugtracker.config
+import bugtracker.core.memory
+import bugtracker.core.profiling
+import bugtracker.core.tracing
 from bugtracker.plots.radial import RadialPlotter
 from bugtracker.plots.identify import TargetIdPlotter
+import bugtracker.plots.raster
+import bugtracker.plots.policy
+from bugtracker.io.scan import to_masked
 
 """
 Multiprocessing optimization:
@@ -68,6 +74,9 @@ def get_plotter(metadata, grid_info, scan_data, config, lats, lons, plot_type):
     if not os.path.isdir(full_folder):
         FileNotFoundError(f"This folder should have been created {full_folder}")
 
+    if bugtracker.plots.raster.get_renderer(config) == 'fast':
+        return bugtracker.plots.raster.FastPlotter(grid_info, full_folder, target_id=(plot_type == 'target_id'))
+
     if plot_type == 'target_id':
         return TargetIdPlotter(lats, lons, full_folder, grid_info)
     else:
@@ -77,6 +86,14 @@ def get_plotter(metadata, grid_info, scan_data, config, lats, lons, plot_type):
 def plot_worker(plot_type, metadata, grid_info, config, lats, lons, dbz_idx, scan_data, id_matrix):
 
     plot_type = plot_type.lower().strip()
+
+    # Each worker process profiles its own plots (--profile)
+    with bugtracker.core.profiling.stage(f"plot_{plot_type}", f"level {dbz_idx}"):
+        plot_product(plot_type, metadata, grid_info, config, lats, lons, dbz_idx, scan_data, id_matrix)
+
+
+def plot_product(plot_type, metadata, grid_info, config, lats, lons, dbz_idx, scan_data, id_matrix):
+
     plotter = get_plotter(metadata, grid_info, scan_data, config, lats, lons, plot_type)
 
 
@@ -110,7 +127,7 @@ def plot_level(plotter, metadata, config, scan_data, dbz_idx, filtered=True):
         dbz_field = scan_data.dbz_unfiltered
 
     elev = scan_data.dbz_elevs[dbz_idx]
-    data = dbz_field[dbz_idx,:,:]
+    data = to_masked(dbz_field[dbz_idx,:,:])
     label = f"{prefix}_angle_{elev:.1f}"
     print(f"Plotting: {label}")
 
@@ -141,7 +158,7 @@ def plot_joint_product(plotter, metadata, config, scan_data):
 
     max_range = config["plot_settings"]["max_range"]
 
-    data = scan_data.joint_product[:,:]
+    data = to_masked(scan_data.joint_product[:,:])
     label = f"joint_product"
     print(f"Plotting: {label}")
     plotter.set_data(data, label, scan_data.datetime, metadata, max_range)
@@ -159,15 +176,26 @@ class ParallelPlotter:
     happen at the same time.
     """
 
-    def __init__(self, lats, lons, metadata, grid_info, scan_data, id_matrix):
+    def __init__(self, lats, lons, metadata, grid_info, scan_data, id_matrix, jobs=None):
+        """
+        jobs is a list of PlotJob (see policy.py), None plots everything.
+        """
 
-        self.config = bugtracker.config.load("./bugtracker.json")
+        self.config = bugtracker.config.get()
         self.lats = lats
         self.lons = lons
         self.metadata = metadata
         self.scan_data = scan_data
         self.id_matrix = id_matrix
 
+        # By default, every product at every elevation
+        if jobs is None:
+            policy = bugtracker.plots.policy.PlotPolicy()
+            jobs = policy.jobs(metadata.radar_id, scan_data.datetime, scan_data.dbz_elevs)
+
+        if len(jobs) == 0:
+            return
+
         radar_id = metadata.radar_id
         plot_dir = self.config['plot_dir']
         output_folder = os.path.join(plot_dir, radar_id)
@@ -178,32 +206,44 @@ class ParallelPlotter:
             print(f"Making folders recursively: {full_folder}")
             os.makedirs(full_folder)
 
-        dbz_elevs = scan_data.dbz_elevs
-        num_elevs = len(dbz_elevs)
+        # The quicklook layout and background are built once here (and
+        # cached on disk), instead of by every worker on the first scan
+        if bugtracker.plots.raster.get_renderer(self.config) == 'fast':
+            max_range = self.config["plot_settings"]["max_range"]
+            layout = bugtracker.plots.raster.get_layout(self.config, metadata, grid_info, max_range)
+            bugtracker.plots.raster.get_background(self.config, layout)
 
         args = []
 
-        for idx in range(0, num_elevs):
-            plot_type = "filtered"
-            arglist = (plot_type, metadata, grid_info, self.config, lats, lons, idx, scan_data, None)
+        for job in jobs:
+            job_matrix = id_matrix if job.product == 'target_id' else None
+            arglist = (job.product, metadata, grid_info, self.config, lats, lons, job.level, scan_data, job_matrix)
             args.append(arglist)
 
-        for idx in range(0, num_elevs):
-            plot_type = "unfiltered"
-            arglist = (plot_type, metadata, grid_info, self.config, lats, lons, idx, scan_data, None)
-            args.append(arglist)
+        processes = self.pool_size(len(args))
 
-        for idx in range(0, num_elevs):
-            plot_type = "target_id"
-            arglist = (plot_type, metadata, grid_info, self.config, lats, lons, idx, scan_data, id_matrix)
-            args.append(arglist)
+        # The workers trace their own plots (--trace), the gaps between
+        # them show the pickling of the scan and the pool imbalance
+        with bugtracker.core.tracing.span("plot_pool", "plot", jobs=len(args), processes=processes or os.cpu_count()):
+            self.pool = mp.Pool(processes)
+            self.pool.starmap(plot_worker, args)
+            self.pool.close()
+            self.pool.join()
+
+
+    def pool_size(self, jobs):
+        """
+        Number of worker processes, one per cpu by default. With a
+        memory budget, as many as fit, each receiving a copy of the scan.
+        """
+
+        budget = bugtracker.core.memory.from_config(self.config)
 
-        #Only one vertical level here (as it's all put into one level)
-        joint_args = ("joint", metadata, grid_info, self.config, lats, lons, None, scan_data, None)
-        args.append(joint_args)
+        if budget is None:
+            return None
 
-        self.pool = mp.Pool()
-        self.pool.starmap(plot_worker, args)
-        self.pool.close()
-        self.pool.join()
+        payload = bugtracker.core.memory.array_bytes(self.scan_data, self.lats, self.lons, self.id_matrix)
+        processes = budget.workers(payload, jobs)
+        print(f"Plot pool: {processes} workers ({jobs} plots)")
 
+        return processes
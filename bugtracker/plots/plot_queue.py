@@ -0,0 +1,295 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+On-disk queue of deferred plot jobs (plot_settings.mode = "deferred").
+
+The processors only add a row per PlotJob to a SQLite database in
+the cache folder (cache/plot_queue.sqlite), and plot.py makes the
+plots later from the netCDF4 outputs. This keeps the processing
+latency independent of the rendering.
+
+A job is 'pending' until plotted, then 'done' (or 'failed', with the
+error message). Queuing the same plot again resets it to pending.
+"""
+
+import os
+import json
+import sqlite3
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+
+import bugtracker.core.grid
+import bugtracker.core.metadata
+import bugtracker.io.models
+import bugtracker.plots.parallel
+from bugtracker.plots.policy import PlotJob
+
+
+DT_FMT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    radar_id TEXT NOT NULL,
+    scan_dt TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    calib_path TEXT NOT NULL,
+    grid_info TEXT NOT NULL,
+    product TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    queued TEXT NOT NULL,
+    message TEXT,
+    UNIQUE (output_path, product, level)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, radar_id, scan_dt);
+"""
+
+# The joint product has no elevation index, stored as -1
+JOINT_LEVEL = -1
+
+
+def queue_filepath(config):
+
+    cache_dir = config['cache_dir']
+    return os.path.join(cache_dir, "plot_queue.sqlite")
+
+
+def grid_to_json(grid_info):
+
+    return json.dumps([grid_info.gates, grid_info.azims, grid_info.gate_step, grid_info.azim_step,
+                       grid_info.azim_offset, grid_info.gate_offset])
+
+
+def grid_from_json(grid_json):
+
+    return bugtracker.core.grid.GridInfo(*json.loads(grid_json))
+
+
+class PlotQueue:
+
+    def __init__(self, db_path):
+
+        self.db_path = db_path
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+
+    def enqueue(self, metadata, scan_dt, output_path, calib_path, grid_info, jobs):
+        """
+        Adds the jobs of one scan, in one transaction.
+        """
+
+        queued = datetime.datetime.utcnow().strftime(DT_FMT)
+        grid_json = grid_to_json(grid_info)
+        output_path = os.path.abspath(output_path)
+        calib_path = os.path.abspath(calib_path)
+
+        rows = []
+        for job in jobs:
+            level = JOINT_LEVEL if job.level is None else int(job.level)
+            rows.append((metadata.radar_id.lower(), scan_dt.strftime(DT_FMT), output_path, calib_path,
+                         grid_json, job.product, level, 'pending', queued))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO jobs (radar_id, scan_dt, output_path, calib_path, grid_info, "
+                "product, level, status, queued) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+    def pending(self, radar_id=None, limit=None):
+        """
+        Pending jobs, oldest scans first, grouped by output file.
+        Returns a list of (output_path, rows).
+        """
+
+        sql = "SELECT * FROM jobs WHERE status = 'pending'"
+        params = []
+
+        if radar_id is not None:
+            sql += " AND radar_id = ?"
+            params.append(radar_id.lower())
+
+        sql += " ORDER BY scan_dt, output_path, id"
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        groups = []
+
+        for row in self.conn.execute(sql, params):
+            row = dict(row)
+            if len(groups) == 0 or groups[-1][0] != row['output_path']:
+                groups.append((row['output_path'], []))
+            groups[-1][1].append(row)
+
+        return groups
+
+
+    def set_status(self, job_ids, status, message=None):
+
+        with self.conn:
+            self.conn.executemany("UPDATE jobs SET status = ?, message = ? WHERE id = ?",
+                                  [(status, message, job_id) for job_id in job_ids])
+
+
+    def retry_failed(self, radar_id=None):
+
+        sql = "UPDATE jobs SET status = 'pending', message = NULL WHERE status = 'failed'"
+        params = []
+
+        if radar_id is not None:
+            sql += " AND radar_id = ?"
+            params.append(radar_id.lower())
+
+        with self.conn:
+            self.conn.execute(sql, params)
+
+
+    def counts(self):
+
+        sql = "SELECT status, COUNT(*) AS num FROM jobs GROUP BY status"
+        return {row['status']: row['num'] for row in self.conn.execute(sql)}
+
+
+    def close(self):
+
+        self.conn.close()
+
+
+def row_to_job(row):
+
+    level = None if row['level'] == JOINT_LEVEL else row['level']
+    return PlotJob(row['product'], level)
+
+
+class OutputScan:
+    """
+    The fields of an output file needed by the plot workers, with the
+    same attribute names as the ScanData objects. scan_dt is the time
+    the scan was queued with, the file name is used otherwise.
+    """
+
+    def __init__(self, output_path, scan_dt=None):
+
+        if not os.path.isfile(output_path):
+            raise FileNotFoundError(f"Missing output file {output_path}")
+
+        dset = nc.Dataset(output_path, mode='r')
+
+        # Older outputs may not have the radar name
+        radar_name = dset.getncattr('radar_id')
+        if 'name' in dset.ncattrs():
+            radar_name = dset.getncattr('name')
+
+        if scan_dt is None:
+            scan_dt = bugtracker.io.models.output_datetime(output_path, dset)
+
+        self.metadata = bugtracker.core.metadata.Metadata(dset.getncattr('radar_id'), scan_dt,
+                                                          float(dset.getncattr('latitude')),
+                                                          float(dset.getncattr('longitude')),
+                                                          radar_name)
+        self.datetime = scan_dt
+        self.dbz_elevs = [float(elev) for elev in dset.variables['dbz_elevs'][:]]
+        self.dbz_filtered = dset.variables['dbz_filtered'][:,:,:]
+        self.dbz_unfiltered = dset.variables['dbz_unfiltered'][:,:,:]
+        self.joint_product = dset.variables['dbz_joint'][:,:]
+
+        self.id_matrix = None
+        if 'target_id' in dset.variables:
+            self.id_matrix = np.array(dset.variables['target_id'][:,:,:])
+
+        dset.close()
+
+
+def load_latlon(calib_path):
+
+    dset = nc.Dataset(calib_path, mode='r')
+    lats = dset.variables['lats'][:,:]
+    lons = dset.variables['lons'][:,:]
+    dset.close()
+
+    return lats, lons
+
+
+def drain(queue, radar_id=None, limit=None):
+    """
+    Makes the pending plots, one output file at a time. Returns the
+    number of (done, failed) jobs.
+    """
+
+    done = 0
+    failed = 0
+    latlons = dict()
+
+    for output_path, rows in queue.pending(radar_id=radar_id, limit=limit):
+        job_ids = [row['id'] for row in rows]
+
+        try:
+            scan_dt = datetime.datetime.strptime(rows[0]['scan_dt'], DT_FMT)
+            scan = OutputScan(output_path, scan_dt)
+            jobs = [row_to_job(row) for row in rows]
+
+            if scan.id_matrix is None and any(job.product == 'target_id' for job in jobs):
+                raise ValueError(f"No target_id field in {output_path}")
+
+            # Levels missing from the output (e.g. queued from all the
+            # scanned elevations) fail on their own
+            num_levels = len(scan.dbz_elevs)
+            missing = [row['id'] for row, job in zip(rows, jobs) if job.level is not None and job.level >= num_levels]
+
+            if len(missing) > 0:
+                print(f"{len(missing)} plot jobs beyond the {num_levels} levels of {output_path}")
+                queue.set_status(missing, 'failed', f"Level not in output ({num_levels} levels)")
+                failed += len(missing)
+
+                jobs = [job for row, job in zip(rows, jobs) if row['id'] not in missing]
+                job_ids = [job_id for job_id in job_ids if job_id not in missing]
+
+                if len(jobs) == 0:
+                    continue
+
+            calib_path = rows[0]['calib_path']
+            if calib_path not in latlons:
+                latlons[calib_path] = load_latlon(calib_path)
+            lats, lons = latlons[calib_path]
+
+            grid_info = grid_from_json(rows[0]['grid_info'])
+
+            print(f"Plotting {len(jobs)} jobs: {output_path}")
+            bugtracker.plots.parallel.ParallelPlotter(lats, lons, scan.metadata, grid_info, scan,
+                                                      scan.id_matrix, jobs=jobs)
+        except Exception as error:
+            # Any error (including from the plot workers) fails the
+            # jobs of this file, the others are still plotted
+            print(f"Plot jobs failed for {output_path}: {error!r}")
+            queue.set_status(job_ids, 'failed', str(error))
+            failed += len(job_ids)
+            continue
+
+        queue.set_status(job_ids, 'done')
+        done += len(job_ids)
+
+    return done, failed
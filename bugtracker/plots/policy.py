@@ -0,0 +1,263 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Which plots are made for a scan, set in the plot_settings section of
+the config:
+
+"mode": "inline" (plotted during processing) or "deferred" (plot
+jobs are queued, see plot_queue.py, and made later by plot.py)
+
+"products": one entry per product to plot, products missing from
+this dict are never plotted. For example:
+
+"products": {
+    "joint": {"cadence": 0, "elevations": []},
+    "target_id": {"cadence": 60, "elevations": [0.5, 1.5]}
+}
+
+cadence - minutes between plots, 0 plots every scan. With a cadence
+          of 60, the first scan of each hour is plotted. The last
+          plotted period of each station and product is kept in
+          cache_dir/plot_policy.sqlite, since tracker.py is usually
+          run once per scan.
+elevations - elevation angles (degrees) to plot, [] plots them all.
+             Not used by the joint product, which has one level.
+"""
+
+import os
+import sqlite3
+import datetime
+
+
+PRODUCTS = ['joint', 'filtered', 'unfiltered', 'target_id']
+MODES = ['inline', 'deferred']
+
+# Tolerance when matching configured and scanned elevation angles
+ELEV_TOLERANCE = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS last_bucket (
+    radar_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    PRIMARY KEY (radar_id, product)
+);
+"""
+
+
+def state_filepath(config):
+
+    cache_dir = config['cache_dir']
+    return os.path.join(cache_dir, "plot_policy.sqlite")
+
+
+def default_products():
+
+    products = dict()
+
+    for product in PRODUCTS:
+        products[product] = {"cadence": 0, "elevations": []}
+
+    return products
+
+
+class PlotJob:
+    """
+    One plot: a product and an elevation index (None for joint).
+    """
+
+    def __init__(self, product, level=None):
+
+        if product not in PRODUCTS:
+            raise ValueError(f"Unrecognizable plot type: {product}")
+
+        if product == 'joint' and level is not None:
+            raise ValueError("The joint product has no elevation index")
+
+        if product != 'joint' and level is None:
+            raise ValueError(f"Missing elevation index for {product}")
+
+        self.product = product
+        self.level = level
+
+
+    def __str__(self):
+        return f"PlotJob: {self.product}, level {self.level}"
+
+
+    def __eq__(self, other):
+        return self.product == other.product and self.level == other.level
+
+
+class ProductPolicy:
+
+    def __init__(self, product, cadence=0, elevations=None):
+
+        if product not in PRODUCTS:
+            raise ValueError(f"Invalid plot product: {product}, must be one of {PRODUCTS}")
+
+        if isinstance(cadence, bool) or not isinstance(cadence, (int, float)) or cadence < 0:
+            raise ValueError(f"Invalid cadence for {product}: {cadence}")
+
+        if elevations is None:
+            elevations = []
+
+        if not isinstance(elevations, list):
+            raise ValueError(f"Invalid elevations for {product}: {elevations}")
+
+        self.product = product
+        self.cadence = cadence
+        self.elevations = [float(elev) for elev in elevations]
+
+
+    def bucket(self, scan_dt):
+        """
+        Index of the cadence period containing scan_dt
+        """
+
+        minutes = (scan_dt - datetime.datetime(1970, 1, 1)).total_seconds() / 60.0
+        return int(minutes // self.cadence)
+
+
+    def levels(self, dbz_elevs):
+
+        if self.product == 'joint':
+            return [None]
+
+        levels = []
+
+        for x in range(0, len(dbz_elevs)):
+            if len(self.elevations) == 0:
+                levels.append(x)
+            elif any(abs(dbz_elevs[x] - elev) < ELEV_TOLERANCE for elev in self.elevations):
+                levels.append(x)
+
+        return levels
+
+
+class PlotPolicy:
+    """
+    Keeps the last plotted cadence period of each product, in the
+    state_path database if given (shared by the processes), in memory
+    otherwise.
+    """
+
+    def __init__(self, mode="inline", products=None, state_path=None):
+
+        if mode not in MODES:
+            raise ValueError(f"Invalid plot mode: {mode}, must be one of {MODES}")
+
+        if products is None:
+            products = default_products()
+
+        if not isinstance(products, dict):
+            raise ValueError(f"Invalid plot products: {products}")
+
+        self.mode = mode
+        self.products = dict()
+
+        for product, settings in products.items():
+            if not isinstance(settings, dict) or not set(settings.keys()) <= {'cadence', 'elevations'}:
+                raise ValueError(f"Invalid plot settings for {product}: {settings}")
+            self.products[product] = ProductPolicy(product, **settings)
+
+        self.last_bucket = dict()
+        self.conn = None
+
+        if state_path is not None:
+            self.conn = sqlite3.connect(state_path)
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+
+
+    def __str__(self):
+        rep = "PlotPolicy:\n"
+
+        rep += f"mode: {self.mode}\n"
+        for product, policy in self.products.items():
+            rep += f"{product}: cadence {policy.cadence} min, elevations {policy.elevations}\n"
+
+        return rep
+
+
+    def is_due(self, radar_id, product, scan_dt):
+
+        policy = self.products[product]
+
+        if policy.cadence == 0:
+            return True
+
+        key = (radar_id.lower(), product)
+        bucket = policy.bucket(scan_dt)
+
+        if self.get_last_bucket(key) == bucket:
+            return False
+
+        self.set_last_bucket(key, bucket)
+        return True
+
+
+    def get_last_bucket(self, key):
+
+        if self.conn is None:
+            return self.last_bucket.get(key)
+
+        row = self.conn.execute("SELECT bucket FROM last_bucket WHERE radar_id = ? AND product = ?", key).fetchone()
+        return None if row is None else row[0]
+
+
+    def set_last_bucket(self, key, bucket):
+
+        self.last_bucket[key] = bucket
+
+        if self.conn is not None:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO last_bucket (radar_id, product, bucket) VALUES (?, ?, ?)",
+                                  (key[0], key[1], bucket))
+
+
+    def jobs(self, radar_id, scan_dt, dbz_elevs):
+        """
+        The list of PlotJob for a scan, in the same order as the
+        ParallelPlotter used to make them.
+        """
+
+        jobs = []
+
+        for product in ['filtered', 'unfiltered', 'target_id', 'joint']:
+            if product not in self.products:
+                continue
+
+            if not self.is_due(radar_id, product, scan_dt):
+                continue
+
+            for level in self.products[product].levels(dbz_elevs):
+                jobs.append(PlotJob(product, level))
+
+        return jobs
+
+
+def from_config(config):
+
+    settings = config['plot_settings']
+
+    mode = settings.get('mode', 'inline')
+    products = settings.get('products', default_products())
+
+    return PlotPolicy(mode, products, state_filepath(config))
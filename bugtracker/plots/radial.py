@@ -19,34 +19,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 The ability to generate radial plots on a variety of radar
 parameters is an important part of this library.
+
+The static parts of the plots (map features, grid, range rings,
+colour bar) come from a FigureTemplate, built once per site and
+colour scale, see bugtracker/plots/template.py
 """
 
 
 import os
-import sys
-import glob
-import datetime
-from contextlib import contextmanager
 
 import numpy as np
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import geopy
-import geopy.distance
-import netCDF4 as nc
-
 
-@contextmanager
-def suppress_stderr():
-    with open(os.devnull, 'w') as devnull:
-        valid_stderr = sys.stderr
-        sys.stderr = devnull
-        try:
-            yield
-        finally:
-            sys.stderr = valid_stderr
+import bugtracker.plots.template
 
 
 class RadialPlotter():
@@ -62,41 +47,13 @@ class RadialPlotter():
         if not os.path.isdir(output_folder):
             raise FileNotFoundError("Folder not found:", output_folder)
 
-        self.ax = None
-        self.fig = None
-
         self.lats = lats
         self.lons = lons
         self.grid_info = grid_info
+        self.dpi = 200
 
 
-    def _set_grid(self):
-        """
-        Private function for setting grid
-        """
-
-        #TODO: Don't hard-code these bounds
-
-        major_ticks_lat = np.arange(35, 60, 1)
-        minor_ticks_lat = np.arange(35, 60, 0.2)
-        major_ticks_lon = np.arange(-140, -60, 1.0)
-        minor_ticks_lon = np.arange(-140, -60, 0.2)
-
-        """
-        Disabling warning from geoaxes (cartopy)
-        """
-        with suppress_stderr():
-
-            self.ax.set_xticks(ticks=major_ticks_lon)
-            self.ax.set_xticks(ticks=minor_ticks_lon, minor=True)
-            self.ax.set_yticks(ticks=major_ticks_lat)
-            self.ax.set_yticks(ticks=minor_ticks_lat, minor=True)
-
-            self.ax.grid(which='minor', alpha=0.2)
-            self.ax.grid(which='major', alpha=0.5)
-
-
-    def _set_contours(self, min_value=(-10), max_value=40):
+    def _draw_contours(self, ax, min_value, max_value):
 
         # It is logical to take the integer floor(min) and ceil(max) values
         # of the data array, given the ranges we are dealing with. Directly taking
@@ -105,46 +62,23 @@ class RadialPlotter():
         # TODO: This currently throws a plotting exception if the values
         # are equal to each other and are an integer (i.e. the exceptional case that all values are zero)
 
-        min_data = min_value
-        max_data = max_value
-
         # Number of distinct color levels
-        gradations = 22
-        gradation_step = (max_data - min_data) / float(gradations)
-
-        CS2 = plt.contourf(self.lons, self.lats, self.data, gradations,
-            transform=ccrs.PlateCarree(), cmap='jet', vmin=min_data, vmax=max_data)
+        gradations = bugtracker.plots.template.DBZ_GRADATIONS
 
-        m = plt.cm.ScalarMappable(cmap=plt.cm.jet)
-        m.set_array(self.data)
-        m.set_clim(min_data, max_data)
-        cbar = plt.colorbar(m, boundaries=np.arange(min_data, max_data, gradation_step))
-        cbar.ax.set_ylabel(self.label)
+        contours = ax.contourf(self.lons, self.lats, self.data, gradations,
+            transform=ccrs.PlateCarree(), cmap='jet', vmin=min_value, vmax=max_value)
 
+        return [contours]
 
 
-    def _add_features(self):
-        """
-        Private function for creating features
-        """
-
-        states_provinces = cfeature.NaturalEarthFeature(
-            category='cultural',
-            name='admin_1_states_provinces_lines',
-            scale='10m',
-            facecolor='none')
-
-        coast = cfeature.NaturalEarthFeature(category='physical', scale='10m',
-            facecolor='none', name='coastline')
+    def _get_title(self, plot_type, plot_date):
+        return plot_type + plot_date.strftime(" at %Y-%m-%d %H:%M UTC")
 
-        self.ax.add_feature(cfeature.LAND.with_scale('10m'))
-        self.ax.add_feature(states_provinces.with_scale('10m'), edgecolor='gray')
-        self.ax.add_feature(cfeature.BORDERS.with_scale('10m'))
-        self.ax.add_feature(coast, edgecolor='black')
 
+    def _get_output_file(self):
 
-    def _get_title(self, plot_type, plot_date):
-        return plot_type + plot_date.strftime(" at %Y-%m-%d %H:%M UTC")
+        plot_filename = self.plot_datetime.strftime("%Y%m%d%H%M") + "_" + self.label + ".png"
+        return os.path.join(self.output_folder, plot_filename)
 
 
     def _fill_wedge(self):
@@ -158,101 +92,17 @@ class RadialPlotter():
         self.lons = np.ma.resize(self.lons, new_shape)
         self.data = np.ma.resize(self.data, new_shape)
 
-    def _set_range(self):
-
-        lat_0 = self.metadata.lat
-        lon_0 = self.metadata.lon
-
-        origin = geopy.Point(lat_0, lon_0)
-
-        max_dist_km = self.max_range
-        dist = geopy.distance.distance(kilometers=max_dist_km)
- 
-
-        west = dist.destination(origin, 270.0)
-        north = dist.destination(origin, 0.0)
-        east = dist.destination(origin, 90.0)
-        south = dist.destination(origin, 180.0)
-
-        min_lat = south.latitude
-        max_lat = north.latitude
-        min_lon = west.longitude
-        max_lon = east.longitude
-
-        self.range = [min_lon, max_lon, min_lat, max_lat]
-
-
-    def _set_cross(self):
-
-        lat_0 = self.metadata.lat
-        lon_0 = self.metadata.lon
-
-        plt.plot(lon_0, lat_0, marker='x', color='black')
-
-
-
-    def _set_circle(self, radius_km):
-
-        lat_0 = self.metadata.lat
-        lon_0 = self.metadata.lon
-
-        origin = geopy.Point(lat_0, lon_0)
-        dist = geopy.distance.distance(kilometers=radius_km)
- 
-        lats = []
-        lons = []
-
-        bearings = np.linspace(-180, 180, num=360)
-        for x in range(0, 360):
-            bearing = bearings[x]
-            destination = dist.destination(origin, bearing)
-            lats.append(destination.latitude)
-            lons.append(destination.longitude)
-
-        plt.plot(lons, lats, color='black', linewidth=0.4, alpha=0.5)
-
-
-    def _set_circles(self):
-
-        km_line = 25.0
-        increment_km = 25.0
-
-        while km_line <= self.max_range:
-            self._set_circle(km_line)
-            km_line += increment_km
-
-
-    def calculate_aspect(self):
-        """
-        Need an actual procedure here.
-        Will be based on lat/lon location.
-        """
-        return 1.4
-
 
     def save_plot(self, min_value=None, max_value=None):
         self._fill_wedge()
-        self._set_range()
-
-        aspect = self.calculate_aspect()
-        self.ax = plt.axes(projection=ccrs.PlateCarree(), aspect=aspect)
-        self.ax.set_xlabel('Longitude')
-        self.ax.set_ylabel('Latitude')
 
-        self._set_grid()
-        self._set_contours(min_value=min_value, max_value=max_value)
-        self._add_features()
-        self._set_cross()
-        self._set_circles()
+        template = bugtracker.plots.template.get_template(self.metadata, self.max_range, dpi=self.dpi,
+                                                          kind='dbz', min_value=min_value, max_value=max_value)
 
-        plt.title(self._get_title(self.label, self.plot_datetime))
-        self.ax.set_extent(self.range)
-
-        plot_filename = self.plot_datetime.strftime("%Y%m%d%H%M") + "_" + self.label + ".png"
-        output_file = os.path.join(self.output_folder, plot_filename)
+        draw_data = lambda ax: self._draw_contours(ax, min_value, max_value)
+        title = self._get_title(self.label, self.plot_datetime)
 
-        plt.savefig(output_file, dpi=200)
-        plt.gcf().clear()
+        template.save(self._get_output_file(), title, self.label, draw_data)
 
 
     def set_data(self, data, label, plot_datetime, metadata, max_range):
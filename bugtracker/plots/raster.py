@@ -0,0 +1,444 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Fast raster quicklooks, an alternative to the cartopy contourf plots
+of RadialPlotter (selected with plot_settings.renderer = "fast").
+
+For a radar site and extent, the (azim, gate) cell shown by every
+pixel of the output image is computed once, as is the background
+(land, coastlines, borders, range rings). Both are cached on disk in
+cache_dir/quicklook. Rendering a scan is then a gather of the polar
+values, a colour lookup table (np.take) and a PNG write.
+
+The image is a lat/lon (PlateCarree) raster, with the same extent as
+the cartopy plots.
+"""
+
+import os
+
+import numpy as np
+import matplotlib
+import matplotlib.colors
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import cartopy.crs as ccrs
+import pyart
+from PIL import Image, ImageDraw
+
+import bugtracker.config
+import bugtracker.core.geometry
+import bugtracker.core.metrics
+from bugtracker.plots.template import add_features, get_extent
+
+
+RENDERERS = ['cartopy', 'fast']
+
+# Height of the map in pixels, the width follows from the latitude
+DEFAULT_HEIGHT = 800
+
+# Same colours as the cartopy plots: 22 levels of 'jet' for the dBZ
+# fields, and clutter/rain/bugs for the target_id field
+DBZ_LEVELS = 22
+TARGET_ID_COLORS = ['red', 'blue', 'green']
+
+RING_STEP_KM = 25.0
+BAR_WIDTH = 60
+TITLE_HEIGHT = 24
+
+# RasterLayout and background arrays already loaded in this process
+_layouts = dict()
+_backgrounds = dict()
+
+
+def get_renderer(config):
+
+    renderer = config['plot_settings'].get('renderer', 'cartopy')
+
+    if renderer not in RENDERERS:
+        raise ValueError(f"Invalid plot renderer: {renderer}, must be one of {RENDERERS}")
+
+    return renderer
+
+
+def get_layout_key(metadata, grid_info, max_range, height):
+
+    radar_id = metadata.radar_id.lower()
+    site = f"{metadata.lat:.5f}_{metadata.lon:.5f}"
+    polar = f"{grid_info.azims}_{grid_info.gates}_{grid_info.azim_step}_{grid_info.gate_step}"
+    polar += f"_{grid_info.azim_offset}_{grid_info.gate_offset}"
+
+    return f"{radar_id}_{site}_{polar}_{max_range}_{height}"
+
+
+def quicklook_folder(config):
+    return os.path.join(config['cache_dir'], 'quicklook')
+
+
+class RasterLayout:
+    """
+    Pixel -> polar cell lookup of the quicklook image.
+
+    pixels are the flat indices (row-major, in the image) of the
+    pixels that show a gate, and cells the flat (azim * gates + gate)
+    index of that gate. ranges is the distance to the radar (km) of
+    every pixel, used for the range rings.
+    """
+
+    def __init__(self, extent, width, height, pixels, cells, ranges):
+
+        self.extent = extent
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+        self.cells = cells
+        self.ranges = ranges
+
+
+    def __str__(self):
+        rep = "RasterLayout:\n"
+
+        rep += f"extent: {self.extent}\n"
+        rep += f"size: {self.width} x {self.height}\n"
+        rep += f"pixels with data: {len(self.pixels)}\n"
+
+        return rep
+
+
+def build_layout(metadata, grid_info, max_range, height=DEFAULT_HEIGHT):
+
+    extent = get_extent(metadata, max_range)
+    min_lon, max_lon, min_lat, max_lat = extent
+
+    # Roughly square pixels on the ground
+    aspect = (max_lon - min_lon) * np.cos(np.radians(metadata.lat)) / (max_lat - min_lat)
+    width = int(round(height * aspect))
+
+    lon_step = (max_lon - min_lon) / width
+    lat_step = (max_lat - min_lat) / height
+    pixel_lons = min_lon + (np.arange(width) + 0.5) * lon_step
+    pixel_lats = max_lat - (np.arange(height) + 0.5) * lat_step
+
+    lon_grid, lat_grid = np.meshgrid(pixel_lons, pixel_lats)
+    x_arr, y_arr = pyart.core.geographic_to_cartesian_aeqd(lon_grid.ravel(), lat_grid.ravel(),
+                                                           metadata.lon, metadata.lat)
+
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    azim_pos, gate_pos, ranges = geometry.polar_position(x_arr, y_arr)
+
+    azim_idx = np.round(azim_pos).astype(np.int64) % grid_info.azims
+    gate_idx = np.round(gate_pos).astype(np.int64)
+
+    valid = (gate_idx >= 0) & (gate_idx < grid_info.gates) & (ranges <= max_range * 1000.0)
+
+    pixels = np.flatnonzero(valid).astype(np.int32)
+    cells = (azim_idx[valid] * grid_info.gates + gate_idx[valid]).astype(np.int32)
+    ranges_km = (ranges * 0.001).astype(np.float32).reshape((height, width))
+
+    return RasterLayout(extent, width, height, pixels, cells, ranges_km)
+
+
+def get_layout(config, metadata, grid_info, max_range, height=DEFAULT_HEIGHT):
+    """
+    Returns the RasterLayout from memory, from the disk cache or
+    built from scratch (in that order).
+    """
+
+    key = get_layout_key(metadata, grid_info, max_range, height)
+
+    if key in _layouts:
+        bugtracker.core.metrics.count_cache(True)
+        return _layouts[key]
+
+    filepath = os.path.join(quicklook_folder(config), f"{key}.npz")
+    bugtracker.core.metrics.count_cache(os.path.isfile(filepath))
+
+    if os.path.isfile(filepath):
+        arrays = np.load(filepath)
+        height, width = arrays['ranges'].shape
+        layout = RasterLayout(list(arrays['extent']), width, height,
+                              arrays['pixels'], arrays['cells'], arrays['ranges'])
+    else:
+        print(f"Building quicklook layout: {filepath}")
+        layout = build_layout(metadata, grid_info, max_range, height)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # Several plot workers may build it at the same time
+        temp_file = f"{filepath}.{os.getpid()}.npz"
+        np.savez(temp_file, extent=np.array(layout.extent), pixels=layout.pixels,
+                 cells=layout.cells, ranges=layout.ranges)
+        os.replace(temp_file, filepath)
+
+    _layouts[key] = layout
+    return layout
+
+
+def render_background(layout, features=True):
+    """
+    RGB (height, width, 3) uint8 map with range rings and the radar
+    site. The Natural Earth features are drawn with cartopy, once.
+    """
+
+    if features:
+        fig = Figure(figsize=(layout.width / 100.0, layout.height / 100.0), dpi=100)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_axes([0.0, 0.0, 1.0, 1.0], projection=ccrs.PlateCarree())
+        ax.set_axis_off()
+        add_features(ax)
+        ax.set_extent(layout.extent, crs=ccrs.PlateCarree())
+        ax.set_aspect('auto')
+        canvas.draw()
+        background = np.array(canvas.buffer_rgba())[:,:,0:3]
+    else:
+        background = np.full((layout.height, layout.width, 3), 255, dtype=np.uint8)
+
+    # Rings are about one pixel wide
+    ranges = layout.ranges
+    row = layout.height // 2
+    km_per_pixel = float(ranges[row,0] + ranges[row,-1]) / layout.width
+    ring_distance = np.abs(ranges - RING_STEP_KM * np.round(ranges / RING_STEP_KM))
+    rings = (ring_distance < 0.75 * km_per_pixel) & (ranges > 0.5 * RING_STEP_KM)
+    background[rings] = background[rings] // 2
+
+    # Radar site
+    col = layout.width // 2
+    for offset in range(-4, 5):
+        background[row + offset, col + offset] = 0
+        background[row + offset, col - offset] = 0
+
+    return background
+
+
+def get_background(config, layout, features=True):
+
+    key = f"{layout.width}_{layout.height}_{layout.extent}_{features}"
+
+    if key in _backgrounds:
+        bugtracker.core.metrics.count_cache(True)
+        return _backgrounds[key]
+
+    extent_str = "_".join(f"{value:.4f}" for value in layout.extent)
+    filename = f"background_{extent_str}_{layout.width}x{layout.height}_{int(features)}.png"
+    filepath = os.path.join(quicklook_folder(config), filename)
+    bugtracker.core.metrics.count_cache(os.path.isfile(filepath))
+
+    if os.path.isfile(filepath):
+        background = np.array(Image.open(filepath).convert('RGB'))
+    else:
+        print(f"Rendering quicklook background: {filepath}")
+        background = render_background(layout, features=features)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        temp_file = f"{filepath}.{os.getpid()}.png"
+        Image.fromarray(background).save(temp_file)
+        os.replace(temp_file, filepath)
+
+    _backgrounds[key] = background
+    return background
+
+
+def color_table(colors):
+    """
+    uint8 RGB lookup table, one row per color
+    """
+
+    rgba = matplotlib.colors.to_rgba_array(colors)
+    return np.round(rgba[:,0:3] * 255.0).astype(np.uint8)
+
+
+def dbz_table(levels=DBZ_LEVELS):
+    return color_table(matplotlib.colormaps['jet'](np.linspace(0.0, 1.0, levels)))
+
+
+def dbz_levels(values, min_value, max_value, levels=DBZ_LEVELS):
+    """
+    Color index of each value, -1 for no echo (masked, NaN or
+    below min_value). Values above max_value take the last color.
+    """
+
+    data = np.ma.getdata(values).astype(np.float32)
+    invalid = np.ma.getmaskarray(values) | ~(data >= min_value)
+
+    data[invalid] = min_value
+
+    scale = levels / float(max_value - min_value)
+    index = ((data - min_value) * scale).astype(np.int32, copy=False)
+    np.clip(index, 0, levels - 1, out=index)
+    index[invalid] = -1
+
+    return index
+
+
+def target_id_levels(values):
+    """
+    Color index of each target_id code, -1 for none (0)
+    """
+
+    codes = np.ma.getdata(values).astype(np.int32)
+    index = codes - 1
+    index[(codes < 1) | (codes > len(TARGET_ID_COLORS))] = -1
+    index[np.ma.getmaskarray(values)] = -1
+
+    return index
+
+
+class QuicklookRenderer:
+    """
+    Composites colored polar fields over the background of a layout.
+    """
+
+    def __init__(self, layout, background):
+
+        if background.shape != (layout.height, layout.width, 3):
+            raise ValueError(f"Incompatible background: {background.shape}")
+
+        self.layout = layout
+        self.background = background
+
+
+    def compose(self, data, index_function, table):
+        """
+        RGB map of a (azims, gates) field. index_function returns
+        the color index of the gathered values.
+        """
+
+        values = np.take(np.ma.ravel(data), self.layout.cells)
+        index = index_function(values)
+        shown = index >= 0
+
+        image = self.background.copy()
+        flat_image = image.reshape((-1, 3))
+        flat_image[self.layout.pixels[shown]] = np.take(table, index[shown], axis=0)
+
+        return image
+
+
+    def decorate(self, image, title, table, labels):
+        """
+        Adds the title band and a color bar on the right.
+        """
+
+        height, width = image.shape[0:2]
+        canvas = np.full((height + TITLE_HEIGHT, width + BAR_WIDTH, 3), 255, dtype=np.uint8)
+        canvas[TITLE_HEIGHT:, 0:width] = image
+
+        # Color bar, first color at the bottom
+        num_colors = len(table)
+        rows = np.arange(height)
+        bar_index = (num_colors - 1) - (rows * num_colors) // height
+        canvas[TITLE_HEIGHT:, width + 8:width + 24] = table[bar_index][:,np.newaxis,:]
+
+        pil_image = Image.fromarray(canvas)
+        draw = ImageDraw.Draw(pil_image)
+        draw.text((8, 6), title, fill=(0, 0, 0))
+
+        for x in range(0, len(labels)):
+            position = 1.0 - (x + 0.5) / len(labels)
+            draw.text((width + 28, TITLE_HEIGHT + int(position * height) - 5), labels[x], fill=(0, 0, 0))
+
+        return pil_image
+
+
+    def dbz_image(self, data, title, min_value=-15.0, max_value=40.0):
+        """
+        Decorated PIL image of a dBZ field, without writing it to disk
+        (also used for the animation frames).
+        """
+
+        table = dbz_table()
+        image = self.compose(data, lambda values: dbz_levels(values, min_value, max_value), table)
+
+        # One label at each end and in the middle of the color bar
+        mid_value = 0.5 * (min_value + max_value)
+        labels = [f"{min_value:.0f}", "", f"{mid_value:.0f}", "", f"{max_value:.0f}"]
+
+        return self.decorate(image, title, table, labels)
+
+
+    def target_id_image(self, data, title):
+
+        table = color_table(TARGET_ID_COLORS)
+        image = self.compose(data, target_id_levels, table)
+        labels = ['clutter', 'rain', 'bugs']
+
+        return self.decorate(image, title, table, labels)
+
+
+    def render_dbz(self, data, output_file, title, min_value=-15.0, max_value=40.0):
+
+        self.save(self.dbz_image(data, title, min_value=min_value, max_value=max_value), output_file)
+
+
+    def render_target_id(self, data, output_file, title):
+
+        self.save(self.target_id_image(data, title), output_file)
+
+
+    def save(self, pil_image, output_file):
+
+        # Low compression, the quicklooks favour speed over size
+        pil_image.save(output_file, compress_level=1)
+
+
+class FastPlotter:
+    """
+    Drop-in replacement of RadialPlotter/TargetIdPlotter (same
+    set_data and save_plot) using the QuicklookRenderer.
+    """
+
+    def __init__(self, grid_info, output_folder, target_id=False):
+
+        if not os.path.isdir(output_folder):
+            raise FileNotFoundError("Folder not found:", output_folder)
+
+        self.config = bugtracker.config.get()
+        self.grid_info = grid_info
+        self.output_folder = output_folder
+        self.target_id = target_id
+
+
+    def set_data(self, data, label, plot_datetime, metadata, max_range):
+
+        self.metadata = metadata
+        self.max_range = max_range
+        self.data = data
+        self.label = label
+        self.plot_datetime = plot_datetime
+
+
+    def get_renderer(self):
+
+        layout = get_layout(self.config, self.metadata, self.grid_info, self.max_range)
+        background = get_background(self.config, layout)
+        return QuicklookRenderer(layout, background)
+
+
+    def save_plot(self, min_value=-15.0, max_value=40.0):
+
+        renderer = self.get_renderer()
+
+        if self.data.shape != (self.grid_info.azims, self.grid_info.gates):
+            raise ValueError(f"Invalid data shape: {self.data.shape}")
+
+        title = self.label + self.plot_datetime.strftime(" at %Y-%m-%d %H:%M UTC")
+        plot_filename = self.plot_datetime.strftime("%Y%m%d%H%M") + "_" + self.label + ".png"
+        output_file = os.path.join(self.output_folder, plot_filename)
+
+        if self.target_id:
+            renderer.render_target_id(self.data, output_file, title)
+        else:
+            renderer.render_dbz(self.data, output_file, title, min_value=min_value, max_value=max_value)
@@ -0,0 +1,328 @@
+"""
+Bugtracker - A radar utility for tracking insects
+Copyright (C) 2020 Frederic Fabry, Daniel Hogg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Reusable cartopy figures for the radial plots.
+
+Everything but the data is the same for every scan of a site: the
+GeoAxes, Natural Earth features, ticks and grid, range rings, radar
+cross and colour bar. A FigureTemplate draws them once per process
+and per (site, extent, dpi, colour scale), as two cached layers:
+
+under - figure and axes background, land
+over  - everything else, on a transparent background
+
+Saving a scan restores the under layer, draws the data, title and
+colour bar label, then blends the over layer on top. The result has
+the same layering as a plot built from scratch (land < data < lines).
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+import matplotlib.colors
+import matplotlib.cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import pyart
+from PIL import Image
+
+
+# FigureTemplate objects already built in this process
+_templates = dict()
+
+RING_STEP_KM = 25.0
+
+# Same as the plots of RadialPlotter
+FIGURE_ASPECT = 1.4
+DBZ_GRADATIONS = 22
+TARGET_ID_COLORS = ['red', 'blue', 'green']
+TARGET_ID_LABELS = ['clutter', 'rain', 'bugs']
+
+
+@contextmanager
+def suppress_stderr():
+    with open(os.devnull, 'w') as devnull:
+        valid_stderr = sys.stderr
+        sys.stderr = devnull
+        try:
+            yield
+        finally:
+            sys.stderr = valid_stderr
+
+
+def get_template_key(metadata, max_range, dpi, kind, min_value, max_value):
+
+    site = f"{metadata.radar_id.lower()}_{metadata.lat:.5f}_{metadata.lon:.5f}"
+    return f"{site}_{max_range}_{dpi}_{kind}_{min_value}_{max_value}"
+
+
+def get_template(metadata, max_range, dpi=200, kind='dbz', min_value=None, max_value=None):
+    """
+    Returns the FigureTemplate of a site and colour scale, building
+    it on the first call. kind is 'dbz' (continuous scale between
+    min_value and max_value) or 'target_id'.
+    """
+
+    key = get_template_key(metadata, max_range, dpi, kind, min_value, max_value)
+
+    if key not in _templates:
+        _templates[key] = FigureTemplate(metadata, max_range, dpi, kind, min_value, max_value)
+
+    return _templates[key]
+
+
+def get_extent(metadata, max_range):
+    """
+    [min_lon, max_lon, min_lat, max_lat], max_range km away from the
+    radar in the 4 cardinal directions.
+    """
+
+    distance = max_range * 1000.0
+    x_arr = np.array([-distance, distance, 0.0, 0.0])
+    y_arr = np.array([0.0, 0.0, distance, -distance])
+
+    lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, metadata.lon, metadata.lat)
+
+    return [float(lons[0]), float(lons[1]), float(lats[3]), float(lats[2])]
+
+
+def ring_coords(metadata, radius_km, num_points=360):
+    """
+    Lat/lon of a circle of radius_km around the radar
+    """
+
+    bearings = np.radians(np.linspace(-180.0, 180.0, num=num_points))
+    x_arr = radius_km * 1000.0 * np.sin(bearings)
+    y_arr = radius_km * 1000.0 * np.cos(bearings)
+
+    lons, lats = pyart.core.cartesian_to_geographic_aeqd(x_arr, y_arr, metadata.lon, metadata.lat)
+    return lats, lons
+
+
+def add_features(ax):
+    """
+    Natural Earth land, state lines, borders and coastline (10m).
+    Returns the land artist, which is drawn under the data.
+    """
+
+    states_provinces = cfeature.NaturalEarthFeature(
+        category='cultural',
+        name='admin_1_states_provinces_lines',
+        scale='10m',
+        facecolor='none')
+
+    coast = cfeature.NaturalEarthFeature(category='physical', scale='10m',
+        facecolor='none', name='coastline')
+
+    land = ax.add_feature(cfeature.LAND.with_scale('10m'))
+    ax.add_feature(states_provinces.with_scale('10m'), edgecolor='gray')
+    ax.add_feature(cfeature.BORDERS.with_scale('10m'))
+    ax.add_feature(coast, edgecolor='black')
+
+    return land
+
+
+class FigureTemplate:
+
+    def __init__(self, metadata, max_range, dpi, kind, min_value=None, max_value=None, features=True):
+
+        if kind not in ['dbz', 'target_id']:
+            raise ValueError(f"Invalid template kind: {kind}")
+
+        self.metadata = metadata
+        self.max_range = max_range
+        self.kind = kind
+        self.min_value = min_value
+        self.max_value = max_value
+
+        self.fig = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree(), aspect=FIGURE_ASPECT)
+        self.ax.set_xlabel('Longitude')
+        self.ax.set_ylabel('Latitude')
+
+        self._set_grid()
+
+        self.land = None
+        if features:
+            self.land = add_features(self.ax)
+
+        self._set_cross()
+        self._set_circles()
+
+        if kind == 'dbz':
+            self.colorbar = self._dbz_colorbar()
+        else:
+            self.colorbar = self._target_id_colorbar()
+
+        self.title = self.ax.set_title(" ")
+        self.label = self.colorbar.ax.set_ylabel(" ")
+        self.ax.set_extent(get_extent(metadata, max_range))
+
+        self._render_layers()
+
+
+    def _set_grid(self):
+
+        #TODO: Don't hard-code these bounds
+
+        major_ticks_lat = np.arange(35, 60, 1)
+        minor_ticks_lat = np.arange(35, 60, 0.2)
+        major_ticks_lon = np.arange(-140, -60, 1.0)
+        minor_ticks_lon = np.arange(-140, -60, 0.2)
+
+        # Disabling warning from geoaxes (cartopy)
+        with suppress_stderr():
+
+            self.ax.set_xticks(ticks=major_ticks_lon)
+            self.ax.set_xticks(ticks=minor_ticks_lon, minor=True)
+            self.ax.set_yticks(ticks=major_ticks_lat)
+            self.ax.set_yticks(ticks=minor_ticks_lat, minor=True)
+
+            self.ax.grid(which='minor', alpha=0.2)
+            self.ax.grid(which='major', alpha=0.5)
+
+
+    def _set_cross(self):
+
+        self.ax.plot(self.metadata.lon, self.metadata.lat, marker='x', color='black')
+
+
+    def _set_circles(self):
+
+        km_line = RING_STEP_KM
+
+        while km_line <= self.max_range:
+            lats, lons = ring_coords(self.metadata, km_line)
+            self.ax.plot(lons, lats, color='black', linewidth=0.4, alpha=0.5)
+            km_line += RING_STEP_KM
+
+
+    def _dbz_colorbar(self):
+
+        if self.min_value is None or self.max_value is None:
+            raise ValueError("A dbz template needs min_value and max_value")
+
+        gradation_step = (self.max_value - self.min_value) / float(DBZ_GRADATIONS)
+
+        mappable = matplotlib.cm.ScalarMappable(cmap=matplotlib.colormaps['jet'])
+        mappable.set_clim(self.min_value, self.max_value)
+        boundaries = np.arange(self.min_value, self.max_value, gradation_step)
+
+        return self.fig.colorbar(mappable, ax=self.ax, boundaries=boundaries)
+
+
+    def _target_id_colorbar(self):
+
+        cmap = matplotlib.colors.ListedColormap(TARGET_ID_COLORS)
+        mappable = matplotlib.cm.ScalarMappable(norm=matplotlib.colors.Normalize(1.0, 3.0), cmap=cmap)
+        colorbar = self.fig.colorbar(mappable, ax=self.ax)
+
+        # This will need to be modified if more categories are added.
+        colorbar.set_ticks([1 + 1/3, 2.0, 3 - 1/3])
+        colorbar.set_ticklabels(TARGET_ID_LABELS)
+
+        return colorbar
+
+
+    def _under_artists(self):
+
+        artists = [self.fig.patch, self.ax.patch]
+        if self.land is not None:
+            artists.append(self.land)
+        return artists
+
+
+    def _render_layers(self):
+        """
+        Renders the under layer (kept in the canvas as a saved region)
+        and the over layer (RGB and alpha arrays).
+        """
+
+        under = self._under_artists()
+        everything = [self.fig.patch] + self.fig.get_children()
+        everything += self.ax.get_children() + self.colorbar.ax.get_children()
+        visible = {id(artist): artist.get_visible() for artist in everything}
+
+        # Under: only the backgrounds and land
+        for artist in everything:
+            artist.set_visible(False)
+        self.ax.set_visible(True)
+        for artist in under:
+            artist.set_visible(True)
+
+        self.canvas.draw()
+        self.under = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        for artist in everything:
+            artist.set_visible(visible[id(artist)])
+
+        # Over: all but the under artists, on a transparent background.
+        # This is drawn last, as it also sets the title position.
+        for artist in under:
+            artist.set_visible(False)
+
+        self.canvas.draw()
+        over = np.array(self.canvas.buffer_rgba(), dtype=np.float32)
+        alpha = over[:,:,3:4] / 255.0
+        self.over_rgb = over[:,:,0:3] * alpha
+        self.under_weight = 1.0 - alpha
+
+        for artist in under:
+            artist.set_visible(True)
+
+        # Only drawn in save()
+        self.title.set_visible(False)
+        self.label.set_visible(False)
+
+
+    def save(self, output_file, title, label, draw_data):
+        """
+        draw_data(ax) adds the data artists to the axes and returns
+        them as a list. They are removed once the plot is saved.
+        """
+
+        self.canvas.restore_region(self.under)
+        artists = draw_data(self.ax)
+
+        self.title.set_text(title)
+        self.label.set_text(label)
+        self.title.set_visible(True)
+        self.label.set_visible(True)
+
+        renderer = self.canvas.get_renderer()
+        try:
+            for artist in artists:
+                artist.draw(renderer)
+            self.title.draw(renderer)
+            self.label.draw(renderer)
+        finally:
+            for artist in artists:
+                artist.remove()
+            self.title.set_visible(False)
+            self.label.set_visible(False)
+
+        image = np.array(self.canvas.buffer_rgba())[:,:,0:3].astype(np.float32)
+        image = self.over_rgb + image * self.under_weight
+
+        Image.fromarray(np.round(image).astype(np.uint8)).save(output_file)
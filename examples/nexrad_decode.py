@@ -0,0 +1,82 @@
+"""
+Comparing the full pyart.io.read() decode of a NEXRAD Level II
+volume against the selective read used by NexradData.
+
+Each decode runs in a fresh process, so that the peak RSS reported
+belongs to that decode alone. Peak RSS uses the 'resource' module,
+which is only available on Linux/macOS.
+
+Run from within the /apps folder:
+python ../examples/nexrad_decode.py 201907190300 kcbw
+"""
+
+import sys
+import time
+import datetime
+import multiprocessing as mp
+
+import pyart
+
+import bugtracker
+
+
+def peak_rss_mb():
+
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def full_decode(nexrad_file):
+
+    t0 = time.time()
+    handle = pyart.io.read(nexrad_file)
+    elapsed = time.time() - t0
+
+    return elapsed, peak_rss_mb(), handle.nsweeps, len(handle.fields)
+
+
+def selective_decode(nexrad_file, scans):
+
+    t0 = time.time()
+    handle = bugtracker.io.nexrad.read_nexrad(nexrad_file, fields=bugtracker.io.nexrad.NEXRAD_FIELDS, scans=scans)
+    elapsed = time.time() - t0
+
+    return elapsed, peak_rss_mb(), handle.nsweeps, len(handle.fields)
+
+
+def report(label, result):
+
+    elapsed, rss, sweeps, fields = result
+    print(f"{label}: {elapsed:.3f} s, peak RSS {rss:.1f} MB, {sweeps} sweeps, {fields} fields")
+
+
+def main():
+
+    scan_dt = datetime.datetime.strptime(sys.argv[1], "%Y%m%d%H%M")
+    radar_id = sys.argv[2]
+
+    config = bugtracker.config.load("./bugtracker.json")
+    manager = bugtracker.io.nexrad.NexradManager(config, radar_id)
+    nexrad_file = manager.get_closest(scan_dt)
+
+    # Same sweep selection as NexradData
+    scans = bugtracker.io.nexrad.scan_indices(get_odd_scans=False)
+
+    with mp.Pool(1) as pool:
+        before = pool.apply(full_decode, (nexrad_file,))
+
+    with mp.Pool(1) as pool:
+        after = pool.apply(selective_decode, (nexrad_file, scans))
+
+    print("File:", nexrad_file)
+    report("Full decode", before)
+    report("Selective decode", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import bugtracker
+
+
+def test_packed_mask():
+
+    rng = np.random.default_rng(2)
+    # Gates not a multiple of 8, for the padding bits
+    mask = rng.random((3, 10, 13)) < 0.4
+    other = rng.random((3, 10, 13)) < 0.1
+
+    packed = bugtracker.core.filter.PackedMask(mask)
+    assert packed.shape == mask.shape
+    assert packed.nbytes == 3 * 10 * 2
+    assert np.array_equal(packed.unpack(), mask)
+    assert np.array_equal(packed[1], mask[1])
+
+    combined = packed.union(other)
+    assert np.array_equal(combined.unpack(), mask | other)
+    assert np.array_equal(packed.unpack(), mask)
+
+    assert combined.coverage() == pytest.approx((mask | other).mean())
+    assert combined.coverage(2) == pytest.approx((mask | other)[0:2].mean())
+
+    with pytest.raises(ValueError):
+        packed.union(np.zeros((3, 10, 12), dtype=bool))
+
+
+def test_precip_nan():
+    """
+    NaN gates (unmasked arrays) are left out of the zone slopes, as
+    the masked gates are.
+    """
+
+    metadata = bugtracker.core.metadata.Metadata("rada", datetime.datetime(2019, 7, 30, 3, 0), 45.0, -73.5, "rada")
+    grid_info = bugtracker.core.grid.GridInfo(16, 8, 500.0, 45.0)
+    angles = [0.5, 1.5, 2.5]
+
+    # Reflectivity increasing quickly with height everywhere
+    shape = (len(angles), grid_info.azims, grid_info.gates)
+    dbz = np.empty(shape, dtype=np.float32)
+    for x in range(0, len(angles)):
+        dbz[x,:,:] = 10.0 + 20.0 * x
+
+    rng = np.random.default_rng(3)
+    missing = rng.random(shape) < 0.1
+    clutter = np.zeros(shape, dtype=bool)
+
+    masked = bugtracker.core.precip.PrecipFilter(metadata, grid_info, angles)
+    masked.apply(np.ma.masked_array(dbz, mask=missing), clutter, angles)
+
+    nan = bugtracker.core.precip.PrecipFilter(metadata, grid_info, angles)
+    nan.apply(np.where(missing, np.nan, dbz), clutter, angles)
+
+    assert masked.filter_3d.all()
+    assert np.array_equal(nan.filter_3d, masked.filter_3d)
@@ -0,0 +1,67 @@
+import numpy as np
+import pyart
+
+import bugtracker
+
+
+def test_beam_height():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    geometry = bugtracker.core.geometry.GridGeometry(grid_info, metadata, elevs=[0.5, 1.5])
+
+    ranges_km = np.arange(grid_info.gates) * grid_info.gate_step / 1000.0
+    azimuths = np.zeros(grid_info.gates)
+
+    for elev in [0.5, 1.5]:
+        elevations = np.full(grid_info.gates, elev)
+        x_arr, y_arr, z_arr = pyart.core.antenna_to_cartesian(ranges_km, azimuths, elevations)
+
+        assert geometry.beam_height(elev).dtype == np.float32
+        assert np.allclose(geometry.beam_height(elev), z_arr, atol=0.01)
+        assert np.allclose(geometry.ground_range(elev), y_arr, atol=0.01)
+
+    assert geometry.heights().shape == (2, grid_info.gates)
+
+
+def test_shared_latlon():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    assert geometry is bugtracker.core.geometry.get_geometry(grid_info, metadata)
+
+    lats, lons = geometry.latlon()
+    assert lats.shape == (grid_info.azims, grid_info.gates)
+    assert lats.dtype == np.float32
+
+    # First gate is at the radar site
+    assert np.allclose(lats[:,0], metadata.lat)
+    assert np.allclose(lons[:,0], metadata.lon)
+
+    # Memoized, the same arrays are returned
+    assert geometry.latlon()[0] is lats
+
+
+def test_gate_offset():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    offset_info = bugtracker.core.grid.GridInfo(grid_info.gates, grid_info.azims, grid_info.gate_step,
+                                                grid_info.azim_step, azim_offset=0.25, gate_offset=2125.0)
+
+    key = bugtracker.core.geometry.get_geometry_key(grid_info, metadata)
+    assert key != bugtracker.core.geometry.get_geometry_key(offset_info, metadata)
+
+    geometry = bugtracker.core.geometry.get_geometry(offset_info, metadata)
+    assert geometry.ranges[0] == 2125.0
+    assert np.allclose(geometry.ranges, offset_info.get_range()['data'])
+
+    # polar_position is the inverse of the gate centers
+    azim_rad = np.radians(geometry.azimuths[10])
+    ground = geometry.ranges[[0, 5, 100]]
+    azim_pos, gate_pos, ranges = geometry.polar_position(ground * np.sin(azim_rad), ground * np.cos(azim_rad))
+
+    assert np.allclose(azim_pos, 10.0)
+    assert np.allclose(gate_pos, [0.0, 5.0, 100.0])
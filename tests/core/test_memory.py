@@ -0,0 +1,79 @@
+import types
+import datetime
+
+import numpy as np
+import pytest
+
+import bugtracker
+
+
+def test_array_bytes():
+
+    dbz = np.ma.masked_invalid(np.full((2, 10, 10), np.nan, dtype=np.float32))
+    scan = types.SimpleNamespace(dbz=dbz, elevs=[0.5, 1.5], fields=[np.zeros(100, dtype=np.int64)], name="scan")
+
+    assert bugtracker.core.memory.array_bytes(dbz) == 800 + 200
+    assert bugtracker.core.memory.array_bytes(scan) == 1000 + 800
+    assert bugtracker.core.memory.array_bytes(scan, np.zeros(10, dtype=np.uint8)) == 1810
+    assert bugtracker.core.memory.array_bytes(None) == 0
+
+
+def test_budget(monkeypatch):
+
+    assert bugtracker.core.memory.from_config({'processing': {'max_memory_mb': 0}}) is None
+
+    config = {'processing': {'max_memory_mb': 1000, 'worker_memory_mb': 100}}
+    budget = bugtracker.core.memory.from_config(config)
+
+    # 400 MB used, 600 MB left
+    monkeypatch.setattr(bugtracker.core.memory, "current_rss_mb", lambda: 400.0)
+    monkeypatch.setattr(bugtracker.core.memory.os, "cpu_count", lambda: 8)
+
+    mb = bugtracker.core.memory.MB
+
+    assert budget.headroom_mb() == 600.0
+    assert budget.chunk_levels(10 * mb, 8, 20) == 7
+    assert budget.chunk_levels(1 * mb, 8, 20) == 20
+    assert budget.chunk_levels(1000 * mb, 8, 20) == 1
+
+    assert budget.workers(50 * mb, 12) == 4
+    assert budget.workers(50 * mb, 2) == 2
+    assert budget.workers(0, 12) == 6
+    assert budget.workers(5000 * mb, 12) == 1
+
+    with pytest.raises(ValueError):
+        bugtracker.core.memory.MemoryBudget(-1)
+
+
+def test_rss():
+
+    peak = bugtracker.core.memory.peak_rss_mb()
+    current = bugtracker.core.memory.current_rss_mb()
+
+    if peak is not None and current is not None:
+        assert peak >= current > 0.0
+
+
+def test_chunked_precip():
+
+    metadata = bugtracker.core.metadata.Metadata("rada", datetime.datetime(2019, 7, 30, 3, 0), 45.0, -73.5, "rada")
+    grid_info = bugtracker.core.grid.GridInfo(30, 36, 500.0, 10.0)
+    angles = [0.5, 1.5, 2.5, 3.5, 4.5]
+
+    rng = np.random.default_rng(4)
+    shape = (len(angles), grid_info.azims, grid_info.gates)
+    scan = types.SimpleNamespace(diff_reflectivity=rng.uniform(-2.0, 6.0, shape).astype(np.float32),
+                                 cross_correlation_ratio=rng.uniform(0.3, 1.0, shape).astype(np.float32))
+
+    # A rain cell: low differential reflectivity, high correlation
+    scan.diff_reflectivity[:, 0:12, 0:15] = 0.5
+    scan.cross_correlation_ratio[:, 0:12, 0:15] = 0.99
+
+    whole = bugtracker.core.precip.NexradPrecipFilter(metadata, grid_info, angles)
+    whole.apply(scan)
+
+    chunked = bugtracker.core.precip.NexradPrecipFilter(metadata, grid_info, angles)
+    chunked.apply(scan, chunk_levels=2)
+
+    assert whole.filter_3d[:, 0:12, 0:15].all()
+    assert np.array_equal(whole.filter_3d, chunked.filter_3d)
@@ -0,0 +1,128 @@
+import os
+import json
+import datetime
+
+import numpy as np
+import pytest
+
+import bugtracker
+
+
+def test_scan_metrics():
+
+    metrics = bugtracker.core.metrics.ScanMetrics("xam", "iris", "input.raw")
+
+    with metrics.stage('precip'):
+        bugtracker.core.metrics.count('bytes_read', 1000)
+
+    with metrics.stage('output'):
+        bugtracker.core.metrics.count('bytes_written', 500)
+        bugtracker.core.metrics.count_cache(True)
+
+    # Repeated stages are accumulated
+    with metrics.stage('precip'):
+        bugtracker.core.metrics.count_cache(False)
+
+    scan_dt = datetime.datetime(2019, 7, 30, 3, 0)
+    metrics.finish(scan_dt, "output.nc")
+
+    assert list(metrics.timings.keys()) == ['precip', 'output']
+    assert metrics.total >= sum(metrics.timings.values())
+    assert metrics.counters == {'bytes_read': 1000, 'bytes_written': 500, 'gates_processed': 0,
+                                'cache_hits': 1, 'cache_misses': 1}
+
+    # Counts after finish() belong to the next scan
+    bugtracker.core.metrics.count('gates_processed', 10)
+    assert metrics.to_dict()['counters']['gates_processed'] == 0
+    assert metrics.to_dict()['scan_datetime'] == "2019-07-30T03:00:00"
+
+    with pytest.raises(ValueError):
+        bugtracker.core.metrics.count('gates', 1)
+
+
+def test_histogram():
+
+    histogram = bugtracker.core.metrics.Histogram([1.0, 0.1, 10.0])
+
+    for value in [0.05, 0.5, 0.5, 20.0]:
+        histogram.observe(value)
+
+    lines = histogram.lines("bugtracker_stage_seconds", 'radar="xam"')
+
+    assert lines[0] == 'bugtracker_stage_seconds_bucket{radar="xam",le="0.1"} 1'
+    assert lines[1] == 'bugtracker_stage_seconds_bucket{radar="xam",le="1"} 3'
+    assert lines[2] == 'bugtracker_stage_seconds_bucket{radar="xam",le="10"} 3'
+    assert lines[3] == 'bugtracker_stage_seconds_bucket{radar="xam",le="+Inf"} 4'
+    assert lines[-1] == 'bugtracker_stage_seconds_count{radar="xam"} 4'
+
+
+def test_writer(tmp_path):
+
+    config = {'cache_dir': str(tmp_path), 'metrics': {'enabled': False}}
+    assert bugtracker.core.metrics.from_config(config, "XAM") is None
+
+    prometheus_dir = os.path.join(str(tmp_path), "textfile")
+    config['metrics'] = {'enabled': True, 'prometheus_dir': prometheus_dir, 'buckets': [0.1, 1.0]}
+    writer = bugtracker.core.metrics.from_config(config, "XAM")
+
+    for x in range(0, 2):
+        metrics = bugtracker.core.metrics.ScanMetrics("XAM", "iris")
+        with metrics.stage('extract'):
+            bugtracker.core.metrics.count('gates_processed', 100)
+        metrics.finish(datetime.datetime(2019, 7, 30, 3, 10 * x), None)
+        writer.write(metrics)
+
+    with open(os.path.join(str(tmp_path), "metrics", "xam.jsonl")) as handle:
+        lines = [json.loads(line) for line in handle]
+
+    assert len(lines) == 2
+    assert lines[1]['scan_datetime'] == "2019-07-30T03:10:00"
+    assert lines[1]['counters']['gates_processed'] == 100
+    assert 'extract' in lines[1]['stages']
+
+    with open(os.path.join(prometheus_dir, "bugtracker_xam.prom")) as handle:
+        text = handle.read()
+
+    assert 'bugtracker_stage_seconds_count{radar="xam",stage="extract"} 2' in text
+    assert 'bugtracker_scans_total{radar="xam"} 2' in text
+    assert 'bugtracker_gates_processed_total{radar="xam"} 200' in text
+    assert os.listdir(prometheus_dir) == ["bugtracker_xam.prom"]
+
+    # The next process (tracker.py run) carries on the totals
+    writer = bugtracker.core.metrics.from_config(config, "XAM")
+    metrics = bugtracker.core.metrics.ScanMetrics("XAM", "iris")
+    with metrics.stage('extract'):
+        bugtracker.core.metrics.count('gates_processed', 100)
+    metrics.finish(datetime.datetime(2019, 7, 30, 3, 20), None)
+    writer.write(metrics)
+
+    with open(os.path.join(prometheus_dir, "bugtracker_xam.prom")) as handle:
+        text = handle.read()
+
+    assert 'bugtracker_stage_seconds_count{radar="xam",stage="extract"} 3' in text
+    assert 'bugtracker_scans_total{radar="xam"} 3' in text
+    assert 'bugtracker_gates_processed_total{radar="xam"} 300' in text
+
+    # Other buckets start over
+    config['metrics']['buckets'] = [0.5]
+    writer = bugtracker.core.metrics.from_config(config, "XAM")
+    assert writer.scans == 0 and len(writer.stage_histograms) == 0
+
+
+def test_scan_memory():
+
+    metrics = bugtracker.core.metrics.ScanMetrics("xam", "nexrad")
+
+    with metrics.stage('extract'):
+        metrics.hold('scan', np.zeros((2, 100), dtype=np.float32))
+
+    with metrics.stage('target_id'):
+        metrics.hold('id_matrix', np.zeros((2, 100), dtype=np.uint8))
+        metrics.hold('scan', None)
+
+    metrics.finish(datetime.datetime(2019, 7, 30, 3, 0), None)
+
+    mb = bugtracker.core.memory.MB
+    assert metrics.array_mb == {'extract': 800 / mb, 'target_id': 200 / mb}
+    assert metrics.held == dict()
+    assert metrics.to_dict()['array_mb']['extract'] == 800 / mb
@@ -31,6 +31,6 @@ def test_iris_output():
     iris_output.validate()
 
     output_filename = "test_netcdf_output.nc"
-    iris_output.write(output_filename)
+    iris_output.write(output_filename, metadata.scan_dt)
 
     assert os.path.isfile(output_filename)
\ No newline at end of file
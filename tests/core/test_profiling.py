@@ -0,0 +1,61 @@
+import os
+import tracemalloc
+
+import numpy as np
+
+import bugtracker
+
+
+def allocate():
+    return [np.ones(1000) for x in range(0, 100)]
+
+
+def test_stage_profiler(tmp_path, monkeypatch):
+
+    for name in [bugtracker.core.profiling.ENV_DIR, bugtracker.core.profiling.ENV_CPU,
+                 bugtracker.core.profiling.ENV_MEMORY]:
+        monkeypatch.delenv(name, raising=False)
+
+    monkeypatch.setattr(bugtracker.core.profiling, "_profiler", None)
+
+    # Disabled: nothing is written
+    with bugtracker.core.profiling.stage('precip'):
+        allocate()
+
+    assert bugtracker.core.profiling.get() is None
+
+    was_tracing = tracemalloc.is_tracing()
+    profile_dir = str(tmp_path / "profiles")
+    profiler = bugtracker.core.profiling.enable(profile_dir, cpu=True, memory=True)
+
+    try:
+        metrics = bugtracker.core.metrics.ScanMetrics("xam", "iris", "input.raw")
+
+        for x in range(0, 2):
+            with metrics.stage('precip'):
+                # Nested stages belong to the enclosing profile
+                with bugtracker.core.profiling.stage('inner'):
+                    data = allocate()
+
+        assert os.environ[bugtracker.core.profiling.ENV_DIR] == os.path.abspath(profile_dir)
+        assert bugtracker.core.profiling.get() is profiler
+
+        pid = os.getpid()
+        assert sorted(os.listdir(profile_dir)) == [f"precip.{pid}.memory.txt", f"precip.{pid}.pstats"]
+
+        with open(os.path.join(profile_dir, f"precip.{pid}.memory.txt")) as handle:
+            report = handle.read()
+
+        assert report.count("peak:") == 2
+        assert "test_profiling.py" in report
+
+        totals = bugtracker.core.profiling.report(profile_dir)
+
+        assert list(totals.keys()) == ['precip']
+        assert os.path.isfile(os.path.join(profile_dir, "precip.pstats"))
+
+        with open(os.path.join(profile_dir, "precip.txt")) as handle:
+            assert "allocate" in handle.read()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import bugtracker
+
+
+def reference_matrix(dbz, clutter, precip, min_dbz, max_dbz):
+    """
+    The former np.where implementation of TargetId.construct_matrix
+    """
+
+    code_dict = bugtracker.core.target_id.get_code_dict()
+    id_matrix = np.zeros(dbz.shape, dtype=int)
+
+    bug_condition = np.logical_and(dbz < max_dbz, dbz > min_dbz)
+    bug_condition = np.logical_and(bug_condition, np.logical_not(np.ma.getmask(dbz)))
+
+    id_matrix = np.where(bug_condition, code_dict['bugs'], id_matrix)
+    id_matrix = np.where(precip, code_dict['rain'], id_matrix)
+    id_matrix = np.where(clutter, code_dict['clutter'], id_matrix)
+
+    return id_matrix
+
+
+def test_classify():
+
+    rng = np.random.default_rng(0)
+    dims = (3, 40, 50)
+
+    data = rng.uniform(-30.0, 50.0, size=dims)
+    data[0,0,0:5] = np.nan
+    dbz = np.ma.masked_array(data, mask=rng.random(dims) < 0.1)
+    clutter = rng.random(dims) < 0.2
+    precip = rng.random(dims) < 0.3
+
+    target_id = bugtracker.core.target_id.TargetId(dbz, clutter, precip)
+    id_matrix = target_id.export_matrix()
+
+    assert id_matrix.dtype == np.uint8
+    assert np.array_equal(id_matrix, reference_matrix(dbz, clutter, precip, -10.0, 30.0))
+
+    # Priority: clutter > rain > bugs
+    bugs = bugtracker.core.target_id.get_code('bugs')
+    assert np.all(id_matrix[clutter] == bugtracker.core.target_id.get_code('clutter'))
+    assert np.all(id_matrix[precip & ~clutter] == bugtracker.core.target_id.get_code('rain'))
+    assert not np.any(id_matrix[0,0,0:5] == bugs)
+
+    # Same result with a NaN field and a packed clutter mask
+    nan_dbz = np.ma.filled(dbz.astype(np.float32), np.nan)
+    packed = bugtracker.core.filter.PackedMask(clutter)
+    packed_matrix = bugtracker.core.target_id.classify(nan_dbz, packed, precip, -10.0, 30.0)
+    assert np.array_equal(packed_matrix, id_matrix)
+
+
+def test_classify_unmasked():
+
+    dbz = np.array([[-20.0, 0.0, 10.0, 35.0]])
+    clutter = np.array([[False, False, True, False]])
+    precip = np.array([[False, False, False, True]])
+
+    id_matrix = bugtracker.core.target_id.classify(dbz, clutter, precip, -10.0, 30.0)
+    assert list(id_matrix[0]) == [0, 3, 1, 2]
+
+    with pytest.raises(ValueError):
+        out = np.zeros((1, 4), dtype=int)
+        bugtracker.core.target_id.classify(dbz[np.newaxis], clutter[np.newaxis], precip[np.newaxis],
+                                           -10.0, 30.0, out=out)
@@ -0,0 +1,61 @@
+import os
+import json
+import multiprocessing as mp
+
+import bugtracker
+
+
+def traced_task(x):
+
+    with bugtracker.core.profiling.stage("plot_joint", f"level {x}"):
+        return x * x
+
+
+def test_trace(tmp_path, monkeypatch):
+
+    monkeypatch.delenv(bugtracker.core.tracing.ENV_DIR, raising=False)
+    monkeypatch.setattr(bugtracker.core.tracing, "_tracer", None)
+
+    # Disabled: nothing is recorded
+    with bugtracker.core.tracing.span("scan"):
+        pass
+
+    assert bugtracker.core.tracing.get() is None
+
+    trace_dir = str(tmp_path / "trace")
+    bugtracker.core.tracing.enable(trace_dir)
+
+    with bugtracker.core.tracing.span("scan", "scan", file="input.raw"):
+        with bugtracker.core.profiling.stage("precip"):
+            pass
+
+        with bugtracker.core.tracing.span("plot_pool", "plot"):
+            with mp.Pool(2) as pool:
+                assert pool.map(traced_task, range(0, 4)) == [0, 1, 4, 9]
+
+    output_file = bugtracker.core.tracing.merge(trace_dir)
+
+    with open(output_file) as handle:
+        events = json.load(handle)['traceEvents']
+
+    main_pid = os.getpid()
+    names = [event['args']['name'] for event in events if event['ph'] == 'M']
+    assert f"main {main_pid}" in names
+    assert any(name.startswith("worker") for name in names)
+
+    main_events = [(event['name'], event['ph']) for event in events if event['pid'] == main_pid and event['ph'] != 'M']
+    assert main_events == [("scan", "B"), ("precip", "B"), ("precip", "E"), ("plot_pool", "B"),
+                           ("plot_pool", "E"), ("scan", "E")]
+
+    plots = [event for event in events if event['name'] == "plot_joint"]
+    assert len(plots) == 8
+    assert all(event['pid'] != main_pid for event in plots)
+    assert sorted(event['args']['label'] for event in plots if event['ph'] == 'B') == [f"level {x}" for x in range(0, 4)]
+
+    # Balanced begin/end events in every process, in time order
+    for pid in set(event['pid'] for event in events):
+        phases = [event['ph'] for event in events if event['pid'] == pid]
+        assert phases.count('B') == phases.count('E')
+
+    times = [event['ts'] for event in events if event['ph'] != 'M']
+    assert times == sorted(times)
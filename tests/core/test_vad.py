@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import bugtracker
+
+
+def synthetic_scan(grid_info, elevs, u, v, noise=0.5):
+
+    rng = np.random.default_rng(3)
+    azims = np.radians(np.arange(grid_info.azims) * grid_info.azim_step)
+    dims = (len(elevs), grid_info.azims, grid_info.gates)
+
+    velocity = np.empty(dims, dtype=np.float32)
+    for level, elev in enumerate(elevs):
+        radial = np.cos(np.radians(elev)) * (u * np.sin(azims) + v * np.cos(azims))
+        velocity[level] = radial[:, np.newaxis] + rng.normal(scale=noise, size=dims[1:])
+
+    id_matrix = np.full(dims, bugtracker.core.target_id.get_code('bugs'), dtype=np.uint8)
+
+    return velocity, id_matrix
+
+
+def test_retrieve():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.core.vad.VadSettings(min_range=5.0, max_range=40.0, height_step=200.0, max_height=2000.0)
+    retrieval = bugtracker.core.vad.VadRetrieval(metadata, grid_info, settings)
+
+    elevs = [0.5, 1.5, 2.5]
+    # Insects heading south-west at 5 m/s
+    velocity, id_matrix = synthetic_scan(grid_info, elevs, -3.0, -4.0)
+
+    # Rain and NaN gates are not used
+    rain = bugtracker.core.target_id.get_code('rain')
+    id_matrix[:, 0:100, :] = rain
+    velocity[:, 0:100, :] = 30.0
+    velocity[:, 200:210, :] = np.nan
+
+    profile = retrieval.retrieve(velocity, elevs, id_matrix, elevs)
+
+    assert len(profile.heights) == 10
+    valid = profile.gates > 0
+    assert np.count_nonzero(valid) >= 5
+    assert np.allclose(profile.u[valid], -3.0, atol=0.1)
+    assert np.allclose(profile.v[valid], -4.0, atol=0.1)
+    assert np.allclose(profile.speed[valid], 5.0, atol=0.1)
+    assert np.allclose(profile.direction[valid], 216.87, atol=1.0)
+    assert np.allclose(profile.rms[valid], 0.5, atol=0.05)
+    assert np.all(np.isnan(profile.u[~valid]))
+
+
+def test_sector_coverage():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.core.vad.VadSettings()
+    retrieval = bugtracker.core.vad.VadRetrieval(metadata, grid_info, settings)
+
+    velocity, id_matrix = synthetic_scan(grid_info, [0.5], 2.0, 1.0)
+
+    # Bugs on half of the circle only
+    id_matrix[:, 360:, :] = bugtracker.core.target_id.get_code('none')
+    profile = retrieval.retrieve(velocity, [0.5], id_matrix, [0.5])
+    assert np.all(profile.gates == 0)
+
+    # No common elevation
+    profile = retrieval.retrieve(velocity, [0.5], id_matrix, [1.5])
+    assert np.all(profile.gates == 0)
+
+
+def test_write(tmp_path):
+
+    heights = np.array([50.0, 150.0])
+    profile = bugtracker.core.vad.VadProfile(heights, np.array([1.0, np.nan]), np.array([0.0, np.nan]),
+                                             np.array([120, 0]), np.array([0.8, np.nan]))
+
+    assert profile.direction[0] == pytest.approx(90.0)
+
+    filename = os.path.join(str(tmp_path), "dbz_201907300300.nc")
+    nc.Dataset(filename, mode='w').close()
+    profile.write(filename)
+
+    dset = nc.Dataset(filename, mode='r')
+    assert list(dset.variables['vad_gates'][:]) == [120, 0]
+    assert dset.variables['vad_speed'][0] == pytest.approx(1.0)
+    dset.close()
+
+    assert bugtracker.core.vad.from_config({'vad': {'enabled': False}}) is None
+
+    with pytest.raises(ValueError):
+        bugtracker.core.vad.VadSettings(min_range=50.0, max_range=10.0)
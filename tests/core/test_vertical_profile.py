@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import bugtracker
+
+
+def test_binned_percentiles():
+
+    rng = np.random.default_rng(5)
+    values = rng.normal(size=500)
+    bins = rng.integers(0, 4, size=500)
+    bins[bins == 2] = 1
+    counts = np.bincount(bins, minlength=5)
+    percentiles = np.array([0.0, 10.0, 50.0, 90.0, 100.0])
+
+    result = bugtracker.core.vertical_profile.binned_percentiles(values, bins, counts, percentiles)
+
+    for x in [0, 1, 3]:
+        assert np.allclose(result[x], np.percentile(values[bins == x], percentiles))
+
+    assert np.all(np.isnan(result[[2, 4]]))
+
+
+def test_compute():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.core.vertical_profile.ProfileSettings(height_step=250.0, max_height=2000.0)
+    profiler = bugtracker.core.vertical_profile.VerticalProfiler(metadata, grid_info, settings)
+
+    dbz_elevs = [0.5, 1.5]
+    dims = (2, grid_info.azims, grid_info.gates)
+    rng = np.random.default_rng(2)
+
+    dbz = rng.uniform(-10.0, 20.0, size=dims).astype(np.float32)
+    dbz[0, 0:10, :] = np.nan
+    id_matrix = np.full(dims, bugtracker.core.target_id.get_code('bugs'), dtype=np.uint8)
+    id_matrix[1, 100:200, :] = bugtracker.core.target_id.get_code('rain')
+
+    profile = profiler.compute(dbz, id_matrix, dbz_elevs)
+
+    assert len(profile.heights) == 8
+    assert profile.heights[0] == 125.0
+
+    # Brute force reference
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    heights = geometry.heights(dbz_elevs)[:, np.newaxis, :] * np.ones(dims, dtype=np.float32)
+    valid = np.isfinite(dbz) & (id_matrix == bugtracker.core.target_id.get_code('bugs'))
+
+    for x in range(0, 8):
+        selected = valid & (heights >= 250.0 * x) & (heights < 250.0 * (x + 1))
+        assert profile.counts[x] == np.count_nonzero(selected)
+        if profile.counts[x] > 0:
+            linear_mean = np.mean(10.0 ** (dbz[selected].astype(np.float64) / 10.0))
+            assert profile.mean_dbz[x] == pytest.approx(10.0 * np.log10(linear_mean), abs=1e-4)
+            assert np.allclose(profile.percentile_values[x], np.percentile(dbz[selected], [10.0, 50.0, 90.0]),
+                               atol=1e-4)
+
+    with pytest.raises(ValueError):
+        profiler.compute(dbz, id_matrix, [0.5])
+
+
+def test_write_and_catalog(tmp_path):
+
+    settings = bugtracker.core.vertical_profile.ProfileSettings(height_step=500.0, max_height=1000.0,
+                                                                percentiles=[50.0])
+    profile = bugtracker.core.vertical_profile.ReflectivityProfile(
+        settings.edges[:-1] + 250.0, np.array([20, 0]), np.array([5.0, np.nan]), settings.percentiles,
+        np.array([[4.0], [np.nan]]))
+
+    filename = os.path.join(str(tmp_path), "dbz_201907300300.nc")
+    nc.Dataset(filename, mode='w').close()
+    profile.write(filename)
+
+    dset = nc.Dataset(filename, mode='r')
+    assert list(dset.variables['profile_count'][:]) == [20, 0]
+    assert dset.variables['profile_dbz'][0, 0] == 4.0
+    dset.close()
+
+    metadata = bugtracker.core.samples.metadata()
+    id_matrix = np.zeros((1, 4, 4), dtype=np.uint8)
+    record = bugtracker.io.catalog.ScanRecord(metadata, metadata.scan_dt, "test", filename, [0.5], id_matrix)
+    record.set_coverage(0.0, 0.0)
+    record.set_profile(profile)
+
+    catalog = bugtracker.io.catalog.ScanCatalog(os.path.join(str(tmp_path), "catalog.sqlite"))
+    catalog.add(record)
+    catalog.flush()
+
+    rows = catalog.profiles("test", metadata.scan_dt, metadata.scan_dt)
+    catalog.close()
+
+    assert len(rows) == 1
+    assert rows[0]['height'] == 250.0
+    assert rows[0]['count'] == 20
+    assert rows[0]['percentiles'] == {50.0: 4.0}
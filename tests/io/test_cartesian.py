@@ -0,0 +1,75 @@
+import os
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+
+import bugtracker
+
+
+def sample_config(tmp_path):
+
+    config = dict()
+    config['cache_dir'] = str(tmp_path)
+    config['plot_settings'] = {'max_range': 100.0}
+    config['cartesian'] = {'enabled': True, 'resolution': 2000.0, 'method': 'idw'}
+
+    return config
+
+
+def test_resample_constant(tmp_path):
+
+    config = sample_config(tmp_path)
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+
+    spec = bugtracker.io.cartesian.from_config(config)
+    assert spec.size == 101
+
+    resampler = bugtracker.io.cartesian.CartesianResampler(config, metadata, grid_info, spec)
+
+    field = np.full((grid_info.azims, grid_info.gates), 12.5, dtype=np.float32)
+    raster = resampler.resample(field)
+
+    assert raster.shape == (spec.size, spec.size)
+    assert np.allclose(raster[resampler.covered], 12.5)
+    assert np.all(np.isnan(raster[~resampler.covered]))
+
+    # Second resampler is loaded from the disk cache
+    filepath = bugtracker.io.cartesian.cartesian_filepath(config, metadata, grid_info, spec, 'idw')
+    assert os.path.isfile(filepath)
+
+    cached = bugtracker.io.cartesian.CartesianResampler(config, metadata, grid_info, spec)
+    assert (cached.operator != resampler.operator).nnz == 0
+
+
+def test_write_target_id(tmp_path):
+
+    config = sample_config(tmp_path)
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    spec = bugtracker.io.cartesian.from_config(config)
+
+    resampler = bugtracker.io.cartesian.get_resampler(config, metadata, grid_info, spec)
+
+    dbz_elevs = [0.5, 1.5]
+    id_matrix = np.full((2, grid_info.azims, grid_info.gates), bugtracker.core.target_id.get_code('bugs'))
+    joint_product = np.ma.masked_less(bugtracker.core.samples.sin_dbz(grid_info), 0.0)
+
+    # The resampler is built from the template metadata, the raster
+    # has the time of the scan
+    scan_dt = metadata.scan_dt + datetime.timedelta(minutes=10)
+
+    filename = os.path.join(tmp_path, "cartesian.nc")
+    resampler.write(filename, "test", scan_dt, dbz_elevs, joint_product, id_matrix)
+
+    dset = nc.Dataset(filename, mode="r")
+    assert dset.getncattr('datetime') == scan_dt.strftime("%Y%m%d%H%M")
+    target = dset.variables['target_id'][:,:,:]
+    assert target.shape == (2, spec.size, spec.size)
+    assert dset.variables['crs'].grid_mapping_name == "azimuthal_equidistant"
+    dset.close()
+
+    bug_code = bugtracker.core.target_id.get_code('bugs')
+    assert np.all(target[:, resampler.covered] == bug_code)
+    assert np.all(np.ma.getmask(target)[:, ~resampler.covered])
@@ -0,0 +1,76 @@
+import os
+import datetime
+
+import numpy as np
+
+import bugtracker
+
+
+def sample_record(scan_dt, bug_fraction):
+
+    metadata = bugtracker.core.samples.metadata()
+    output_path = scan_dt.strftime("dbz_%Y%m%d%H%M.nc")
+
+    dbz_elevs = [0.5, 1.5]
+    id_matrix = np.zeros((2, 10, 10), dtype=int)
+
+    num_bugs = int(bug_fraction * id_matrix.size)
+    id_matrix.flat[0:num_bugs] = bugtracker.core.target_id.get_code('bugs')
+
+    record = bugtracker.io.catalog.ScanRecord(metadata, scan_dt, "test", output_path, dbz_elevs, id_matrix)
+    record.set_coverage(0.1, 0.2)
+    record.set_timings({'extract': 1.0, 'plot': 2.0})
+
+    return record
+
+
+def test_catalog_query(tmp_path):
+
+    db_path = os.path.join(tmp_path, "catalog.sqlite")
+    catalog = bugtracker.io.catalog.ScanCatalog(db_path, batch_size=2)
+
+    start = datetime.datetime(2019, 7, 1, 0, 0)
+
+    for x in range(0, 5):
+        scan_dt = start + datetime.timedelta(minutes=10*x)
+        catalog.add(sample_record(scan_dt, 0.02 * x))
+
+    catalog.flush()
+
+    end = start + datetime.timedelta(hours=1)
+    all_scans = catalog.query("test", start, end)
+    bug_scans = catalog.query("test", start, end, min_bug_fraction=0.05)
+
+    assert len(all_scans) == 5
+    assert len(bug_scans) == 2
+    assert bug_scans[0]['scan_dt'] == start + datetime.timedelta(minutes=30)
+
+    levels = catalog.levels(bug_scans[0]['id'])
+    assert len(levels) == 2
+    assert levels[0]['bugs'] + levels[1]['bugs'] == 12
+
+    timings = catalog.timings(bug_scans[0]['id'])
+    assert timings['plot'] == 2.0
+
+    catalog.close()
+
+
+def test_catalog_replace(tmp_path):
+    """
+    Reprocessing a scan should replace the previous entry.
+    """
+
+    db_path = os.path.join(tmp_path, "catalog.sqlite")
+    catalog = bugtracker.io.catalog.ScanCatalog(db_path)
+
+    scan_dt = datetime.datetime(2019, 7, 1, 0, 0)
+    catalog.add(sample_record(scan_dt, 0.0))
+    catalog.flush()
+    catalog.add(sample_record(scan_dt, 0.5))
+    catalog.close()
+
+    catalog = bugtracker.io.catalog.ScanCatalog(db_path)
+    scans = catalog.query("test", scan_dt, scan_dt)
+
+    assert len(scans) == 1
+    assert scans[0]['bug_fraction'] == 0.5
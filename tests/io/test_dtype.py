@@ -0,0 +1,61 @@
+import copy
+
+import numpy as np
+import pytest
+
+import bugtracker
+
+
+def dtype_config(name):
+
+    config = copy.deepcopy(bugtracker.config.defaults())
+    config['processing']['dtype'] = name
+    return config
+
+
+def test_policy():
+
+    assert bugtracker.io.scan.get_dtype(bugtracker.config.defaults()) == np.float32
+    assert bugtracker.io.scan.get_dtype(dtype_config('float64')) == np.float64
+
+    with pytest.raises(ValueError):
+        bugtracker.io.scan.get_dtype(dtype_config('float16'))
+
+    with pytest.raises(ValueError):
+        bugtracker.io.scan.check_dtype(np.zeros(3), np.dtype(np.float32), "test")
+
+
+@pytest.mark.parametrize("name", bugtracker.io.scan.DTYPES)
+def test_stages(name):
+    """
+    No stage upcasts the fields: the decoding (upsample), the level
+    merge, the dBZ cutoff, the filter and the joint product.
+    """
+
+    dtype = bugtracker.io.scan.get_dtype(dtype_config(name))
+    rng = np.random.default_rng(3)
+
+    # Raw IRIS-like levels, half the resolution of the grid, as float64
+    # masked arrays (like the pyart fields)
+    raw = np.ma.masked_array(rng.uniform(-40.0, 50.0, size=(360, 256)), mask=rng.random((360, 256)) < 0.2)
+
+    level = bugtracker.io.iris.upsample(raw, 720, 512, dtype)
+    bugtracker.io.scan.check_dtype(level, dtype, "upsample")
+    assert np.isnan(level[0,0]) == bool(raw.mask[0,0])
+    assert np.array_equal(np.isnan(level[::2,::2]), raw.mask)
+
+    all_dbz = np.stack([level, level, rng.uniform(-40.0, 50.0, size=(720, 512)).astype(dtype)])
+    merged, elevs = bugtracker.io.iris.merge_levels(all_dbz, [0.5, 0.5, 1.5])
+    bugtracker.io.scan.check_dtype(merged, dtype, "merge")
+    assert elevs == [0.5, 1.5]
+    assert np.array_equal(merged[0], level, equal_nan=True)
+
+    bugtracker.io.scan.apply_cutoff(merged, -30.0)
+    bugtracker.io.scan.check_dtype(merged, dtype, "cutoff")
+
+    mask = bugtracker.core.filter.PackedMask(rng.random(merged.shape) < 0.3)
+    filtered = bugtracker.io.scan.apply_filter(merged, mask)
+    bugtracker.io.scan.check_dtype(filtered, dtype, "filter")
+
+    joint = bugtracker.io.scan.joint_max(filtered, 30.0)
+    bugtracker.io.scan.check_dtype(joint, dtype, "joint")
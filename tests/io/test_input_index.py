@@ -0,0 +1,57 @@
+import os
+import datetime
+
+import bugtracker
+
+
+def parse_test_file(path):
+
+    basename = os.path.basename(path)
+    if not basename.endswith(".vol"):
+        raise ValueError(f"Not a volume: {basename}")
+
+    scan_dt = datetime.datetime.strptime(basename[0:12], "%Y%m%d%H%M")
+    return scan_dt, "vol"
+
+
+def make_files(base, scan_times):
+
+    for scan_dt in scan_times:
+        folder = os.path.join(base, "xyz", scan_dt.strftime(os.path.join("%Y", "%m", "%d")))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, scan_dt.strftime("%Y%m%d%H%M.vol")), "w") as handle:
+            handle.write("test")
+
+
+def test_input_index(tmp_path):
+
+    input_dir = os.path.join(tmp_path, "input")
+    config = {'input_dirs': {'nexrad': input_dir}, 'cache_dir': str(tmp_path)}
+
+    start = datetime.datetime(2019, 7, 1, 23, 0)
+    scan_times = [start + datetime.timedelta(minutes=10*x) for x in range(0, 12)]
+    make_files(input_dir, scan_times)
+
+    # Ignored by the parser
+    with open(os.path.join(input_dir, "xyz", "2019", "07", "01", "notes.txt"), "w") as handle:
+        handle.write("test")
+
+    index = bugtracker.io.input_index.InputIndex(config, "nexrad", "XYZ", parse_test_file)
+
+    end = start + datetime.timedelta(hours=2)
+    files = index.get_range(start, end)
+
+    assert len(files) == 12
+    assert files == sorted(files)
+
+    closest = index.get_closest(datetime.datetime(2019, 7, 2, 0, 14), datetime.timedelta(hours=1))
+    assert os.path.basename(closest) == "201907020010.vol"
+
+    far_away = index.get_closest(datetime.datetime(2019, 7, 2, 5, 0), datetime.timedelta(hours=1))
+    assert far_away is None
+
+    # New files must show up once the folder mtime changes
+    make_files(input_dir, [datetime.datetime(2019, 7, 2, 1, 0)])
+    assert len(index.get_range(start, end)) == 13
+
+    index.close()
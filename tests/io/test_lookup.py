@@ -0,0 +1,95 @@
+import os
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import bugtracker
+
+
+def sample_lookup():
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    geometry = bugtracker.core.geometry.get_geometry(grid_info, metadata)
+    lats, lons = geometry.latlon()
+
+    lookup = bugtracker.io.lookup.GateLookup(lats, lons, metadata.lat, metadata.lon)
+    return lookup, lats, lons
+
+
+def test_query_point():
+
+    lookup, lats, lons = sample_lookup()
+
+    for azim, gate in [(0, 10), (100, 200), (719, 511)]:
+        selection = lookup.query_point(lats[azim,gate], lons[azim,gate])
+        assert selection.azims[0] == azim
+        assert selection.gates[0] == gate
+        assert selection.weights[0] == 1.0
+
+    selection = lookup.query_point(lats[50,50], lons[50,50], neighbours=4)
+    assert len(selection) == 4
+    assert np.isclose(selection.weights.sum(), 1.0)
+
+    # A site a degree outside the coverage is not snapped to an edge gate
+    assert len(lookup.query_point(lats[0,10], lons[0,10], max_distance=2000.0)) == 1
+    with pytest.raises(ValueError):
+        lookup.query_point(lats[0,-1] + 1.0, lons[0,-1], max_distance=2000.0)
+
+
+def test_query_polygon():
+
+    lookup, lats, lons = sample_lookup()
+
+    # Small box around gate (360, 100)
+    lat_c = lats[360,100]
+    lon_c = lons[360,100]
+    delta = 0.02
+    vertices = [(lat_c - delta, lon_c - delta), (lat_c - delta, lon_c + delta),
+                (lat_c + delta, lon_c + delta), (lat_c + delta, lon_c - delta)]
+
+    selection = lookup.query_polygon(vertices)
+    assert len(selection) > 1
+    assert np.isclose(selection.weights.sum(), 1.0)
+    assert np.any(np.logical_and(selection.azims == 360, selection.gates == 100))
+
+
+def test_extract(tmp_path):
+
+    lookup, lats, lons = sample_lookup()
+    azims, gates = lats.shape
+    bug_code = bugtracker.core.target_id.get_code('bugs')
+
+    output_files = []
+    start = datetime.datetime(2019, 7, 1, 0, 0)
+
+    for x in range(0, 3):
+        scan_dt = start + datetime.timedelta(minutes=10*x)
+        filename = os.path.join(tmp_path, scan_dt.strftime("dbz_%Y%m%d%H%M.nc"))
+        dset = nc.Dataset(filename, mode="w")
+        # Stale attribute, the scan time is taken from the filename
+        dset.datetime = start.strftime("%Y%m%d%H%M")
+        dset.createDimension("dbz_elevs", 2)
+        dset.createDimension("azims", azims)
+        dset.createDimension("gates", gates)
+        joint = dset.createVariable("dbz_joint", np.float32, ('azims','gates'))
+        joint[:,:] = float(x)
+        target_id = dset.createVariable("target_id", int, ('dbz_elevs','azims','gates'))
+        target_id[:,:,:] = 0
+        target_id[1,:,:] = bug_code
+        dset.close()
+        output_files.append(filename)
+
+    selections = dict()
+    selections['a'] = lookup.query_point(lats[10,10], lons[10,10], neighbours=4)
+    selections['b'] = lookup.query_point(lats[300,400], lons[300,400])
+
+    extractor = bugtracker.io.lookup.TimeSeriesExtractor(selections)
+    series = extractor.extract(output_files, fields=['dbz_joint', 'target_id', 'dbz_filtered'])
+
+    assert series['scan_dt'] == [start + datetime.timedelta(minutes=10*x) for x in range(0, 3)]
+    assert np.allclose(series['b']['dbz_joint'][:,0], [0.0, 1.0, 2.0])
+    assert np.allclose(series['a']['target_id'], [[0.0, 1.0]] * 3)
+    assert np.all(np.isnan(series['a']['dbz_filtered']))
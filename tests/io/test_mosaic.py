@@ -0,0 +1,136 @@
+import os
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import bugtracker
+
+
+def write_station(config, radar_id, lat, lon, scan_dt, grid_info, dbz, target):
+    """
+    Calib file (only its name and grid offsets are used) and one
+    output file
+    """
+
+    metadata = bugtracker.core.metadata.Metadata(radar_id, scan_dt, lat, lon, radar_id)
+    calib_dir = os.path.join(config['cache_dir'], 'calib')
+    os.makedirs(calib_dir, exist_ok=True)
+
+    dset = nc.Dataset(os.path.join(calib_dir, bugtracker.core.cache.get_calib_key(metadata, grid_info)), mode='w')
+    dset.setncattr("azim_offset", grid_info.azim_offset)
+    dset.setncattr("gate_offset", grid_info.gate_offset)
+    dset.close()
+
+    folder = os.path.join(config['netcdf_dir'], radar_id, scan_dt.strftime(os.path.join("%Y", "%m", "%d")))
+    os.makedirs(folder, exist_ok=True)
+
+    dset = nc.Dataset(os.path.join(folder, scan_dt.strftime("dbz_%Y%m%d%H%M.nc")), mode='w')
+    dset.latitude = lat
+    dset.longitude = lon
+    # Start time of the run, the scan time is in the file name
+    dset.setncattr('datetime', scan_dt.strftime("%Y%m%d0000"))
+    dset.createDimension("dbz_elevs", 1)
+    dset.createDimension("azims", grid_info.azims)
+    dset.createDimension("gates", grid_info.gates)
+
+    nc_joint = dset.createVariable("dbz_joint", np.float32, ('azims','gates'))
+    nc_joint[:,:] = np.full((grid_info.azims, grid_info.gates), dbz, dtype=np.float32)
+    nc_target = dset.createVariable("target_id", int, ('dbz_elevs','azims','gates'))
+    nc_target[:,:,:] = target
+
+    dset.close()
+
+
+def sample_config(tmp_path, rule):
+
+    config = dict()
+    config['cache_dir'] = os.path.join(str(tmp_path), "cache")
+    config['netcdf_dir'] = os.path.join(str(tmp_path), "netcdf")
+    config['mosaic'] = {'stations': ['rada', 'radb'], 'rule': rule, 'lat_min': 44.0, 'lat_max': 46.0,
+                        'lon_min': -74.0, 'lon_max': -71.0, 'resolution': 0.02, 'max_range': 100.0,
+                        'max_offset': 10.0}
+
+    return config
+
+
+@pytest.mark.parametrize("rule", ['max', 'nearest', 'distance'])
+def test_mosaic(tmp_path, rule):
+
+    config = sample_config(tmp_path, rule)
+    grid_info = bugtracker.core.grid.GridInfo(200, 360, 500.0, 1.0, azim_offset=0.5, gate_offset=250.0)
+    target_dt = datetime.datetime(2019, 7, 30, 3, 0)
+
+    bugs = bugtracker.core.target_id.get_code('bugs')
+    rain = bugtracker.core.target_id.get_code('rain')
+
+    # Two radars 80 km apart, the second scan is 5 minutes late
+    write_station(config, "rada", 45.0, -73.5, target_dt, grid_info, 10.0, bugs)
+    write_station(config, "radb", 45.0, -72.48, target_dt + datetime.timedelta(minutes=5), grid_info, 20.0, rain)
+
+    settings = bugtracker.io.mosaic.from_config(config)
+    builder = bugtracker.io.mosaic.MosaicBuilder(config, settings)
+    filename = builder.build_and_write(target_dt)
+
+    assert filename.endswith(os.path.join("2019", "07", "30", "mosaic_201907300300.nc"))
+
+    dset = nc.Dataset(filename, mode='r')
+    lats = dset.variables['lat'][:]
+    lons = dset.variables['lon'][:]
+    joint = dset.variables['dbz_joint'][:,:].filled(np.nan)
+    target = dset.variables['target_id'][:,:].filled(-1)
+    radar_index = dset.variables['radar_index'][:,:].filled(-1)
+    assert dset.getncattr('stations') == "rada radb"
+    assert dset.getncattr('scan_datetimes') == "201907300300 201907300305"
+    dset.close()
+
+    row = np.argmin(np.abs(lats - 45.0))
+    near_a = np.argmin(np.abs(lons + 73.4))
+    near_b = np.argmin(np.abs(lons + 72.58))
+    outside = np.argmin(np.abs(lons + 74.0))
+
+    # Both radars cover these pixels, each nearer to one of them
+    if rule == 'max':
+        assert joint[row, near_a] == 20.0
+    elif rule == 'nearest':
+        assert joint[row, near_a] == 10.0
+        assert joint[row, near_b] == 20.0
+    else:
+        assert 10.0 < joint[row, near_a] < joint[row, near_b] < 20.0
+
+    assert target[row, near_a] == bugs and target[row, near_b] == rain
+    assert radar_index[row, near_a] == 0 and radar_index[row, near_b] == 1
+
+    # Only covered by the first radar, then by none
+    assert joint[row, outside + 10] == 10.0
+    assert np.isnan(joint[0, 0]) and target[0, 0] == -1
+
+    # The operators are built with the offsets of the calib files
+    scan = bugtracker.io.mosaic.read_station(config, "rada", target_dt, 10.0)
+    assert (scan.grid_info.azim_offset, scan.grid_info.gate_offset) == (0.5, 250.0)
+    key = bugtracker.io.mosaic.get_operator_key(scan.metadata, scan.grid_info, settings.grid, settings.max_range)
+    assert key in bugtracker.io.mosaic._operators
+
+
+def test_operator_cache(tmp_path):
+
+    config = sample_config(tmp_path, 'max')
+    grid = bugtracker.io.mosaic.from_config(config).grid
+    grid_info = bugtracker.core.grid.GridInfo(200, 360, 500.0, 1.0)
+    metadata = bugtracker.core.metadata.Metadata("radc", datetime.datetime(2019, 7, 30), 45.0, -73.0, "radc")
+
+    operator = bugtracker.io.mosaic.get_operator(config, metadata, grid_info, grid, 50.0)
+    filepath = bugtracker.io.mosaic.operator_filepath(config, metadata, grid_info, grid, 50.0)
+    assert os.path.isfile(filepath)
+    assert np.all(operator.distance <= 50.0)
+    assert len(np.unique(operator.pixels)) == len(operator)
+
+    # Same operator object in this process
+    assert bugtracker.io.mosaic.get_operator(config, metadata, grid_info, grid, 50.0) is operator
+
+    with pytest.raises(ValueError):
+        bugtracker.io.mosaic.MosaicGrid(46.0, 44.0, -74.0, -71.0, 0.02)
+
+    with pytest.raises(ValueError):
+        bugtracker.io.mosaic.from_config(config, rule='mean')
@@ -0,0 +1,179 @@
+import os
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+from scipy import ndimage
+
+import bugtracker
+
+
+def blobs(x_arr, y_arr):
+    """
+    Textured echo pattern (dBZ, NaN without echo): smoothed noise on a
+    1 km grid spanning +-200 km, interpolated at x/y (meters)
+    """
+
+    rng = np.random.default_rng(7)
+    pattern = ndimage.gaussian_filter(rng.normal(size=(401, 401)), 3.0) * 150.0
+
+    rows = (np.asarray(y_arr) + 200000.0) / 1000.0
+    cols = (np.asarray(x_arr) + 200000.0) / 1000.0
+    field = ndimage.map_coordinates(pattern, [rows, cols], order=1)
+
+    return np.where(field > 0.0, field, np.nan).astype(np.float32)
+
+
+def polar_blobs(grid_info, shift_x, shift_y):
+
+    azims = np.radians(np.arange(grid_info.azims) * grid_info.azim_step + grid_info.azim_offset)
+    ranges = np.arange(grid_info.gates) * grid_info.gate_step + grid_info.gate_offset
+    x_arr = np.outer(np.sin(azims), ranges)
+    y_arr = np.outer(np.cos(azims), ranges)
+
+    return blobs(x_arr - shift_x, y_arr - shift_y)
+
+
+def test_estimate_motion():
+
+    settings = bugtracker.io.motion.MotionSettings(resolution=1000.0, max_range=150.0)
+    x_axis, y_axis = settings.spec.coords()
+    x_arr, y_arr = np.meshgrid(x_axis, y_axis)
+
+    # 5 km east and 3 km south in 10 minutes
+    previous = blobs(x_arr, y_arr)
+    current = blobs(x_arr - 5000.0, y_arr + 3000.0)
+
+    motion = bugtracker.io.motion.estimate_motion(previous, current, settings, 600.0)
+
+    assert motion.u.shape == (10, 10)
+    assert len(motion.x) == 10 and len(motion.y) == 10
+    assert np.nanmedian(motion.u) == pytest.approx(5000.0 / 600.0, abs=0.5)
+    assert np.nanmedian(motion.v) == pytest.approx(-3000.0 / 600.0, abs=0.5)
+    assert np.all((motion.quality >= 0.0) & (motion.quality <= 1.0))
+
+    # Tiles without echo are rejected
+    empty = np.full(previous.shape, np.nan, dtype=np.float32)
+    motion = bugtracker.io.motion.estimate_motion(empty, empty, settings, 600.0)
+    assert np.all(motion.quality == 0.0)
+    assert np.all(np.isnan(motion.u))
+
+
+def test_settings():
+
+    assert bugtracker.io.motion.from_config(bugtracker.config.defaults()) is None
+
+    config = {'motion': {'enabled': True, 'field': 'bugs', 'tile_size': 16}}
+    settings = bugtracker.io.motion.from_config(config)
+    assert settings.field == 'bugs'
+    assert settings.tile_size == 16
+
+    with pytest.raises(ValueError):
+        bugtracker.io.motion.MotionSettings(tile_size=15)
+
+    with pytest.raises(ValueError):
+        bugtracker.io.motion.MotionSettings(field='rain')
+
+
+def test_tracker(tmp_path):
+
+    config = {'cache_dir': str(tmp_path)}
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.io.motion.MotionSettings(resolution=2000.0, max_range=120.0, tile_size=16, max_gap=15.0)
+
+    tracker = bugtracker.io.motion.MotionTracker(config, metadata, grid_info, settings)
+
+    filename = os.path.join(str(tmp_path), "dbz_201907300310.nc")
+    dset = nc.Dataset(filename, mode='w')
+    dset.close()
+
+    scan_dt = datetime.datetime(2019, 7, 30, 3, 0)
+    assert tracker.update(scan_dt, polar_blobs(grid_info, 0.0, 0.0)) is None
+
+    scan_dt += datetime.timedelta(minutes=10)
+    motion = tracker.update(scan_dt, polar_blobs(grid_info, 6000.0, 4000.0), filename)
+
+    assert np.nanmedian(motion.u) == pytest.approx(10.0, abs=1.0)
+    assert np.nanmedian(motion.v) == pytest.approx(4000.0 / 600.0, abs=1.0)
+
+    # Written twice, the second time in place
+    motion.write(filename)
+
+    dset = nc.Dataset(filename, mode='r')
+    assert dset.getncattr('motion_previous') == "201907300300"
+    assert dset.getncattr('motion_interval') == 600.0
+    assert np.allclose(dset.variables['motion_u'][:,:].filled(np.nan), motion.u, equal_nan=True)
+    dset.close()
+
+    # No motion after a gap
+    scan_dt += datetime.timedelta(minutes=30)
+    assert tracker.update(scan_dt, polar_blobs(grid_info, 0.0, 0.0)) is None
+
+
+def test_track_outputs(tmp_path):
+
+    config = {'cache_dir': str(tmp_path)}
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.io.motion.MotionSettings(field='joint', resolution=2000.0, max_range=120.0,
+                                                   tile_size=16, max_gap=15.0)
+
+    output_files = []
+    start = datetime.datetime(2019, 7, 30, 3, 0)
+
+    for x in range(0, 2):
+        scan_dt = start + datetime.timedelta(minutes=10*x)
+        filename = os.path.join(str(tmp_path), scan_dt.strftime("dbz_%Y%m%d%H%M.nc"))
+        dset = nc.Dataset(filename, mode='w')
+        # Same attribute in all the outputs of a run
+        dset.datetime = start.strftime("%Y%m%d%H%M")
+        dset.latitude = metadata.lat
+        dset.longitude = metadata.lon
+        dset.createDimension("azims", grid_info.azims)
+        dset.createDimension("gates", grid_info.gates)
+        joint = dset.createVariable("dbz_joint", np.float32, ('azims','gates'))
+        joint[:,:] = polar_blobs(grid_info, 6000.0 * x, 4000.0 * x)
+        dset.close()
+        output_files.append(filename)
+
+    tracker = bugtracker.io.motion.MotionTracker(config, metadata, grid_info, settings)
+    assert bugtracker.io.motion.track_outputs(tracker, output_files) == 1
+
+    dset = nc.Dataset(output_files[1], mode='r')
+    assert dset.getncattr('motion_previous') == "201907300300"
+    assert dset.getncattr('motion_interval') == 600.0
+    dset.close()
+
+
+def test_seed_from_output(tmp_path):
+
+    config = {'cache_dir': str(tmp_path), 'netcdf_dir': str(tmp_path)}
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    settings = bugtracker.io.motion.MotionSettings(field='joint', resolution=2000.0, max_range=120.0,
+                                                   tile_size=16, max_gap=15.0)
+
+    # Output of the previous tracker.py run
+    previous_dt = datetime.datetime(2019, 7, 30, 3, 0)
+    folder = os.path.join(str(tmp_path), metadata.radar_id, previous_dt.strftime(os.path.join("%Y", "%m", "%d")))
+    os.makedirs(folder)
+    dset = nc.Dataset(os.path.join(folder, previous_dt.strftime("dbz_%Y%m%d%H%M.nc")), mode='w')
+    dset.createDimension("azims", grid_info.azims)
+    dset.createDimension("gates", grid_info.gates)
+    dset.createVariable("dbz_joint", np.float32, ('azims','gates'))[:,:] = polar_blobs(grid_info, 0.0, 0.0)
+    dset.close()
+
+    # A new process, whose first scan is 10 minutes later
+    tracker = bugtracker.io.motion.MotionTracker(config, metadata, grid_info, settings, seed_outputs=True)
+    scan_dt = previous_dt + datetime.timedelta(minutes=10)
+    motion = tracker.update(scan_dt, polar_blobs(grid_info, 6000.0, 4000.0))
+
+    assert motion is not None
+    assert motion.interval == 600.0
+    assert np.nanmedian(motion.u) == pytest.approx(10.0, abs=1.0)
+
+    # Nothing within max_gap
+    tracker = bugtracker.io.motion.MotionTracker(config, metadata, grid_info, settings, seed_outputs=True)
+    assert tracker.update(scan_dt + datetime.timedelta(minutes=30), polar_blobs(grid_info, 0.0, 0.0)) is None
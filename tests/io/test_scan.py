@@ -0,0 +1,43 @@
+import numpy as np
+
+import bugtracker
+
+
+def test_nan_conversion():
+
+    masked = np.ma.masked_array([[1.0, 2.0], [3.0, 4.0]], mask=[[0, 1], [0, 0]])
+
+    field = bugtracker.io.scan.to_nan(masked)
+    assert field.dtype == np.float32
+    assert np.isnan(field[0,1])
+    assert field[1,1] == 4.0
+
+    roundtrip = bugtracker.io.scan.to_masked(field)
+    assert np.array_equal(np.ma.getmaskarray(roundtrip), np.ma.getmaskarray(masked))
+
+    bugtracker.io.scan.apply_cutoff(field, 2.5)
+    assert np.isnan(field[0,0]) and field[1,0] == 3.0
+
+
+def test_filter_and_joint():
+
+    rng = np.random.default_rng(1)
+    dims = (3, 20, 30)
+
+    dbz = rng.uniform(-30.0, 50.0, size=dims).astype(np.float32)
+    dbz[rng.random(dims) < 0.2] = np.nan
+    mask = rng.random(dims) < 0.3
+
+    # Same results as the masked array version of the processors
+    masked_dbz = np.ma.masked_invalid(dbz)
+    masked_filtered = np.ma.array(masked_dbz, mask=np.ma.mask_or(mask, np.ma.getmask(masked_dbz)))
+    masked_joint = np.amax(np.ma.masked_where(masked_filtered >= 30.0, masked_filtered), axis=0)
+
+    packed = bugtracker.core.filter.PackedMask(mask)
+    filtered = bugtracker.io.scan.apply_filter(dbz, packed)
+    assert np.array_equal(np.isnan(filtered), np.ma.getmaskarray(masked_filtered))
+
+    joint = bugtracker.io.scan.joint_max(filtered, 30.0)
+    assert joint.dtype == np.float32
+    assert np.array_equal(np.isnan(joint), np.ma.getmaskarray(masked_joint))
+    assert np.allclose(joint[~np.isnan(joint)], masked_joint.compressed())
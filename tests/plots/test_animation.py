@@ -0,0 +1,121 @@
+import os
+import argparse
+
+import numpy as np
+import netCDF4 as nc
+import cv2
+import pytest
+from PIL import Image
+
+import bugtracker
+
+
+def write_output(filename, scan_dt, grid_info, dbz_elevs, data):
+
+    dset = nc.Dataset(filename, mode='w')
+    dset.setncattr('datetime', scan_dt.strftime("%Y%m%d%H%M"))
+    dset.createDimension("dbz_elevs", len(dbz_elevs))
+    dset.createDimension("azims", grid_info.azims)
+    dset.createDimension("gates", grid_info.gates)
+
+    nc_elevs = dset.createVariable("dbz_elevs", np.float32, ('dbz_elevs',))
+    nc_filtered = dset.createVariable("dbz_filtered", np.float32, ('dbz_elevs','azims','gates'))
+    nc_joint = dset.createVariable("dbz_joint", np.float32, ('azims','gates'))
+
+    nc_elevs[:] = dbz_elevs
+    for x in range(0, len(dbz_elevs)):
+        nc_filtered[x,:,:] = data
+    nc_joint[:,:] = data
+
+    dset.close()
+
+
+def test_settings():
+
+    config = bugtracker.config.defaults()
+    args = argparse.Namespace(source='netcdf', codec=None, fps=None, scale=0.25, workers=None)
+
+    settings = bugtracker.plots.animation.get_settings(config, args)
+    assert settings['source'] == 'netcdf'
+    assert settings['codec'] == 'mp4v'
+    assert settings['scale'] == 0.25
+
+    args.codec = 'XVID'
+    with pytest.raises(ValueError):
+        bugtracker.plots.animation.get_settings(config, args)
+
+    assert bugtracker.plots.animation.even_size(1281, 961, 0.5) == (640, 480)
+
+
+def test_calib_key(tmp_path):
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+
+    key = bugtracker.core.cache.get_calib_key(metadata, grid_info)
+    radar_id, parsed = bugtracker.core.cache.parse_calib_key(key)
+
+    assert radar_id == metadata.radar_id
+    assert (parsed.azims, parsed.gates) == (grid_info.azims, grid_info.gates)
+    assert parsed.gate_step == grid_info.gate_step
+
+    # The offsets are read from the calib file
+    calib_file = os.path.join(str(tmp_path), key)
+    dset = nc.Dataset(calib_file, mode='w')
+    dset.setncattr("azim_offset", 0.25)
+    dset.setncattr("gate_offset", 2125.0)
+    dset.close()
+
+    radar_id, calib_grid = bugtracker.core.cache.calib_grid(calib_file)
+    assert (calib_grid.azims, calib_grid.gates) == (grid_info.azims, grid_info.gates)
+    assert (calib_grid.azim_offset, calib_grid.gate_offset) == (0.25, 2125.0)
+
+
+def test_png_worker(tmp_path):
+
+    image_list = []
+    for x in range(0, 3):
+        filename = os.path.join(str(tmp_path), f"20190730030{x}_joint_product.png")
+        Image.fromarray(np.full((121, 161, 3), 40 * x, dtype=np.uint8)).save(filename)
+        image_list.append(filename)
+
+    video_name = os.path.join(str(tmp_path), "joint_product.avi")
+    frames = bugtracker.plots.animation.png_worker(video_name, image_list, 'MJPG', 1.0, 0.5)
+    assert frames == 3
+
+    video = cv2.VideoCapture(video_name)
+    assert video.get(cv2.CAP_PROP_FRAME_WIDTH) == 80
+    assert video.get(cv2.CAP_PROP_FRAME_HEIGHT) == 60
+    video.release()
+
+
+def test_netcdf_worker(tmp_path):
+
+    config = {'cache_dir': str(tmp_path)}
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    data = bugtracker.core.samples.sin_dbz(grid_info)
+
+    output_files = []
+    for x in range(0, 4):
+        scan_dt = metadata.scan_dt.replace(minute=10 * x)
+        filename = os.path.join(str(tmp_path), scan_dt.strftime("dbz_%Y%m%d%H%M.nc"))
+        # The last scan is missing the 1.5 degree elevation
+        dbz_elevs = [0.5, 1.5] if x < 3 else [0.5]
+        write_output(filename, scan_dt, grid_info, dbz_elevs, data)
+        output_files.append(filename)
+
+    keywords = bugtracker.plots.animation.netcdf_keywords(output_files[0])
+    assert keywords == [('filtered', 0.5), ('filtered', 1.5), ('unfiltered', 0.5), ('unfiltered', 1.5), ('joint', None)]
+
+    layout = bugtracker.plots.raster.get_layout(config, metadata, grid_info, 100.0, height=120)
+    background = bugtracker.plots.raster.get_background(config, layout, features=False)
+
+    video_name = os.path.join(str(tmp_path), "filtered_angle_1.5.mp4")
+    frames = bugtracker.plots.animation.netcdf_worker(video_name, output_files, 'filtered', 1.5,
+                                                      layout, background, 'mp4v', 2.0)
+    assert frames == 3
+
+    video = cv2.VideoCapture(video_name)
+    assert video.get(cv2.CAP_PROP_FRAME_COUNT) == 3
+    video.release()
@@ -0,0 +1,214 @@
+import os
+import json
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import bugtracker
+
+
+def test_default_policy():
+
+    policy = bugtracker.plots.policy.PlotPolicy()
+    scan_dt = datetime.datetime(2019, 7, 30, 3, 4)
+    jobs = policy.jobs('kcbw', scan_dt, [0.5, 1.5, 2.5])
+
+    # 3 levels of filtered, unfiltered and target_id, then joint
+    assert len(jobs) == 10
+    assert jobs[0] == bugtracker.plots.policy.PlotJob('filtered', 0)
+    assert jobs[-1] == bugtracker.plots.policy.PlotJob('joint')
+
+
+def test_cadence():
+
+    products = {
+        "joint": {"cadence": 0, "elevations": []},
+        "target_id": {"cadence": 60, "elevations": [1.5]}
+    }
+    policy = bugtracker.plots.policy.PlotPolicy("deferred", products)
+    dbz_elevs = [0.48, 1.53, 2.4]
+
+    products_by_scan = []
+    for minute in [4, 10, 58, 64, 70]:
+        scan_dt = datetime.datetime(2019, 7, 30, 3, 0) + datetime.timedelta(minutes=minute)
+        products_by_scan.append([(job.product, job.level) for job in policy.jobs('kcbw', scan_dt, dbz_elevs)])
+
+    assert products_by_scan[0] == [('target_id', 1), ('joint', None)]
+    assert products_by_scan[1] == [('joint', None)]
+    assert products_by_scan[2] == [('joint', None)]
+    assert products_by_scan[3] == [('target_id', 1), ('joint', None)]
+    assert products_by_scan[4] == [('joint', None)]
+
+
+def test_cadence_state(tmp_path):
+
+    products = {"target_id": {"cadence": 60, "elevations": []}}
+    state_path = bugtracker.plots.policy.state_filepath({'cache_dir': str(tmp_path)})
+    dbz_elevs = [0.5, 1.5]
+
+    # One policy per scan, as with one tracker.py run per scan
+    num_jobs = []
+    for minute in [4, 10, 64]:
+        policy = bugtracker.plots.policy.PlotPolicy("inline", products, state_path)
+        scan_dt = datetime.datetime(2019, 7, 30, 3, 0) + datetime.timedelta(minutes=minute)
+        num_jobs.append(len(policy.jobs('kcbw', scan_dt, dbz_elevs)))
+
+    assert num_jobs == [2, 0, 2]
+
+    # Stations are independent
+    policy = bugtracker.plots.policy.PlotPolicy("inline", products, state_path)
+    assert len(policy.jobs('kenx', datetime.datetime(2019, 7, 30, 3, 10), dbz_elevs)) == 2
+
+
+def test_invalid_policy():
+
+    with pytest.raises(ValueError):
+        bugtracker.plots.policy.PlotPolicy("later")
+
+    with pytest.raises(ValueError):
+        bugtracker.plots.policy.PlotPolicy("inline", {"reflectivity": {"cadence": 0}})
+
+    with pytest.raises(ValueError):
+        bugtracker.plots.policy.PlotPolicy("inline", {"joint": {"cadence": -5}})
+
+    with pytest.raises(ValueError):
+        bugtracker.plots.policy.PlotPolicy("inline", {"joint": {"every": 5}})
+
+
+def write_output(filename, metadata, grid_info, dbz_elevs):
+
+    dset = nc.Dataset(filename, mode='w')
+    dset.setncattr('latitude', metadata.lat)
+    dset.setncattr('longitude', metadata.lon)
+    dset.setncattr('radar_id', metadata.radar_id)
+    dset.setncattr('datetime', metadata.scan_dt.strftime("%Y%m%d%H%M"))
+
+    dset.createDimension("dbz_elevs", len(dbz_elevs))
+    dset.createDimension("azims", grid_info.azims)
+    dset.createDimension("gates", grid_info.gates)
+
+    dims = ('dbz_elevs', 'azims', 'gates')
+    dset.createVariable("dbz_elevs", np.float32, ('dbz_elevs',))[:] = dbz_elevs
+    dset.createVariable("dbz_filtered", np.float32, dims)[:] = 1.0
+    dset.createVariable("dbz_unfiltered", np.float32, dims)[:] = 2.0
+    dset.createVariable("dbz_joint", np.float32, ('azims', 'gates'))[:] = 3.0
+    dset.close()
+
+
+def test_queue(tmp_path):
+
+    config = {'cache_dir': str(tmp_path)}
+    queue = bugtracker.plots.plot_queue.PlotQueue(bugtracker.plots.plot_queue.queue_filepath(config))
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    dbz_elevs = [0.5, 1.5]
+
+    output_file = os.path.join(str(tmp_path), "dbz_201307171950.nc")
+    write_output(output_file, metadata, grid_info, dbz_elevs)
+
+    jobs = bugtracker.plots.policy.PlotPolicy().jobs(metadata.radar_id, metadata.scan_dt, dbz_elevs)
+    queue.enqueue(metadata, metadata.scan_dt, output_file, "calib.nc", grid_info, jobs)
+
+    # Queuing the same scan again does not duplicate the jobs
+    queue.enqueue(metadata, metadata.scan_dt, output_file, "calib.nc", grid_info, jobs)
+    assert queue.counts() == {'pending': len(jobs)}
+
+    groups = queue.pending()
+    assert len(groups) == 1
+    assert groups[0][0] == os.path.abspath(output_file)
+
+    rows = groups[0][1]
+    assert [bugtracker.plots.plot_queue.row_to_job(row) for row in rows] == jobs
+
+    stored_grid = bugtracker.plots.plot_queue.grid_from_json(rows[0]['grid_info'])
+    assert stored_grid.gate_step == grid_info.gate_step
+    assert stored_grid.azims == grid_info.azims
+
+    # The output file has everything but target_id
+    scan = bugtracker.plots.plot_queue.OutputScan(output_file)
+    assert scan.datetime == metadata.scan_dt
+    assert scan.metadata.radar_id == metadata.radar_id
+    assert scan.dbz_filtered.shape == (2, grid_info.azims, grid_info.gates)
+    assert scan.id_matrix is None
+
+    # No target_id in the output file, so the jobs fail
+    done, failed = bugtracker.plots.plot_queue.drain(queue)
+    assert (done, failed) == (0, len(jobs))
+    assert queue.counts() == {'failed': len(jobs)}
+
+    queue.retry_failed()
+    assert queue.counts() == {'pending': len(jobs)}
+
+    queue.close()
+
+
+def test_drain_nexrad(tmp_path, monkeypatch):
+    """
+    A NEXRAD output keeps vertical_scans of the scanned elevations, and
+    its 'datetime' attribute is the start time of the run.
+    """
+
+    template = bugtracker.config.ConfigTemplate()
+    template.populate(str(tmp_path))
+    template.data['plot_settings']['renderer'] = 'fast'
+
+    for key in ["plot_dir", "cache_dir"]:
+        os.makedirs(template.data[key], exist_ok=True)
+
+    config_path = os.path.join(str(tmp_path), "bugtracker.json")
+    with open(config_path, 'w') as handle:
+        json.dump(template.data, handle)
+
+    monkeypatch.setenv(bugtracker.config.ENV_VARIABLE, config_path)
+    config = bugtracker.config.reload()
+
+    # No Natural Earth features (downloaded by cartopy)
+    render_background = bugtracker.plots.raster.render_background
+    monkeypatch.setattr(bugtracker.plots.raster, "render_background",
+                        lambda layout, features=True: render_background(layout, features=False))
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    scan_dt = metadata.scan_dt + datetime.timedelta(hours=3)
+    scanned_elevs = [0.5, 0.9, 1.3, 1.8, 2.4, 3.1, 4.0, 5.1, 6.4]
+    vertical_scans = config['nexrad_settings']['vertical_scans']
+
+    output_file = os.path.join(str(tmp_path), scan_dt.strftime("dbz_%Y%m%d%H%M.nc"))
+    write_output(output_file, metadata, grid_info, scanned_elevs[0:vertical_scans])
+
+    dset = nc.Dataset(output_file, mode='a')
+    target_id = dset.createVariable("target_id", int, ('dbz_elevs', 'azims', 'gates'))
+    target_id[:,:,:] = 0
+    dset.close()
+
+    calib_file = os.path.join(str(tmp_path), "calib.nc")
+    dset = nc.Dataset(calib_file, mode='w')
+    dset.createDimension("azims", grid_info.azims)
+    dset.createDimension("gates", grid_info.gates)
+    dset.createVariable("lats", np.float32, ('azims', 'gates'))[:] = metadata.lat
+    dset.createVariable("lons", np.float32, ('azims', 'gates'))[:] = metadata.lon
+    dset.close()
+
+    products = {"joint": {"cadence": 0, "elevations": []}, "target_id": {"cadence": 0, "elevations": []}}
+    policy = bugtracker.plots.policy.PlotPolicy("deferred", products)
+    queue = bugtracker.plots.plot_queue.PlotQueue(bugtracker.plots.plot_queue.queue_filepath(config))
+
+    # Jobs of every scanned elevation (as queued before), only the
+    # levels in the output can be plotted
+    jobs = policy.jobs(metadata.radar_id, scan_dt, scanned_elevs)
+    queue.enqueue(metadata, scan_dt, output_file, calib_file, grid_info, jobs)
+
+    done, failed = bugtracker.plots.plot_queue.drain(queue)
+    assert (done, failed) == (vertical_scans + 1, len(scanned_elevs) - vertical_scans)
+
+    plot_folder = bugtracker.plots.parallel.get_folder(os.path.join(config['plot_dir'], metadata.radar_id), scan_dt)
+    plots = sorted(os.listdir(plot_folder))
+    assert len(plots) == vertical_scans + 1
+    assert all(plot.startswith(scan_dt.strftime("%Y%m%d%H%M")) for plot in plots)
+
+    queue.close()
+    monkeypatch.delenv(bugtracker.config.ENV_VARIABLE)
+    bugtracker.config.reload()
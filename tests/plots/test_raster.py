@@ -0,0 +1,75 @@
+import os
+import datetime
+
+import numpy as np
+from PIL import Image
+
+import bugtracker
+
+
+def sample_config(tmp_path):
+
+    config = dict()
+    config['cache_dir'] = str(tmp_path)
+    config['plot_settings'] = {'max_range': 100.0, 'renderer': 'fast'}
+
+    return config
+
+
+def test_layout(tmp_path):
+
+    config = sample_config(tmp_path)
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+
+    layout = bugtracker.plots.raster.get_layout(config, metadata, grid_info, 100.0, height=200)
+
+    # Radar site at the center of the image, on the first gate
+    center = (layout.height // 2) * layout.width + layout.width // 2
+    assert center in layout.pixels
+    assert layout.cells[np.searchsorted(layout.pixels, center)] % grid_info.gates <= 1
+
+    # Corners are beyond max_range
+    assert 0 not in layout.pixels
+    assert layout.cells.max() < grid_info.azims * grid_info.gates
+
+    # Reloaded from the disk cache
+    bugtracker.plots.raster._layouts.clear()
+    cached = bugtracker.plots.raster.get_layout(config, metadata, grid_info, 100.0, height=200)
+    assert np.array_equal(cached.cells, layout.cells)
+    assert np.allclose(cached.extent, layout.extent)
+
+
+def test_levels():
+
+    values = np.ma.masked_array([-30.0, -15.0, 12.5, 40.0, 80.0, np.nan, 0.0], mask=[0, 0, 0, 0, 0, 0, 1])
+    index = bugtracker.plots.raster.dbz_levels(values, -15.0, 40.0, levels=22)
+    assert list(index) == [-1, 0, 11, 21, 21, -1, -1]
+
+    codes = np.array([0, 1, 2, 3, 0])
+    assert list(bugtracker.plots.raster.target_id_levels(codes)) == [-1, 0, 1, 2, -1]
+
+
+def test_render(tmp_path):
+
+    config = sample_config(tmp_path)
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+
+    layout = bugtracker.plots.raster.get_layout(config, metadata, grid_info, 100.0, height=200)
+    background = bugtracker.plots.raster.get_background(config, layout, features=False)
+    renderer = bugtracker.plots.raster.QuicklookRenderer(layout, background)
+
+    data = bugtracker.core.samples.sin_dbz(grid_info)
+    output_file = os.path.join(str(tmp_path), "dbz.png")
+    renderer.render_dbz(data, output_file, "sin_dbz")
+
+    image = np.array(Image.open(output_file))
+    assert image.shape == (layout.height + bugtracker.plots.raster.TITLE_HEIGHT,
+                           layout.width + bugtracker.plots.raster.BAR_WIDTH, 3)
+
+    id_matrix = np.zeros((grid_info.azims, grid_info.gates), dtype=np.int32)
+    id_matrix[:,10:20] = bugtracker.core.target_id.get_code('bugs')
+    output_file = os.path.join(str(tmp_path), "target_id.png")
+    renderer.render_target_id(id_matrix, output_file, "target_id")
+    assert os.path.isfile(output_file)
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import cartopy.crs as ccrs
+from PIL import Image
+
+import bugtracker
+
+
+def test_ring_coords():
+
+    metadata = bugtracker.core.samples.metadata()
+    lats, lons = bugtracker.plots.template.ring_coords(metadata, 50.0)
+
+    x_arr, y_arr = bugtracker.io.lookup.GateLookup(np.zeros((1, 1)), np.zeros((1, 1)), metadata.lat, metadata.lon).project(lats, lons)
+    assert np.allclose(np.hypot(x_arr, y_arr), 50000.0, atol=1.0)
+
+
+def test_template_reuse(tmp_path):
+
+    metadata = bugtracker.core.samples.metadata()
+    grid_info = bugtracker.core.samples.grid_info()
+    lats, lons = bugtracker.core.geometry.get_geometry(grid_info, metadata).latlon()
+    data = bugtracker.core.samples.sin_dbz(grid_info)
+
+    template = bugtracker.plots.template.FigureTemplate(metadata, 100.0, 50, 'dbz', -15.0, 40.0, features=False)
+    num_children = len(template.ax.get_children())
+
+    def draw_data(ax):
+        return [ax.contourf(lons, lats, data, 22, transform=ccrs.PlateCarree(), cmap='jet', vmin=-15.0, vmax=40.0)]
+
+    images = []
+    for x in range(0, 2):
+        output_file = os.path.join(str(tmp_path), f"plot_{x}.png")
+        template.save(output_file, f"title {x}", "dBZ", draw_data)
+        images.append(np.array(Image.open(output_file)))
+
+    # The data artists are removed after each plot
+    assert len(template.ax.get_children()) == num_children
+    assert images[0].shape == (240, 320, 3)
+
+    # Only the title differs
+    different = np.any(images[0] != images[1], axis=2)
+    assert different.any()
+    assert not different[images[0].shape[0] // 2:,:].any()
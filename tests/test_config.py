@@ -1,4 +1,5 @@
 import os
+import json
 
 import pytest
 
@@ -39,4 +40,74 @@ def test_fields():
         assert key in config["clutter"]
 
     for key in precip_keys:
-        assert key in config["precip"]
\ No newline at end of file
+        assert key in config["precip"]
+
+def write_minimal(tmp_path, extra=None):
+
+    template = bugtracker.config.ConfigTemplate()
+    template.populate(str(tmp_path))
+
+    # Older config files only have the directories and a few sections
+    data = dict()
+    for key in ["input_dirs", "plot_dir", "netcdf_dir", "cache_dir", "animation_dir"]:
+        data[key] = template.data[key]
+
+    data["precip"] = {"azim_region": 8}
+
+    if extra is not None:
+        data.update(extra)
+
+    config_path = os.path.join(tmp_path, "bugtracker.json")
+    with open(config_path, 'w') as handle:
+        json.dump(data, handle)
+
+    return config_path
+
+
+def test_defaults(tmp_path):
+
+    config_path = write_minimal(tmp_path)
+    config = bugtracker.config.read(config_path)
+
+    assert config["precip"]["azim_region"] == 8
+    assert config["precip"]["gate_region"] == 4
+    assert config["processing"]["joint_cutoff"] == 30.0
+    assert config["processing"]["max_memory_mb"] == 0
+    assert config["cartesian"]["enabled"] is False
+    assert config["motion"]["enabled"] is False
+    assert config["metrics"]["enabled"] is True
+    assert config["metrics"]["prometheus_dir"] == ""
+
+
+def test_invalid(tmp_path):
+
+    config_path = write_minimal(tmp_path, extra={"processing": {"joint_cutoff": "thirty"}})
+
+    with pytest.raises(ValueError):
+        bugtracker.config.read(config_path)
+
+    del_path = write_minimal(tmp_path)
+    with open(del_path, 'r') as handle:
+        data = json.load(handle)
+    del data["cache_dir"]
+    with open(del_path, 'w') as handle:
+        json.dump(data, handle)
+
+    with pytest.raises(ValueError):
+        bugtracker.config.read(del_path)
+
+
+def test_env_override(tmp_path, monkeypatch):
+
+    config_path = write_minimal(tmp_path)
+    monkeypatch.setenv(bugtracker.config.ENV_VARIABLE, config_path)
+
+    config = bugtracker.config.reload()
+    assert config["cache_dir"] == os.path.join(str(tmp_path), "cache")
+
+    # Shared object, the file is not read again
+    assert bugtracker.config.get() is config
+    assert bugtracker.config.load("./bugtracker.json") is config
+
+    monkeypatch.delenv(bugtracker.config.ENV_VARIABLE)
+    bugtracker.config.reload()
@@ -0,0 +1,34 @@
+import sys
+import subprocess
+
+import bugtracker
+
+
+def imported_modules(statement):
+    """
+    Top-level modules loaded by the statement, in a fresh interpreter
+    (pyart is already loaded in this one).
+    """
+
+    code = f"{statement}\nimport sys\nprint(' '.join(sorted(set(name.split('.')[0] for name in sys.modules))))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_lazy_startup():
+    """
+    The downloader and calib tools should not load the heavy
+    packages just by importing bugtracker.
+    """
+
+    modules = imported_modules("import bugtracker.config, bugtracker.io.nexrad, bugtracker.core.utils")
+
+    for heavy in ['pyart', 'matplotlib', 'cartopy', 'cv2', 'scipy', 'geopy']:
+        assert heavy not in modules
+
+
+def test_attribute_access():
+
+    assert bugtracker.io.iris.IrisCollection is not None
+    assert bugtracker.core.target_id.get_code('bugs') == 3
+    assert 'plots' in dir(bugtracker)